@@ -2,11 +2,17 @@
 """
 
 import os
+import re
 import glob
 import datetime
 import csv
 from  dateutil  import  parser
 
+# Pipeline indicator file names, as matched by get_pipeline_indicator
+INDICATOR_PATTERN = re.compile(r'^[0-9][0-9]_.*\.txt$')
+# Parsed indicator files by name, with the modification time and size they were parsed at
+_INDICATOR_CACHE = {}
+
 def fastq_screen_finished(fastq_screen_dir):
     """Determine if the finished output from fastq_screen exists
     """
@@ -116,4 +122,75 @@ def _is_indicator(fname):
     except:
         return False
     return True
-    
+
+def _parse_indicator(fname):
+    """Parse an indicator file once per modification and return a tuple with whether
+       it is an indicator file, as in _is_indicator, and its most recent timestamp before
+       the first line that is not a timestamp, as in get_most_recent_indicator
+    """
+    try:
+        st = os.stat(fname)
+    except OSError:
+        return (False,None)
+    cached = _INDICATOR_CACHE.get(fname)
+    if cached is not None and cached[0] == (st.st_mtime,st.st_size):
+        return cached[1]
+    is_indicator = True
+    most_recent = None
+    timestamps = True
+    try:
+        with open(fname) as fh:
+            for line in fh:
+                try:
+                    time = parser.parse(line.strip())
+                except:
+                    # Empty lines are allowed in indicator files but end the timestamps
+                    timestamps = False
+                    if len(line.strip()) > 0:
+                        is_indicator = False
+                        break
+                    continue
+                if timestamps and (most_recent is None or time > most_recent):
+                    most_recent = time
+    except IOError:
+        is_indicator = False
+    result = (is_indicator,most_recent)
+    _INDICATOR_CACHE[fname] = ((st.st_mtime,st.st_size),result)
+    return result
+
+class IndicatorIndex(object):
+    """The pipeline indicator files of a sample directory, listed once, with each 
+       file parsed once per modification. Gives the same results as 
+       get_pipeline_indicator and get_most_recent_indicator, which list the 
+       directory and parse the files on each call.
+    """
+    def __init__(self, sample_dir):
+        self.sample_dir = sample_dir
+        self._indicators = []
+        for name in os.listdir(sample_dir):
+            fname = os.path.join(sample_dir,name)
+            if not INDICATOR_PATTERN.match(name) or not os.path.isfile(fname):
+                continue
+            is_indicator, most_recent = _parse_indicator(fname)
+            if is_indicator:
+                self._indicators.append((name,fname,most_recent))
+
+    def _select(self, steps=[]):
+        if len(steps) == 0:
+            return self._indicators
+        return [ind for step in steps for ind in self._indicators if ind[0].startswith("{s:02d}_".format(s=step))]
+
+    def get_pipeline_indicator(self, steps=[]):
+        """Get the pipeline indicator files, optionally for the given steps
+        """
+        return [fname for _, fname, _ in self._select(steps)]
+
+    def get_most_recent_indicator(self, steps=[]):
+        """Return a tuple with the most recent timestamp and the file that contains it,
+           optionally for the given steps
+        """
+        most_recent = (datetime.datetime.fromtimestamp(0.0),None)
+        for _, fname, time in self._select(steps):
+            if time is not None and time > most_recent[0]:
+                most_recent = (time,fname)
+        return most_recent
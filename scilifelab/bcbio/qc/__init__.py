@@ -9,11 +9,18 @@ import json
 import numpy as np
 import csv
 import collections
+import multiprocessing
 import xml.etree.cElementTree as ET
-from bs4 import BeautifulSoup
 import datetime
+import HTMLParser
+import htmlentitydefs
+try:
+    from scandir import walk
+except ImportError:
+    from os import walk
 
 from scilifelab.log import minimal_logger
+from scilifelab.io.pandas.picard import read_picard, parse_picard
 LOG = minimal_logger("bcbio")
 
 from bcbio.broad.metrics import PicardMetricsParser
@@ -89,91 +96,82 @@ class MetricsParser():
         return sver
 
 class ExtendedPicardMetricsParser(PicardMetricsParser):
-    """Extend basic functionality and parse all picard metrics"""
+    """Extend basic functionality and parse all picard metrics. Files
+    are read with the Picard metrics reader in scilifelab.io.pandas.picard
+    and values are kept as strings.
 
-    def __init__(self):
-        PicardMetricsParser.__init__(self)
+    :param cachedir: directory for caching parsed metrics files
+    """
 
-    def _get_command(self, in_handle):
-        while 1:
-            line = in_handle.readline()
+    def __init__(self, cachedir=None):
+        PicardMetricsParser.__init__(self)
+        self.cachedir = cachedir
+
+    def extract_metrics(self, metrics_files):
+        """Return metrics for a set of metrics files, keyed by metrics
+        type prefix and metrics name."""
+        extension_maps = dict(
+            align_metrics=(self._align_metrics, "AL"),
+            dup_metrics=(self._dup_metrics, "DUP"),
+            hs_metrics=(self._hybrid_metrics, "HS"),
+            insert_metrics=(self._insert_metrics, "INS"))
+        all_metrics = dict()
+        for fname in metrics_files:
+            ext = os.path.splitext(fname)[-1][1:]
+            if ext not in extension_maps:
+                all_metrics.update(PicardMetricsParser.extract_metrics(self, [fname]))
+                continue
+            parse_fn, prefix = extension_maps[ext]
+            for key, val in parse_fn(read_picard(fname, self.cachedir)).iteritems():
+                if not key.startswith(prefix):
+                    key = "%s_%s" % (prefix, key)
+                all_metrics[key] = val
+        return all_metrics
+
+    def _get_command(self, data):
+        for line in data.header:
             if line.startswith("# net.sf.picard.analysis") or line.startswith("# net.sf.picard.sam"):
-                break
-        return line.rstrip("\n")
+                return line
+        return ""
 
-    def _read_off_header(self, in_handle):
-        while 1:
-            line = in_handle.readline()
-            if line.startswith("## METRICS"):
-                break
-        return in_handle.readline().rstrip("\n").split("\t")
+    def _rows(self, data):
+        """Get the metrics rows as dictionaries of strings"""
+        header, values = data.metrics
+        return [dict(zip(header, row)) for row in values.tolist()]
 
-    def _read_vals_of_interest(self, header, info):
-        want_indexes = [header.index(w) for w in header]
-        vals = dict()
-        for i in want_indexes:
-            vals[header[i]] = info[i]
-        return vals
+    def _histogram(self, data):
+        if data.histogram is None:
+            return None
+        labels, values = data.histogram
+        return {labels[i]:values[:,i].tolist() for i in range(0, len(labels))}
+
+    def _align_metrics(self, data):
+        d = dict([[x, []] for x in data.metrics[0]])
+        res = dict(command=self._get_command(data), FIRST_OF_PAIR = d, SECOND_OF_PAIR = d, PAIR = d)
+        for vals in self._rows(data):
+            res[vals[data.metrics[0][0]]] = vals
+        return res
+
+    def _dup_metrics(self, data):
+        return dict(command=self._get_command(data), metrics = self._rows(data)[0], hist = self._histogram(data))
+
+    def _insert_metrics(self, data):
+        return dict(command=self._get_command(data), metrics = self._rows(data)[0], hist = self._histogram(data))
+
+    def _hybrid_metrics(self, data):
+        return dict(command=self._get_command(data), metrics = self._rows(data)[0])
 
     def _parse_align_metrics(self, in_handle):
-        command = self._get_command(in_handle)
-        header = self._read_off_header(in_handle)
-        d = dict([[x, []] for x in header])
-        res = dict(command=command, FIRST_OF_PAIR = d, SECOND_OF_PAIR = d, PAIR = d)
-        while 1:
-            info = in_handle.readline().rstrip("\n").split("\t")
-            category = info[0]
-            if len(info) <= 1:
-                break
-            vals = self._read_vals_of_interest(header, info)
-            res[category] = vals
-        return res
+        return self._align_metrics(parse_picard(in_handle))
 
     def _parse_dup_metrics(self, in_handle):
-        command = self._get_command(in_handle)
-        header = self._read_off_header(in_handle)
-        info = in_handle.readline().rstrip("\n").split("\t")
-        vals = self._read_vals_of_interest(header, info)
-        histvals = self._read_histogram(in_handle)
-        return dict(command=command, metrics = vals, hist = histvals)
+        return self._dup_metrics(parse_picard(in_handle))
 
     def _parse_insert_metrics(self, in_handle):
-        command = self._get_command(in_handle)
-        header = self._read_off_header(in_handle)
-        info = in_handle.readline().rstrip("\n").split("\t")
-        vals = self._read_vals_of_interest(header, info)
-        histvals = self._read_histogram(in_handle)
-        return dict(command=command, metrics = vals, hist = histvals)
+        return self._insert_metrics(parse_picard(in_handle))
 
     def _parse_hybrid_metrics(self, in_handle):
-        command = self._get_command(in_handle)
-        header = self._read_off_header(in_handle)
-        info = in_handle.readline().rstrip("\n").split("\t")
-        vals = self._read_vals_of_interest(header, info)
-        return dict(command=command, metrics = vals)
-
-    def _read_histogram(self, in_handle):
-        labels = self._read_to_histogram(in_handle)
-        if labels is None:
-            return None
-        vals = dict([[x, []] for x in labels])
-        while 1:
-            line = in_handle.readline()
-            info = line.rstrip("\n").split("\t")
-            if len(info) < len(labels):
-                break
-            for i in range(0, len(labels)):
-                vals[labels[i]].append(info[i])
-        return vals
-
-    def _read_to_histogram(self, in_handle):
-        while 1:
-            line = in_handle.readline()
-            if line.startswith("## HISTOGRAM"):
-                break
-            if not line:
-                return None
-        return in_handle.readline().rstrip("\n").split("\t")
+        return self._hybrid_metrics(parse_picard(in_handle))
 
 class RunInfoParser():
     """RunInfo parser"""
@@ -318,13 +316,200 @@ class XmlToDict(dict):
             else:
                 self.update({element.tag: element.text})
 
-class IlluminaXMLParser():
-    """Illumina xml data parser. Parses xml files in flowcell directory."""
+## Table rows of an html document
+TableRow = collections.namedtuple("TableRow", ["table", "th", "td"])
+
+class HtmlTableParser(HTMLParser.HTMLParser):
+    """Streaming parser for the table rows of an html document. Rows are
+    collected in self.rows as TableRow tuples of the index of the
+    table, in document order, and the strings of the header and data
+    cells. As in BeautifulSoup, the string of a cell is None unless the
+    cell holds a single string, possibly nested in a single element.
+    """
+    ## Elements without end tags
+    _void = ["area", "base", "br", "col", "embed", "hr", "img", "input", "link", "meta", "param", "source", "wbr"]
+
     def __init__(self):
+        HTMLParser.HTMLParser.__init__(self)
+        self.rows = []
+        self._ntables = 0
+        self._tables = []
+        self._row = None
+        self._cell = None
+
+    def _end_cell(self):
+        if self._cell is not None:
+            self._row[self._cell[0][0]].append(self._string(self._cell[0][1]))
+            self._cell = None
+
+    def _end_row(self):
+        self._end_cell()
+        if self._row is not None:
+            self.rows.append(TableRow(self._tables[-1] if self._tables else None, self._row["th"], self._row["td"]))
+            self._row = None
+
+    def _string(self, children):
+        """The string of an element, given its children"""
+        merged = []
+        for child in children:
+            if isinstance(child, basestring) and merged and isinstance(merged[-1], basestring):
+                merged[-1] += child
+            else:
+                merged.append(child)
+        if len(merged) != 1:
+            return None
+        if isinstance(merged[0], basestring):
+            return merged[0].encode("utf-8") if isinstance(merged[0], unicode) else merged[0]
+        return self._string(merged[0][1])
+
+    def handle_starttag(self, tag, attrs):
+        if tag == "table":
+            self._end_row()
+            self._tables.append(self._ntables)
+            self._ntables += 1
+        elif tag == "tr":
+            self._end_row()
+            self._row = {"th":[], "td":[]}
+        elif tag in ["th", "td"]:
+            self._end_cell()
+            if self._row is None:
+                self._row = {"th":[], "td":[]}
+            self._cell = [(tag, [])]
+        elif self._cell is not None:
+            element = (tag, [])
+            self._cell[-1][1].append(element)
+            if tag not in self._void:
+                self._cell.append(element)
+
+    def handle_startendtag(self, tag, attrs):
+        if self._cell is not None:
+            self._cell[-1][1].append((tag, []))
+
+    def handle_endtag(self, tag):
+        if tag == "table":
+            self._end_row()
+            if self._tables:
+                self._tables.pop()
+        elif tag == "tr":
+            self._end_row()
+        elif tag in ["th", "td"]:
+            self._end_cell()
+        elif self._cell is not None:
+            for i in range(len(self._cell) - 1, 0, -1):
+                if self._cell[i][0] == tag:
+                    del self._cell[i:]
+                    break
+
+    def handle_data(self, data):
+        if self._cell is not None:
+            self._cell[-1][1].append(data)
+
+    def handle_entityref(self, name):
+        if name in htmlentitydefs.name2codepoint:
+            self.handle_data(unichr(htmlentitydefs.name2codepoint[name]))
+        else:
+            self.handle_data("&{}".format(name))
+
+    def handle_charref(self, name):
+        self.handle_data(unichr(int(name[1:], 16) if name.lower().startswith("x") else int(name)))
+
+def html_table_rows(fh, chunk_size=65536):
+    """Iterate over the table rows of an html file, reading the file in
+    chunks.
+
+    :param fh: file handle
+    :param chunk_size: number of bytes to read at a time
+
+    :returns: generator of TableRow tuples
+    """
+    parser = HtmlTableParser()
+    while True:
+        chunk = fh.read(chunk_size)
+        if not chunk:
+            break
+        parser.feed(chunk)
+        for row in parser.rows:
+            yield row
+        del parser.rows[:]
+    parser.close()
+    parser._end_row()
+    for row in parser.rows:
+        yield row
+
+## RTA chart directories parsed in full mode
+RTA_CHARTS = ["ErrorRate", "FWHM", "Intensity", "NumGT30"]
+
+def _rta_kind(f, fullRTA=False):
+    """Get the kind of RTA xml file f, or None if it is not parsed"""
+    dirname = os.path.dirname(f)
+    if fullRTA:
+        for chart in RTA_CHARTS:
+            if dirname.endswith(chart):
+                return chart
+        if os.path.basename(f).endswith("_Chart.xml"):
+            return "Charts"
+    if dirname.endswith("Summary"):
+        return "Summary"
+    if os.path.basename(f).startswith("NumClusters By"):
+        return "NumClusters"
+    return None
+
+def rta_files(reports, fullRTA=False):
+    """Find the RTA xml files in the reports directory of a run, without
+    scanning the rest of the run folder.
+
+    :param reports: the Data/reports directory of a run
+    :param fullRTA: include the chart files
+
+    :returns: list of xml files
+    """
+    dirs = [reports, os.path.join(reports, "Summary")]
+    if fullRTA:
+        dirs.extend([os.path.join(reports, chart) for chart in RTA_CHARTS])
+    files = []
+    for d in dirs:
+        if os.path.isdir(d):
+            files.extend(sorted([os.path.join(d, f) for f in os.listdir(d) if f.endswith(".xml")]))
+    return [f for f in files if _rta_kind(f, fullRTA) is not None]
+
+def _parse_rta_file(job):
+    """Parse an RTA xml file. Module level function so that files can
+    be parsed in worker processes.
+
+    :param job: tuple of the kind of file and the file name
+
+    :returns: tuple of the kind of file and the parsed data
+    """
+    kind, f = job
+    parser = IlluminaXMLParser()
+    if kind == "Summary":
+        return kind, parser._parse_summary([f])
+    if kind == "NumClusters":
+        return kind, parser._parse_clusters([f])
+    return kind, parser._parse_chart(f)
+
+class IlluminaXMLParser():
+    """Illumina xml data parser. Parses xml files in flowcell directory.
+
+    Summary and cluster data are parsed to dictionaries. Chart data
+    are parsed to a dictionary of the flowcell and layout attributes,
+    where 'charts' lists the chart indexes in the order parsed and
+    'values' is an array of tile values, of shape (charts, lanes,
+    tiles per lane). Missing and NaN values are NaN.
+
+    :param workers: number of worker processes for parsing files
+    """
+    ## Positions of the lane and tile keys in chart values, by layout
+    _positions = {}
+
+    def __init__(self, workers=1):
         self._data = {}
         self._element = None
         self._tmp = None
         self._header = None
+        self._values = None
+        self._shape = None
+        self.workers = workers
 
     def _chart_start_element(self, name, attrs):
         self._element = name
@@ -332,41 +517,45 @@ class IlluminaXMLParser():
             self._header = attrs
         if name == "Layout":
             n_tiles_per_lane = int(attrs['RowsPerLane']) * int(attrs['ColsPerLane'])
-            if self._tmp is None:
-                self._tmp = self._header
-                self._tmp.update(attrs)
-                for i in range(1,int(attrs['NumLanes'])+1):
-                    for j in range(1,n_tiles_per_lane+1):
-                        key = "%s_%s" % (i,j)
-                        self._tmp[key] = {}
+            self._tmp = self._header
+            self._tmp.update(attrs)
+            self._shape = (int(attrs['NumLanes']), n_tiles_per_lane)
+            self._values = [np.nan] * (self._shape[0] * self._shape[1])
+            if self._shape not in self._positions:
+                self._positions[self._shape] = {"{}_{}".format(i + 1, j + 1): i * n_tiles_per_lane + j for i in range(0, self._shape[0]) for j in range(0, n_tiles_per_lane)}
 
         if name == "TL":
-            self._tmp[attrs["Key"]][self._index] = {}
             for k in attrs.keys():
                 if k == "Key":
                     continue
-                if attrs[k] == "NaN":
-                    v = None
-                else:
-                    v = float(attrs[k])
-
-                self._tmp[attrs["Key"]][self._index] = v
+                self._values[self._positions[self._shape][attrs["Key"]]] = float(attrs[k])
 
     def _chart_end_element(self, name):
         self._element = None
     def _chart_char_data(self, data):
         pass
 
-    def _parse_charts(self, files):
-        for f in files:
-            self._index = os.path.basename(f).rstrip(".xml").lstrip("Chart_")
-            p = xml.parsers.expat.ParserCreate()
-            p.StartElementHandler = self._chart_start_element
-            p.EndElementHandler = self._chart_end_element
-            p.CharacterDataHandler = self._chart_char_data
-            fp = open(f)
+    def _parse_chart(self, f):
+        """Parse a chart file and return a tuple of the chart index, the
+        flowcell and layout attributes and the array of tile values"""
+        index = os.path.basename(f).rstrip(".xml").lstrip("Chart_")
+        p = xml.parsers.expat.ParserCreate()
+        p.StartElementHandler = self._chart_start_element
+        p.EndElementHandler = self._chart_end_element
+        p.CharacterDataHandler = self._chart_char_data
+        p.returns_unicode = False
+        with open(f) as fp:
             p.ParseFile(fp)
-            fp.close()
+        return index, self._tmp, np.array(self._values).reshape(self._shape)
+
+    def _merge_charts(self, charts):
+        """Merge parsed chart files into a chart dictionary"""
+        if not charts:
+            return None
+        data = charts[0][1]
+        data["charts"] = [index for index, _, _ in charts]
+        data["values"] = np.array([values for _, _, values in charts])
+        return data
 
     def _summary_start_element(self, name, attrs):
         self._element = name
@@ -380,6 +569,7 @@ class IlluminaXMLParser():
         pass
 
     def _parse_summary(self, files):
+        self._tmp = {}
         for f in files:
             self._index = os.path.basename(f).rstrip(".xml")
             p = xml.parsers.expat.ParserCreate()
@@ -389,6 +579,7 @@ class IlluminaXMLParser():
             fp = open(f)
             p.ParseFile(fp)
             fp.close()
+        return self._tmp
 
     def _clusters_start_element(self, name, attrs):
         self._element = name
@@ -402,6 +593,7 @@ class IlluminaXMLParser():
         pass
 
     def _parse_clusters(self, files):
+        self._tmp = {}
         for f in files:
             self._index = os.path.basename(f).rstrip(".xml")
             p = xml.parsers.expat.ParserCreate()
@@ -411,42 +603,37 @@ class IlluminaXMLParser():
             fp = open(f)
             p.ParseFile(fp)
             fp.close()
+        return self._tmp
+
+    def _parse_files(self, jobs):
+        """Parse files serially or with a pool of workers, in job order"""
+        if self.workers <= 1 or len(jobs) <= 1:
+            return [_parse_rta_file(job) for job in jobs]
+        pool = multiprocessing.Pool(min(self.workers, len(jobs)))
+        try:
+            results = pool.map(_parse_rta_file, jobs, chunksize=max(1, len(jobs) // (4 * self.workers)))
+            pool.close()
+        finally:
+            pool.terminate()
+            pool.join()
+        return results
 
     ## Caution: no assert statements for file existence
     def parse(self, files, fullRTA=False):
         """Full parsing includes all RTA files"""
+        jobs = [(_rta_kind(f, fullRTA), f) for f in files]
+        jobs = [job for job in jobs if job[0] is not None]
+        charts = collections.defaultdict(list)
+        self._data["Summary"] = {}
+        self._data["NumClusters"] = {}
+        for kind, res in self._parse_files(jobs):
+            if kind in ["Summary", "NumClusters"]:
+                self._data[kind].update(res)
+            else:
+                charts[kind].append(res)
         if fullRTA:
-            error_files = filter(lambda x: os.path.dirname(x).endswith("ErrorRate"), files)
-            self._parse_charts(error_files)
-            self._data["ErrorRate"] = self._tmp
-            self._tmp = None
-            FWHM_files = filter(lambda x: os.path.dirname(x).endswith("FWHM"), files)
-            self._parse_charts(FWHM_files)
-            self._data["FWHM"] = self._tmp
-            self._tmp = None
-            intensity_files = filter(lambda x: os.path.dirname(x).endswith("Intensity"), files)
-            self._parse_charts(intensity_files)
-            self._data["Intensity"] = self._tmp
-            self._tmp = None
-            numgt30_files = filter(lambda x: os.path.dirname(x).endswith("NumGT30"), files)
-            self._parse_charts(numgt30_files)
-            self._data["NumGT30"] = self._tmp
-            self._tmp = None
-            chart_files = filter(lambda x: os.path.basename(x).endswith("_Chart.xml"), files)
-            self._parse_charts(chart_files)
-            self._data["Charts"] = self._tmp
-            self._tmp = None
-
-        ## Parse Summary and clusters
-        self._tmp = {}
-        summary_files = filter(lambda x: os.path.dirname(x).endswith("Summary"), files)
-        self._parse_summary(summary_files)
-        self._data["Summary"] = self._tmp
-        self._tmp = {}
-        cluster_files = filter(lambda x: os.path.basename(x).startswith("NumClusters By"), files)
-        self._parse_clusters(cluster_files)
-        self._data["NumClusters"] = self._tmp
-
+            for kind in RTA_CHARTS + ["Charts"]:
+                self._data[kind] = self._merge_charts(charts[kind])
         return self._data
 
 class ExtendedFastQCParser(FastQCParser):
@@ -474,6 +661,98 @@ class ExtendedFastQCParser(FastQCParser):
 ##############################
 ##  objects
 ##############################
+class FileCatalog(object):
+    """Catalogue of the files below a run directory, collected in a
+    single directory scan and indexed by lane, extension and file name.
+    Catalogues are shared by all parsers of a directory and rescanned
+    only when one of its directories has been modified. The
+    max_catalogs most recently used catalogues are kept.
+
+    :param path: directory to scan
+    :param ignore: regular expression for directories, relative to path, whose files are ignored
+    """
+    _catalogs = collections.OrderedDict()
+    max_catalogs = 4
+    ## Lane numbers of file names like 1_120924_AC003CCCXX
+    _lane_re = re.compile("(?=([0-9]+)_[0-9]+_[0-9A-Za-z])")
+
+    def __init__(self, path, ignore=None):
+        self.path = path
+        self.ignore = ignore
+        self.all_files = []
+        self.files = []
+        self._ignored = set()
+        self._mtimes = {}
+        self._lane = collections.defaultdict(list)
+        self._ext = collections.defaultdict(list)
+        self._name = collections.defaultdict(list)
+        self._scan()
+
+    @classmethod
+    def get(cls, path, ignore=None):
+        """Get the shared catalogue for path, scanning the directory if
+        it has not been scanned or has been modified since"""
+        catalog = cls._catalogs.pop((path, ignore), None)
+        if catalog is None or not catalog.is_current():
+            catalog = cls(path, ignore)
+        cls._catalogs[(path, ignore)] = catalog
+        while len(cls._catalogs) > cls.max_catalogs:
+            cls._catalogs.popitem(last=False)
+        return catalog
+
+    def _scan(self):
+        for root, dirs, files in walk(self.path):
+            self._mtimes[root] = os.stat(root).st_mtime
+            ## Match below the catalogue root so that the location of
+            ## the run directory does not affect which files are ignored
+            relroot = os.path.relpath(root, self.path)
+            ignored = self.ignore is not None and relroot != os.curdir and re.search(self.ignore, relroot) is not None
+            for f in files:
+                i = len(self.all_files)
+                self.all_files.append(os.path.join(root, f))
+                if ignored:
+                    self._ignored.add(i)
+                else:
+                    self.files.append(self.all_files[i])
+                for lane in set(m.group(1) for m in self._lane_re.finditer(os.path.join(relroot, f))):
+                    self._lane[lane].append(i)
+                if "." in f:
+                    self._ext[".{}".format(f.rsplit(".", 1)[1])].append(i)
+                self._name[f].append(i)
+
+    def is_current(self):
+        """Return True if no directory has been modified since the scan"""
+        for d, mtime in self._mtimes.iteritems():
+            try:
+                if os.stat(d).st_mtime != mtime:
+                    return False
+            except OSError:
+                return False
+        return True
+
+    def select(self, lane=None, ext=None, name=None, contains=None, ignored=False):
+        """Get the files, in scan order, that match any of the given
+        criteria.
+
+        :param lane: lane number preceding a date and a flowcell id, as in 1_120924_AC003CCCXX
+        :param ext: file extension, including the dot
+        :param name: file name
+        :param contains: substring of the file path
+        :param ignored: include files in ignored directories
+
+        :returns: list of file paths
+        """
+        if lane is not None and not str(lane).isdigit():
+            positions = range(0, len(self.all_files))
+        else:
+            positions = set(self._ext.get(ext, []) + self._name.get(name, []))
+            if lane is not None:
+                positions.update(self._lane.get(str(lane), []))
+            if contains is not None:
+                positions.update(i for i, f in enumerate(self.all_files) if contains in f)
+            positions = sorted(positions)
+        return [self.all_files[i] for i in positions if ignored or i not in self._ignored]
+
 class RunMetricsParser(dict):
     """Generic Run Parser class"""
     _metrics = []
@@ -483,53 +762,74 @@ class RunMetricsParser(dict):
 
     def __init__(self, log=None):
         super(RunMetricsParser, self).__init__()
-        self.files = []
+        self._catalog = None
         self.path=None
         self.log = LOG
         if log:
             self.log = log
 
     def _collect_files(self):
+        """Check the parser path. The files are collected in the
+        catalogue when first needed."""
         if not self.path:
             return
         if not os.path.exists(self.path):
             raise IOError
-        self.files = []
-        for root, dirs, files in os.walk(self.path):
-            if re.search(self.reignore, root):
-                continue
-            self.files = self.files + [os.path.join(root, x) for x in files]
 
-    def filter_files(self, pattern, filter_fn=None):
+    @property
+    def catalog(self):
+        """The file catalogue of the parser path"""
+        if self._catalog is None and self.path:
+            self._catalog = FileCatalog.get(self.path, self.reignore.pattern)
+        return self._catalog
+
+    @property
+    def files(self):
+        """The files below the parser path, except in ignored directories"""
+        if self.catalog is None:
+            return []
+        return self.catalog.files
+
+    def select_files(self, **kw):
+        """Get the files matching the catalogue criteria in kw; see FileCatalog.select"""
+        if self.catalog is None:
+            return self.files
+        return self.catalog.select(**kw)
+
+    def filter_files(self, pattern, filter_fn=None, files=None):
         """Take file list and return those files that pass the filter_fn criterium"""
         def filter_function(f):
             return re.search(pattern, f) != None
         if not filter_fn:
             filter_fn = filter_function
-        return filter(filter_fn, self.files)
+        if files is None:
+            files = self.files
+        return filter(filter_fn, files)
 
-    def parse_json_files(self, filter_fn=None):
+    def parse_json_files(self, filter_fn=None, files=None):
         """Parse json files and return the corresponding dicts
         """
         def filter_function(f):
             return f is not None and f.endswith(".json")
         if not filter_fn:
             filter_fn = filter_function
-        files = self.filter_files(None,filter_fn)
+            files = self.select_files(ext=".json")
+        files = self.filter_files(None,filter_fn,files)
         dicts = []
         for f in files:
             with open(f) as fh:
                 dicts.append(json.load(fh))
         return dicts
 
-    def parse_csv_files(self, filter_fn=None):
+    def parse_csv_files(self, filter_fn=None, files=None):
         """Parse csv files and return a dict with filename as key and the corresponding dicts as value
         """
         def filter_function(f):
             return f is not None and f.endswith(".csv")
         if not filter_fn:
             filter_fn = filter_function
-        files = self.filter_files(None,filter_fn)
+            files = self.select_files(ext=".csv")
+        files = self.filter_files(None,filter_fn,files)
         dicts = {}
         for f in files:
             with open(f) as fh:
@@ -539,17 +839,18 @@ class RunMetricsParser(dict):
 class SampleRunMetricsParser(RunMetricsParser):
     """Sample-level class for parsing run metrics data"""
 
-    def __init__(self, path):
+    def __init__(self, path, cachedir=None):
         RunMetricsParser.__init__(self)
         self.path = path
+        self.cachedir = cachedir
         self._collect_files()
 
     def read_picard_metrics(self, barcode_name, sample_prj, lane, flowcell, barcode_id, **kw):
         self.log.debug("read_picard_metrics for sample {}, project {}, lane {} in run {}".format(barcode_name, sample_prj, lane, flowcell))
-        picard_parser = ExtendedPicardMetricsParser()
+        picard_parser = ExtendedPicardMetricsParser(self.cachedir)
         pattern = "|".join(["{}_[0-9]+_[0-9A-Za-z]+(_nophix)?(_{})?-.*.(align|hs|insert|dup)_metrics".format(lane, barcode_id),
                             "{}_[0-9]+_[0-9A-Za-z]+(_{})?(_nophix)?-.*.(align|hs|insert|dup)_metrics".format(lane, barcode_id)])
-        files = self.filter_files(pattern)
+        files = self.filter_files(pattern, files=self.select_files(lane=lane))
         if len(files) == 0:
             self.log.warn("no picard metrics files for sample {}; pattern {}".format(barcode_name, pattern))
             return {}
@@ -567,7 +868,7 @@ class SampleRunMetricsParser(RunMetricsParser):
         pattern = "|".join(["{}_[0-9]+_[0-9A-Za-z]+(_nophix)?(_{})?_[12]_screen.txt".format(lane, barcode_id),
                             "{}_[0-9]+_[0-9A-Za-z]+(_{})?(_nophix)?_[12]_screen.txt".format(lane, barcode_id),
                             "{}_{}_L0*{}_.*_screen.txt".format(barcode_name, kw.get("sequence"), lane)])
-        files = self.filter_files(pattern)
+        files = self.filter_files(pattern, files=self.select_files(lane=lane, contains="_screen"))
         self.log.debug("files {}".format(",".join(files)))
         try:
             fp = open(files[0])
@@ -602,7 +903,7 @@ class SampleRunMetricsParser(RunMetricsParser):
         self.log.debug("parse_software_versions for sample {}, project {} in run {}".format(barcode_name, sample_prj, flowcell))
         parser = MetricsParser()
         pattern = "bcbb_software_versions.txt"
-        files = self.filter_files(pattern)
+        files = self.filter_files(pattern, files=self.select_files(contains="bcbb_software_versions"))
         self.log.debug("files {}".format(",".join(files)))
         data = {}
         try:
@@ -619,7 +920,7 @@ class SampleRunMetricsParser(RunMetricsParser):
         if barcode_name == "unmatched":
             return
         pattern = "fastqc/{}_[0-9]+_[0-9A-Za-z]+(_nophix)?(_{})?-*".format(lane, barcode_id)
-        files = self.filter_files(pattern)
+        files = self.filter_files(pattern, files=self.select_files(lane=lane))
         self.log.debug("files {}".format(",".join(files)))
         try:
             fastqc_dir = os.path.dirname(files[0])
@@ -637,7 +938,7 @@ class SampleRunMetricsParser(RunMetricsParser):
         pattern = "{}_[0-9]+_[0-9A-Za-z]+(_{})?(_nophix)?.*.eval_metrics".format(lane, barcode_id)
         def filter_function(f):
             return re.search(pattern, f) != None
-        metrics = self.parse_json_files(filter_fn=filter_function)
+        metrics = self.parse_json_files(filter_fn=filter_function, files=self.select_files(lane=lane))
         if metrics:
             return metrics[0]
         return {}
@@ -648,7 +949,7 @@ class SampleRunMetricsParser(RunMetricsParser):
         pattern = "project-summary.csv"
         def filter_function(f):
             return os.path.basename(f) == pattern
-        metrics = self.parse_csv_files(filter_fn=filter_function)
+        metrics = self.parse_csv_files(filter_fn=filter_function, files=self.select_files(name=pattern))
         if metrics:
             return metrics.values()[0][0]
         return {}
@@ -709,7 +1010,7 @@ class SampleRunMetricsParser(RunMetricsParser):
                 else:
                     return reads/2
         pattern = "{}_[0-9]+_[0-9A-Za-z]+(_nophix)?[\._]bc[\._]metrics".format(lane)
-        files = self.filter_files(pattern)
+        files = self.filter_files(pattern, files=self.select_files(lane=lane))
         if len(files) == 0:
             self.log.debug("no bc metrics files for sample {}, lane {}; pattern {}".format(barcode_name, lane, pattern))
             return None
@@ -818,20 +1119,32 @@ class FlowcellRunMetricsParser(RunMetricsParser):
             self.log.warn("No such file {}".format(infile))
             return False
 
-    def parse_illumina_metrics(self, fullRTA=False, **kw):
+    def parse_illumina_metrics(self, fullRTA=False, workers=1, **kw):
+        """Parse the RTA xml files of the run. The files are looked
+        up in Data/reports, falling back on all xml files of the run.
+
+        :param fullRTA: parse the chart files
+        :param workers: number of worker processes for parsing files
+        """
         self.log.debug("parse_illumina_metrics")
-        fn = []
-        for root, dirs, files in os.walk(os.path.abspath(self.path)):
-            for f in files:
-                if f.endswith(".xml"):
-                    fn.append(os.path.join(root, f))
+        reports = os.path.join(os.path.abspath(self.path), "Data", "reports")
+        if os.path.isdir(reports):
+            fn = rta_files(reports, fullRTA)
+        else:
+            fn = [os.path.abspath(f) for f in self.select_files(ext=".xml", ignored=True)]
         self.log.debug("Found {} RTA files {}...".format(len(fn), ",".join(fn[0:10])))
-        parser = IlluminaXMLParser()
+        parser = IlluminaXMLParser(workers)
         metrics = parser.parse(fn, fullRTA)
+        ## Chart values are parsed into arrays but stored as lists, with
+        ## None for NaN, so that the metrics can be saved in documents
+        for kind in RTA_CHARTS + ["Charts"]:
+            if metrics.get(kind) is not None:
+                values = metrics[kind]["values"]
+                metrics[kind]["values"] = np.where(np.isnan(values), None, values).tolist()
         def filter_function(f):
             return f is not None and f == "run_summary.json"
         try:
-            metrics.update(self.parse_json_files(filter_fn=filter_function).pop(0))
+            metrics.update(self.parse_json_files(filter_fn=filter_function, files=glob.glob(os.path.join(self.path, "run_summary.json"))).pop(0))
         except IndexError:
             pass
         return metrics
@@ -843,7 +1156,7 @@ class FlowcellRunMetricsParser(RunMetricsParser):
         for lane in self._lanes:
             pattern = "{}_[0-9]+_[0-9A-Za-z]+(_nophix)?.filter_metrics".format(lane)
             lanes[str(lane)]["filter_metrics"] = {"reads":None, "reads_aligned":None, "reads_fail_align":None}
-            files = self.filter_files(pattern)
+            files = self.filter_files(pattern, files=self.select_files(lane=lane))
             self.log.debug("filter metrics files {}".format(",".join(files)))
             try:
                 fp = open(files[0])
@@ -862,7 +1175,7 @@ class FlowcellRunMetricsParser(RunMetricsParser):
         for lane in self._lanes:
             pattern = "{}_[0-9]+_[0-9A-Za-z]+(_nophix)?[\._]bc[\._]metrics".format(lane)
             lanes[str(lane)]["bc_metrics"] = {}
-            files = self.filter_files(pattern)
+            files = self.filter_files(pattern, files=self.select_files(lane=lane))
             self.log.debug("bc metrics files {}".format(",".join(files)))
             try:
                 parser = MetricsParser()
@@ -921,12 +1234,22 @@ class FlowcellRunMetricsParser(RunMetricsParser):
 
         return lanes
 
+    def _check_demultiplex_stats_headers(self, bc_header, smp_header):
+        """Warn if the Demultiplex_Stats.htm headers differ from the known headers"""
+        ## 'Known' headers from a Demultiplex_Stats.htm document
+        bc_header_known = ['Lane', 'Sample ID', 'Sample Ref', 'Index', 'Description', 'Control', 'Project', 'Yield (Mbases)', '% PF', '# Reads', '% of raw clusters per lane', '% Perfect Index Reads', '% One Mismatch Reads (Index)', '% of >= Q30 Bases (PF)', 'Mean Quality Score (PF)']
+        smp_header_known = ['None', 'Recipe', 'Operator', 'Directory']
+        if not bc_header == bc_header_known:
+            self.log.warn("Barcode lane statistics header information has changed. New format?\nOld format: {}\nSaw: {}".format(",".join((["'{}'".format(x) for x in bc_header_known])), ",".join(["'{}'".format(x) for x in bc_header])))
+        if not smp_header == smp_header_known:
+            self.log.warn("Sample header information has changed. New format?\nOld format: {}\nSaw: {}".format(",".join((["'{}'".format(x) for x in smp_header_known])), ",".join(["'{}'".format(x) for x in smp_header])))
+
     def parse_demultiplex_stats_htm(self, fc_name, **kw):
         """Parse the Unaligned*/Basecall_Stats_*/Demultiplex_Stats.htm file
         generated from CASAVA demultiplexing and returns barcode metrics.
         """
-        metrics = {"Barcode_lane_statistics": [],
-                   "Sample_information": []}
+        metrics = {"Barcode_lane_statistics": collections.OrderedDict(),
+                   "Sample_information": collections.OrderedDict()}
         # Use a glob to allow for multiple fastq directories
         htm_file_pattern = os.path.join(self.path, "Unaligned*", "Basecall_Stats_*{}".format(fc_name[1:]), "Demultiplex_Stats.htm")
         for htm_file in glob.glob(htm_file_pattern):
@@ -934,57 +1257,38 @@ class FlowcellRunMetricsParser(RunMetricsParser):
             if not os.path.exists(htm_file):
                 self.log.warn("No such file {}".format(htm_file))
                 continue
+            bc_header, smp_header = None, None
             with open(htm_file) as fh:
-                htm_doc = fh.read()
-            soup = BeautifulSoup(htm_doc)
-            ##
-            ## Find headers
-            allrows = soup.findAll("tr")
-            column_gen=(row.findAll("th") for row in allrows)
-            parse_row = lambda row: row
-            headers = [h for h in map(parse_row, column_gen) if h]
-            bc_header = [str(x.string) for x in headers[0]]
-            smp_header = [str(x.string) for x in headers[1]]
-            ## 'Known' headers from a Demultiplex_Stats.htm document
-            bc_header_known = ['Lane', 'Sample ID', 'Sample Ref', 'Index', 'Description', 'Control', 'Project', 'Yield (Mbases)', '% PF', '# Reads', '% of raw clusters per lane', '% Perfect Index Reads', '% One Mismatch Reads (Index)', '% of >= Q30 Bases (PF)', 'Mean Quality Score (PF)']
-            smp_header_known = ['None', 'Recipe', 'Operator', 'Directory']
-            if not bc_header == bc_header_known:
-                self.log.warn("Barcode lane statistics header information has changed. New format?\nOld format: {}\nSaw: {}".format(",".join((["'{}'".format(x) for x in bc_header_known])), ",".join(["'{}'".format(x) for x in bc_header])))
-            if not smp_header == smp_header_known:
-                self.log.warn("Sample header information has changed. New format?\nOld format: {}\nSaw: {}".format(",".join((["'{}'".format(x) for x in smp_header_known])), ",".join(["'{}'".format(x) for x in smp_header])))
-            ## Fix first header name in smp_header since htm document is mal-formatted: <th>Sample<p></p>ID</th>
-            smp_header[0] = "Sample ID"
-
-            ## Parse Barcode lane statistics
-            soup = BeautifulSoup(htm_doc)
-            table = soup.findAll("table")[1]
-            rows = table.findAll("tr")
-            column_gen = (row.findAll("td") for row in rows)
-            parse_row = lambda row: {bc_header[i]:str(row[i].string) for i in range(0, len(bc_header)) if row}
-            metrics["Barcode_lane_statistics"].extend(map(parse_row, column_gen))
-
-            ## Parse Sample information
-            soup = BeautifulSoup(htm_doc)
-            table = soup.findAll("table")[3]
-            rows = table.findAll("tr")
-            column_gen = (row.findAll("td") for row in rows)
-            parse_row = lambda row: {smp_header[i]:str(row[i].string) for i in range(0, len(smp_header)) if row}
-            metrics["Sample_information"].extend(map(parse_row, column_gen))
+                for row in html_table_rows(fh):
+                    ## Find headers
+                    if row.th and bc_header is None:
+                        bc_header = [str(x) for x in row.th]
+                    elif row.th and smp_header is None:
+                        smp_header = [str(x) for x in row.th]
+                        self._check_demultiplex_stats_headers(bc_header, smp_header)
+                        ## Fix first header name in smp_header since htm document is mal-formatted: <th>Sample<p></p>ID</th>
+                        smp_header[0] = "Sample ID"
+                    ## Parse Barcode lane statistics and Sample information
+                    if row.table == 1:
+                        metric, header = "Barcode_lane_statistics", bc_header
+                    elif row.table == 3:
+                        metric, header = "Sample_information", smp_header
+                    else:
+                        continue
+                    data = {header[i]:str(row.td[i]) for i in range(0, len(header)) if row.td}
+                    # Eliminate duplicates resulting from multiple stats files
+                    key = tuple(sorted(data.items()))
+                    if key in metrics[metric]:
+                        self.log.debug("Duplicates of Demultiplex Stats entries discarded: {}".format("\t".join(data.values())[0:35]))
+                        continue
+                    metrics[metric][key] = data
 
         # Define a function for sorting the values
         def by_lane_sample(data):
             return "{}-{}-{}".format(data.get('Lane',''),data.get('Sample ID',''),data.get('Index',''))
 
-        # Post-process the metrics data to eliminate duplicates resulting from multiple stats files
         for metric in ['Barcode_lane_statistics', 'Sample_information']:
-            dedupped = {}
-            for row in metrics[metric]:
-                key = "\t".join(row.values())
-                if key not in dedupped:
-                    dedupped[key] = row
-                else:
-                    self.log.debug("Duplicates of Demultiplex Stats entries discarded: {}".format(key[0:min(35,len(key))]))
-            metrics[metric] = sorted(dedupped.values(), key=by_lane_sample)
+            metrics[metric] = sorted(metrics[metric].values(), key=by_lane_sample)
 
         ## Set data
         return metrics
@@ -1,116 +1,158 @@
 import os
+import sys
+import json
 import datetime
+from multiprocessing.pool import ThreadPool
 import scilifelab.bcbio.filesystem as bcbio
+from scilifelab.illumina import IlluminaRun
+from scilifelab.illumina.hiseq import HiSeqRun
 
 try:
     import scilifelab.utils.slurm as slurm
 except:
     class DummyWrapper():
-        """A dummy wrapper that will just return an empty list
+        """A dummy wrapper that will just return no jobs
         """
         def get_slurm_jobid(self, *args, **kwargs):
             return []
+        
+        def get_slurm_jobs(self, *args, **kwargs):
+            return {}
     
     slurm = DummyWrapper()
 
-    
-def status_query(archive_dir, analysis_dir, flowcell, project, brief=False):
+## The last step of the pipeline
+LAST_STEP = 14
+## Default number of flowcells processed concurrently
+STATUS_WORKERS = 8
+
+def status_query(archive_dir, analysis_dir, flowcell, project, brief=False, json_output=False, workers=STATUS_WORKERS):
     """Get a status report of the progress of flowcells based on a snapshot of the file system
     """
+    status = get_status(archive_dir, analysis_dir, flowcell, project, workers)
+    if json_output:
+        print(status_to_json(status))
+    else:
+        print_status(status,brief)
+    return status
+
+def get_status(archive_dir, analysis_dir, flowcell, project, workers=STATUS_WORKERS):
+    """Collect the status of the flowcells in the archive directory. The slurm jobs
+    are listed once for all samples and the flowcells are processed in a pool of threads
+    """
+    jobs = slurm.get_slurm_jobs()
+    fcdirs = bcbio.get_flowcelldirs(archive_dir,flowcell)
+    if len(fcdirs) == 0:
+        return []
+    pool = ThreadPool(max(1,min(workers,len(fcdirs))))
+    try:
+        status = pool.map(lambda fcdir: _flowcell_status(fcdir, analysis_dir, project, jobs), fcdirs)
+    finally:
+        pool.close()
+        pool.join()
+    return [fc_status for fc_status in status if fc_status is not None]
+
+def _flowcell_status(fcdir, analysis_dir, project, jobs):
+    """Get the status of the projects and samples of a flowcell
+    """
+    fc_status = {}
+    fc_status['flowcell'] = os.path.basename(fcdir)
+    
+    # Locate the samplesheet
+    samplesheet = IlluminaRun.get_samplesheet(fcdir)
+    if samplesheet is None:
+        sys.stderr.write("{}\t***ERROR***: Could not locate samplesheet in flowcell directory. Skipping..\n".format(fc_status['flowcell']))
+        return None
+    fc_status['samplesheet'] = samplesheet
+    
+    # Get the projects and samples in the samplesheet
+    samples = {}
+    for e in HiSeqRun.parse_samplesheet(samplesheet):
+        samples.setdefault(e['SampleProject'].replace("__","."),[]).append(e['SampleID'])
+    projects = [proj for proj in sorted(samples.keys()) if project is None or proj == project.replace("__",".")]
+    if len(projects) == 0:
+        sys.stderr.write("{}\t***WARNING***: No projects matched your filter [{}] for flowcell. Skipping..\n".format(fc_status['flowcell'],project))
+        return None
+    
+    fc_status['projects'] = []
     
-    last_step = 14
-    status = []
-    # Process each flowcell in the archive directory
-    for fcdir in bcbio.get_flowcelldirs(archive_dir,flowcell):
-        fc_status = {}
-        fc_status['flowcell'] = os.path.basename(fcdir)
+    # Iterate over the projects in the flowcell
+    for proj in projects:
+        proj_status = {}
+        proj_status['project'] = proj
         
-        # Locate the samplesheet
-        samplesheet = bcbio.get_samplesheet(fcdir)
-        if samplesheet is None:
-            print("{}***ERROR***: Could not locate samplesheet in flowcell directory. Skipping..")
-            continue
-        fc_status['samplesheet'] = samplesheet
-
-        # Get a list of the projects in the samplesheet
-        projects = bcbio.get_projects(samplesheet,project)
-        if len(projects) == 0:
-            print("\t***WARNING***: No projects matched your filter [{}] for flowcell. Skipping..".format(project))
+        pdir = bcbio.get_project_analysis_dir(analysis_dir, proj)
+        if not pdir:
             continue
         
-        fc_status['projects'] = []
+        proj_status['project_dir'] = pdir
+        proj_status['samples'] = []
+        proj_status['no_finished_samples'] = 0
+        for smpl in samples[proj]:
+            sample_status = _sample_status(fcdir, pdir, smpl.replace("__","."), jobs)
+            proj_status['samples'].append(sample_status)
+            if sample_status.get('finished',False):
+                proj_status['no_finished_samples'] += 1
         
-        # Iterate over the projects in the flowcell
-        for proj in projects:
-            proj = proj.replace("__",".")
-            proj_status = {}
-            proj_status['project'] = proj
-            
-            pdir = bcbio.get_project_analysis_dir(analysis_dir, proj)
-            if not pdir:
-                continue
-            
-            proj_status['project_dir'] = pdir
-            proj_status['samples'] = []
-            proj_status['no_finished_samples'] = 0
-            samples = bcbio.get_project_samples(samplesheet, proj)
-            for smpl in samples:
-                smpl = smpl.replace("__",".")
-                sample_status = {}
-                proj_status['samples'].append(sample_status)
-                sample_status['sample_id'] = smpl
-                sdir = bcbio.get_sample_analysis_dir(pdir, smpl)
-                if not sdir:
-                    continue
-                sample_status['sample_dir'] = sdir
-                
-                # Match the flowcell we're processing to the sample flowcell directories
-                sample_fc = [d for d in bcbio.get_flowcelldirs(sdir) if d.split("_")[-1] == fcdir.split("_")[-1]]
-                if len(sample_fc) == 0:
-                    continue
-                sample_fc = sample_fc[0]
-                sample_status['sample_fc_dir'] = sample_fc
-                
-                fastq_screen = bcbio.get_fastq_screen_folder(sample_fc)
-                if fastq_screen:
-                    sample_status['fastq_screen'] = [fastq_screen,bcbio.fastq_screen_finished(fastq_screen)]
-                
-                now = datetime.datetime.now()
-                pipeline_start_indicator = bcbio.get_pipeline_indicator(sample_fc,[1])
-                if len(pipeline_start_indicator) == 0:
-                    continue
-                pipeline_start_indicator = pipeline_start_indicator[0]
-                
-                most_recent, _ = bcbio.get_most_recent_indicator([pipeline_start_indicator])
-                sample_status['pipeline_started'] = [pipeline_start_indicator,most_recent]
-                
-                most_recent, ifile = bcbio.get_most_recent_indicator(bcbio.get_pipeline_indicator(sample_fc))
-                sample_status['pipeline_progress'] = [ifile,most_recent]
-                
-                sample_log = bcbio.get_sample_pipeline_log(sample_fc,smpl)
-                if not sample_log:
-                    continue
-                st = os.stat(sample_log)
-                sample_status['pipeline_log'] = [sample_log,datetime.datetime.fromtimestamp(st.st_mtime)]
-                
-                jobids = slurm.get_slurm_jobid(smpl)
-                sample_status['slurm_job'] = []
-                for jobid in jobids:
-                    sample_status['slurm_job'].append([jobid,slurm.get_slurm_jobstatus(jobid)])
-                
-                most_recent, ifile = bcbio.get_most_recent_indicator(bcbio.get_pipeline_indicator(sample_fc,[last_step]))
-                if ifile is not None and sample_status.get('fastq_screen',[None,False])[1]:
-                    sample_status['finished'] = True
-                    proj_status['no_finished_samples'] += 1
-                
-            
-            if proj_status['no_finished_samples'] == len(samples):
-                proj_status['finished'] = True
-                
-            fc_status['projects'].append(proj_status)
+        if proj_status['no_finished_samples'] == len(samples[proj]):
+            proj_status['finished'] = True
             
-        status.append(fc_status) 
-    print_status(status,brief)
+        fc_status['projects'].append(proj_status)
+    
+    return fc_status
+
+def _sample_status(fcdir, pdir, smpl, jobs):
+    """Get the status of a sample on a flowcell, from its analysis directory and
+    the slurm jobs by job name
+    """
+    sample_status = {}
+    sample_status['sample_id'] = smpl
+    sdir = bcbio.get_sample_analysis_dir(pdir, smpl)
+    if not sdir:
+        return sample_status
+    sample_status['sample_dir'] = sdir
+    
+    # Match the flowcell we're processing to the sample flowcell directories
+    sample_fc = [d for d in bcbio.get_flowcelldirs(sdir) if d.split("_")[-1] == fcdir.split("_")[-1]]
+    if len(sample_fc) == 0:
+        return sample_status
+    sample_fc = sample_fc[0]
+    sample_status['sample_fc_dir'] = sample_fc
+    
+    fastq_screen = bcbio.get_fastq_screen_folder(sample_fc)
+    if fastq_screen:
+        sample_status['fastq_screen'] = [fastq_screen,bcbio.fastq_screen_finished(fastq_screen)]
+    
+    indicators = bcbio.IndicatorIndex(sample_fc)
+    pipeline_start_indicator = indicators.get_pipeline_indicator([1])
+    if len(pipeline_start_indicator) == 0:
+        return sample_status
+    pipeline_start_indicator = pipeline_start_indicator[0]
+    
+    most_recent, _ = bcbio.get_most_recent_indicator([pipeline_start_indicator])
+    sample_status['pipeline_started'] = [pipeline_start_indicator,most_recent]
+    
+    most_recent, ifile = indicators.get_most_recent_indicator()
+    sample_status['pipeline_progress'] = [ifile,most_recent]
+    
+    sample_log = bcbio.get_sample_pipeline_log(sample_fc,smpl)
+    if not sample_log:
+        return sample_status
+    st = os.stat(sample_log)
+    sample_status['pipeline_log'] = [sample_log,datetime.datetime.fromtimestamp(st.st_mtime)]
+    
+    sample_status['slurm_job'] = [[jobid,state] for jobid, state in jobs.get(smpl,[])]
+    
+    most_recent, ifile = indicators.get_most_recent_indicator([LAST_STEP])
+    if ifile is not None and sample_status.get('fastq_screen',[None,False])[1]:
+        sample_status['finished'] = True
+    
+    return sample_status
+
+def status_to_json(status):
+    """Serialize the status as JSON, with timestamps in ISO 8601 format
+    """
+    return json.dumps(status, indent=2, sort_keys=True, default=lambda o: o.isoformat() if hasattr(o,"isoformat") else str(o))
 
 def print_status(status, brief=False):
     """Pretty-print the status output
@@ -1,7 +1,10 @@
 """Database module"""
 import os
 import sys
+import json
+import collections
 import couchdb
+from couchdb.client import Row
 
 from scilifelab.log import minimal_logger
 from scilifelab.utils.http import check_url
@@ -37,10 +40,241 @@ class Database(object):
     def __repr__(self):
         return "{}".format(self.__class__)
 
+# Number of documents per bulk request
+BATCH_SIZE = 500
+# Maximum number of changes applied to a cached view before it is reloaded instead
+CHANGES_LIMIT = 10000
+
+class CouchView(object):
+    """Lazy lookups in a CouchDB view.
+
+    Rows are fetched by key when first asked for, and the whole view is only
+    loaded when it is iterated over. If cachedir is given, the whole view is
+    kept in a file in cachedir, together with the database update sequence it
+    was loaded at, and is brought up to date from the _changes feed when
+    loaded. Changed documents are passed through map_fn, a python version of
+    the view map function returning a list of (key, value) pairs. Without a
+    map_fn the view is reloaded on any change.
+
+    :param db: couchdb database
+    :param viewname: view name, as in 'names/name'
+    :param value: what a lookup returns for a row; 'id', 'value' or 'row'
+    :param map_fn: python version of the view map function
+    :param cachedir: directory for the cached view
+    :param options: options passed on to each view query
+    """
+    _missing = object()
+
+    def __init__(self, db, viewname, value="row", map_fn=None, cachedir=None, **options):
+        self.db = db
+        self.viewname = viewname
+        self.value = value
+        self.map_fn = map_fn
+        self.cachedir = cachedir
+        self.options = options
+        self.log = minimal_logger(repr(self))
+        self._rows = None
+        self._lookups = {}
+        self._stale = set()
+        self._indexes = {}
+
+    def __repr__(self):
+        return "<CouchView {}>".format(self.viewname)
+
+    def _wrap(self, row):
+        if self.value == "id":
+            return row.id
+        if self.value == "value":
+            return row.value
+        return row
+
+    def _query(self, **options):
+        opts = dict(self.options)
+        opts.update(options)
+        return self.db.view(self.viewname, **opts)
+
+    def get(self, key, default=None):
+        """Get the row, id or value for key
+
+        :param key: view key
+        :param default: returned if key is not in the view
+        """
+        if self._rows is not None:
+            return self.get_many([key]).get(key, default)
+        if key not in self._lookups:
+            self.get_many([key])
+        value = self._lookups[key]
+        return default if value is self._missing else value
+
+    def get_many(self, keys):
+        """Get the rows, ids or values for several keys in one query
+
+        :param keys: list of view keys
+
+        :returns: dictionary with the keys present in the view
+        """
+        if self._rows is not None:
+            stale = list(self._stale.intersection(keys))
+            if stale:
+                self._stale.difference_update(stale)
+                for k in stale:
+                    self._index_remove(k)
+                    self._rows.pop(k, None)
+                for row in self._query(keys=stale):
+                    self._rows[row.key] = self._wrap(row)
+                    self._index_add(row.key)
+            return {k:self._rows[k] for k in keys if k in self._rows}
+        missing = list(set([k for k in keys if k not in self._lookups]))
+        if missing:
+            for k in missing:
+                self._lookups[k] = self._missing
+            for row in self._query(keys=missing):
+                self._lookups[row.key] = self._wrap(row)
+        return {k:self._lookups[k] for k in keys if self._lookups[k] is not self._missing}
+
+    def range(self, startkey=None, endkey=None):
+        """Get the (key, row/id/value) pairs with keys between startkey and endkey
+
+        :param startkey: first key
+        :param endkey: last key
+        """
+        if self._rows is not None:
+            self.load()
+            return sorted([(k, v) for k, v in self._rows.iteritems() if (startkey is None or k >= startkey) and (endkey is None or k <= endkey)])
+        opts = {}
+        if startkey is not None:
+            opts["startkey"] = startkey
+        if endkey is not None:
+            opts["endkey"] = endkey
+        return [(row.key, self._wrap(row)) for row in self._query(**opts)]
+
+    def _cachefile(self):
+        return os.path.join(self.cachedir, "{}_{}.json".format(self.db.name, self.viewname.replace("/", "_")))
+
+    def _fetch(self):
+        """Fetch the whole view, returning the update sequence and the rows"""
+        seq = self.db.info()["update_seq"]
+        return seq, [dict(row) for row in self._query()]
+
+    def _refresh(self, seq, rows):
+        """Apply the changes since seq to the cached rows"""
+        changes = self.db.changes(since=seq, include_docs=self.map_fn is not None, limit=CHANGES_LIMIT)
+        results = [c for c in changes.get("results", []) if not c["id"].startswith("_design/")]
+        if not results:
+            return changes.get("last_seq", seq), rows, len(changes.get("results", [])) > 0
+        if self.map_fn is None or len(changes.get("results", [])) >= CHANGES_LIMIT:
+            self.log.debug("reloading view {} with {} changes".format(self.viewname, len(results)))
+            return self._fetch() + (True,)
+        ids = set([c["id"] for c in results])
+        rows = [row for row in rows if row.get("id") not in ids]
+        for c in results:
+            if c.get("deleted") or not c.get("doc"):
+                continue
+            rows.extend([{"id":c["id"], "key":k, "value":v} for k, v in self.map_fn(c["doc"])])
+        self.log.debug("applied {} changes to view {}".format(len(results), self.viewname))
+        return changes["last_seq"], rows, True
+
+    def load(self):
+        """Load the whole view, from the cache if there is one"""
+        if self._rows is not None:
+            if self._stale:
+                self.get_many(list(self._stale))
+            return self
+        updated = True
+        if self.cachedir and os.path.exists(self._cachefile()):
+            with open(self._cachefile()) as fh:
+                cache = json.load(fh)
+            seq, rows, updated = self._refresh(cache["update_seq"], cache["rows"])
+        else:
+            seq, rows = self._fetch()
+        if self.cachedir and updated:
+            if not os.path.exists(self.cachedir):
+                os.makedirs(self.cachedir)
+            tmp = "{}.{}.tmp".format(self._cachefile(), os.getpid())
+            with open(tmp, "w") as fh:
+                json.dump({"update_seq":seq, "rows":rows}, fh)
+            os.rename(tmp, self._cachefile())
+        self._rows = {}
+        for row in rows:
+            self._rows[row["key"]] = self._wrap(Row(row))
+        self._lookups = {}
+        self._indexes = {}
+        return self
+
+    def index(self, key_fn):
+        """Get a secondary index of the view, mapping key_fn(value) to
+        the set of view keys with that value, where value is the row, id
+        or value of a view key. The index is built once, from the whole
+        view, and kept up to date as rows are fetched again.
+
+        :param key_fn: function giving the index key of a value
+
+        :returns: dictionary of sets of view keys
+        """
+        self.load()
+        if key_fn not in self._indexes:
+            index = collections.defaultdict(set)
+            for k, v in self._rows.iteritems():
+                index[key_fn(v)].add(k)
+            self._indexes[key_fn] = index
+        return self._indexes[key_fn]
+
+    def _index_add(self, key):
+        for key_fn, index in self._indexes.iteritems():
+            index[key_fn(self._rows[key])].add(key)
+
+    def _index_remove(self, key):
+        if key not in self._rows:
+            return
+        for key_fn, index in self._indexes.iteritems():
+            index[key_fn(self._rows[key])].discard(key)
+
+    def __getitem__(self, key):
+        value = self.get(key, self._missing)
+        if value is self._missing:
+            raise KeyError(key)
+        return value
+
+    def forget(self, keys):
+        """Forget the rows for keys, so that they are fetched again
+
+        :param keys: list of view keys
+        """
+        if self._rows is not None:
+            self._stale.update(keys)
+        for k in keys:
+            self._lookups.pop(k, None)
+
+    def __contains__(self, key):
+        return self.get(key, self._missing) is not self._missing
+
+    def __iter__(self):
+        return iter(self.load()._rows)
+
+    def __len__(self):
+        return len(self.load()._rows)
+
+    def keys(self):
+        return self.load()._rows.keys()
+
+    def values(self):
+        return self.load()._rows.values()
+
+    def items(self):
+        return self.load()._rows.items()
+
+    def iteritems(self):
+        return self.load()._rows.iteritems()
+
+def _row_value(row):
+    return row.value
+
 ## From http://stackoverflow.com/questions/8780168/how-to-begin-writing-a-python-wrapper-around-another-wrapper
 class Couch(Database):
     _doc_type = None
     _update_fn = None
+    _merge_fn = None
+    _name_field = "name"
 
     def __init__(self, log=None, url="localhost", **kwargs):
         self.db = None
@@ -48,6 +282,10 @@ class Couch(Database):
         self.port = 5984
         self.user = kwargs.get("username", None)
         self.pw = kwargs.get("password", None)
+        self.cachedir = kwargs.get("cachedir", None)
+        self.batch_size = kwargs.get("batch_size", None) or BATCH_SIZE
+        self._entries = {}
+        self._views = []
         if self.user and self.pw:
             self.url_string = "http://{}:{}@{}:{}".format(self.user, self.pw, self.url, self.port)
             self.display_url_string = "http://{}:{}@{}:{}".format(self.user, "*********", self.url, self.port)
@@ -72,6 +310,28 @@ class Couch(Database):
         self.user = username
         self.pw = password
 
+    def view(self, viewname, value="row", map_fn=None, **options):
+        """Get a lazy view of the current database, cached in cachedir
+        if one was given
+
+        :param viewname: view name
+        :param value: what lookups return for a row; 'id', 'value' or 'row'
+        :param map_fn: python version of the view map function, used to update the cache
+        :param options: options passed on to the view queries
+        """
+        view = CouchView(self.db, viewname, value, map_fn, self.cachedir, **options)
+        self._views.append(view)
+        return view
+
+    def _forget(self, names, ids=()):
+        """Forget entries and view rows for names, and the id_name_view
+        rows for ids, after saving them"""
+        for name in names:
+            self._entries.pop(name, None)
+        id_name_view = getattr(self, "id_name_view", None)
+        for view in self._views:
+            view.forget(ids if view is id_name_view else names)
+
     def set_db(self, dbname):
         """Set database to use
 
@@ -92,15 +352,62 @@ class Couch(Database):
         if not self._doc_type:
             return
         self.log.debug("retrieving field entry in field '{}' for name '{}'".format(field, name))
-        if self.name_view.get(name, None) is None:
+        if name in self._entries:
+            doc = self._doc_type(**self._entries[name])
+        elif self.name_view.get(name, None) is None:
             self.log.warn("no entry '{}' in {}".format(name, self.db))
             return None
-        doc = self._doc_type(**self.db.get(self.name_view.get(name)))
+        else:
+            doc = self._doc_type(**self.db.get(self.name_view.get(name)))
         if field:
             return doc[field]
         else:
             return doc
 
+    def _get_docs(self, ids):
+        """Retrieve documents by id with _all_docs, batch_size at a time
+
+        :param ids: list of document ids
+
+        :returns: dictionary of documents by id
+        """
+        docs = {}
+        ids = list(ids)
+        for i in xrange(0, len(ids), self.batch_size):
+            for row in self.db.view("_all_docs", keys=ids[i:i+self.batch_size], include_docs=True):
+                if row.get("doc", None):
+                    docs[row.id] = row["doc"]
+        return docs
+
+    def get_entries(self, names, field=None):
+        """Retrieve entries from db for several names, subset to field
+        if that value is passed. The documents are fetched in batches
+        and kept, so that later calls to get_entry for the same names
+        do not query the database.
+
+        :param names: list of unique name identifiers
+        :param field: get 'field' of documents
+
+        :returns: dictionary of entries (or fields) by name, for the names present in db
+        """
+        if not self._doc_type:
+            return {}
+        names = list(names)
+        self.log.debug("retrieving {} entries".format(len(names)))
+        ids = self.name_view.get_many([x for x in names if x not in self._entries])
+        docs = self._get_docs(ids.values())
+        for name, dbid in ids.iteritems():
+            if dbid in docs:
+                self._entries[name] = docs[dbid]
+        entries = {}
+        for name in names:
+            if name not in self._entries:
+                self.log.warn("no entry '{}' in {}".format(name, self.db))
+                continue
+            doc = self._doc_type(**self._entries[name])
+            entries[name] = doc[field] if field else doc
+        return entries
+
     def save(self, obj, **kwargs):
         """Save/update database object <obj>. If <obj> already exists
         and <update_fn> is defined, update will only take place if
@@ -118,6 +425,66 @@ class Couch(Database):
                 self.db.save(new_obj)
             else:
                 self.log.info("Object {} with id '{}' present and not in need of updating".format(repr(obj), dbid.id))
+        self._forget([obj.get(self._name_field, None)], [obj.get("_id", None)])
+
+    def _get_ids(self, objs):
+        """Find the database ids of objects by name in the id_name_view,
+        the names/id_to_name view that update_fn also uses. If several
+        documents have the name of an object, the id of the object
+        itself is preferred.
+
+        :param objs: list of database objects
+
+        :returns: dictionary of database ids by name
+        """
+        by_name = self.id_name_view.index(_row_value)
+        ids = {}
+        for obj in objs:
+            name = obj.get(self._name_field, None)
+            found = by_name.get(name, set())
+            if obj.get("_id", None) in found:
+                ids[name] = obj["_id"]
+            elif found:
+                ids[name] = min(found)
+        return ids
+
+    def save_many(self, objs):
+        """Save/update several database objects with _bulk_docs,
+        batch_size at a time. If <merge_fn> is defined, the objects
+        are compared with their versions in the database, found by
+        name as in update_fn, and only saved if they have been modified.
+
+        :param objs: list of database objects to save
+
+        :returns: list of saved objects
+        """
+        saved = []
+        for i in xrange(0, len(objs), self.batch_size):
+            batch = objs[i:i+self.batch_size]
+            names = [obj.get(self._name_field, None) for obj in batch]
+            self._forget(names)
+            if self._merge_fn:
+                ids = self._get_ids(batch)
+                dbobjs = self._get_docs(ids.values())
+                new_objs = []
+                for obj, name in zip(batch, names):
+                    new_obj = self._merge_fn(obj, dbobjs.get(ids.get(name, None), None))
+                    if new_obj is None:
+                        self.log.info("Object {} with id '{}' present and not in need of updating".format(repr(obj), ids.get(name)))
+                    else:
+                        new_objs.append(new_obj)
+                batch = new_objs
+            if not batch:
+                continue
+            for obj, (success, dbid, rev) in zip(batch, self.db.update(batch)):
+                if success:
+                    obj["_rev"] = rev
+                    self.log.info("Saving object {} with id '{}'".format(repr(obj), dbid))
+                    saved.append(obj)
+                else:
+                    self.log.warn("Failed to save object {} with id '{}': {}".format(repr(obj), dbid, rev))
+            self._forget(names, [obj["_id"] for obj in batch])
+        return saved
 
 
 class GenoLogics(Database):
@@ -0,0 +1,124 @@
+"""Synchronization of LIMS projects to statusdb.
+
+Project documents are built from LIMS entities in a pool of workers and
+saved to statusdb in bulk. LIMS entities are shared between workers
+through the entity cache of the Lims instance, where an entity is only
+fetched once, and are prefetched in batches before they are used, rather
+than with one request on first attribute access. The number of
+concurrent requests to the LIMS server is capped.
+"""
+import threading
+from multiprocessing.pool import ThreadPool
+
+from scilifelab.db.statusDB_utils import find_projs_from_view, find_or_make_key, save_couchdb_objs
+from scilifelab.log import minimal_logger
+
+LOG = minimal_logger(__name__)
+
+## Number of entities per batch request
+BATCH_SIZE = 500
+## Entity types that the LIMS API can retrieve in batch requests
+BATCH_ENTITIES = ("Artifact", "Sample", "Container")
+
+def limit_requests(lims, max_requests):
+    """Cap the number of concurrent requests of a Lims instance
+
+    :param lims: Lims instance
+    :param max_requests: maximum number of concurrent requests
+    """
+    semaphore = threading.BoundedSemaphore(max_requests)
+    def _limited(fn):
+        def wrapper(*args, **kwargs):
+            with semaphore:
+                return fn(*args, **kwargs)
+        return wrapper
+    for method in ["get", "post"]:
+        setattr(lims, method, _limited(getattr(lims, method)))
+    return lims
+
+def _pool_map(fn, items, workers):
+    if workers <= 1 or len(items) <= 1:
+        return map(fn, items)
+    pool = ThreadPool(min(workers, len(items)))
+    try:
+        return pool.map(fn, items, chunksize=1)
+    finally:
+        pool.close()
+        pool.join()
+
+def prefetch(lims, entities, workers=4, batch_size=BATCH_SIZE):
+    """Fetch the entities that have not been fetched yet, with batch
+    requests for the entity types that support them and concurrent
+    requests for the others
+
+    :param lims: Lims instance
+    :param entities: list of entities. None values are ignored
+    :param workers: number of concurrent requests
+    :param batch_size: number of entities per batch request
+
+    :returns: list of the unique entities
+    """
+    unique = {}
+    for entity in entities:
+        if entity is not None:
+            unique.setdefault(entity.uri, entity)
+    todo = [e for e in unique.values() if e.root is None]
+    batches = []
+    single = []
+    for name in BATCH_ENTITIES:
+        same = [e for e in todo if type(e).__name__ == name]
+        if same and hasattr(lims, "get_batch"):
+            batches.extend([same[i:i + batch_size] for i in xrange(0, len(same), batch_size)])
+        else:
+            single.extend(same)
+    single.extend([e for e in todo if type(e).__name__ not in BATCH_ENTITIES])
+    _pool_map(lambda job: lims.get_batch(job) if isinstance(job, list) else job.get(), batches + single, workers)
+    return unique.values()
+
+def sync_projects(projects, build, db, workers=4, batch_size=50, log=None):
+    """Build and save the documents of LIMS projects
+
+    :param projects: list of LIMS projects
+    :param build: function returning the document of a project
+    :param db: statusdb projects database
+    :param workers: number of projects built concurrently
+    :param batch_size: number of documents per bulk save
+    :param log: logger, by default the module logger
+
+    :returns: dictionary of project names and statuses; 'created', 'uppdated', 'not uppdated' or 'failed'
+    """
+    log = log or LOG
+    keys = find_projs_from_view(db, [proj.name for proj in projects])
+    statuses = {}
+    docs = []
+    def _build(proj):
+        try:
+            return proj, build(proj)
+        except Exception as e:
+            log.warn("Issues geting info for {}: {}".format(proj.name, e))
+            return proj, None
+    def _save(docs):
+        try:
+            saved = save_couchdb_objs(db, [doc for _, doc in docs])
+        except Exception as e:
+            log.warn("Issues saving {}: {}".format(", ".join([name for name, _ in docs]), e))
+            saved = ['failed'] * len(docs)
+        for (name, doc), status in zip(docs, saved):
+            statuses[name] = status
+            log.info("project {} is handeled and {} : _id = {}".format(name, status, doc['_id']))
+    pool = ThreadPool(max(min(workers, len(projects)), 1))
+    try:
+        for proj, doc in pool.imap_unordered(_build, projects):
+            if doc is None:
+                statuses[proj.name] = 'failed'
+                continue
+            doc['_id'] = find_or_make_key(keys.get(proj.name))
+            docs.append((proj.name, doc))
+            if len(docs) == batch_size:
+                _save(docs)
+                docs = []
+        _save(docs)
+    finally:
+        pool.close()
+        pool.join()
+    return statuses
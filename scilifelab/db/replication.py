@@ -0,0 +1,127 @@
+"""Client side CouchDB replication.
+
+Changes are read from the source database in batches. The changed
+documents are fetched with their revision history and written to the
+target database with _bulk_docs without new edits, so that documents
+keep their ids and revisions and updates and deletions extend the
+revision tree of the target instead of adding conflicting leaves. The last
+sequence copied for each database is checkpointed in a local file so
+that an interrupted replication resumes where it stopped.
+"""
+import os
+import json
+import threading
+from multiprocessing.pool import ThreadPool
+
+import couchdb
+
+from scilifelab.log import minimal_logger
+
+LOG = minimal_logger(__name__)
+
+## Number of changes per batch
+BATCH_SIZE = 1000
+
+class Checkpoints(object):
+    """Last replicated sequence per replication, kept in a json file
+
+    :param fn: checkpoint file. Without it, checkpoints are only kept in memory
+    """
+    def __init__(self, fn=None):
+        self.fn = fn
+        self._lock = threading.Lock()
+        self._seq = {}
+        if self.fn and os.path.exists(self.fn):
+            with open(self.fn) as fh:
+                self._seq = json.load(fh)
+
+    def __contains__(self, key):
+        return key in self._seq
+
+    def get(self, key, default=0):
+        return self._seq.get(key, default)
+
+    def set(self, key, seq):
+        """Set and save the checkpoint of a replication"""
+        with self._lock:
+            self._seq[key] = seq
+            if not self.fn:
+                return
+            tmp = "{}.{}.tmp".format(self.fn, os.getpid())
+            with open(tmp, "w") as fh:
+                json.dump(self._seq, fh)
+            os.rename(tmp, self.fn)
+
+def _get_docs(source_db, changes):
+    """Get the documents of changes at their changed revision, with their
+    revision history and inline attachments. Deleted documents are
+    returned as deletion stubs. Uses one _bulk_get request, or one
+    request per document where the server has no _bulk_get"""
+    refs = [{"id":c["id"], "rev":c["changes"][0]["rev"]} for c in changes]
+    try:
+        _, _, data = source_db.resource.post_json("_bulk_get", body={"docs":refs}, revs="true", attachments="true")
+    except (couchdb.ResourceNotFound, couchdb.ServerError):
+        return [source_db.get(ref["id"], rev=ref["rev"], revs="true", attachments="true") for ref in refs]
+    docs = []
+    for result in data["results"]:
+        for doc in result["docs"]:
+            if "error" in doc:
+                raise couchdb.ServerError("Could not get {} from {}: {}".format(result["id"], source_db.name, doc["error"]))
+            docs.append(doc["ok"])
+    return docs
+
+def replicate_db(source_db, target_db, checkpoints=None, key=None, batch_size=BATCH_SIZE):
+    """Replicate source_db to target_db from the last checkpoint of
+    the replication.
+
+    :param source_db: source couchdb.Database
+    :param target_db: target couchdb.Database
+    :param checkpoints: Checkpoints
+    :param key: checkpoint key, by default the database names
+    :param batch_size: number of changes per batch
+
+    :returns: tuple of the last replicated sequence and the number of documents written
+    """
+    if checkpoints is None:
+        checkpoints = Checkpoints()
+    if key is None:
+        key = "{}->{}".format(source_db.name, target_db.name)
+    since = checkpoints.get(key)
+    ndocs = 0
+    while True:
+        changes = source_db.changes(since=since, limit=batch_size)
+        results = changes.get("results", [])
+        if not results:
+            break
+        docs = _get_docs(source_db, results)
+        target_db.update(docs, new_edits=False)
+        ndocs += len(docs)
+        since = changes["last_seq"]
+        checkpoints.set(key, since)
+        LOG.debug("replicated {} documents of {} up to sequence {}".format(ndocs, source_db.name, since))
+    return since, ndocs
+
+def replicate(jobs, workers=4, checkpoints=None, batch_size=BATCH_SIZE):
+    """Replicate several databases concurrently
+
+    :param jobs: list of tuples of source and target databases and checkpoint key
+    :param workers: number of databases to replicate concurrently
+    :param checkpoints: Checkpoints
+    :param batch_size: number of changes per batch
+
+    :returns: list of tuples of the last replicated sequence and the number of documents written, in the order of jobs
+    """
+    if checkpoints is None:
+        checkpoints = Checkpoints()
+    def _replicate(job):
+        source_db, target_db, key = job
+        return replicate_db(source_db, target_db, checkpoints, key, batch_size)
+    workers = min(workers or 1, len(jobs))
+    if workers <= 1:
+        return [_replicate(job) for job in jobs]
+    pool = ThreadPool(workers)
+    try:
+        return pool.map(_replicate, jobs, chunksize=1)
+    finally:
+        pool.close()
+        pool.join()
@@ -1,6 +1,8 @@
 #!/usr/bin/env python
 from uuid import uuid4
 import time
+import json
+import hashlib
 from  datetime  import  datetime
 import couchdb
 #Make it backwards compatible
@@ -24,13 +26,71 @@ def find_or_make_key(key):
         key = uuid4().hex
     return key
 
+## View emitting [_rev, content_hash, creation_time] of documents by _id
+HASH_VIEW = 'content/hash'
+## Fields left out of the content hash
+VOLATILE_FIELDS = ['_rev', 'creation_time', 'modification_time', 'content_hash']
+
+def _canonical_object(pairs):
+    # Each object becomes a single member object holding its members sorted as
+    # pairs, so that objects stay distinct from lists and the C encoder, which
+    # does not support sort_keys, can be used
+    return {"": sorted(pairs)}
+
+def content_hash(obj):
+    """md5 of a canonical json serialisation of obj, without the volatile fields"""
+    content = dict((k, v) for k, v in obj.items() if k not in VOLATILE_FIELDS)
+    canonical = json.loads(json.dumps(content), object_pairs_hook=_canonical_object)
+    return hashlib.md5(json.dumps(canonical, separators=(',', ':'))).hexdigest()
+
+def _needs_stored_obj(obj):
+    """Checks if comparing obj rewrites it from the stored object,
+    see dont_load_status_if_20158_not_found"""
+    for samp in obj.get('samples', {}).values():
+        if isinstance(samp, dict):
+            for key in ['status', 'm_reads_sequenced']:
+                if samp.has_key(key) and samp[key] in ['doc_not_found', None]:
+                    return True
+    return False
+
+def get_stored_objs(db, objs):
+    """Gets what is needed to compare the objects objs with their stored
+    versions, in at most two requests. Objects that are compared by content
+    hash get the _rev, content_hash and creation_time of the stored object
+    from HASH_VIEW. Other objects, or all if the view is missing from db,
+    get the whole stored object. Returns a dictionary of the stored objects
+    found, by _id."""
+    ids = [obj['_id'] for obj in objs if not _needs_stored_obj(obj)]
+    dbobjs = {}
+    if ids:
+        try:
+            for row in db.view(HASH_VIEW, keys=ids):
+                dbobjs[row.key] = dict(zip(['_rev', 'content_hash', 'creation_time'], row.value))
+        except couchdb.ResourceNotFound:
+            pass
+    missing = [obj['_id'] for obj in objs if not dbobjs.has_key(obj['_id'])]
+    if missing:
+        for row in db.view('_all_docs', keys=missing, include_docs=True):
+            if row.get('doc'):
+                dbobjs[row.key] = row.doc
+    return dbobjs
+
+def _unchanged(obj, dbobj):
+    """Compares obj with a stored object from get_stored_objs, by content
+    hash if only the hash was stored"""
+    if dbobj.has_key('_id'):
+        return comp_obj(obj, dbobj)
+    obj['content_hash'] = content_hash(obj)
+    return obj['content_hash'] == dbobj['content_hash']
+
 def save_couchdb_obj(db, obj):
     """Updates ocr creates the object obj in database db."""
-    dbobj = db.get(obj['_id'])
+    dbobj = get_stored_objs(db, [obj]).get(obj['_id'])
     time_log = datetime.utcnow().isoformat() + "Z"
     if dbobj is None:
         obj["creation_time"] = time_log
         obj["modification_time"] = time_log
+        obj["content_hash"] = content_hash(obj)
         db.save(obj)
         return 'created'
     else:
@@ -38,11 +98,53 @@ def save_couchdb_obj(db, obj):
         obj["modification_time"] = time_log
         dbobj["modification_time"] = time_log
         obj["creation_time"] = dbobj["creation_time"]
-        if not comp_obj(obj, dbobj):
+        if not _unchanged(obj, dbobj):
             db.save(obj)
             return 'uppdated'
     return 'not uppdated'
 
+def save_couchdb_objs(db, objs):
+    """Updates or creates the objects objs in database db, as save_couchdb_obj,
+    with at most two requests to get the stored objects and one bulk request
+    to save the changed ones. Objects that conflict with a concurrent update
+    are saved again one at a time. Returns the list of statuses of objs, with
+    'failed' for the objects that could not be saved."""
+    if not objs:
+        return []
+    dbobjs = get_stored_objs(db, objs)
+    time_log = datetime.utcnow().isoformat() + "Z"
+    statuses = []
+    changed = []
+    for obj in objs:
+        dbobj = dbobjs.get(obj['_id'])
+        if dbobj is None:
+            obj["creation_time"] = time_log
+            obj["modification_time"] = time_log
+            obj["content_hash"] = content_hash(obj)
+            obj.pop("_rev", None)
+            statuses.append('created')
+            changed.append(len(statuses) - 1)
+            continue
+        obj["_rev"] = dbobj.get("_rev")
+        obj["modification_time"] = time_log
+        dbobj["modification_time"] = time_log
+        obj["creation_time"] = dbobj["creation_time"]
+        if not _unchanged(obj, dbobj):
+            statuses.append('uppdated')
+            changed.append(len(statuses) - 1)
+        else:
+            statuses.append('not uppdated')
+    for i, (success, docid, result) in zip(changed, db.update([objs[i] for i in changed])):
+        if success:
+            continue
+        statuses[i] = 'failed'
+        if isinstance(result, couchdb.ResourceConflict):
+            try:
+                statuses[i] = save_couchdb_obj(db, objs[i])
+            except couchdb.HTTPError:
+                pass
+    return statuses
+
 def save_couchdb_ref_obj(db, obj):
     """Updates ocr creates the object obj in database db."""
     dbobj = db.get(obj['_id'])
@@ -58,20 +160,15 @@ def save_couchdb_ref_obj(db, obj):
     return 'not uppdated'
 
 def comp_obj(obj, dbobj):
+    """compares the two dictionaries obj and dbobj by content hash, leaving
+    out the volatile fields, and sets the content_hash of obj"""
     ####temporary
     if dbobj.has_key('entity_type'):
         if dbobj['entity_type']=='project_summary':
             obj=dont_load_status_if_20158_not_found(obj, dbobj)
     ###end temporary
-    """compares the two dictionaries obj and dbobj"""
-    keys = list(set(obj.keys() + dbobj.keys()))
-    for key in keys:
-        if (obj.has_key(key)) and dbobj.has_key(key):
-            if (obj[key] != dbobj[key]):
-                return False
-        else:
-            return False
-    return True
+    obj['content_hash'] = content_hash(obj)
+    return obj['content_hash'] == content_hash(dbobj)
 
 
 def dont_load_status_if_20158_not_found(obj, dbobj):
@@ -98,41 +195,77 @@ def dont_load_status_if_20158_not_found(obj, dbobj):
             except: pass
     return obj
 
+def _first_values(rows):
+    """Maps the keys of view rows to the value of their first row"""
+    values = {}
+    for row in rows:
+        values.setdefault(row.key, row.value)
+    return values
+
 def find_proj_from_view(proj_db, project_name):
-    view = proj_db.view('project/project_name')
-    for proj in view:
-        if proj.key == project_name:
-            return proj.value
-    return None
+    """Finds the _id of a project by name, with a keyed view query"""
+    return find_projs_from_view(proj_db, [project_name]).get(project_name)
+
+def find_projs_from_view(proj_db, project_names):
+    """Finds the _ids of several projects by name in one view query.
+    Returns a dictionary with the names found."""
+    return _first_values(proj_db.view('project/project_name', keys=list(set(project_names))))
 
 def find_proj_from_samp(proj_db, sample_name):
-    view = proj_db.view('samples/sample_project_name')
-    for samp in view:
-        if samp.key == sample_name:
-            return samp.value
-    return None
+    """Finds the project of a sample, with a keyed view query"""
+    return find_projs_from_samps(proj_db, [sample_name]).get(sample_name)
+
+def find_projs_from_samps(proj_db, sample_names):
+    """Finds the projects of several samples in one view query.
+    Returns a dictionary with the samples found."""
+    return _first_values(proj_db.view('samples/sample_project_name', keys=list(set(sample_names))))
 
 def find_samp_from_view(samp_db, proj_name):
-    view = samp_db.view('names/id_to_proj')
-    samps = {}
-    for doc in view:
-        if (doc.value[0] == proj_name) or (doc.value[0] == proj_name.lower()):
-            samps[doc.key] = doc.value[1:3]
+    return find_samps_from_view(samp_db, [proj_name])[proj_name]
+
+def find_samps_from_view(samp_db, proj_names):
+    """Finds the samples of several projects. The view is keyed on
+    sample _id, so it is read once and indexed on project name.
+    Returns a dictionary of sample dictionaries for each project."""
+    projs = {}
+    for proj_name in proj_names:
+        projs.setdefault(proj_name, [])
+        projs.setdefault(proj_name.lower(), [])
+        projs[proj_name].append(proj_name)
+        if proj_name.lower() != proj_name:
+            projs[proj_name.lower()].append(proj_name)
+    samps = dict((proj_name, {}) for proj_name in proj_names)
+    for doc in samp_db.view('names/id_to_proj'):
+        for proj_name in projs.get(doc.value[0], []):
+            samps[proj_name][doc.key] = doc.value[1:3]
     return samps
 
 def find_flowcell_from_view(flowcell_db, flowcell_name):
-    view = flowcell_db.view('names/id_to_name')
-    for doc in view:
+    return find_flowcells_from_view(flowcell_db, [flowcell_name]).get(flowcell_name)
+
+def find_flowcells_from_view(flowcell_db, flowcell_names):
+    """Finds the _ids of several flowcells by flowcell id. The view is
+    keyed on _id, so it is read once for all flowcells.
+    Returns a dictionary with the flowcells found."""
+    names = set(flowcell_names)
+    keys = {}
+    for doc in flowcell_db.view('names/id_to_name'):
         if doc.value:
             id = doc.value.split('_')[1]
-            if (id == flowcell_name):
-                return doc.key
+            if id in names and id not in keys:
+                keys[id] = doc.key
+    return keys
 
 def find_sample_run_id_from_view(samp_db,sample_run):
-    view = samp_db.view('names/id_to_name')
-    for doc in view:
-        if doc.value == sample_run:
-            return doc.key
-    return None
-
+    return find_sample_run_ids_from_view(samp_db, [sample_run]).get(sample_run)
 
+def find_sample_run_ids_from_view(samp_db, sample_runs):
+    """Finds the _ids of several sample runs by name. The view is keyed
+    on _id, so it is read once for all sample runs.
+    Returns a dictionary with the sample runs found."""
+    names = set(sample_runs)
+    keys = {}
+    for doc in samp_db.view('names/id_to_name'):
+        if doc.value in names and doc.value not in keys:
+            keys[doc.value] = doc.key
+    return keys
@@ -1,6 +1,7 @@
 """Database backend for connecting to statusdb"""
 import re
 import collections
+import couchdb
 from itertools import izip
 from scilifelab.db import Couch
 from scilifelab.utils.timestamp import utc_time
@@ -11,23 +12,68 @@ from scilifelab.log import minimal_logger
 
 LOG = minimal_logger(__name__)
 
+# View of the stored content hashes, see statusDB_utils.get_stored_objs
+CONTENT_HASH_VIEW = '''function(doc) {if (doc.content_hash) {emit(doc._id, [doc._rev, doc.content_hash, doc.creation_time]);}}'''
+
 # Statusdb views essential for pm qc functionality
 # FIXME: import ViewDefinition from couchdb.design and create views if not present
 VIEWS = {'samples' : {'names': {'name' : '''function(doc) {if (!doc["name"].match(/_[0-9]+$/)) {emit(doc["name"], null);}}''',
                                 'name_fc' : '''function(doc) {if (!doc["name"].match(/_[0-9]+$/)) {emit(doc["name"], doc["flowcell"]);}}''',
                                 'name_fc_proj' : '''var list; function(doc) {if (!doc["name"].match(/_[0-9]+$/)) {list = [doc["flowcell"], doc["sample_prj"]];emit(doc["name"], list);}}''',
                                 'name_proj' : '''function(doc) {if (!doc["name"].match(/_[0-9]+$/)) {emit(doc["name"], doc["sample_prj"]);}}''',
+                                'fc_name' : '''function(doc) {if (!doc["name"].match(/_[0-9]+$/)) {emit(doc["flowcell"], doc["name"]);}}''',
+                                'proj_name' : '''function(doc) {if (!doc["name"].match(/_[0-9]+$/)) {emit(doc["sample_prj"], doc["name"]);}}''',
                                 'id_to_name' : '''function(doc) {emit(doc["_id"], doc["name"]);}''',
                                 }},
          'flowcells' : {'names' : {'name' : '''function(doc) {emit(doc["name"], null);}''',
                                    'id_to_name' : '''function(doc) {emit(doc["_id"], doc["name"]);}''',
-                                   'Barcode_lane_stat' : '''function(doc) {emit(doc["name"],doc["illumina"]["Demultiplex_Stats"]["Barcode_lane_statistics"] );}'''}},
+                                   'Barcode_lane_stat' : '''function(doc) {emit(doc["name"],doc["illumina"]["Demultiplex_Stats"]["Barcode_lane_statistics"] );}'''},
+                        'content' : {'hash' : CONTENT_HASH_VIEW}},
          'projects' : {'project' : {'project_id' : '''function(doc) {emit(doc.project_id, doc._id)}''',
                                     'project_name' : '''function(doc) {emit(doc.project_name, doc._id)}'''},
                        'names' : {'id_to_name' : '''function(doc) {emit(doc["_id"], doc["project_name"]);}''',
-                                  'name' : '''function(doc) {emit(doc["project_name"], null);}'''}},
+                                  'name' : '''function(doc) {emit(doc["project_name"], null);}'''},
+                       'content' : {'hash' : CONTENT_HASH_VIEW}},
          }
 
+# Python versions of the views, used to bring cached views up to date
+def _sample_view_map(value_fn):
+    """Map function of the samples names views, emitting value_fn(doc) for sample runs"""
+    def map_fn(doc):
+        name = doc.get("name", None)
+        if not isinstance(name, basestring) or re.search("_[0-9]+$", name):
+            return []
+        return [(name, value_fn(doc))]
+    return map_fn
+
+def _id_to_name_map(key):
+    """Map function of the names/id_to_name views, emitting the name in key"""
+    def map_fn(doc):
+        return [(doc["_id"], doc.get(key, None))]
+    return map_fn
+
+def _flowcell_name_map(doc):
+    return [(doc["name"], None)] if "name" in doc else []
+
+def _barcode_lane_stat_map(doc):
+    try:
+        return [(doc["name"], doc["illumina"]["Demultiplex_Stats"].get("Barcode_lane_statistics", None))]
+    except (KeyError, TypeError, AttributeError):
+        return []
+
+def _project_name_map(doc):
+    return [(doc.get("project_name", None), doc["_id"])]
+
+# Index keys of the samples names/name_fc_proj view
+def _row_flowcell(row):
+    return row.value[0]
+
+def _row_project(row):
+    return row.value[1]
+
+def _row_id(row):
+    return row.id
+
 # Regular expressions for general use
 re_project_id = "^(P[0-9]{3,})"
 re_project_id_nr = "^P([0-9]{3,})"
@@ -216,14 +262,14 @@ class AnalysisDocument(StatusDocument):
         StatusDocument.__init__(self, **kw)
 
 # Updating function for object comparison
-def update_fn(cls, db, obj, viewname = "names/id_to_name", key="name"):
-    """Compare object with object in db if present.
+def merge_fn(cls, obj, dbobj):
+    """Compare object with its version in the database, if present.
 
     :param cls: calling class
-    :param db: couch database
     :param obj: database object to save
+    :param dbobj: database version of the object, or None
 
-    :returns: database object to save and database id if present
+    :returns: database object to save, or None if the object is unchanged
     """
     t_utc = utc_time()
     def equal(a, b):
@@ -232,6 +278,30 @@ def update_fn(cls, db, obj, viewname = "names/id_to_name", key="name"):
         keys = list(set(a_keys + b_keys))
         return {k:a.get(k, None) for k in keys} == {k:b.get(k, None) for k in keys}
 
+    if dbobj is None:
+        obj["creation_time"] = t_utc
+        return obj
+    if equal(obj, dbobj):
+        return None
+    # Merge the newly created object with the one found in the database, replacing
+    # the information found in the database for the new one if found the same key
+    merge(obj, dbobj)
+    # We need the original times and id from the DB object though
+    obj["creation_time"] = dbobj.get("creation_time")
+    obj["modification_time"] = t_utc
+    obj["_rev"] = dbobj.get("_rev")
+    obj["_id"] = dbobj.get("_id")
+    return obj
+
+def update_fn(cls, db, obj, viewname = "names/id_to_name", key="name"):
+    """Compare object with object in db if present.
+
+    :param cls: calling class
+    :param db: couch database
+    :param obj: database object to save
+
+    :returns: database object to save and database id if present
+    """
     view = db.view(viewname)
     d_view = {k.value:k for k in view}
     dbid =  d_view.get(obj[key], None)
@@ -239,21 +309,7 @@ def update_fn(cls, db, obj, viewname = "names/id_to_name", key="name"):
 
     if dbid:
         dbobj = db.get(dbid.id, None)
-    if dbobj is None:
-        obj["creation_time"] = t_utc
-        return (obj, dbid)
-    if equal(obj, dbobj):
-        return (None, dbid)
-    else:
-        # Merge the newly created object with the one found in the database, replacing
-        # the information found in the database for the new one if found the same key
-        merge(obj, dbobj)
-        # We need the original times and id from the DB object though
-        obj["creation_time"] = dbobj.get("creation_time")
-        obj["modification_time"] = t_utc
-        obj["_rev"] = dbobj.get("_rev")
-        obj["_id"] = dbobj.get("_id")
-        return (obj, dbid)
+    return (merge_fn(cls, obj, dbobj), dbid)
 
 ##############################
 # functions that operate on status_document objects
@@ -342,45 +398,82 @@ def get_scilife_to_customer_name(project_name, p_con, s_con):
 class SampleRunMetricsConnection(Couch):
     _doc_type = SampleRunMetricsDocument
     _update_fn = update_fn
+    _merge_fn = merge_fn
     def __init__(self, dbname="samples", **kwargs):
         super(SampleRunMetricsConnection, self).__init__(**kwargs)
         self.db = self.con[dbname]
-        self.name_view = {k.key:k.id for k in self.db.view("names/name", reduce=False)}
-        self.name_fc_view = {k.key:k for k in self.db.view("names/name_fc", reduce=False)}
-        self.name_proj_view = {k.key:k for k in self.db.view("names/name_proj", reduce=False)}
-        self.name_fc_proj_view = {k.key:k for k in self.db.view("names/name_fc_proj", reduce=False)}
+        self.name_view = self.view("names/name", "id", _sample_view_map(lambda doc: None), reduce=False)
+        self.id_name_view = self.view("names/id_to_name", "row", _id_to_name_map("name"), reduce=False)
+        self.name_fc_view = self.view("names/name_fc", "row", _sample_view_map(lambda doc: doc.get("flowcell", None)), reduce=False)
+        self.name_proj_view = self.view("names/name_proj", "row", _sample_view_map(lambda doc: doc.get("sample_prj", None)), reduce=False)
+        self.name_fc_proj_view = self.view("names/name_fc_proj", "row", _sample_view_map(lambda doc: [doc.get("flowcell", None), doc.get("sample_prj", None)]), reduce=False)
 
     def set_db(self, dbname):
         """Make sure we don't change db from samples"""
         pass
 
-    def get_sample_ids(self, fc_id=None, sample_prj=None):
-        """Retrieve sample ids subset by fc_id and/or sample_prj
+    def _view_runs(self, viewname, key):
+        """Get the ids and names of the sample runs with key in one of the
+        keyed flowcell and project views, or None if the view is missing"""
+        try:
+            return {row.id:row.value for row in self.db.view(viewname, keys=[key])}
+        except couchdb.ResourceNotFound:
+            self.log.debug("no view {}; using names/name_fc_proj".format(viewname))
+            return None
+
+    def _index_runs(self, key_fn, key):
+        """Get the ids and names of the sample runs with key in an index of names/name_fc_proj"""
+        view = self.name_fc_proj_view
+        return {view[k].id:k for k in view.index(key_fn).get(key, [])}
+
+    def _sample_runs(self, fc_id=None, sample_prj=None):
+        """Get the ids and names of the sample runs subset by fc_id and/or sample_prj.
+        Without a view cache, the runs are looked up with keyed queries; with
+        one, the cached names/name_fc_proj view is indexed on flowcell and
+        project, since it is kept up to date at little cost
 
         :param fc_id: flowcell id
         :param sample_prj: sample project name
 
-        :returns sample_ids: list of couchdb sample ids
+        :returns: dictionary of sample run names by couchdb id
         """
         self.log.debug("retrieving sample ids subset by flowcell '{}' and sample_prj '{}'".format(fc_id, sample_prj))
-        fc_sample_ids = [self.name_fc_view[k].id for k in self.name_fc_view.keys() if self.name_fc_view[k].value == fc_id] if fc_id else []
-        prj_sample_ids = [self.name_proj_view[k].id for k in self.name_proj_view.keys() if self.name_proj_view[k].value == sample_prj] if sample_prj else []
+        fc_runs, prj_runs = {}, {}
+        if fc_id:
+            fc_runs = None if self.cachedir else self._view_runs("names/fc_name", fc_id)
+            if fc_runs is None:
+                fc_runs = self._index_runs(_row_flowcell, fc_id)
+        if sample_prj:
+            prj_runs = None if self.cachedir else self._view_runs("names/proj_name", sample_prj)
+            if prj_runs is None:
+                prj_runs = self._index_runs(_row_project, sample_prj)
         # | -> union, & -> intersection
-        if len(fc_sample_ids) > 0 and len(prj_sample_ids) > 0:
-            sample_ids = list(set(fc_sample_ids) & set(prj_sample_ids))
+        if len(fc_runs) > 0 and len(prj_runs) > 0:
+            runs = {k:v for k, v in fc_runs.iteritems() if k in prj_runs}
         else:
-            sample_ids = list(set(fc_sample_ids) | set(prj_sample_ids))
-        # Set to empty list if we actually had supplied a flowcell id and project id but one of them is non-existent
+            runs = dict(fc_runs)
+            runs.update(prj_runs)
+        # Set to empty if we actually had supplied a flowcell id and project id but one of them is non-existent
         if fc_id and sample_prj:
-            if len(fc_sample_ids)==0:
-                sample_ids = []
+            if len(fc_runs)==0:
+                runs = {}
                 self.log.warn("No such flowcell '{}' for project '{}'".format(fc_id, sample_prj))
-            elif len(prj_sample_ids)==0:
-                sample_ids = []
+            elif len(prj_runs)==0:
+                runs = {}
                 self.log.warn("No such project '{}' for flowcell '{}'".format(sample_prj, fc_id))
 
-        self.log.debug("Number of samples: {}, number of fc samples: {}, number of project samples: {}".format(len(sample_ids), len(fc_sample_ids), len(prj_sample_ids)))
-        return sample_ids
+        self.log.debug("Number of samples: {}, number of fc samples: {}, number of project samples: {}".format(len(runs), len(fc_runs), len(prj_runs)))
+        return runs
+
+    def get_sample_ids(self, fc_id=None, sample_prj=None):
+        """Retrieve sample ids subset by fc_id and/or sample_prj
+
+        :param fc_id: flowcell id
+        :param sample_prj: sample project name
+
+        :returns sample_ids: list of couchdb sample ids
+        """
+        return self._sample_runs(fc_id, sample_prj).keys()
 
     def get_samples(self, fc_id=None, sample_prj=None):
         """Retrieve samples subset by fc_id and/or sample_prj
@@ -391,21 +484,23 @@ class SampleRunMetricsConnection(Couch):
         :returns samples: list of sample_run_metrics documents
         """
         self.log.debug("retrieving samples subset by flowcell '{}' and sample_prj '{}'".format(fc_id, sample_prj))
-        sample_ids = self.get_sample_ids(fc_id, sample_prj)
-        inv_view = {v:k for k,v in self.name_view.iteritems()}
-        sample_names = [inv_view[x] for x in sample_ids]
-        return [self.get_entry(x) for x in sample_names]
+        sample_names = self._sample_runs(fc_id, sample_prj).values()
+        entries = self.get_entries(sample_names)
+        return [entries.get(x, None) for x in sample_names]
 
 class FlowcellRunMetricsConnection(Couch):
     _doc_type = FlowcellRunMetricsDocument
     _update_fn = update_fn
+    _merge_fn = merge_fn
     def __init__(self, dbname="flowcells", **kwargs):
         super(FlowcellRunMetricsConnection, self).__init__(**kwargs)
         self.db = self.con[dbname]
-        self.name_view = {k.key:k.id for k in self.db.view("names/name", reduce=False)}
-        self.storage_status_view = {k.key:k.value for k in self.db.view("info/storage_status")}
-        self.id_view = {k.key:k.value for k in self.db.view("info/id")}
-        self.stat_view = {k.key:k.value for k in self.db.view("names/Barcode_lane_stat", reduce=False)}
+        self.name_view = self.view("names/name", "id", _flowcell_name_map, reduce=False)
+        self.id_name_view = self.view("names/id_to_name", "row", _id_to_name_map("name"), reduce=False)
+        self.storage_status_view = self.view("info/storage_status", "value")
+        self.id_view = self.view("info/id", "value")
+        self.stat_view = self.view("names/Barcode_lane_stat", "value", _barcode_lane_stat_map, reduce=False)
+        self._stat_index = {}
 
     def set_db(self):
         """Make sure we don't change db from flowcells"""
@@ -419,13 +514,18 @@ class FlowcellRunMetricsConnection(Couch):
         project names are formatted as J__Doe_00_01 in
         Demultiplex_stats.htm.
         """
-        if flowcell not in self.stat_view.keys():
+        stats = self.stat_view.get(flowcell, None)
+        if stats is None:
             return None, None
-        stats = self.stat_view.get(flowcell)
-        stats_d = {"{}-{}-{}".format(item.get("Project", None).replace("__", "."),
-                                     item.get("Sample ID", None),
-                                     item.get("Lane", None)):item for item in stats}
-        sample_data = stats_d.get("{}-{}-{}".format(project_id, sample_id, lane), None)
+        # Index the statistics of a flowcell once, rebuilding the index
+        # if the flowcell statistics have been fetched again
+        indexed = self._stat_index.get(flowcell, None)
+        if indexed is None or indexed[0] is not stats:
+            indexed = (stats, {"{}-{}-{}".format(item.get("Project", None).replace("__", "."),
+                                                 item.get("Sample ID", None),
+                                                 item.get("Lane", None)):item for item in stats})
+            self._stat_index[flowcell] = indexed
+        sample_data = indexed[1].get("{}-{}-{}".format(project_id, sample_id, lane), None)
         if not sample_data:
             return None, None
         return sample_data.get('Mean Quality Score (PF)', None), sample_data.get('% of >= Q30 Bases (PF)', None)
@@ -507,10 +607,13 @@ class FlowcellRunMetricsConnection(Couch):
 class ProjectSummaryConnection(Couch):
     _doc_type = ProjectSummaryDocument
     _update_fn = update_fn
+    _merge_fn = merge_fn
+    _name_field = "project_name"
     def __init__(self, dbname="projects", **kwargs):
         super(ProjectSummaryConnection, self).__init__(**kwargs)
         self.db = self.con[dbname]
-        self.name_view = {k.key:k.id for k in self.db.view("project/project_name", reduce=False)}
+        self.name_view = self.view("project/project_name", "id", _project_name_map, reduce=False)
+        self.id_name_view = self.view("names/id_to_name", "row", _id_to_name_map("project_name"), reduce=False)
 
     def set_db(self, dbname):
         """Make sure we don't change db from projects"""
@@ -0,0 +1,214 @@
+"""Mismatch tolerant lookup of index (barcode) sequences"""
+
+import collections
+import itertools
+from scilifelab.illumina.index_definitions import BASIC_LOOKUP
+from scilifelab.illumina.hiseq import HiSeqRun
+
+# Characters separating the two indexes of a dual index
+DUAL_SEPARATORS = "-+"
+
+def normalize_barcode(barcode):
+    """Return the barcode with any dual index separator removed
+    """
+    for sep in DUAL_SEPARATORS:
+        if sep in barcode:
+            barcode = barcode.replace(sep,"")
+    return barcode
+
+def neighbourhood(barcode, mismatches=1, alphabet="ACGTN"):
+    """Generate (distance, sequence) tuples for all sequences within the given
+    number of mismatches from barcode, including barcode itself at distance 0
+    """
+    yield 0, barcode
+    seq = list(barcode)
+    for d in xrange(1,mismatches+1):
+        for positions in itertools.combinations(xrange(len(barcode)),d):
+            substitutes = [[c for c in alphabet if c != barcode[p]] for p in positions]
+            for chars in itertools.product(*substitutes):
+                for p, c in zip(positions,chars):
+                    seq[p] = c
+                yield d, "".join(seq)
+            for p in positions:
+                seq[p] = barcode[p]
+
+class BarcodeIndex(object):
+    """Lookup of barcodes allowing for mismatches. All sequences within the
+    given number of mismatches from each barcode are precomputed into a hash
+    map, so that each lookup is a single dictionary access. Dual indexes are
+    matched as the concatenation of the two indexes.
+
+    A query is classified as the barcode closest to it. Sequences that are
+    equally close to more than one barcode cannot be classified and are
+    listed in collisions.
+
+    :param barcodes: dictionary with barcode sequences by name, or a list of 
+                     (name, barcode) tuples
+    :param mismatches: the number of mismatches to allow
+    """
+
+    def __init__(self, barcodes, mismatches=1, alphabet="ACGTN"):
+        self.mismatches = mismatches
+        self.names = collections.defaultdict(list)
+        if hasattr(barcodes,"items"):
+            barcodes = barcodes.items()
+        for name, barcode in barcodes:
+            self.names[normalize_barcode(barcode)].append(name)
+
+        hits = collections.defaultdict(list)
+        for barcode in self.names.keys():
+            for d, seq in neighbourhood(barcode,mismatches,alphabet):
+                hits[seq].append((d,barcode))
+
+        self._hits = {}
+        self._best = {}
+        self.collisions = {}
+        for seq, h in hits.iteritems():
+            h.sort()
+            self._hits[seq] = [barcode for d, barcode in h]
+            if len(h) == 1 or h[0][0] < h[1][0]:
+                self._best[seq] = h[0][1]
+            else:
+                self.collisions[seq] = [barcode for d, barcode in h if d == h[0][0]]
+
+    @classmethod
+    def from_samplesheet(cls, samplesheet, lane=None, mismatches=1):
+        """Create an index from the barcodes in a samplesheet, named by sample id
+        """
+        return cls(dict([(sd['SampleID'],sd['Index']) for sd in HiSeqRun.parse_samplesheet(samplesheet,lane=lane)]),
+                   mismatches)
+
+    @classmethod
+    def from_index_definitions(cls, mismatches=1, lookup=BASIC_LOOKUP):
+        """Create an index from the known index definitions
+        """
+        return cls(lookup,mismatches)
+
+    def __contains__(self, barcode):
+        return normalize_barcode(barcode) in self._hits
+
+    def __len__(self):
+        return len(self.names)
+
+    def classify(self, barcode):
+        """Return the (normalized) barcode that is closest to the query, or None
+        if no barcode is within the allowed number of mismatches or the closest
+        match is ambiguous
+        """
+        return self._best.get(normalize_barcode(barcode))
+
+    def classify_many(self, barcodes, normalized=False):
+        """Classify a sequence of barcodes and return a list of the results. If
+        the barcodes are known to have no dual index separators, pass normalized
+        as True to skip normalization
+        """
+        if not normalized:
+            barcodes = itertools.imap(normalize_barcode,barcodes)
+        return map(self._best.get,barcodes)
+
+    def count(self, barcodes, normalized=False):
+        """Count the classified barcodes in a sequence of queries. Queries that
+        could not be classified are counted as None
+        """
+        return collections.Counter(self.classify_many(barcodes,normalized))
+
+    def matches(self, barcode):
+        """Return the names of all barcodes within the allowed number of mismatches
+        from the query, closest first
+        """
+        return [name for match in self._hits.get(normalize_barcode(barcode),[]) for name in self.names[match]]
+
+    def get_names(self, barcode):
+        """Return the names of the barcode that the query is classified as
+        """
+        return self.names.get(self.classify(barcode),[])
+
+_DEFINITIONS_INDEX = {}
+
+def index_definitions_lookup(mismatches=0):
+    """Return a BarcodeIndex of the known index definitions, built on first use
+    and shared by subsequent calls
+    """
+    if mismatches not in _DEFINITIONS_INDEX:
+        _DEFINITIONS_INDEX[mismatches] = BarcodeIndex.from_index_definitions(mismatches)
+    return _DEFINITIONS_INDEX[mismatches]
+
+## Maximum number of classified prefixes cached by PrefixIndex
+PREFIX_CACHE_SIZE = 100000
+
+class PrefixIndex(object):
+    """Lookup of indexes of varying length at the start of a read, such as
+    HaloPlex indexes followed by a molecular tag. The neighbourhood of each
+    index is precomputed into a hash map per index length, so that a read is
+    matched with one dictionary access per distinct index length.
+
+    The start of the read is compared to each index over the length of the
+    index. An exact match to an index takes precedence, the longest index
+    first. Otherwise the read matches the indexes with the fewest mismatches,
+    which is ambiguous if there is more than one.
+
+    :param indexes: list of index sequences
+    :param mismatches: the number of mismatches to allow
+    """
+
+    def __init__(self, indexes, mismatches=1, alphabet="ACGTN"):
+        self.mismatches = mismatches
+        self.alphabet = alphabet
+        # Indexes ranked by descending length, keeping the given order otherwise
+        self.indexes = sorted(indexes, key=lambda x: -len(x))
+        lookups = collections.OrderedDict()
+        for rank, index in enumerate(self.indexes):
+            hits = lookups.setdefault(len(index), {})
+            for d, seq in neighbourhood(index, mismatches, alphabet):
+                hits.setdefault(seq, []).append((d, rank))
+        self._lookups = lookups.items()
+        self._maxlen = max(lookups.keys()) if lookups else 0
+        self._cache = {}
+
+    def __len__(self):
+        return len(self.indexes)
+
+    def _scan(self, prefix, length):
+        """Compare a prefix that cannot be looked up, because it is shorter than
+        the indexes or has characters outside of the alphabet, to each index
+        """
+        hits = []
+        for rank, index in enumerate(self.indexes):
+            if len(index) == length:
+                d = sum(1 for a, b in itertools.izip(index, prefix) if a != b)
+                if d <= self.mismatches:
+                    hits.append((d, rank))
+        return hits
+
+    def _classify(self, seq):
+        hits = []
+        for length, lookup in self._lookups:
+            prefix = seq[0:length]
+            h = lookup.get(prefix)
+            if h is None and (len(prefix) < length or prefix.translate(None, self.alphabet)):
+                h = self._scan(prefix, length)
+            if not h:
+                continue
+            best = min(h)
+            if best[0] == 0:
+                return (self.indexes[best[1]],), 0
+            hits.extend(h)
+        if not hits:
+            return (), None
+        hits.sort()
+        d = hits[0][0]
+        return tuple([self.indexes[rank] for dist, rank in hits if dist == d]), d
+
+    def classify(self, seq):
+        """Return a tuple with the matching indexes and the number of mismatches.
+        There is one index for an unambiguous match, more than one (longest 
+        first) for an ambiguous match and none, with None mismatches, if no 
+        index is within the allowed number of mismatches
+        """
+        key = seq[0:self._maxlen]
+        result = self._cache.get(key)
+        if result is None or len(seq) < self._maxlen:
+            result = self._classify(seq)
+            if len(self._cache) < PREFIX_CACHE_SIZE and len(seq) >= self._maxlen:
+                self._cache[key] = result
+        return result
@@ -1,7 +1,11 @@
 """pm picard lib"""
 import os
 import re
+import hashlib
+import collections
+import numpy as np
 import pandas as pd
+from cStringIO import StringIO
 from scilifelab.io import index_containing_substring
 import scilifelab.log
 
@@ -9,7 +13,15 @@ LOG = scilifelab.log.minimal_logger(__name__)
 
 METRICS_TYPES=['align', 'hs', 'dup', 'insert']
 
-def _raw(x):
+## Sections of a Picard metrics file: the comment lines preceding the
+## metrics, the metrics class and the metrics and histogram tables as
+## tuples of column names and arrays of strings
+PicardMetrics = collections.namedtuple("PicardMetrics", ["header", "metrics_class", "metrics", "histogram"])
+
+## Column types by metrics class and column names
+_COLUMN_TYPES = {}
+
+def _raw(x, cachedir=None):
     return (x, None)
 
 def _convert_input(x):
@@ -20,25 +32,144 @@ def _convert_input(x):
     else:
         return str(x)
 
-def _read_picard_metrics(f):
+def _table(lines):
+    """Split tab separated lines in a tuple of the column names in the
+    first line and an array of strings of the following lines. Short
+    rows are padded with empty strings."""
+    if not lines:
+        return None
+    columns = lines[0].split("\t")
+    if len(lines) == 1:
+        return (columns, np.empty((0, len(columns)), dtype=str))
+    values = pd.read_csv(StringIO("\n".join(lines[1:])), sep="\t", header=None, names=range(0, len(columns)), index_col=False,
+                         dtype=str, na_filter=False, quoting=3).values
+    return (columns, values.astype(str))
+
+def parse_picard(fh):
+    """Parse a Picard metrics file.
+
+    :param fh: file handle
+
+    :returns: PicardMetrics tuple
+    """
+    lines = fh.read().split("\n")
+    i_hist = index_containing_substring(lines, "## HISTOGRAM")
+    if i_hist == -1:
+        i_hist = len(lines)
+    i_metrics = index_containing_substring(lines[0:i_hist], "## METRICS")
+    header = lines[0:i_metrics] if i_metrics > -1 else [x for x in lines[0:i_hist] if x.startswith("#")]
+    metrics_class = lines[i_metrics].split("\t")[-1] if i_metrics > -1 else None
+    keep = lambda x: x and x[0] not in " #"
+    return PicardMetrics(header, metrics_class, _table(filter(keep, lines[0:i_hist])), _table(filter(keep, lines[i_hist:])))
+
+def _cachefile(f, cachedir):
+    """Name of the cache file for f, keyed by path, inode, modification time and size"""
+    st = os.stat(f)
+    key = hashlib.sha1("{}\t{}\t{}\t{}".format(os.path.abspath(f), st.st_ino, repr(st.st_mtime), st.st_size)).hexdigest()
+    return os.path.join(cachedir, "{}.npz".format(key))
+
+def _save_cache(fn, data):
+    arrays = {"header":np.array(data.header, dtype=str), "metrics_class":np.array([data.metrics_class or ""], dtype=str)}
+    for section in ["metrics", "histogram"]:
+        if getattr(data, section) is not None:
+            arrays["{}_columns".format(section)] = np.array(getattr(data, section)[0], dtype=str)
+            arrays["{}_values".format(section)] = getattr(data, section)[1]
+    if not os.path.exists(os.path.dirname(fn)):
+        os.makedirs(os.path.dirname(fn))
+    tmp = "{}.{}.tmp.npz".format(fn[:-4], os.getpid())
+    np.savez(tmp, **arrays)
+    os.rename(tmp, fn)
+
+def _load_cache(fn):
+    with np.load(fn) as arrays:
+        tables = {}
+        for section in ["metrics", "histogram"]:
+            tables[section] = None
+            if "{}_columns".format(section) in arrays.files:
+                tables[section] = (arrays["{}_columns".format(section)].tolist(), arrays["{}_values".format(section)])
+        return PicardMetrics(arrays["header"].tolist(), arrays["metrics_class"][0] or None, tables["metrics"], tables["histogram"])
+
+def read_picard(f, cachedir=None):
+    """Read a Picard metrics file. If cachedir is given, the parsed
+    file is cached there in a file named by the path, modification time
+    and size of f.
+
+    :param f: Picard metrics file
+    :param cachedir: cache directory
+
+    :returns: PicardMetrics tuple
+    """
+    fn = _cachefile(f, cachedir) if cachedir else None
+    if fn and os.path.exists(fn):
+        try:
+            return _load_cache(fn)
+        except Exception as e:
+            LOG.warn("Failed to read cached metrics {} for {}: {}".format(fn, f, e))
+    with open(f) as fh:
+        data = parse_picard(fh)
+    if fn:
+        try:
+            _save_cache(fn, data)
+        except (IOError, OSError) as e:
+            LOG.warn("Failed to cache metrics for {}: {}".format(f, e))
+    return data
+
+def _is_int(values):
+    """Check that all strings match ^[0-9]+$"""
+    return np.char.isdigit(values).all()
+
+def _is_float(values):
+    """Check that all strings match ^[0-9,.]+$"""
+    digits = np.char.replace(np.char.replace(values, ",", ""), ".", "")
+    return (np.char.str_len(values) > 0).all() and (np.char.isdigit(digits) | (np.char.str_len(digits) == 0)).all()
+
+def _column_type(values, column_type=None):
+    """Get the type of a column of strings, checking column_type first"""
+    for t, check in [("int", _is_int), ("float", _is_float)]:
+        if column_type in [None, t] and check(values):
+            return t
+    if column_type is not None:
+        return _column_type(values)
+    return "object"
+
+def _data_frame(table, key):
+    """Convert a table of strings to a DataFrame with int, float and
+    string columns as _convert_input would. Column types are inferred
+    once per metrics class and checked for later tables."""
+    columns, values = table
+    types = _COLUMN_TYPES.get((key, tuple(columns)), [None] * len(columns))
+    data = collections.OrderedDict()
+    for i, c in enumerate(columns):
+        if len(values) == 0:
+            data[i] = []
+            continue
+        types[i] = _column_type(values[:,i], types[i])
+        if types[i] == "int":
+            data[i] = values[:,i].astype(np.int64)
+        elif types[i] == "float":
+            data[i] = np.char.replace(values[:,i], ",", ".").astype(float)
+        else:
+            data[i] = [_convert_input(x) for x in values[:,i]]
+    _COLUMN_TYPES[(key, tuple(columns))] = types
+    df = pd.DataFrame(data, columns=range(0, len(columns)))
+    df.columns = columns
+    return df
+
+def _read_picard_metrics(f, cachedir=None):
     if not os.path.exists(f):
         LOG.warn("IO failure: no such file {}".format(f))
         return (None, None)
-    with open(f) as fh:
-        data = fh.readlines()
-        # Find histogram line
-        i_hist = index_containing_substring(data, "## HISTOGRAM")
-        if i_hist == -1:
-            i = len(data)
-        else:
-            i = i_hist
-        tmp = [[_convert_input(y) for y in x.rstrip("\n").split("\t")] for x in data[0:i] if not re.match("^[ #\n]", x)]
-        metrics = pd.DataFrame(tmp[1:], columns=tmp[0])
-        if i_hist == -1:
-            return (metrics, None)
-        tmp = [[_convert_input(y) for y in x.rstrip("\n").split("\t")] for x in data[i_hist:len(data)] if not re.match("^[ #\n]", x)]
-        hist = pd.DataFrame(tmp[1:], columns=tmp[0])
-    return (metrics, hist)
+    data = read_picard(f, cachedir)
+    metrics = _data_frame(data.metrics, data.metrics_class) if data.metrics else pd.DataFrame()
+    if data.histogram is None:
+        return (metrics, None)
+    return (metrics, _data_frame(data.histogram, "HISTOGRAM"))
+
+def metrics_cachedir(cachedir):
+    """Get the Picard metrics cache directory in cachedir"""
+    if not cachedir:
+        return None
+    return os.path.join(cachedir, "picard")
 
 # For now: extension maps to tuple (label, description). Label should
 # be reused for analysis definitions
@@ -50,8 +181,12 @@ EXTENSIONS={'.align_metrics':('align', 'alignment', _read_picard_metrics),
             }
 
 
-def read_metrics(f):
-    """Read metrics"""
+def read_metrics(f, cachedir=None):
+    """Read metrics
+
+    :param f: metrics file
+    :param cachedir: Picard metrics cache directory
+    """
     (_, metrics_type) = os.path.splitext(f)
-    d = EXTENSIONS[metrics_type][2](f)
+    d = EXTENSIONS[metrics_type][2](f, cachedir)
     return d
@@ -4,6 +4,9 @@ import os
 import re
 import subprocess
 import shlex
+import json
+import multiprocessing
+from multiprocessing.pool import ThreadPool
 
 from cStringIO import StringIO
 from fabric.api import task, run, execute, cd, settings, local
@@ -12,13 +15,84 @@ from datetime import datetime
 
 from scilifelab.utils.misc import filtered_walk
 from scilifelab.utils.misc import query_yes_no, md5sum
+from scilifelab.utils.tarball import write_tarball, read_excludes
 
 import scilifelab.log
 
 LOG = scilifelab.log.minimal_logger(__name__)
 
 
-def flowcell_remove_status(archive_dir, swestore_dir, to_remove="to_remove"):
+## Patterns of the compress logs
+COMPRESS_RE = re.compile("Compressing[ ]+([0-9A-Za-z_\-]+)\.\.\.")
+EXIT_CODE_RE = re.compile("Exit code:[ ]+([0-9]+)")
+
+def parse_compress_log(f):
+    """Read a compress log line by line and get the first flowcell it
+    compresses and the last exit code following it
+
+    :param f: compress log
+
+    :returns: tuple of flowcell and exit code, or None if there is no match
+    """
+    flowcell, exit_code = None, None
+    with open(f) as fh:
+        for line in fh:
+            if flowcell is None:
+                m = COMPRESS_RE.search(line)
+                if not m:
+                    continue
+                flowcell = m.group(1)
+                line = line[m.end():]
+            for m in EXIT_CODE_RE.finditer(line):
+                exit_code = m.group(1)
+    if exit_code is None:
+        return None
+    return (flowcell, exit_code)
+
+def irods_checksum(fctar):
+    """Get the iRODS checksum of a tarball with ichksum
+
+    :param fctar: tarball, looked up by its base name in the current iRODS collection
+
+    :returns: checksum line of the ichksum output, or None if the command failed
+    """
+    cl = ["ichksum", os.path.basename(fctar)]
+    try:
+        proc = subprocess.Popen(cl, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+        (stdout, stderr) = proc.communicate()
+        if proc.returncode:
+            raise subprocess.CalledProcessError(proc.returncode, " ".join(cl), stderr)
+        return stdout.split("\n")[1]
+    except (OSError, subprocess.CalledProcessError, IndexError) as e:
+        LOG.warn("command {} failed: {}".format(" ".join(cl), e))
+        return None
+
+def _signature(f):
+    """Size and modification time of f, or None if it does not exist"""
+    if not os.path.exists(f):
+        return None
+    st = os.stat(f)
+    return [st.st_size, st.st_mtime]
+
+def _load_state(state_file):
+    if state_file and os.path.exists(state_file):
+        try:
+            with open(state_file) as fh:
+                return json.load(fh)
+        except ValueError:
+            LOG.warn("Ignoring corrupt state file {}".format(state_file))
+    return {'logs':{}, 'checksums':{}}
+
+def _save_state(state_file, state):
+    tmp = "{}.{}.tmp".format(state_file, os.getpid())
+    try:
+        with open(tmp, "w") as fh:
+            json.dump(state, fh)
+        os.rename(tmp, state_file)
+    except (IOError, OSError) as e:
+        LOG.warn("Failed to save state file {}: {}".format(state_file, e))
+
+def flowcell_remove_status(archive_dir, swestore_dir, to_remove="to_remove", workers=8, state_file=None):
     """This function looks for flowcells that could be deleted
     from archive and returns a list of flowcells with a KEEP/RM
     flag. The rules are
@@ -28,9 +102,16 @@ def flowcell_remove_status(archive_dir, swestore_dir, to_remove="to_remove"):
     3. the tarball filesize looks ok
     4. checksum irods is ok
 
+    The iRODS checksums are fetched by up to workers concurrent ichksum
+    commands. Parsed compress logs and iRODS checksums are kept in a
+    state file, so that only logs and tarballs that changed since the
+    last report are looked at again.
+
     :param archive_dir: archive directory
     :param swestore_dir: base dir for swestore
     :param to_remove: to remove file name
+    :param workers: number of concurrent ichksum commands
+    :param state_file: state file, by default <to_remove>.status.json in archive_dir
     """
     output_data = {'stdout':StringIO(), 'stderr':StringIO()}
     ## Check for ils
@@ -44,51 +125,74 @@ def flowcell_remove_status(archive_dir, swestore_dir, to_remove="to_remove"):
     except:
         LOG.warn("No such command 'ils': please load the irods module" )
         return output_data
+    if state_file is None:
+        state_file = os.path.join(archive_dir, "{}.status.json".format(to_remove))
+    state = _load_state(state_file)
     ## make flowcell dictionary based on to_remove contents
     to_remove_file = os.path.join(archive_dir, to_remove)
     with open(to_remove_file) as fh:
         remove_list = fh.readlines()
     flowcells = {k.replace("./", "").rstrip():{'in_archive':False, 'pbzip_exit':1, 'tarball_size':0, 'irods_checksum':1} for k in remove_list if k.rstrip() != ''}
 
-    ## Look for compress logs
+    ## Look for compress logs, parsing only new or changed logs
     pattern = "slurm.*.out$"
     def compress_fn(f):
         return re.search(pattern, f) != None
     compress_log_files = filtered_walk(os.path.join(archive_dir, "compress_logs"), compress_fn)
+    logs = {}
     for f in compress_log_files:
-        with open(f) as fh:
-            compress_str = "".join([x.strip() for x in fh.readlines()])
-        m = re.search("Compressing[ ]+([0-9A-Za-z_\-]+)\.\.\..*Exit code:[ ]+([0-9]+)", compress_str)
-        if m:
-            if not m.groups()[0] in flowcells.keys():
-                LOG.warn("flowcell {} present in to_remove but not in archive".format(m.groups()[0]))
+        sig = _signature(f)
+        cached = state['logs'].get(f)
+        if cached and cached[0] == sig:
+            res = cached[1]
+        else:
+            res = parse_compress_log(f)
+        logs[f] = [sig, res]
+        if res:
+            if not res[0] in flowcells.keys():
+                LOG.warn("flowcell {} present in to_remove but not in archive".format(res[0]))
             else:
-                flowcells[m.groups()[0]]['pbzip_exit'] = m.groups()[1]
+                flowcells[res[0]]['pbzip_exit'] = res[1]
         else:
-            LOG.warn("{}: no match for {}".format(f, compress_str))
+            LOG.warn("{}: no match for compressed flowcell and exit code".format(f))
+    state['logs'] = logs
 
     ## Get tarball sizes and check if in archive
-    ## Loop through flowcells and perform ichksum
+    checksums = {}
+    to_check = []
     for k in flowcells.keys():
-        LOG.debug("Getting tarball size, archive presence and ichksum for {}".format(k))
+        LOG.debug("Getting tarball size and archive presence for {}".format(k))
         fcdir = os.path.join(archive_dir, k)
         if os.path.exists(fcdir):
             flowcells[k]['in_archive'] = True
         fctar = os.path.join(swestore_dir, "drophere2archive", "{}.tar.bz2".format(k))
-        try:
-            cl = ["ichksum", os.path.basename(fctar)]
-            proc = subprocess.Popen(cl, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
-            (stdout, stderr) = proc.communicate()
-            proc.wait()
-            flowcells[k]['irods_checksum'] = stdout.split("\n")[1]
-        except:
-            LOG.warn("command {} failed".format(" ".join(cl)))
-        if not os.path.exists(fctar):
-            continue
+        sig = _signature(fctar)
+        cached = state['checksums'].get(k)
+        if cached and cached[0] == sig:
+            flowcells[k]['irods_checksum'] = cached[1]
+            checksums[k] = cached
         else:
+            to_check.append((k, fctar, sig))
+        if sig is not None:
             LOG.debug("tarball exists: {}".format(fctar))
-            statinfo = os.stat(fctar)
-            flowcells[k]['tarball_size'] = float(int(statinfo.st_size) / 1e9)
+            flowcells[k]['tarball_size'] = float(int(sig[0]) / 1e9)
+
+    ## Perform ichksum for flowcells with new or changed tarballs
+    if to_check:
+        LOG.debug("Running ichksum for {} flowcells with {} workers".format(len(to_check), workers))
+        pool = ThreadPool(max(min(workers, len(to_check)), 1))
+        try:
+            res = pool.map(irods_checksum, [fctar for k, fctar, sig in to_check], chunksize=1)
+        finally:
+            pool.close()
+            pool.join()
+        for (k, fctar, sig), checksum in zip(to_check, res):
+            if checksum is None:
+                continue
+            flowcells[k]['irods_checksum'] = checksum
+            checksums[k] = [sig, checksum]
+    state['checksums'] = checksums
+    _save_state(state_file, state)
 
     output_data["stdout"].write("\nFlowcell archive status\n")
     output_data["stdout"].write("=======================\n")
@@ -169,6 +273,20 @@ def package_run(arch, root, flowcell, workdir=None, excludes=None, compress_prog
         else:
             arch.log.info("Run package already exists but --force-overwrite specified, will replace existing package")
 
+    # Write the tarball and its checksums in one pass
+    if kw.get("stream_package", False):
+        checksums = ["md5"] + (["sha256"] if kw.get("sha256", False) else [])
+        threads = kw.get("compress_threads", None) or multiprocessing.cpu_count()
+        def runpipe():
+            return write_tarball(dest_path, root, flowcell, threads=threads, checksums=checksums,
+                                 excludes=read_excludes(excludes) if excludes else None)
+        sums = arch.app.cmd.dry("writing tarball {} with {} compression threads".format(dest_path, threads), runpipe)
+        for algorithm, checksum in (sums or {}).items():
+            arch.app.cmd.write("{}.{}".format(dest_path, algorithm), "{}  {}".format(checksum, os.path.basename(dest_path)), True)
+        if sums:
+            arch.app.cmd.cache_md5sum(dest_path, sums["md5"])
+        return dest_path
+
     cmd = "tar {} --use-compress-program={} {}-cf {} -C {} {}".format(arch._meta.compress_opt,
                                                                 arch._meta.compress_prog,
                                                                 "--exclude-from={} ".format(excludes) if excludes else "",
@@ -25,24 +25,33 @@ def  main(flowcell, all_flowcells,days,conf):
     fc_db = couch['flowcells']
     if all_flowcells:
         flowcells = lims.get_processes(type = ['Illumina Sequencing (Illumina SBS) 4.0','MiSeq Run (MiSeq) 4.0'])
+        # Get the flowcell names first, so that their _ids are looked up
+        # in a single read of the view
+        runs = []
         for fc in flowcells:
             try:
                 closed = date(*map(int, fc.date_run.split('-')))
                 delta = today-closed
-                #if delta.days < days and dict(fc.udf.items()).has_key('Flow Cell ID'):
-                if dict(fc.udf.items()).has_key('Flow Cell ID'):
-                    if '-' in dict(fc.udf.items())['Flow Cell ID']:
-                        flowcell_name = dict(fc.udf.items())['Flow Cell ID']
-                    elif dict(fc.udf.items()).has_key('Flow Cell Position'):
-                        flowcell_name = dict(fc.udf.items())['Flow Cell Position'] + dict(fc.udf.items())['Flow Cell ID'] 
-                    key = find_flowcell_from_view(fc_db, flowcell_name)
-                    if key:
-                        dbobj = fc_db.get(key)
-                        print dbobj['modification_time']+'  '+key
-                        if delta.days < days:
-                            dbobj["illumina"]["run_summary"] = get_sequencing_info(fc)
-                            info = save_couchdb_obj(fc_db, dbobj)
-                            LOG.info('flowcell %s %s : _id = %s' % (flowcell_name, info, key))
+                udfs = dict(fc.udf.items())
+                #if delta.days < days and udfs.has_key('Flow Cell ID'):
+                if udfs.has_key('Flow Cell ID'):
+                    if '-' in udfs['Flow Cell ID']:
+                        runs.append((fc, udfs['Flow Cell ID'], delta))
+                    elif udfs.has_key('Flow Cell Position'):
+                        runs.append((fc, udfs['Flow Cell Position'] + udfs['Flow Cell ID'], delta))
+            except:
+                pass
+        keys = find_flowcells_from_view(fc_db, [flowcell_name for _, flowcell_name, _ in runs])
+        for fc, flowcell_name, delta in runs:
+            try:
+                key = keys.get(flowcell_name)
+                if key:
+                    dbobj = fc_db.get(key)
+                    print dbobj['modification_time']+'  '+key
+                    if delta.days < days:
+                        dbobj["illumina"]["run_summary"] = get_sequencing_info(fc)
+                        info = save_couchdb_obj(fc_db, dbobj)
+                        LOG.info('flowcell %s %s : _id = %s' % (flowcell_name, info, key))
             except:
                 pass
     elif flowcell is not None:
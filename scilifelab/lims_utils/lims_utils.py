@@ -7,6 +7,7 @@ Maya Brandi, Science for Life Laboratory, Stockholm, Sweden.
 
 from genologics.lims import *
 from genologics.config import BASEURI, USERNAME, PASSWORD
+from scilifelab.db.lims_sync import prefetch
 lims = Lims(BASEURI, USERNAME, PASSWORD)
 
 """process category dictionaries
@@ -104,7 +105,15 @@ def get_sequencing_info(fc):
 
 
 
-def make_sample_artifact_maps(sample_name):
+def prefetch_artifact_history(lims_instance, artifacts):
+    """Fetches the parent processes of artifacts, their input artifacts
+    and the samples of the input artifacts, in batches"""
+    prefetch(lims_instance, artifacts)
+    prefetch(lims_instance, [art.parent_process for art in artifacts])
+    inarts = prefetch(lims_instance, [inart for art in artifacts for inart in art.input_artifact_list()])
+    prefetch(lims_instance, [samp for inart in inarts for samp in inart.samples])
+
+def make_sample_artifact_maps(sample_name, lims_instance = None):
     """
     outin: connects each out_art for a specific sample to its 
     corresponding in_art and process. one-one relation
@@ -113,7 +122,12 @@ def make_sample_artifact_maps(sample_name):
     coresponding out_arts and processes. one-many relation"""
     outin = {}
     inout = {}
-    artifacts = lims.get_artifacts(sample_name = sample_name)
+    lims_instance = lims_instance or lims
+    artifacts = lims_instance.get_artifacts(sample_name = sample_name)
+    try:
+        prefetch_artifact_history(lims_instance, artifacts)
+    except:
+        pass
     for outart in artifacts:
         try: 
             pro = outart.parent_process
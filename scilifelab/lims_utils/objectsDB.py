@@ -13,7 +13,9 @@ from genologics.lims import *
 from helpers import *
 from lims_utils import *
 from scilifelab.db.statusDB_utils import *
+from scilifelab.db.lims_sync import prefetch
 import os
+import threading
 import couchdb
 import bcbio.pipeline.config_utils as cl
 import time
@@ -25,6 +27,18 @@ db_conf = cl.load_config(config_file)['statusdb']
 url = db_conf['username']+':'+db_conf['password']+'@'+db_conf['url']+':'+str(db_conf['port'])
 samp_db = couchdb.Server("http://" + url)['samples']
 
+_sample_run_ids = {}
+_sample_run_ids_lock = threading.Lock()
+
+def find_sample_run_id(samp_run_met_id):
+    """Finds the samples database _id of a sample run, from the names/id_to_name
+    view read once and shared by all projects"""
+    with _sample_run_ids_lock:
+        if not _sample_run_ids:
+            for doc in samp_db.view('names/id_to_name'):
+                _sample_run_ids.setdefault(doc.value, doc.key)
+    return _sample_run_ids.get(samp_run_met_id)
+
 class ProjectDB():
     """Instances of this class holds a dictionary formatted for building up the project database on statusdb. 
     Source of information come from different lims artifacts and processes. A detailed documentation of the 
@@ -82,6 +96,7 @@ class ProjectDB():
 
 
         samples = self.lims.get_samples(projectlimsid = self.lims_project.id)
+        prefetch(self.lims, samples)
         self.project['no_of_samples'] = len(samples)
         if len(samples) > 0:
             self.project['first_initial_qc'] = '3000-10-10'
@@ -124,6 +139,9 @@ class ProcessInfo():
 
     def get_run_info(self, runs):
         run_info = {}
+        prefetch(self.lims, runs)
+        in_arts = prefetch(self.lims, [Artifact(self.lims, id = IOM[0]['limsid']) for run in runs for IOM in run.input_output_maps])
+        prefetch(self.lims, [samp for in_art in in_arts for samp in in_art.samples])
         for run in runs:
             run_info[run.id] = {'type' : run.type.name ,'start_date': run.date_run,'samples' : {}}
             run_udfs = dict(run.udf.items())
@@ -164,7 +182,7 @@ class SampleDB():
         self.lims_sample = Sample(self.lims, id = sample_id)
         self.name = self.lims_sample.name
         self.application = application
-        self.outin, self.inout = make_sample_artifact_maps(self.name)
+        self.outin, self.inout = make_sample_artifact_maps(self.name, self.lims)
         self.obj = {'scilife_name' : self.name}
         self.obj = get_udfs('details', self.obj, self.lims_sample.udf.items(), SAMP_UDF_EXCEPTIONS)
         preps = self.get_initQC_preps_and_libval(prep_info)
@@ -198,6 +216,8 @@ class SampleDB():
         """process_list is a list of process type names, 
         sample_name is a sample name :)"""
         arts = self.lims.get_artifacts(sample_name = sample_name, process_type = process_list)
+        prefetch(self.lims, arts)
+        prefetch(self.lims, [a.parent_process for a in arts])
         day = date.today().isoformat()
         for a in arts:
             new_day = a.parent_process.date_run
@@ -358,7 +378,7 @@ class SampleDB():
                                 'sequencing_start_date':sequencing_start_date,
                                 'sequencing_run_QC_finished': run['start_date'],
                                 'sequencing_finish_date': run['finish_date'],
-                                'sample_run_metrics_id': find_sample_run_id_from_view(samp_db, samp_run_met_id) }
+                                'sample_run_metrics_id': find_sample_run_id(samp_run_met_id) }
                         dict = delete_Nones(dict)
                         if not sample_runs.has_key(key): 
                             sample_runs[key] = {}
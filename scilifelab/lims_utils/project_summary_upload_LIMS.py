@@ -9,6 +9,7 @@ import os
 import codecs
 from optparse import OptionParser
 from scilifelab.db.statusDB_utils import *
+from scilifelab.db.lims_sync import sync_projects, limit_requests
 from helpers import *
 from pprint import pprint
 from genologics.lims import *
@@ -18,13 +19,14 @@ from datetime import date
 import scilifelab.log
 lims = Lims(BASEURI, USERNAME, PASSWORD)
 
-def  main(proj_name, all_projects, days, conf):
+def  main(proj_name, all_projects, days, conf, workers=1, max_requests=8):
     first_of_july = '2013-06-30'
     today = date.today()
     couch = load_couch_server(conf)
     proj_db = couch['projects']
     if all_projects:
         projects = lims.get_projects()
+        to_sync = []
         for proj in projects:
             LOG.info(proj.name)
             try:
@@ -36,21 +38,15 @@ def  main(proj_name, all_projects, days, conf):
             if opened:
                 if comp_dates(first_of_july, opened):
                     if (days_closed < days):
-                        proj_time = time.time()
-                        try:
-                            obj = DB.ProjectDB(lims, proj.id)
-                            key = find_proj_from_view(proj_db, proj.name)
-                            obj.project['_id'] = find_or_make_key(key)
-                            info = save_couchdb_obj(proj_db, obj.project)
-                            LOG.info('project %s is handeled and %s : _id = %s' % (proj.name, info, obj.project['_id']))
-                        except:
-                            LOG.info('Issues geting info for %s. The"Application" udf might be missing' % proj.name)
+                        to_sync.append(proj)
                     else:
                         LOG.info('Project is not updated because the project has been closed for %s days.' % days_closed)  
                 else:
                     LOG.info('Project is not updated because the project was opened before 2013-06-30 (%s)'%opened)
             else:
                 LOG.info('Project is not updated because open date missing for project %s' % proj.name)
+        limit_requests(lims, max_requests)
+        sync_projects(to_sync, lambda proj: DB.ProjectDB(lims, proj.id).project, proj_db, workers=workers, log=LOG)
     elif proj_name is not None:
         proj = lims.get_projects(name = proj_name)
         if len(proj) == 0:
@@ -89,8 +85,14 @@ if __name__ == '__main__':
     default=os.path.join(os.environ['HOME'],'opt/config/post_process.yaml'),         
     help = "Config file.  Default: ~/opt/config/post_process.yaml")
 
+    parser.add_option("-w", "--workers", dest="workers", type="int", default=1,
+    help = "Number of projects built concurrently. Use with -a flagg. Default is 1")
+
+    parser.add_option("-r", "--max_requests", dest="max_requests", type="int", default=8,
+    help = "Maximum number of concurrent requests to Lims. Use with -a flagg. Default is 8")
+
     (options, args) = parser.parse_args()
 
     LOG = scilifelab.log.file_logger('LOG',options.conf ,'lims2db_projects.log', 'log_dir_tools')
-    main(options.project_name, options.all_projects, options.days, options.conf)
+    main(options.project_name, options.all_projects, options.days, options.conf, options.workers, options.max_requests)
 
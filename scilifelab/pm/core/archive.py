@@ -28,6 +28,9 @@ class ArchiveController(AbstractExtendedBaseController):
         base_app.args.add_argument('-P', '--list-projects', action="store_true", default=False, help="list projects of flowcell")
         base_app.args.add_argument('--package-run', action="store_true", default=False, help="package a run in preparation for archiving to swestore")
         base_app.args.add_argument('--clean-from-staging', action="store_true", default=False, help="Removes the uncompressed run from staging if archiving was OK")
+        base_app.args.add_argument('--stream-package', action="store_true", default=False, help="package a run in one pass, computing the checksums of the tarball while it is written and indexing its members")
+        base_app.args.add_argument('--compress-threads', action="store", default=None, type=int, help="number of compression threads with --stream-package (default is the number of cpus)")
+        base_app.args.add_argument('--sha256', action="store_true", default=False, help="also write a sha256 checksum of the tarball with --stream-package")
         base_app.args.add_argument('--check-finished', action="store_true", default=False, help="Whether to check if a run has finished transfer before packing it")
         base_app.args.add_argument('--excludes', action="store", default=None, help="a file containing file and directory name patterns to exclude from tarball")
         base_app.args.add_argument('--workdir', action="store", default=None, help="the folder to create tarballs in (default is parent of the run folder)")
@@ -42,6 +45,8 @@ class ArchiveController(AbstractExtendedBaseController):
         base_app.args.add_argument('--clean-swestore', action="store_true", default=False, help="Clean the tarball after successfuly archiving in swestore")
         base_app.args.add_argument('--swestore-path', action="store", default=None, help="the path to the project's folder on the swestore area")
         base_app.args.add_argument('--remote-swestore', action="store_true", default=False, help="run the swestore archiving script on the remote host instead of locally")
+        base_app.args.add_argument('--workers', action="store", default=8, type=int, help="number of concurrent iRODS checksum commands in rm_status. Default is 8")
+        base_app.args.add_argument('--md5-workers', action="store", default=1, type=int, help="number of files to hash concurrently when calculating or verifying md5sums. Default is 1")
         base_app.args.add_argument('--log-to-db', action="store_true", default=False, help="log the swestore archiving progress to db")
 
 
@@ -79,7 +84,7 @@ class ArchiveController(AbstractExtendedBaseController):
         """This function looks for flowcells that could be deleted
         from archive and returns a list of flowcells with a KEEP/RM
         flag."""
-        out_data = flowcell_remove_status(self.app.config.get("archive", "root"), self.app.config.get("production", "swestore"))
+        out_data = flowcell_remove_status(self.app.config.get("archive", "root"), self.app.config.get("production", "swestore"), workers=self.pargs.workers)
         self.app._output_data['stdout'].write(out_data['stdout'].getvalue())
         self.app._output_data['stderr'].write(out_data['stderr'].getvalue())
 
@@ -162,6 +162,30 @@ class CommandHandler(handler.CementBaseHandler):
             deliver_fn(src, tgt)
         return self.dry("{} file {} to {}".format(deliver_fn.__name__, src, tgt), runpipe) 
 
+    def copy_and_hash(self, sources, targets, verify=False, workers=1, bwlimit=None):
+        """Wrapper for copying files and computing their md5sums in
+        the same pass. In a dry run, the md5sums of the sources are
+        computed without copying.
+
+        :param sources: source files
+        :param targets: target files
+        :param verify: re-read the targets and compute their md5sums
+        :param workers: number of files to transfer concurrently
+        :param bwlimit: bandwidth limit in bytes per second
+
+        :returns: list of TransferResult
+        """
+        import scilifelab.utils.transfer
+        def runpipe():
+            return scilifelab.utils.transfer.transfer_files(sources, targets, verify=verify, workers=workers, bwlimit=bwlimit,
+                                                            cache=self._checksum_cache())
+        res = self.dry("copying and checksumming {} files".format(len(sources)), runpipe)
+        if res is None:
+            md5 = self.md5sums(sources)
+            res = [scilifelab.utils.transfer.TransferResult(src, tgt, md5[src], os.path.getsize(src), md5[src] if verify else None, None)
+                   for src, tgt in zip(sources, targets)]
+        return res
+
     def write(self, fn, data=None, overwrite=False):
         """Wrapper for writing data to a file.
 
@@ -282,16 +306,42 @@ class CommandHandler(handler.CementBaseHandler):
             os.chmod(fname,mode)
         return self.dry("changing mode of file {}".format(fname), runpipe)
 
+    def _checksum_cache(self):
+        """Get the md5sum cache, kept in the md5 directory of --cachedir
+        if it is set"""
+        import scilifelab.utils.checksum
+        if getattr(self, "_md5_cache", None) is None:
+            cachedir = getattr(self.app.pargs, "cachedir", None)
+            self._md5_cache = scilifelab.utils.checksum.ChecksumCache(os.path.join(cachedir, "md5") if cachedir else None)
+        return self._md5_cache
+
+    def md5sums(self, fnames):
+        """Calculate the md5sums of files in --md5-workers threads. Files
+        that are unchanged since their md5sums were cached are not read.
+
+        :param fnames: list of file names
+
+        :returns: dictionary of md5sums by file name
+        """
+        import scilifelab.utils.checksum
+        return scilifelab.utils.checksum.md5sums(fnames, workers=getattr(self.app.pargs, "md5_workers", 1), cache=self._checksum_cache())
+
+    def cache_md5sum(self, fname, md5):
+        """Cache an md5sum of fname computed elsewhere, so that the
+        file is not read again while it is unchanged"""
+        cache = self._checksum_cache()
+        cache.set(fname, md5)
+        cache.save()
+
     def md5sum(self, fname):
         """Calculate the md5sum of a file and write the output to a file or, if supplied, an output pipe
         """
-        import scilifelab.utils.misc
         def runpipe():
             if not os.path.exists(fname):
                 self.app.log.warn("not calculating md5sum of non-existant file {}".format(fname))
                 return
             self.app.log.debug("Calculating md5sum of file {}".format(fname))
-            md5 = scilifelab.utils.misc.md5sum(fname)
+            md5 = self.md5sums([fname])[fname]
             md5file = "{}.md5".format(fname)
             self.app.log.debug("Writing md5sum to file {}".format(md5file))
             self.write(md5file,"{}  {}".format(md5,os.path.basename(fname)),True)
@@ -299,34 +349,25 @@ class CommandHandler(handler.CementBaseHandler):
         return self.dry("calculating md5sum of {}".format(fname), runpipe)
     
     def verify_md5sum(self, md5file):
-        """Verify the md5sums and files given in the supplied md5file
+        """Verify the md5sums and files given in the supplied md5file,
+        hashing the files in --md5-workers threads
         """
-        import scilifelab.utils.misc
+        import scilifelab.utils.checksum
         def runpipe():
             if not os.path.exists(md5file):
                 self.app.log.warn("not verifying md5sums in non-existant file {}".format(md5file))
                 return False
             passed = True
             self.app.log.debug("Verifying md5sums in file {}".format(md5file))
-            with open(md5file) as fh:
-                for line in fh:
-                    line = line.strip()
-                    if len(line) == 0:
-                        continue
-                    self.app.log.debug("Processing line: {}".format(line))
-                    pcs = line.split()
-                    if not len(pcs) == 2:
-                        self.app.log.warn("malformed line: {} in {}".format(line,md5file))
-                        continue
-                    fpath = os.path.join(os.path.dirname(md5file),pcs[1])
-                    self.app.log.debug("Calculating md5sum of file {}. Expecting {}".format(fpath,pcs[0]))
-                    md5 = scilifelab.utils.misc.md5sum(fpath)
-                    self.app.log.debug("Calculated md5sum is {}".format(md5))
-                    if md5 == pcs[0]:
-                        self.app.log.info("{}: OK".format(pcs[1]))
-                    else: 
-                        self.app.log.warn("{}: FAILED".format(pcs[1]))
-                        passed = False
+            checks = scilifelab.utils.checksum.verify_md5_files([md5file], workers=getattr(self.app.pargs, "md5_workers", 1),
+                                                                cache=self._checksum_cache())[md5file]
+            for check in checks:
+                self.app.log.debug("Calculated md5sum of file {} is {}. Expecting {}".format(check.path,check.observed,check.expected))
+                if check.observed == check.expected:
+                    self.app.log.info("{}: OK".format(check.fname))
+                else: 
+                    self.app.log.warn("{}: FAILED".format(check.fname))
+                    passed = False
             return passed
         return self.dry("verifying md5sums in {}".format(md5file), runpipe)
     
\ No newline at end of file
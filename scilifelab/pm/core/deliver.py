@@ -19,7 +19,7 @@ from scilifelab.report.delivery_notes import sample_status_note, project_status_
 from scilifelab.report.survey import initiate_survey, closed_projects
 from scilifelab.report.best_practice import best_practice_note, SEQCAP_KITS
 from scilifelab.db.statusdb import SampleRunMetricsConnection, ProjectSummaryConnection, FlowcellRunMetricsConnection, get_scilife_to_customer_name
-from scilifelab.utils.misc import query_yes_no, filtered_walk, md5sum
+from scilifelab.utils.misc import query_yes_no, filtered_walk
 from scilifelab.report.gdocs_report import upload_to_gdocs
 from scilifelab.utils.timestamp import utc_time
 from ConfigParser import NoSectionError, NoOptionError
@@ -61,6 +61,9 @@ class DeliveryController(AbstractBaseController):
         group.add_argument('--rsync', help="Transfer file with rsync (default)", default=True, action="store_true")
         group.add_argument('--intermediate', help="Work on intermediate data", default=False, action="store_true")
         group.add_argument('--data', help="Work on data folder", default=False, action="store_true")
+        group.add_argument('--paranoid', help="Verify raw data deliveries by re-reading the delivered files", default=False, action="store_true")
+        group.add_argument('--workers', help="Number of raw data files to transfer concurrently. Each transfer also calculates the md5sum of its file. Default is 1", default=1, action="store", type=int)
+        group.add_argument('--bwlimit', help="Limit the combined I/O bandwidth of raw data transfers to this number of KB per second, as rsync's --bwlimit", default=None, action="store", type=int)
 
     def _process_args(self):
         # NB: duplicate of project.ProjectController._process_args
@@ -183,12 +186,20 @@ class DeliveryController(AbstractBaseController):
                                           destination_root,
                                           samples)
 
-        # Make sure that transfer will be with rsync
-        if not self.pargs.rsync:
-            self.log.warn("Files must be transferred using rsync")
-            if not query_yes_no("Do you wish to continue delivering using rsync?", default="yes"):
-                return
-            self.pargs.rsync = True
+        # Raw data is copied and checksummed in a single pass
+        if self.pargs.move:
+            self.log.warn("Raw data files are copied, not moved")
+
+        # Copy and checksum the files of all sample runs, several files at a time
+        sources = [f[0] for files in to_copy.values() for f in files]
+        targets = [f[1] for files in to_copy.values() for f in files]
+        for tgt in targets:
+            if not os.path.exists(os.path.dirname(tgt)):
+                self.app.cmd.safe_makedir(os.path.dirname(tgt))
+        self.log.info("Transferring {} fastq files".format(len(sources)))
+        bwlimit = self.pargs.bwlimit * 1024 if self.pargs.bwlimit else None
+        transferred = {r.src:r for r in self.app.cmd.copy_and_hash(sources, targets, verify=self.pargs.paranoid,
+                                                                   workers=self.pargs.workers, bwlimit=bwlimit)}
 
         # Process each sample run
         for id, files in to_copy.items():
@@ -196,39 +207,33 @@ class DeliveryController(AbstractBaseController):
             [sample] = [s for s in samples if s.get('_id') == id]
             self.log.info("Processing sample {} and flowcell {}".format(sample.get("project_sample_name","NA"),sample.get("flowcell","NA")))
 
-            # calculate md5sums on the source side and write it on the destination
+            # write the md5sum of the source to a file at the destination and verify the transfer
             md5 = []
-            for f in files:
-                m = md5sum(f[0])
-                mfile = "{}.md5".format(f[1])
-                md5.append([m,mfile,f[2],f[0]])
-                self.log.debug("md5sum for source file {}: {}".format(f[0],m))
-
-            # transfer files
-            self.log.debug("Transferring {} fastq files".format(len(files)))
-            self._transfer_files([f[0] for f in files], [f[1] for f in files])
-
-            # write the md5sum to a file at the destination and verify the transfer
             passed = True
-            for m, mfile, read, srcpath in md5:
-                dstfile = os.path.splitext(mfile)[0]
+            for srcpath, dstfile, read in files:
+                res = transferred[srcpath]
+                mfile = "{}.md5".format(dstfile)
+                if res.error:
+                    self.log.warn("Transfer FAILED for {}: {}".format(dstfile, res.error))
+                    passed = False
+                    continue
+                m = res.md5
+                md5.append([m,mfile,read,srcpath])
+                self.log.debug("md5sum for source file {}: {}".format(srcpath,m))
                 self.log.debug("Writing md5sum to file {}".format(mfile))
                 self.app.cmd.write(mfile,"{}  {}".format(m,os.path.basename(dstfile)),True)
-                self.log.debug("Verifying md5sum for file {}".format(dstfile))
 
-                # if dry-run, make sure verification pass
-                if self.pargs.dry_run:
-                    dm = m
-                else:
-                    dm = md5sum(dstfile)
-                self.log.debug("md5sum for destination file {}: {}".format(dstfile,dm))
-                if m != dm:
-                    self.log.warn("md5sum verification FAILED for {}. Source: {}, Target: {}".format(dstfile,m,dm))
-                    self.log.warn("Improperly transferred file {} is removed from destination, please retry transfer of this file".format(dstfile))
-                    self.app.cmd.safe_unlink(dstfile)
-                    self.app.cmd.safe_unlink(mfile)
-                    passed = False
-                    continue
+                # with --paranoid, the destination has been re-read
+                if self.pargs.paranoid:
+                    dm = res.verified_md5
+                    self.log.debug("md5sum for destination file {}: {}".format(dstfile,dm))
+                    if m != dm:
+                        self.log.warn("md5sum verification FAILED for {}. Source: {}, Target: {}".format(dstfile,m,dm))
+                        self.log.warn("Improperly transferred file {} is removed from destination, please retry transfer of this file".format(dstfile))
+                        self.app.cmd.safe_unlink(dstfile)
+                        self.app.cmd.safe_unlink(mfile)
+                        passed = False
+                        continue
 
                 # Modify the permissions to ug+rw
                 for f in [dstfile, mfile]:
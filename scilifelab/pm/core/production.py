@@ -42,6 +42,7 @@ class ProductionController(AbstractExtendedBaseController, BcbioRunController):
         group.add_argument('--to_pre_casava', help="Use pre-casava directory structure for delivery", action="store_true", default=False)
         group.add_argument('--transfer_dir', help="Transfer data to transfer_dir instead of sample_prj dir", action="store", default=None)
         base_app.args.add_argument('--brief', help="Output brief information from status queries", action="store_true", default=False)
+        base_app.args.add_argument('--json', help="Output status queries as JSON", action="store_true", default=False)
 
     def _process_args(self):
         # Set root path for parent class
@@ -71,7 +72,7 @@ class ProductionController(AbstractExtendedBaseController, BcbioRunController):
     def status_query(self):
         if not self._check_pargs(["project", "flowcell"]):
             return
-        status_query(self.app.config.get("archive", "root"), self.app.config.get("production", "root"), self.pargs.flowcell, self.pargs.project, brief=self.pargs.brief)
+        status_query(self.app.config.get("archive", "root"), self.app.config.get("production", "root"), self.pargs.flowcell, self.pargs.project, brief=self.pargs.brief, json_output=self.pargs.json)
 
     def _from_casava_structure(self):
         """Get information from casava structure"""
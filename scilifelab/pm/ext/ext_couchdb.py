@@ -11,17 +11,21 @@ def add_shared_couchdb_options(app):
     user = None
     url = None
     password = None
+    cachedir = None
     if app.config.has_option("db", "user"):
         user = app.config.get("db", "user") 
     if app.config.has_option("db", "password"):
         password = app.config.get("db", "password") 
     if app.config.has_option("db", "url"):
         url = app.config.get("db", "url") 
+    if app.config.has_option("db", "cachedir"):
+        cachedir = app.config.get("db", "cachedir")
     group = app.args.add_argument_group('couchdb', 'Options for couchdb connections')
     group.add_argument('--url', help="Database url (excluding http://). Default '{}'".format(url), default=url, nargs="?", type=str)
     group.add_argument('--port', help="Database port. Default 5984", nargs="?", default="5984", type=str)
     group.add_argument('--username', help="Database user. Default '{}'".format(user), nargs="?", default=user, type=str)
     group.add_argument('--password', help="Database password.", default=password, type=str)
+    group.add_argument('--cachedir', help="Directory for caching database views and parsed metrics files between runs. Default '{}'".format(cachedir), default=cachedir, type=str)
 
 def load():
     """Called by the framework when the extension is 'loaded'."""
@@ -6,6 +6,7 @@ import ast
 import itertools
 import re
 import glob
+import multiprocessing
 from collections import defaultdict
 
 from cement.core import backend, controller, handler, hook
@@ -13,6 +14,7 @@ from scilifelab.utils.misc import query_yes_no
 from scilifelab.pm.core.controller import AbstractBaseController
 from scilifelab.utils.timestamp import modified_within_days
 from scilifelab.bcbio.qc import FlowcellRunMetricsParser, SampleRunMetricsParser
+from scilifelab.io.pandas.picard import metrics_cachedir
 from scilifelab.pm.bcbio.utils import validate_fc_directory_format, fc_id, fc_parts, fc_fullname
 from scilifelab.db.statusdb import SampleRunMetricsConnection, FlowcellRunMetricsConnection, ProjectSummaryConnection, SampleRunMetricsDocument, FlowcellRunMetricsDocument, AnalysisConnection, AnalysisDocument
 from scilifelab.utils.dry import dry
@@ -20,6 +22,38 @@ import scilifelab.log
 
 LOG = scilifelab.log.minimal_logger(__name__)
 
+# Number of qc objects saved at a time, as they are collected
+UPLOAD_BATCH_SIZE = 16
+
+def _collect_sample_qc(job):
+    """Collect qc data for a sample run.
+
+    :param job: tuple of the sample run directory, the sample keyword
+      arguments, additional keyword arguments for get_bc_count and the
+      metrics cache directory
+
+    :returns: a SampleRunMetricsDocument
+    """
+    path, sample_kw, bc_kw, cachedir = job
+    parser = SampleRunMetricsParser(path, cachedir)
+    obj = SampleRunMetricsDocument(**sample_kw)
+    obj["picard_metrics"] = parser.read_picard_metrics(**sample_kw)
+    obj["fastq_scr"] = parser.parse_fastq_screen(**sample_kw)
+    obj["bc_count"] = parser.get_bc_count(**dict(bc_kw, **sample_kw))
+    obj["fastqc"] = parser.read_fastqc_metrics(**sample_kw)
+    obj["bcbb_checkpoints"] = parser.parse_bcbb_checkpoints(**sample_kw)
+    obj["software_versions"] = parser.parse_software_versions(**sample_kw)
+    return obj
+
+def _batches(objs, size):
+    """Group an iterable of objects in lists of at most size objects"""
+    objs = iter(objs)
+    while True:
+        batch = list(itertools.islice(objs, size))
+        if not batch:
+            return
+        yield batch
+
 class RunMetricsController(AbstractBaseController):
     """
     This class is an implementation of the :ref:`ICommand
@@ -41,6 +75,7 @@ class RunMetricsController(AbstractBaseController):
             (['--names'], dict(help="Sample name mapping from barcode name to project name as a JSON string, as in \"{'sample_run_name':'project_run_name'}\". Mapping can also be given in a file", default=None, action="store", type=str)),
             (['--extensive_matching'], dict(help="Perform extensive barcode to project sample name matcing", default=False, action="store_true")),
             (['--project_alias'], dict(help="True project name as defined in project summary, as in 'J.Doe_00_01'.", default=None, action="store", type=str)),
+            (['--workers'], dict(help="Number of worker processes collecting sample qc data and parsing RTA files. Defaults to 1", default=1, action="store", type=int)),
             ]
 
 
@@ -63,6 +98,7 @@ class RunMetricsController(AbstractBaseController):
 
         s_con = SampleRunMetricsConnection(dbname=self.app.config.get("db", "samples"), **vars(self.app.pargs))
         samples = s_con.get_samples(sample_prj=self.pargs.sample_prj)
+        modified = []
 
         if self.pargs.project_id:
             self.app.log.debug("Going to update 'project_id' to {} for sample runs with 'sample_prj' == {}".format(self.pargs.project_id, self.pargs.sample_prj))
@@ -71,7 +107,7 @@ class RunMetricsController(AbstractBaseController):
                     if not query_yes_no("'project_id':{} for sample {}; are you sure you want to overwrite?".format(s["project_id"], s["name"]), force=self.pargs.force):
                         continue
                 s["project_id"] = self.pargs.project_id
-                s_con.save(s)
+                modified.append(s)
         if self.pargs.names:
             self.app.log.debug("Going to update 'project_sample_name' for sample runs with 'sample_prj' == {}".format(self.pargs.sample_prj))
             if os.path.exists(self.pargs.names):
@@ -92,7 +128,7 @@ class RunMetricsController(AbstractBaseController):
                         if not query_yes_no("'project_sample_name':{} for sample {}; are you sure you want to overwrite?".format(s["project_sample_name"], s["name"]), force=self.pargs.force):
                             continue
                     s["project_sample_name"] = names_d[barcode_name]
-                    s_con.save(s)
+                    modified.append(s)
         else:
             self.app.log.info("Trying to use extensive matching...")
             p_con = ProjectSummaryConnection(dbname=self.app.config.get("db", "projects"), **vars(self.app.pargs))
@@ -104,13 +140,40 @@ class RunMetricsController(AbstractBaseController):
                 if project_sample:
                     self.app.log.info("using mapping '{} : {}'...".format(s["barcode_name"], project_sample["sample_name"]))
                     s["project_sample_name"] = project_sample["sample_name"]
-                    s_con.save(s)
+                    modified.append(s)
+        s_con.save_many(modified)
                 
     ##############################
     ## New structures
     ##############################
+    def _sample_qc(self, jobs):
+        """Collect qc data for sample runs, in a pool of worker processes
+        if more than one worker was asked for. The documents are returned
+        as they are finished, in the order of the jobs.
+
+        :param jobs: list of arguments to _collect_sample_qc
+        """
+        workers = min(getattr(self.pargs, "workers", 1) or 1, len(jobs))
+        if workers <= 1:
+            for job in jobs:
+                yield _collect_sample_qc(job)
+            return
+        self.app.log.info("Collecting qc data for {} sample runs with {} workers".format(len(jobs), workers))
+        pool = multiprocessing.Pool(workers)
+        try:
+            for obj in pool.imap(_collect_sample_qc, jobs):
+                yield obj
+            pool.close()
+        finally:
+            pool.terminate()
+            pool.join()
+
     def _parse_samplesheet(self, runinfo, qc_objects, fc_date, fc_name, fcdir, as_yaml=False, demultiplex_stats=None, setup=None):
-        """Parse samplesheet information and populate sample run metrics object"""
+        """Parse samplesheet information and populate sample run metrics
+        objects. Returns an iterator over qc_objects followed by the
+        sample run metrics objects, collected as they are needed."""
+        jobs = []
+        cachedir = metrics_cachedir(getattr(self.pargs, "cachedir", None))
         if as_yaml:
             for info in runinfo:
                 if not info.get("multiplex"):
@@ -123,16 +186,7 @@ class RunMetricsController(AbstractBaseController):
                     sample.update({k: info.get(k, None) for k in ('analysis', 'description', 'flowcell_id', 'lane')})
                     sample_kw = dict(flowcell=fc_name, date=fc_date, lane=sample['lane'], barcode_name=sample['name'], sample_prj=sample.get('sample_prj', None),
                                      barcode_id=sample['barcode_id'], sequence=sample.get('sequence', "NoIndex"))
-                
-                    parser = SampleRunMetricsParser(fcdir)
-                    obj = SampleRunMetricsDocument(**sample_kw)
-                    obj["picard_metrics"] = parser.read_picard_metrics(**sample_kw)
-                    obj["fastq_scr"] = parser.parse_fastq_screen(**sample_kw)
-                    obj["bc_count"] = parser.get_bc_count(run_setup=setup, **sample_kw)
-                    obj["fastqc"] = parser.read_fastqc_metrics(**sample_kw)
-                    obj["bcbb_checkpoints"] = parser.parse_bcbb_checkpoints(**sample_kw)
-                    obj["software_versions"] = parser.parse_software_versions(**sample_kw)
-                    qc_objects.append(obj)
+                    jobs.append((fcdir, sample_kw, dict(run_setup=setup), cachedir))
         else:
             for d in runinfo:
                 LOG.debug("Getting information for sample defined by {}".format(d.values()))
@@ -161,16 +215,8 @@ class RunMetricsController(AbstractBaseController):
                     self.app.log.warn("No multiplex information for sample {}".format(d['SampleID']))
                     runinfo_yaml['details'][0]['multiplex'] = [{'barcode_id': 0, 'sequence': 'NoIndex'}]
                 sample_kw = dict(flowcell=fc_name, date=fc_date, lane=d['Lane'], barcode_name=d['SampleID'], sample_prj=d['SampleProject'].replace("__", "."), barcode_id=runinfo_yaml['details'][0]['multiplex'][0]['barcode_id'], sequence=runinfo_yaml['details'][0]['multiplex'][0]['sequence'])
-                parser = SampleRunMetricsParser(sample_fcdir)
-                obj = SampleRunMetricsDocument(**sample_kw)
-                obj["picard_metrics"] = parser.read_picard_metrics(**sample_kw)
-                obj["fastq_scr"] = parser.parse_fastq_screen(**sample_kw)
-                obj["bc_count"] = parser.get_bc_count(demultiplex_stats=demultiplex_stats, run_setup=setup, **sample_kw)
-                obj["fastqc"] = parser.read_fastqc_metrics(**sample_kw)
-                obj["bcbb_checkpoints"] = parser.parse_bcbb_checkpoints(**sample_kw)
-                obj["software_versions"] = parser.parse_software_versions(**sample_kw)
-                qc_objects.append(obj)
-        return qc_objects
+                jobs.append((sample_fcdir, sample_kw, dict(demultiplex_stats=demultiplex_stats, run_setup=setup), cachedir))
+        return itertools.chain(qc_objects, self._sample_qc(jobs))
 
     def _collect_pre_casava_qc(self):
         qc_objects = []
@@ -211,7 +257,7 @@ class RunMetricsController(AbstractBaseController):
         fcobj = FlowcellRunMetricsDocument(**fc_kw)
         fcobj["RunInfo"] = runinfo_xml
         fcobj["RunParameters"] = runparams
-        fcobj["illumina"] = parser.parse_illumina_metrics(fullRTA=False, **fc_kw)
+        fcobj["illumina"] = parser.parse_illumina_metrics(fullRTA=False, workers=getattr(self.pargs, "workers", 1) or 1, **fc_kw)
         fcobj["bc_metrics"] = parser.parse_bc_metrics(**fc_kw)
         fcobj["filter_metrics"] = parser.parse_filter_metrics(**fc_kw)
         fcobj["samplesheet_csv"] = runinfo
@@ -249,7 +295,7 @@ class RunMetricsController(AbstractBaseController):
             fcobj["RunInfo"] = runinfo_xml
             fcobj["RunParameters"] = runparams
             fcobj["DemultiplexConfig"] = parser.parseDemultiplexConfig(**fc_kw)
-            fcobj["illumina"] = parser.parse_illumina_metrics(fullRTA=False, **fc_kw)
+            fcobj["illumina"] = parser.parse_illumina_metrics(fullRTA=False, workers=getattr(self.pargs, "workers", 1) or 1, **fc_kw)
             fcobj["bc_metrics"] = parser.parse_bc_metrics(**fc_kw)
             fcobj["undemultiplexed_barcodes"] = parser.parse_undemultiplexed_barcode_metrics(**fc_kw)
             fcobj["illumina"].update({"Demultiplex_Stats" : parser.parse_demultiplex_stats_htm(**fc_kw)})
@@ -336,7 +382,7 @@ class RunMetricsController(AbstractBaseController):
                         sinfos.append(sample_kw)
                 
                 # Create a parser object and collect the metrics
-                parser = SampleRunMetricsParser(sdir)
+                parser = SampleRunMetricsParser(sdir, metrics_cachedir(getattr(self.pargs, "cachedir", None)))
                 sinfo = sinfos[0]
                 name = sinfo.get("barcode_name","unknown")
                 samples[name] = {}
@@ -386,25 +432,31 @@ class RunMetricsController(AbstractBaseController):
             self.log.info("Assuming casava based file structure for {}".format(fc_id(self.pargs.flowcell)))
             qc_objects = self._collect_casava_qc()
 
-        if len(qc_objects) == 0:
-            self.log.info("No out-of-date qc objects for {}".format(fc_id(self.pargs.flowcell)))
-            return
-        else:
-            self.log.info("Retrieved {} updated qc objects".format(len(qc_objects)))
-
         s_con = SampleRunMetricsConnection(dbname=self.app.config.get("db", "samples"), **vars(self.app.pargs))
         fc_con = FlowcellRunMetricsConnection(dbname=self.app.config.get("db", "flowcells"), **vars(self.app.pargs))
         p_con = ProjectSummaryConnection(dbname=self.app.config.get("db", "projects"), **vars(self.app.pargs))
-        for obj in qc_objects:
-            if self.app.pargs.debug:
-                self.log.debug("{}: {}".format(str(obj), obj["_id"]))
-            if isinstance(obj, FlowcellRunMetricsDocument):
-                dry("Saving object {}".format(repr(obj)), fc_con.save(obj))
-            if isinstance(obj, SampleRunMetricsDocument):
+        # Save the qc objects in batches as they are collected
+        n_objects = 0
+        for batch in _batches(qc_objects, UPLOAD_BATCH_SIZE):
+            n_objects += len(batch)
+            fc_objects = [obj for obj in batch if isinstance(obj, FlowcellRunMetricsDocument)]
+            sample_objects = [obj for obj in batch if isinstance(obj, SampleRunMetricsDocument)]
+            # Fetch the projects of all samples at once
+            p_con.get_entries(set([obj.get("sample_prj", None) for obj in sample_objects]))
+            for obj in sample_objects:
+                if self.app.pargs.debug:
+                    self.log.debug("{}: {}".format(str(obj), obj["_id"]))
                 project_sample = p_con.get_project_sample(obj.get("sample_prj", None), obj.get("barcode_name", None), self.pargs.extensive_matching)
                 if project_sample:
                     obj["project_sample_name"] = project_sample['sample_name']
-                dry("Saving object {}".format(repr(obj)), s_con.save(obj))
+            if fc_objects:
+                dry("Saving {} flowcell objects".format(len(fc_objects)), fc_con.save_many(fc_objects))
+            if sample_objects:
+                dry("Saving {} sample objects".format(len(sample_objects)), s_con.save_many(sample_objects))
+        if n_objects == 0:
+            self.log.info("No out-of-date qc objects for {}".format(fc_id(self.pargs.flowcell)))
+        else:
+            self.log.info("Retrieved {} updated qc objects".format(n_objects))
 
     @controller.expose(help="Perform a multiplex QC")
     def multiplex_qc(self):
@@ -6,7 +6,7 @@ import glob
 import pandas as pd
 from cStringIO import StringIO
 from scilifelab.report.rst import make_rest_note
-from scilifelab.io.pandas.picard import read_metrics
+from scilifelab.io.pandas.picard import read_metrics, metrics_cachedir
 from bcbio.broad.metrics import _add_commas
 from texttable import Texttable
 from itertools import izip
@@ -117,7 +117,7 @@ def _split_project_summary_sample_name(samplename):
             info['ScilifeName'] = m.groups()[1]
     return info
 
-def _get_seqcap_summary(flist, amplicon=False):
+def _get_seqcap_summary(flist, amplicon=False, cachedir=None):
     """Gather relevant information for sequence capture.  
 
     If amplicon=true, make sure that hs_metrics results are *not* based on
@@ -126,6 +126,7 @@ def _get_seqcap_summary(flist, amplicon=False):
 
     :param flist: list of run info files
     :param amplicon: boolean to indicate amplicon run
+    :param cachedir: Picard metrics cache directory
     """
     df_list = []
     for run_info in flist:
@@ -137,7 +138,7 @@ def _get_seqcap_summary(flist, amplicon=False):
             LOG.debug("Reading file {}".format(prj_summary))
             tmp_df = pd.io.parsers.read_csv(fh, sep=",")
             if amplicon:
-                tmp_df = _update_project_summary_hs_metrics(run_info, tmp_df)
+                tmp_df = _update_project_summary_hs_metrics(run_info, tmp_df, cachedir)
             df_list.append(tmp_df)
             
     df = pd.concat(df_list)
@@ -147,12 +148,13 @@ def _get_seqcap_summary(flist, amplicon=False):
     df.columns = SEQCAP_TABLE_COLUMNS
     return df.sort(["Sample"]), samples_df.sort(["Sample"])
 
-def _update_project_summary_hs_metrics(run_info, tmp_df):
+def _update_project_summary_hs_metrics(run_info, tmp_df, cachedir=None):
     """Gather relevant information for sequence capture. Skip
     project-summary files and use metrics files directly instead.
 
     :param run_info: runinfo file
     :param tmp_df: temporary DataFrame
+    :param cachedir: Picard metrics cache directory
 
     :return: updated data frame
     """
@@ -166,7 +168,7 @@ def _update_project_summary_hs_metrics(run_info, tmp_df):
             return tmp_df
         else:
             LOG.debug("Reading non-marked duplicate file {} for hs_metrics statistics".format(hs_metrics_flist[dup_marked.index(False)]))
-            hs_metrics = read_metrics(hs_metrics_flist[dup_marked.index(False)])[0]
+            hs_metrics = read_metrics(hs_metrics_flist[dup_marked.index(False)], cachedir)[0]
         tmp_df["On target bases"] = _count_percent(hs_metrics.ON_TARGET_BASES, hs_metrics.PF_UQ_BASES_ALIGNED)
         tmp_df["Mean target coverage"] = "{}x".format(_try_float_format(str(hs_metrics.MEAN_TARGET_COVERAGE.values[0]), "%d"))
         tmp_df["10x coverage targets"] = "{}%".format(_try_float_format(str(hs_metrics.PCT_TARGET_BASES_10X.values[0]), "%.1f", 100.0))
@@ -242,7 +244,7 @@ def best_practice_note(project_name=None, samples=None, capture_kit="agilent_v4"
     if application not in BEST_PRACTICE_NOTES:
         LOG.warn("No such application '{}'. Valid choices are: \n\t{}".format(application, "\n\t".join(BEST_PRACTICE_NOTES)))
     if application == "seqcap":
-        df, samples_df = _get_seqcap_summary(flist, kw.get("amplicon", False))
+        df, samples_df = _get_seqcap_summary(flist, kw.get("amplicon", False), metrics_cachedir(kw.get("cachedir", None)))
         software_df = _get_software_table(flist)
         database_df = _get_database_table(flist, post_process=kw.get("post_process", None))
         if sample_name_map:
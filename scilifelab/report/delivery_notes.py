@@ -268,8 +268,8 @@ def sample_status_note(project_name=None, flowcell=None, username=None, password
     paragraphs = sample_note_paragraphs()
     headers = sample_note_headers()
 
-    # Get project
-    project = p_con.get_entry(project_name)
+    # Get project; the document is kept by the connection for later lookups
+    project = p_con.get_entries([project_name]).get(project_name, None)
     source = p_con.get_info_source(project_name)
     if not project:
         LOG.warn("No such project '{}'".format(project_name))
@@ -286,6 +286,9 @@ def sample_status_note(project_name=None, flowcell=None, username=None, password
     bc_count = _literal_eval_option(bc_count)
     phix = _literal_eval_option(phix)
 
+    # Fetch the flowcells of all sample runs at once
+    fc_con.get_entries(set(["{}_{}".format(s.get("date"), s.get("flowcell")) for s in sample_run_list]))
+
     # Count number of times a sample has been run on a flowcell; if several, make lane-specific reports
     sample_count = Counter([x.get("barcode_name") for x in sample_run_list])
 
@@ -616,6 +619,9 @@ def _project_status_note_table(project_name=None, username=None, password=None,
     fc_con = FlowcellRunMetricsConnection(dbname=flowcelldb, username=username, password=password, url=url)
     p_con = ProjectSummaryConnection(dbname=projectdb, username=username, password=password, url=url)
 
+    # Fetch the project once; the document is kept by the connection for later lookups
+    p_con.get_entries([project_name])
+
     #Get the information source for this project
     source = p_con.get_info_source(project_name)
 
@@ -0,0 +1,249 @@
+"""Compute and verify md5sums of many files, in worker threads and with a
+persistent cache of the md5sums of unchanged files"""
+import os
+import json
+import time
+import hashlib
+import threading
+import collections
+from multiprocessing.pool import ThreadPool
+
+import scilifelab.log
+
+LOG = scilifelab.log.minimal_logger(__name__)
+
+## Read size, large enough for the kernel to read ahead sequentially
+BUFFER_SIZE = 4 * 1024 * 1024
+
+## Result of verifying a line of an md5 file. observed is None if the
+## file could not be read
+Md5Check = collections.namedtuple("Md5Check", ["fname", "path", "expected", "observed"])
+
+def hash_file(fn, buf=None, limiter=None):
+    """Compute the md5sum of fn, reading it into buf
+
+    :param fn: file name
+    :param buf: bytearray to read into
+    :param limiter: object with a consume(nbytes) method called for each read
+
+    :returns: md5sum as hex string
+    """
+    if buf is None:
+        buf = bytearray(BUFFER_SIZE)
+    md5 = hashlib.md5()
+    view = memoryview(buf)
+    with open(fn, "rb", 0) as fh:
+        while True:
+            n = fh.readinto(buf)
+            if not n:
+                break
+            if limiter:
+                limiter.consume(n)
+            md5.update(view[0:n])
+    return md5.hexdigest()
+
+class ChecksumCache(object):
+    """md5sums of files by absolute path, each stored with the device,
+    inode, size and modification time of the file when it was hashed
+    and kept in a json file in cachedir. A file that has not changed
+    since its md5sum was computed is not read again.
+
+    :param cachedir: cache directory. Without it, the cache is only kept in memory
+    """
+    def __init__(self, cachedir=None):
+        self.cachedir = cachedir
+        self._lock = threading.Lock()
+        self._md5 = {}
+        self._updated = False
+        if self.cachedir and os.path.exists(self._cachefile()):
+            self._md5 = self._load()
+
+    def _cachefile(self):
+        return os.path.join(self.cachedir, "md5sums.json")
+
+    def _load(self):
+        """Read the cache file, skipping entries that are not [key, md5]
+        pairs, as written by earlier versions"""
+        try:
+            with open(self._cachefile()) as fh:
+                md5 = json.load(fh)
+        except ValueError as e:
+            LOG.warn("Ignoring corrupt checksum cache {}: {}".format(self._cachefile(), e))
+            return {}
+        return {path: entry for path, entry in md5.items() if isinstance(entry, list) and len(entry) == 2}
+
+    @staticmethod
+    def _key(st):
+        return "{}:{}:{}:{}".format(st.st_dev, st.st_ino, st.st_size, repr(st.st_mtime))
+
+    @classmethod
+    def _current(cls, path, entry):
+        """Whether the file at path is unchanged since entry was cached"""
+        try:
+            return entry[0] == cls._key(os.stat(path))
+        except OSError:
+            return False
+
+    def get(self, fn):
+        """Get the cached md5sum of fn, or None"""
+        entry = self._md5.get(os.path.abspath(fn))
+        if entry is None or entry[0] != self._key(os.stat(fn)):
+            return None
+        return entry[1]
+
+    def set(self, fn, md5, st=None):
+        """Cache the md5sum of fn. st is the stat of fn when the md5sum
+        was computed"""
+        with self._lock:
+            self._md5[os.path.abspath(fn)] = [self._key(st or os.stat(fn)), md5]
+            self._updated = True
+
+    def save(self):
+        """Write the cache, merged with entries written by others since
+        it was read. Entries of files that have been removed or changed
+        since they were hashed are dropped"""
+        if not self.cachedir or not self._updated:
+            return
+        with self._lock:
+            if not os.path.exists(self.cachedir):
+                os.makedirs(self.cachedir)
+            md5 = self._load() if os.path.exists(self._cachefile()) else {}
+            md5.update(self._md5)
+            md5 = {path: entry for path, entry in md5.items() if self._current(path, entry)}
+            tmp = "{}.{}.tmp".format(self._cachefile(), os.getpid())
+            with open(tmp, "w") as fh:
+                json.dump(md5, fh)
+            os.rename(tmp, self._cachefile())
+            self._md5 = md5
+            self._updated = False
+
+class Progress(object):
+    """Count hashed files and bytes and log the progress and throughput
+    at most every interval seconds
+
+    :param nfiles: total number of files
+    :param nbytes: total number of bytes
+    :param interval: seconds between log messages
+    :param log: logger
+    """
+    def __init__(self, nfiles, nbytes, interval=30, log=LOG):
+        self.nfiles = nfiles
+        self.nbytes = nbytes
+        self.interval = interval
+        self.log = log
+        self.files = 0
+        self.bytes = 0
+        self.cached = 0
+        self._lock = threading.Lock()
+        self._start = self._last = time.time()
+
+    def update(self, nbytes, cached=False):
+        """Count a file of nbytes bytes"""
+        with self._lock:
+            self.files += 1
+            if cached:
+                self.cached += 1
+            else:
+                self.bytes += nbytes
+            now = time.time()
+            if now - self._last >= self.interval or self.files == self.nfiles:
+                self._last = now
+                self.log.info(str(self))
+
+    @property
+    def throughput(self):
+        """Hashed bytes per second"""
+        return self.bytes / max(time.time() - self._start, 1e-9)
+
+    def __str__(self):
+        return "md5sum: {}/{} files ({} cached), {:.1f}/{:.1f} MB, {:.1f} MB/s".format(self.files, self.nfiles, self.cached,
+                                                                                       self.bytes / 1024.0**2, self.nbytes / 1024.0**2,
+                                                                                       self.throughput / 1024.0**2)
+
+def _md5sum(job):
+    fn, cache, progress = job
+    st = os.stat(fn)
+    md5 = cache.get(fn) if cache else None
+    if md5 is None:
+        md5 = hash_file(fn)
+        if cache:
+            cache.set(fn, md5, st)
+        if progress:
+            progress.update(st.st_size)
+    elif progress:
+        progress.update(st.st_size, cached=True)
+    return md5
+
+def _safe_md5sum(job):
+    try:
+        return _md5sum(job)
+    except (IOError, OSError) as e:
+        LOG.warn("Failed to compute md5sum of {}: {}".format(job[0], e))
+        return None
+
+def md5sums(files, workers=1, cache=None, progress=True):
+    """Compute the md5sums of files in worker threads. Files that
+    cannot be read get the md5sum None.
+
+    :param files: list of file names
+    :param workers: number of files to hash concurrently
+    :param cache: ChecksumCache
+    :param progress: log progress and throughput
+
+    :returns: dictionary of md5sums by file name
+    """
+    files = list(files)
+    if progress:
+        progress = Progress(len(files), sum(os.path.getsize(f) for f in files if os.path.exists(f)))
+    jobs = [(fn, cache, progress or None) for fn in files]
+    workers = min(workers or 1, len(jobs))
+    if workers <= 1:
+        res = map(_safe_md5sum, jobs)
+    else:
+        pool = ThreadPool(workers)
+        try:
+            res = pool.map(_safe_md5sum, jobs, chunksize=1)
+        finally:
+            pool.close()
+            pool.join()
+    if cache:
+        cache.save()
+    return dict(zip(files, res))
+
+def read_md5_file(md5file):
+    """Read the lines of an md5 file, in the format written by md5sum,
+    as tuples of md5sum, file name and path. Malformed lines are
+    skipped with a warning.
+
+    :param md5file: md5 file
+
+    :returns: list of (md5sum, fname, path)
+    """
+    entries = []
+    with open(md5file) as fh:
+        for line in fh:
+            line = line.strip()
+            if len(line) == 0:
+                continue
+            pcs = line.split()
+            if not len(pcs) == 2:
+                LOG.warn("malformed line: {} in {}".format(line, md5file))
+                continue
+            entries.append((pcs[0], pcs[1], os.path.join(os.path.dirname(md5file), pcs[1])))
+    return entries
+
+def verify_md5_files(md5files, workers=1, cache=None, progress=True):
+    """Verify the md5sums given in md5 files, hashing the files of all
+    md5 files in one pool of worker threads.
+
+    :param md5files: list of md5 files
+    :param workers: number of files to hash concurrently
+    :param cache: ChecksumCache
+    :param progress: log progress and throughput
+
+    :returns: dictionary of lists of Md5Check by md5 file
+    """
+    entries = collections.OrderedDict((md5file, read_md5_file(md5file)) for md5file in md5files)
+    observed = md5sums(set(path for x in entries.values() for _, _, path in x), workers, cache, progress)
+    return collections.OrderedDict((md5file, [Md5Check(fname, path, md5, observed[path]) for md5, fname, path in x])
+                                   for md5file, x in entries.items())
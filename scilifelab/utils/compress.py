@@ -0,0 +1,298 @@
+"""Compressed file I/O with optional parallel (de)compression.
+
+Files are opened through codecs registered by file extension in CODECS.
+The gzip codec writes multi-member gzip files when given more than one
+thread: the data is cut into blocks that are compressed independently in
+a pool of threads and written as separate gzip members. Each member
+carries its compressed size in a gzip extra subfield, so that such files
+can be decompressed block-wise in parallel as well. The output is
+regular gzip and can be read by any gzip-capable tool.
+
+Other gzip files are decompressed in a pigz subprocess when more than one
+thread is requested and pigz is available, otherwise with the gzip module.
+"""
+import collections
+import gzip
+import os
+import struct
+import subprocess
+import zlib
+from multiprocessing.pool import ThreadPool
+
+from distutils.spawn import find_executable
+
+# Uncompressed size of the blocks compressed independently by the writer
+BLOCK_SIZE = 4*1024*1024
+# Default compression level of the parallel writer, the same as the gzip
+# command line tool. The single threaded writer keeps the gzip module default
+COMPRESS_LEVEL = 6
+
+GZIP_MAGIC = "\037\213"
+# Subfield identifier for the compressed member size stored in the gzip header
+SUBFIELD_ID = "SL"
+_HEADER = struct.Struct("<2sBBIBBH2sHI")
+_TRAILER = struct.Struct("<II")
+
+def _compress_member(data, level):
+    """Compress data into a complete gzip member holding its own size
+    """
+    c = zlib.compressobj(level, zlib.DEFLATED, -zlib.MAX_WBITS)
+    deflated = c.compress(data) + c.flush()
+    size = _HEADER.size + len(deflated) + _TRAILER.size
+    header = _HEADER.pack(GZIP_MAGIC, 8, 4, 0, 0, 255, 8, SUBFIELD_ID, 4, size)
+    trailer = _TRAILER.pack(zlib.crc32(data) & 0xffffffff, len(data) & 0xffffffff)
+    return "".join([header, deflated, trailer])
+
+def _decompress_member(member):
+    """Decompress a gzip member written by _compress_member and verify its checksum
+    """
+    data = zlib.decompress(member[_HEADER.size:-_TRAILER.size], -zlib.MAX_WBITS)
+    crc, isize = _TRAILER.unpack(member[-_TRAILER.size:])
+    if crc != (zlib.crc32(data) & 0xffffffff) or isize != (len(data) & 0xffffffff):
+        raise IOError("CRC check failed for gzip member")
+    return data
+
+def _member_size(header):
+    """Return the member size stored in a gzip header, or None if the header
+    was not written by ParallelGzipWriter
+    """
+    if len(header) < _HEADER.size:
+        return None
+    magic, method, flags, _, _, _, xlen, sid, slen, size = _HEADER.unpack(header[0:_HEADER.size])
+    if magic != GZIP_MAGIC or method != 8 or not flags & 4 or xlen != 8 or sid != SUBFIELD_ID or slen != 4:
+        return None
+    return size
+
+def is_blocked_gzip(fname):
+    """Return True if fname is a gzip file written block-wise by ParallelGzipWriter
+    """
+    with open(fname, "rb") as fh:
+        return _member_size(fh.read(_HEADER.size)) is not None
+
+
+class ParallelGzipWriter:
+    """File-like object that compresses the data written to it in blocks
+    of block_size bytes using a pool of threads, and writes each block as a
+    separate gzip member. At most 2*threads blocks are held in memory.
+    """
+
+    def __init__(self, fname, threads=2, level=COMPRESS_LEVEL, block_size=BLOCK_SIZE, mode="wb"):
+        self.name = fname
+        self.level = level
+        self.block_size = block_size
+        self.threads = threads
+        self._fh = open(fname, mode)
+        self._pool = ThreadPool(threads)
+        self._pending = collections.deque()
+        self._buffer = []
+        self._buffered = 0
+
+    def write(self, data):
+        self._buffer.append(data)
+        self._buffered += len(data)
+        if self._buffered >= self.block_size:
+            self._submit()
+
+    def _submit(self):
+        data = "".join(self._buffer)
+        self._buffer = []
+        self._buffered = 0
+        for i in xrange(0, len(data), self.block_size):
+            while len(self._pending) >= 2*self.threads:
+                self._fh.write(self._pending.popleft().get())
+            self._pending.append(self._pool.apply_async(_compress_member, (data[i:i+self.block_size], self.level)))
+
+    def flush(self):
+        if self._buffered > 0:
+            self._submit()
+        while self._pending:
+            self._fh.write(self._pending.popleft().get())
+        self._fh.flush()
+
+    def close(self):
+        if self._fh.closed:
+            return
+        try:
+            self.flush()
+            # An empty file is not valid gzip, so a writer that got no data
+            # writes a single empty member
+            if os.fstat(self._fh.fileno()).st_size == 0:
+                self._fh.write(_compress_member("", self.level))
+        finally:
+            self._pool.close()
+            self._pool.join()
+            self._fh.close()
+
+    @property
+    def closed(self):
+        return self._fh.closed
+
+
+class ParallelGzipReader:
+    """File-like object that decompresses a gzip file written by
+    ParallelGzipWriter, decompressing up to 2*threads members ahead in a
+    pool of threads.
+    """
+
+    def __init__(self, fname, threads=2):
+        self.name = fname
+        self.threads = threads
+        self._fh = open(fname, "rb")
+        self._pool = ThreadPool(threads)
+        self._blocks = self._read_blocks()
+        self._data = ""
+        self._offset = 0
+
+    def _members(self):
+        while True:
+            header = self._fh.read(_HEADER.size)
+            if not header:
+                break
+            size = _member_size(header)
+            if size is None:
+                raise IOError("{} is not a block compressed gzip file".format(self.name))
+            member = header + self._fh.read(size - len(header))
+            if len(member) != size:
+                raise IOError("Unexpected end of file in {}".format(self.name))
+            yield member
+
+    def _read_blocks(self):
+        pending = collections.deque()
+        for member in self._members():
+            if len(pending) >= 2*self.threads:
+                yield pending.popleft().get()
+            pending.append(self._pool.apply_async(_decompress_member, (member,)))
+        while pending:
+            yield pending.popleft().get()
+
+    def read(self, size=-1):
+        chunks = []
+        if self._offset < len(self._data):
+            chunks.append(self._data[self._offset:])
+        n = len(chunks[0]) if chunks else 0
+        while size < 0 or n < size:
+            try:
+                block = self._blocks.next()
+            except StopIteration:
+                break
+            chunks.append(block)
+            n += len(block)
+        data = "".join(chunks)
+        if size < 0 or len(data) <= size:
+            self._data, self._offset = "", 0
+            return data
+        self._data, self._offset = data, size
+        return data[0:size]
+
+    def seek(self, offset, whence=0):
+        if offset != 0 or whence != 0:
+            raise IOError("ParallelGzipReader can only seek to the beginning of the file")
+        self._fh.seek(0)
+        self._blocks = self._read_blocks()
+        self._data, self._offset = "", 0
+
+    def close(self):
+        self._pool.close()
+        self._pool.join()
+        self._fh.close()
+
+    @property
+    def closed(self):
+        return self._fh.closed
+
+
+class PigzReader:
+    """File-like object reading the output of pigz decompressing fname
+    """
+
+    def __init__(self, fname, threads=2):
+        self.name = fname
+        self.threads = threads
+        self._open()
+
+    def _open(self):
+        self._proc = subprocess.Popen(["pigz", "-dc", "-p", str(self.threads), self.name],
+                                      stdout=subprocess.PIPE, bufsize=-1)
+        self._fh = self._proc.stdout
+
+    def read(self, size=-1):
+        data = self._fh.read(size)
+        if not data and self._proc.poll() not in [None, 0]:
+            raise IOError("pigz failed decompressing {}".format(self.name))
+        return data
+
+    def seek(self, offset, whence=0):
+        if offset != 0 or whence != 0:
+            raise IOError("PigzReader can only seek to the beginning of the file")
+        self.close()
+        self._open()
+
+    def close(self):
+        self._fh.close()
+        if self._proc.poll() is None:
+            self._proc.terminate()
+        self._proc.wait()
+
+    @property
+    def closed(self):
+        return self._fh.closed
+
+
+class GzipCodec:
+    """Codec for gzip compressed files
+    """
+
+    @staticmethod
+    def reader(fname, threads=1):
+        if threads > 1:
+            if is_blocked_gzip(fname):
+                return ParallelGzipReader(fname, threads)
+            if find_executable("pigz"):
+                return PigzReader(fname, threads)
+        return gzip.GzipFile(fileobj=open(fname, "rb"))
+
+    @staticmethod
+    def writer(fname, threads=1, level=None, block_size=BLOCK_SIZE, mode="wb"):
+        if threads > 1:
+            return ParallelGzipWriter(fname, threads, level or COMPRESS_LEVEL, block_size, mode)
+        return gzip.GzipFile(fname, mode, level or 9)
+
+# Codecs by file extension
+CODECS = {".gz": GzipCodec}
+
+def get_codec(fname):
+    """Return the codec for fname based on its extension, or None for uncompressed files
+    """
+    return CODECS.get(os.path.splitext(fname)[1])
+
+def open_input(fname, threads=1):
+    """Open fname for reading, decompressing it if it has a registered compressed extension
+    """
+    codec = get_codec(fname)
+    if codec is None:
+        return open(fname, "rb")
+    return codec.reader(fname, threads)
+
+def open_output(fname, threads=1, level=None, block_size=BLOCK_SIZE, mode="wb"):
+    """Open fname for writing, compressing it if it has a registered compressed extension.
+    Use mode "ab" to append to an existing file; compressed data is then appended as 
+    new gzip members. The default level is that of the gzip module (9) with one 
+    thread and COMPRESS_LEVEL with more
+    """
+    codec = get_codec(fname)
+    if codec is None:
+        return open(fname, mode)
+    return codec.writer(fname, threads, level, block_size, mode)
+
+def input_offset(fh):
+    """Return the number of bytes consumed from the file underlying a handle returned
+    by open_input, i.e. the offset in the compressed data for compressed input, or 
+    None if it is not known
+    """
+    if isinstance(fh, gzip.GzipFile):
+        return fh.fileobj.tell()
+    if isinstance(fh, ParallelGzipReader):
+        return fh._fh.tell()
+    if isinstance(fh, file):
+        return fh.tell()
+    return None
@@ -0,0 +1,150 @@
+"""Exact removal of duplicate reads from fastq files using external memory"""
+import itertools
+import os
+import shutil
+import tempfile
+from scilifelab.utils.fastq_utils import FastQParser, FastQWriter
+
+# Approximate memory used per entry when deduplicating a partition in memory,
+# in addition to the length of the key
+ENTRY_OVERHEAD = 200
+# Default memory budget in bytes
+MAX_MEMORY = 1024*1024*1024
+# Limits on the number of partitions written at a time
+MIN_PARTITIONS = 4
+MAX_PARTITIONS = 512
+
+class FastQDeduplicator(object):
+    """Removes duplicate reads, or read pairs, from fastq files, keeping one
+    copy of each distinct sequence (or pair of sequences).
+
+    The input is read twice. The first pass writes the sequence, position and
+    quality sum of each read to partition files on disk, split on a hash of
+    the sequence into partitions small enough to be deduplicated in memory
+    within max_memory bytes. Partitions that turn out too large are split
+    again. Each partition is then reduced to the positions of the reads to
+    keep, recorded in a bit array, and the second pass writes those reads to
+    the output in their original order.
+
+    :param fastq1: fastq file with the reads
+    :param fastq2: optional fastq file with the paired reads
+    :param max_memory: memory budget in bytes
+    :param best_quality: keep the copy with the highest quality sum rather than the first
+    :param tmpdir: directory for the partition files
+    """
+
+    def __init__(self, fastq1, fastq2=None, max_memory=MAX_MEMORY, best_quality=False, tmpdir=None):
+        self.fastq = [fastq1] if fastq2 is None else [fastq1, fastq2]
+        self.max_memory = max_memory
+        self.best_quality = best_quality
+        self.tmpdir = tmpdir
+        self.records = 0
+        self.unique = 0
+
+    def duplication_rate(self):
+        """Return the fraction of reads (or pairs) that were duplicates
+        """
+        if self.records == 0:
+            return 0.
+        return 1. - float(self.unique)/self.records
+
+    def _partitions(self, size):
+        """Return the number of partitions needed for size bytes of partition data
+        """
+        n = int(size*2/self.max_memory) + 1
+        return max(MIN_PARTITIONS,min(MAX_PARTITIONS,n))
+
+    def _records(self):
+        parsers = [FastQParser(f) for f in self.fastq]
+        for records in itertools.izip_longest(*parsers):
+            if None in records:
+                raise ValueError("{:s} and {:s} have different numbers of records".format(*self.fastq))
+            yield records
+
+    def _write_partitions(self, entries, workdir, nparts, level):
+        """Write (key, position, score) entries to nparts partition files split on
+        a hash of the key, and return the partition file names
+        """
+        fnames = [os.path.join(workdir,"part_{}_{}".format(level,n)) for n in xrange(nparts)]
+        fhs = [open(f,"wb",1024*1024) for f in fnames]
+        salt = str(level)
+        for key, pos, score in entries:
+            fhs[hash(salt + key) % nparts].write("{}\t{}\t{}\n".format(key,pos,score))
+        for fh in fhs:
+            fh.close()
+        return fnames
+
+    def _read_partition(self, fname):
+        with open(fname,"rb") as fh:
+            for line in fh:
+                key, pos, score = line.split("\t")
+                yield key, int(pos), int(score)
+
+    def _reduce(self, fname, keep, workdir, level, split=True):
+        """Record the positions of the reads to keep in a partition, splitting
+        it further if it is too large to deduplicate in memory and split is True
+        """
+        size = os.path.getsize(fname)
+        if size == 0:
+            return
+        with open(fname,"rb") as fh:
+            nlines = sum(1 for line in fh)
+        if split and size + nlines*ENTRY_OVERHEAD > self.max_memory/2 and nlines > 1 and level < 8:
+            parts = self._write_partitions(self._read_partition(fname),workdir,self._partitions(size + nlines*ENTRY_OVERHEAD),level+1)
+            os.unlink(fname)
+            # All copies of a key hash to the same partition, so a partition
+            # of many copies of a few keys does not shrink when split. Its
+            # memory use depends on the distinct keys only, so it is
+            # deduplicated in memory instead of being rewritten again.
+            for part in parts:
+                self._reduce(part,keep,workdir,level+1,os.path.getsize(part) < size)
+            return
+
+        # The entries of a partition are in input order, so the first copy is
+        # kept unless a later one has a strictly higher quality sum
+        best = {}
+        for key, pos, score in self._read_partition(fname):
+            current = best.get(key)
+            if current is None or (self.best_quality and score > current[1]):
+                best[key] = (pos, score)
+        for pos, _ in best.itervalues():
+            keep[pos >> 3] |= (1 << (pos & 7))
+        self.unique += len(best)
+        os.unlink(fname)
+
+    def run(self, outfiles):
+        """Deduplicate the input and write the unique reads to outfiles, one for
+        each input file
+        """
+        workdir = tempfile.mkdtemp(prefix="fastq_dedup_",dir=self.tmpdir)
+        try:
+            # First pass, write the reads to partitions
+            size = sum([os.path.getsize(f) for f in self.fastq])
+            if any([f.endswith(".gz") for f in self.fastq]):
+                size *= 4
+            def entries():
+                for pos, records in enumerate(self._records()):
+                    key = ",".join([r[1] for r in records])
+                    score = sum([sum(bytearray(r[3])) for r in records]) if self.best_quality else 0
+                    self.records = pos + 1
+                    yield key, pos, score
+            self.records = 0
+            self.unique = 0
+            parts = self._write_partitions(entries(),workdir,self._partitions(size/2),0)
+
+            # Reduce each partition to the reads to keep
+            keep = bytearray((self.records + 7) >> 3)
+            for part in parts:
+                self._reduce(part,keep,workdir,0)
+
+            # Second pass, write the reads to keep in the original order
+            writers = [FastQWriter(f) for f in outfiles]
+            for pos, records in enumerate(self._records()):
+                if keep[pos >> 3] & (1 << (pos & 7)):
+                    for writer, record in zip(writers,records):
+                        writer.write(record)
+            for writer in writers:
+                writer.close()
+        finally:
+            shutil.rmtree(workdir)
+        return outfiles
@@ -1,62 +1,117 @@
 """Utilities for handling FastQ data"""
+import collections
 import gzip
+import itertools
+import multiprocessing
+import operator
 import os
 import re
 from scilifelab.illumina.hiseq import HiSeqRun
+from scilifelab.illumina.barcodes import BarcodeIndex, PrefixIndex, normalize_barcode
+from scilifelab.utils import compress
          
+# Size of the blocks read from the input by FastQParser
+BLOCK_SIZE = 4*1024*1024
+
 class FastQParser:
     """Parser for fastq files, possibly compressed with gzip. 
        Iterates over one record at a time. A record consists 
        of a list with 4 elements corresponding to 1) Header, 
-       2) Nucleotide sequence, 3) Optional header, 4) Qualities"""
+       2) Nucleotide sequence, 3) Optional header, 4) Qualities
+       
+       The input is read in blocks of bufsize bytes which are split 
+       into records in bulk rather than line by line. Use batches() 
+       to get the records in lists of a given size. With threads > 1,
+       compressed input is decompressed in parallel (see 
+       scilifelab.utils.compress)."""
     
-    def __init__(self,file,filter=None):
+    def __init__(self,file,filter=None,bufsize=BLOCK_SIZE,threads=1):
         self.fname = file
         self.filter = filter
-        fh = open(file,"rb")
-        if file.endswith(".gz"):
-            self._fh = gzip.GzipFile(fileobj=fh)
-        else:
-            self._fh = fh
+        self.bufsize = bufsize
+        self._fh = compress.open_input(file,threads)
         self._records_read = 0
-        self._next = self.setup_next()
+        self._bytes_read = 0
+        self._records = self._read_records()
         
     def __iter__(self):
-        return self
+        return self._records
     
     def next(self):
-        return self._next(self)
+        return self._records.next()
+
+    def _read_blocks(self):
+        """Generator that reads the input in blocks and yields lists of 
+        stripped lines holding a whole number of records
+        """
+        remainder = ""
+        while True:
+            block = self._fh.read(self.bufsize)
+            if not block:
+                break
+            self._bytes_read += len(block)
+            lines = (remainder + block).split("\n")
+            # The last element is an incomplete line (or empty if the block ended 
+            # with a newline), so only full records before it are emitted
+            n = 4*((len(lines)-1)//4)
+            remainder = "\n".join(lines[n:])
+            if n > 0:
+                del lines[n:]
+                yield map(str.strip,lines)
+        
+        # Emit a final record if the file did not end with a newline. An incomplete
+        # trailing record is silently dropped
+        lines = remainder.split("\n")
+        if len(lines) >= 4:
+            yield map(str.strip,lines[0:4])
 
-    def setup_next(self):
-        """Return the function to return the next record
+    def _read_records(self):
+        """Generator that yields one record at a time, skipping records
+        that do not pass the filter
         """
         if self.filter is None or len(self.filter.keys()) == 0:
-            def _next(self):
-                self._records_read += 1
-                return [self._fh.next().strip() for n in range(4)]
+            for lines in self._read_blocks():
+                for i in xrange(0,len(lines),4):
+                    self._records_read += 1
+                    yield lines[i:i+4]
         else:
-            def _next(self):
-                while True:
-                    record = [self._fh.next().strip() for n in range(4)]
+            filter = self.filter.items()
+            for lines in self._read_blocks():
+                for i in xrange(0,len(lines),4):
+                    record = lines[i:i+4]
                     header = parse_header(record[0])
                     skip = False
-                    for k, v in self.filter.items():
+                    for k, v in filter:
                         if k in header and header[k] not in v:
                             skip = True
                             break
                     if not skip:
                         self._records_read += 1
-                        return record 
-        return _next
+                        yield record
+
+    def batches(self, size=10000):
+        """Iterate over lists of at most size records
+        """
+        while True:
+            batch = list(itertools.islice(self,size))
+            if len(batch) == 0:
+                break
+            yield batch
     
     def name(self):
         return self.fname
     
     def rread(self):
         return self._records_read
+    
+    def bread(self):
+        """Return the number of (uncompressed) bytes read from the input
+        """
+        return self._bytes_read
 
-    def seek(self,offset,whence=None):
+    def seek(self,offset,whence=0):
         self._fh.seek(offset,whence)
+        self._records = self._read_records()
         
     def close(self):
         self._fh.close()
@@ -65,15 +120,14 @@ class FastQWriter:
     """Writes fastq records, where each record is a list with 4 elements
        corresponding to 1) Header, 2) Nucleotide sequence, 3) Optional header, 
        4) Qualities. If the supplied filename ends with .gz, the output file 
-       will be compressed with gzip"""
+       will be compressed with gzip. With threads > 1, the output is compressed
+       in blocks of block_size bytes in parallel and written as multi-member gzip.
+       By default, the compression level is 9 with one thread, as for gzip.GzipFile,
+       and compress.COMPRESS_LEVEL with more"""
        
-    def __init__(self,file):
+    def __init__(self,file,threads=1,compresslevel=None,block_size=compress.BLOCK_SIZE):
         self.fname = file
-        fh = open(file,"wb")
-        if file.endswith(".gz"):
-            self._fh = gzip.GzipFile(fileobj=fh)
-        else:    
-            self._fh = fh
+        self._fh = compress.open_output(file,threads,compresslevel,block_size)
         self._records_written = 0
         
     def name(self):
@@ -83,6 +137,14 @@ class FastQWriter:
         self._fh.write("{}\n".format("\n".join([r.strip() for r in record])))
         self._records_written += 1
     
+    def write_batch(self,records):
+        """Write a list of records with a single write to the output
+        """
+        if len(records) == 0:
+            return
+        self._fh.write("{}\n".format("\n".join(["\n".join([r.strip() for r in record]) for record in records])))
+        self._records_written += len(records)
+    
     def rwritten(self):
         return self._records_written
     
@@ -124,6 +186,181 @@ class BarcodeExtractor():
         return _next
 
 
+# Translation of nucleotides to base 4 digits for the integer barcode encoding
+_BARCODE_DIGITS = "".join([dict(zip("ACGT","0123")).get(chr(i),chr(i)) for i in xrange(256)])
+# Number of records per chunk and size limits of byte ranges handed to each worker by count_barcodes
+COUNT_CHUNK_RECORDS = 200000
+COUNT_RANGE_SIZE = 32*1024*1024
+COUNT_MIN_RANGE_SIZE = 1024*1024
+
+def encode_barcode(barcode):
+    """Encode a nucleotide barcode as an integer using 2 bits per base, with a 
+    leading 1 bit to keep the length. Barcodes containing other characters than 
+    A, C, G and T are returned unchanged
+    """
+    if barcode.translate(None,"ACGT"):
+        return barcode
+    return int("1{}".format(barcode.translate(_BARCODE_DIGITS)),4)
+
+def decode_barcode(code):
+    """Decode a barcode encoded by encode_barcode
+    """
+    if not isinstance(code,(int,long)):
+        return code
+    bases = []
+    while code > 1:
+        code, b = divmod(code,4)
+        bases.append("ACGT"[b])
+    return "".join(reversed(bases))
+
+def _extract_barcodes(lines, casava18, start, end):
+    """Extract the barcodes from a list of record lines the same way as BarcodeExtractor
+    """
+    if casava18:
+        return [h.strip().rsplit(":",1)[1] for h in lines[0::4]]
+    # BarcodeExtractor includes the newline if the barcode extends past the sequence
+    return [s[start:end] if len(s) >= end else "{}\n".format(s)[start:end] for s in lines[1::4]]
+
+def _count_encoded(lines_per_file, casava18, start, end):
+    barcodes = [_extract_barcodes(lines,casava18,start,end) for lines in lines_per_file]
+    if len(barcodes) > 1:
+        barcodes = [map(operator.add,*barcodes)]
+    return collections.Counter(itertools.imap(encode_barcode,barcodes[0]))
+
+def _count_chunk(args):
+    """Count the barcodes in a chunk of text with the same records from each input file
+    """
+    texts, casava18, start, end = args
+    return _count_encoded([t.split("\n") for t in texts],casava18,start,end)
+
+def _is_record_start(data, offset):
+    """Return True if a fastq record starts at offset in data
+    """
+    if not data.startswith("@",offset):
+        return False
+    i = data.find("\n",offset)
+    if i < 0:
+        return False
+    i = data.find("\n",i+1)
+    return i >= 0 and data.startswith("+",i+1)
+
+def _count_range(args):
+    """Count the barcodes in the records whose header starts in a byte range of 
+    an uncompressed fastq file
+    """
+    fname, begin, stop, casava18, start, end = args
+    with open(fname,"rb") as fh:
+        at_line_start = True
+        if begin > 0:
+            fh.seek(begin-1)
+            at_line_start = (fh.read(1) == "\n")
+        data = fh.read(stop - begin + 1024*1024)
+        
+        # Find the first record start, a line starting with @ and followed by a 
+        # sequence line and a line starting with +
+        offset = 0 if at_line_start else data.find("\n") + 1
+        if offset == 0 and not at_line_start:
+            return collections.Counter()
+        while not _is_record_start(data,offset):
+            offset = data.find("\n",offset) + 1
+            if offset == 0 or offset >= stop - begin:
+                return collections.Counter()
+        if offset >= stop - begin:
+            return collections.Counter()
+        
+        # Take the records with headers starting before the end of the range and 
+        # read any lines needed to complete the last record
+        started = data[offset:stop-begin].split("\n")
+        nrecords = (len(started) - 1 + (1 if started[-1] else 0) + 3)//4
+        lines = data[offset:].split("\n")
+        while len(lines) - 1 < 4*nrecords:
+            line = fh.readline()
+            if not line:
+                lines.append("")
+                break
+            lines[-1] += line.rstrip("\n")
+            lines.append("")
+    return _count_encoded([lines[0:4*nrecords]],casava18,start,end)
+
+def _record_chunks(fnames, records, bufsize=BLOCK_SIZE):
+    """Generate tuples with a chunk of text for each input file, holding the same 
+    number (at most records) of complete records. The input files can also be given as open handles
+    """
+    fhs = [compress.open_input(f) if isinstance(f,basestring) else f for f in fnames]
+    pending = [[] for f in fnames]
+    tails = ["" for f in fnames]
+    eof = [False for f in fnames]
+    while True:
+        for i, fh in enumerate(fhs):
+            while len(pending[i]) < 4*records and not eof[i]:
+                block = fh.read(bufsize)
+                if not block:
+                    eof[i] = True
+                    if tails[i]:
+                        pending[i].append(tails[i])
+                    break
+                lines = (tails[i] + block).split("\n")
+                tails[i] = lines.pop()
+                pending[i].extend(lines)
+        n = 4*(min([4*records] + [len(p) for p in pending])//4)
+        if n == 0:
+            break
+        yield tuple(["\n".join(p[0:n]) for p in pending])
+        for p in pending:
+            del p[0:n]
+    for fh in fhs:
+        fh.close()
+
+def _windowed_imap(pool, fn, tasks, window):
+    """Like pool.imap_unordered but keeps at most window tasks in flight, so 
+    that the task generator is not consumed ahead of the workers
+    """
+    pending = collections.deque()
+    for task in tasks:
+        if len(pending) >= window:
+            yield pending.popleft().get()
+        pending.append(pool.apply_async(fn,(task,)))
+    while pending:
+        yield pending.popleft().get()
+
+def count_barcodes(fqfile1, fqfile2=None, casava18=True, offset=101, length=6, processes=1):
+    """Count the barcodes extracted from a fastq file, or the concatenated barcodes
+    from a pair of fastq files, the same way as BarcodeExtractor. With more than 
+    one process, the input is split into shards that are counted in worker processes 
+    using an integer encoding of the barcodes, and the counts are merged at the end. 
+    Uncompressed single files are split into byte ranges that the workers read 
+    directly; other input is read in chunks of records that are sent to the workers.
+    Returns a Counter with the barcodes as keys
+    """
+    if processes <= 1:
+        bcx = BarcodeExtractor(fqfile1, casava18, offset, length)
+        if fqfile2 is None:
+            return collections.Counter(bcx)
+        bcx2 = BarcodeExtractor(fqfile2, casava18, offset, length)
+        return collections.Counter(itertools.imap(operator.add, bcx, bcx2))
+    
+    start, end = offset, offset+length
+    if fqfile2 is None and compress.get_codec(fqfile1) is None:
+        size = os.path.getsize(fqfile1)
+        chunk = max(COUNT_MIN_RANGE_SIZE,min(COUNT_RANGE_SIZE,size//(4*processes) + 1))
+        tasks = [(fqfile1,b,min(b+chunk,size),casava18,start,end) for b in xrange(0,size,chunk)]
+        fn = _count_range
+    else:
+        fnames = [fqfile1] if fqfile2 is None else [fqfile1, fqfile2]
+        tasks = ((texts,casava18,start,end) for texts in _record_chunks(fnames,COUNT_CHUNK_RECORDS))
+        fn = _count_chunk
+    
+    pool = multiprocessing.Pool(processes)
+    try:
+        counts = collections.Counter()
+        for c in _windowed_imap(pool,fn,tasks,2*processes):
+            counts.update(c)
+    finally:
+        pool.close()
+        pool.join()
+    return collections.Counter(dict([(decode_barcode(k),v) for k, v in counts.iteritems()]))
+
+
 def avgQ(record,offset=33):
     qual = record[3].strip()
     l = len(qual)
@@ -172,65 +409,309 @@ def is_read_pair(rec1, rec2, casava18=True):
     r2 = rec2[0].split(' ')
     return (len(r1) == 2 and len(r2) == 2 and r1[0] == r2[0] and r1[1][1:] == r2[1][1:])
 
-def demultiplex_fastq(outdir, samplesheet, fastq1, fastq2=None):
-    """Demultiplex a bcl-converted illumina fastq file. Assumes it has the index sequence
-    in the header a la CASAVA 1.8+
-    """
-    outfiles = {}
-    counts = {}
-    sdata = HiSeqRun.parse_samplesheet(samplesheet)
-    reads = [1]
-    if fastq2 is not None:
-        reads.append(2)
+# Default maximum number of simultaneously open output files in FastQWriterPool
+MAX_OPEN_FILES = 256
+# Default number of records buffered per output file in FastQWriterPool
+BUFFER_RECORDS = 10000
+
+class FastQWriterPool:
+    """Writes fastq records to a large number of output files. Records are
+       buffered per file and written in chunks of buffer_records records. At
+       most max_open files are kept open; when the limit is reached the least 
+       recently used file is closed and is later reopened for appending.
+       Records are written as given, without stripping whitespace."""
+    
+    def __init__(self,max_open=MAX_OPEN_FILES,buffer_records=BUFFER_RECORDS,threads=1):
+        self.max_open = max_open
+        self.buffer_records = buffer_records
+        self.threads = threads
+        self._buffers = {}
+        self._written = collections.Counter()
+        self._handles = collections.OrderedDict()
         
-    # For each Lane-Index combination, create a file and open a filehandle
-    for sd in sdata:
-        lane = sd['Lane']
-        index = sd['Index']
-        if lane not in outfiles:
-            outfiles[lane] = {}
-            counts[lane] = {}
-        outfiles[lane][index] = []
-        counts[lane][index] = 0
-        for read in reads:
-            fname = "tmp_{}_{}_L00{}_R{}_001.fastq.gz".format(sd['SampleID'],
-                                                              index,
-                                                              lane,
-                                                              read)
-            outfiles[lane][index].append(FastQWriter(os.path.join(outdir,fname)))
-    
-    # Parse the input file(s) and write the records to the appropriate output files
-    fhs = [FastQParser(fastq1)]
-    if fastq2 is not None:
-        fhs.append(FastQParser(fastq2))
+    def write(self,fname,record):
+        buf = self._buffers.get(fname)
+        if buf is None:
+            buf = self._buffers[fname] = []
+        buf.append("\n".join(record))
+        if len(buf) >= self.buffer_records:
+            self._flush(fname)
+    
+    def write_joined(self,fname,records):
+        """Buffer a list of records that are each already joined into a single string
+        """
+        buf = self._buffers.get(fname)
+        if buf is None:
+            buf = self._buffers[fname] = []
+        buf.extend(records)
+        if len(buf) >= self.buffer_records:
+            self._flush(fname)
+    
+    def _flush(self,fname):
+        buf = self._buffers[fname]
+        if len(buf) == 0:
+            return
+        self._handle(fname).write("{}\n".format("\n".join(buf)))
+        self._written[fname] += len(buf)
+        self._buffers[fname] = []
+    
+    def _handle(self,fname):
+        """Return an open handle to fname, closing the least recently used 
+        handle if needed
+        """
+        fh = self._handles.pop(fname,None)
+        if fh is None:
+            if len(self._handles) >= self.max_open:
+                _, lru = self._handles.popitem(last=False)
+                lru.close()
+            mode = "ab" if fname in self._written else "wb"
+            fh = compress.open_output(fname,self.threads,mode=mode)
+        self._handles[fname] = fh
+        return fh
+    
+    def rwritten(self,fname):
+        """Return the number of records written to fname, including buffered records
+        """
+        return self._written[fname] + len(self._buffers.get(fname,[]))
+    
+    def names(self):
+        """Return the names of the files that records have been written to
+        """
+        return [fname for fname in self._buffers.keys() if self.rwritten(fname) > 0]
+    
+    def close(self):
+        for fname in self._buffers.keys():
+            self._flush(fname)
+        for fh in self._handles.values():
+            fh.close()
+        self._handles.clear()
+
+class FastQDemultiplexer:
+    """Demultiplexes bcl-converted illumina fastq files in a single pass, 
+       based on the lane and index sequence in the CASAVA 1.8+ headers. The
+       first and second reads of a pair are processed in lockstep and the
+       records are classified by a lookup on (lane, index), allowing for the
+       given number of mismatches in the index. The number of records (or read 
+       pairs) per lane and index are available in counts."""
+    
+    def __init__(self,outdir,samplesheet,max_open=MAX_OPEN_FILES,buffer_records=BUFFER_RECORDS,threads=1,mismatches=0):
+        self.outdir = outdir
+        self.sdata = HiSeqRun.parse_samplesheet(samplesheet)
+        self.mismatches = mismatches
+        self.max_open = max_open
+        self.buffer_records = buffer_records
+        self.threads = threads
+        self.counts = {}
         
-    for r, fh in enumerate(fhs):
-        for record in fh:
-            header = parse_header(record[0])
-            lane = str(header['lane'])
-            index = header['index']
-            if lane in outfiles and index in outfiles[lane]:
-                outfiles[lane][index][r].write(record)
-                counts[lane][index] += 1
-    
-    # Close filehandles and replace the handles with the file names
-    for lane in outfiles.keys():
-        for index in outfiles[lane].keys():
-            for r, fh in enumerate(outfiles[lane][index]):
-                fh.close()
-                fname = fh.name()
-                # If no sequences were written, remove the temporary file and the entry from the results
-                if counts[lane][index] == 0:
+    def _outfile(self,sd,read):
+        return os.path.join(self.outdir,
+                            "tmp_{}_{}_L00{}_R{}_001.fastq.gz".format(sd['SampleID'],
+                                                                      sd['Index'],
+                                                                      sd['Lane'],
+                                                                      read))
+    
+    def run(self,fastq1,fastq2=None):
+        """Demultiplex the input and return a dictionary with the output file 
+        names for each read, by lane and index
+        """
+        parsers = [FastQParser(fastq1,threads=self.threads)]
+        if fastq2 is not None:
+            parsers.append(FastQParser(fastq2,threads=self.threads))
+        
+        # Map each lane and index combination to the output file for each read
+        # and create a barcode index for each lane
+        lookup = {}
+        barcodes = {}
+        self.counts = {}
+        for sd in self.sdata:
+            lane = sd['Lane']
+            index = sd['Index']
+            self.counts.setdefault(lane,{})[index] = 0
+            barcodes.setdefault(lane,{})[index] = index
+            lookup[(lane,index)] = [self._outfile(sd,r+1) for r in range(len(parsers))]
+        classify = dict([(lane,BarcodeIndex(bc,self.mismatches).classify) for lane, bc in barcodes.items()])
+        indexes = dict([((lane,normalize_barcode(index)),index) for lane, index in lookup.keys()])
+        
+        # Walk through the input and buffer the records in the output pool. 
+        # The temporary files are removed if the reads are not properly paired
+        counts = collections.Counter()
+        pool = FastQWriterPool(self.max_open,self.buffer_records,self.threads)
+        write = pool.write
+        try:
+            for records in itertools.izip_longest(*parsers):
+                if None in records:
+                    raise ValueError("{:s} and {:s} have different numbers of records".format(fastq1,fastq2))
+                fields = records[0][0].split(":")
+                lane = fields[3]
+                if lane not in classify:
+                    continue
+                key = (lane,indexes.get((lane,classify[lane](fields[-1]))))
+                fnames = lookup.get(key)
+                if fnames is None:
+                    continue
+                counts[key] += 1
+                for fname, record in zip(fnames,records):
+                    write(fname,record)
+        except:
+            pool.close()
+            for fname in itertools.chain(*lookup.values()):
+                if os.path.exists(fname):
                     os.unlink(fname)
-                    del outfiles[lane][index]
-                    break
-                
-                # Rename the temporary file to a persistent name
+            raise
+        finally:
+            for parser in parsers:
+                parser.close()
+        pool.close()
+        
+        # Rename the temporary files to persistent names. No files are created 
+        # for lane and index combinations without any records
+        outfiles = {}
+        for (lane, index), fnames in lookup.items():
+            outfiles.setdefault(lane,{})
+            self.counts[lane][index] = counts[(lane,index)]
+            if counts[(lane,index)] == 0:
+                continue
+            outfiles[lane][index] = []
+            for fname in fnames:
                 nname = fname.replace("tmp_","")
                 os.rename(fname,nname)
-                outfiles[lane][index][r] = nname
+                outfiles[lane][index].append(nname)
+        
+        return outfiles
+
+def demultiplex_fastq(outdir, samplesheet, fastq1, fastq2=None, max_open=MAX_OPEN_FILES, threads=1, mismatches=0):
+    """Demultiplex a bcl-converted illumina fastq file. Assumes it has the index sequence
+    in the header a la CASAVA 1.8+
+    """
+    return FastQDemultiplexer(outdir,samplesheet,max_open,threads=threads,mismatches=mismatches).run(fastq1,fastq2)
+
+
+# Number of read pairs per chunk handed to each worker by MolecularTagDemultiplexer
+MCTAG_CHUNK_RECORDS = 50000
+# Output names for reads matching more than one index and reads matching no index
+AMBIGUOUS = "Ambiguous"
+UNDETERMINED = "Undetermined"
+
+# The index of a MolecularTagDemultiplexer worker process
+_MCTAG_INDEX = None
+
+def _init_mctag_worker(indexes, mismatches):
+    global _MCTAG_INDEX
+    _MCTAG_INDEX = PrefixIndex(indexes,mismatches)
+
+def _mctag_worker(texts):
+    return _demultiplex_mctag_chunk(_MCTAG_INDEX,texts)
+
+def _demultiplex_mctag_chunk(index, texts):
+    """Classify a chunk of read 1, read 2 and index read text by the index at the 
+    start of the index read. Returns a dictionary with lists of the joined read 1 
+    and read 2 records by matching index, AMBIGUOUS or UNDETERMINED, and a Counter 
+    of matched, corrected, ambiguous and undetermined read pairs
+    """
+    lines1, lines2, lines_ind = [map(str.strip,t.split("\n")) for t in texts]
+    classify = index.classify
+    out = {}
+    counts = collections.Counter()
+    for i in xrange(0,len(lines_ind),4):
+        seq = lines_ind[i+1]
+        matches, mismatches = classify(seq)
+        if len(matches) == 1:
+            key = matches[0]
+            tag = "{}:{}:".format(key,seq[len(key):])
+            counts['match'] += 1
+            if mismatches > 0:
+                counts['corrected'] += 1
+        elif matches:
+            key = AMBIGUOUS
+            tag = "{}:{}:".format(",".join(matches),seq)
+            counts['ambiguous'] += 1
+        else:
+            key = UNDETERMINED
+            tag = ":{}:".format(seq)
+            counts['undetermined'] += 1
+        records = out.get(key)
+        if records is None:
+            records = out[key] = ([],[])
+        records[0].append("\n".join((lines1[i] + tag,lines1[i+1],lines1[i+2],lines1[i+3])))
+        records[1].append("\n".join((lines2[i] + tag,lines2[i+1],lines2[i+2],lines2[i+3])))
+    return out, counts
+
+class MolecularTagDemultiplexer:
+    """Demultiplexes HaloPlex read pairs by the index at the start of a separate
+       index read, where the rest of the index read is a molecular tag. Indexes
+       are matched with a PrefixIndex and the matching index and the molecular 
+       tag are appended to the headers of both reads as "index:tag:". Read pairs
+       matching more than one index or none are written to the Ambiguous and 
+       Undetermined outputs, with the whole index read as the tag. 
+       
+       The input is read in chunks of records that are classified in worker 
+       processes and written in input order through a FastQWriterPool. The number
+       of read pairs per outcome and per output are available in counts and 
+       samples."""
+    
+    def __init__(self,outdir,indexes,mismatches=1,max_open=MAX_OPEN_FILES,buffer_records=BUFFER_RECORDS,processes=1,chunk_records=MCTAG_CHUNK_RECORDS):
+        """indexes is a dictionary with sample names by index sequence, where 
+        indexes without a name are named by the sequence
+        """
+        self.outdir = outdir
+        # Ambiguous matches list equally long indexes in the given order
+        self.indexes = indexes.keys()
+        self.names = dict([(ix,name or ix) for ix, name in indexes.items()])
+        self.mismatches = mismatches
+        self.max_open = max_open
+        self.buffer_records = buffer_records
+        self.processes = processes
+        self.chunk_records = chunk_records
+        self.counts = collections.Counter()
+        self.samples = collections.Counter()
     
-    return outfiles
+    def _outfile(self,name,read):
+        return os.path.join(self.outdir,"{}_R{}.fastq".format(name,read))
+    
+    def run(self,read1,read2,index_read,progress=None):
+        """Demultiplex the input and return a dictionary with the output file names 
+        for each read by sample name. If given, progress is called after each chunk 
+        with the number of read pairs processed and the fraction of the input 
+        processed, estimated from the offset in the (compressed) read 1 file
+        """
+        fhs = [compress.open_input(f) for f in (read1,read2,index_read)]
+        size = os.path.getsize(read1)
+        tasks = _record_chunks(fhs,self.chunk_records)
+        indexes = self.indexes
+        pool = None
+        if self.processes > 1:
+            pool = multiprocessing.Pool(self.processes,_init_mctag_worker,(indexes,self.mismatches))
+            results = _windowed_imap(pool,_mctag_worker,tasks,2*self.processes)
+        else:
+            index = PrefixIndex(indexes,self.mismatches)
+            results = itertools.imap(lambda texts: _demultiplex_mctag_chunk(index,texts),tasks)
+        
+        self.counts = collections.Counter()
+        self.samples = collections.Counter()
+        writers = FastQWriterPool(self.max_open,self.buffer_records)
+        outfiles = {}
+        try:
+            for out, counts in results:
+                for key, records in out.iteritems():
+                    name = self.names.get(key,key)
+                    if name not in outfiles:
+                        outfiles[name] = [self._outfile(name,r) for r in (1,2)]
+                    for fname, recs in zip(outfiles[name],records):
+                        writers.write_joined(fname,recs)
+                    self.samples[name] += len(records[0])
+                self.counts.update(counts)
+                self.counts['processed'] += sum(counts.values()) - counts['corrected']
+                if progress is not None:
+                    offset = compress.input_offset(fhs[0])
+                    progress(self.counts['processed'],None if offset is None or size == 0 else min(1.0,float(offset)/size))
+        finally:
+            if pool is not None:
+                pool.close()
+                pool.join()
+            writers.close()
+            for fh in fhs:
+                fh.close()
+        return outfiles
 
   
 def create_final_name(fname, date, fc_id, sample_name):
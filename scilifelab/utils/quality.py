@@ -0,0 +1,110 @@
+"""Vectorised quality statistics over batches of fastq records"""
+import itertools
+import numpy as np
+
+class QualityBatch(object):
+    """A batch of quality strings held as a single uint8 buffer of quality
+    scores together with the start offset and length of each string. The
+    statistics are computed for all strings at once with numpy.
+
+    :param qualities: a list of quality strings
+    :param offset: the Phred quality score offset
+    """
+
+    def __init__(self, qualities, offset=33):
+        self.offset = offset
+        self.lengths = np.fromiter(itertools.imap(len,qualities), dtype=np.int64, count=len(qualities))
+        self.starts = np.zeros(len(qualities), dtype=np.int64)
+        np.cumsum(self.lengths[0:-1], out=self.starts[1:])
+        self.buffer = np.frombuffer("".join(qualities), dtype=np.uint8)
+
+    @classmethod
+    def from_records(cls, records, offset=33):
+        """Create a batch from the qualities of a list of fastq records
+        """
+        return cls([r[3] for r in records], offset)
+
+    def __len__(self):
+        return len(self.lengths)
+
+    def _sums(self, values):
+        """Sum values over the positions of each quality string
+        """
+        cs = np.zeros(len(values) + 1, dtype=np.int64)
+        np.cumsum(values, out=cs[1:])
+        return cs[self.starts + self.lengths] - cs[self.starts]
+
+    def mean(self):
+        """Return an array with the mean quality of each string
+        """
+        with np.errstate(divide='ignore', invalid='ignore'):
+            return (self._sums(self.buffer) - self.lengths*self.offset).astype(np.float64)/self.lengths
+
+    def fraction_above(self, quality=30):
+        """Return an array with the fraction of positions with a quality of at
+        least the given value in each string
+        """
+        with np.errstate(divide='ignore', invalid='ignore'):
+            return self._sums(self.buffer >= quality + self.offset).astype(np.float64)/self.lengths
+
+    def cycles(self):
+        """Return an array with the cycle (position in the read) of each quality score
+        """
+        return np.arange(len(self.buffer), dtype=np.int64) - np.repeat(self.starts, self.lengths)
+
+    def cycle_histogram(self, max_quality=50):
+        """Return a 2-dimensional array with the number of quality scores of each
+        value (columns, 0 to max_quality) in each cycle (rows). Scores above
+        max_quality are counted as max_quality
+        """
+        ncycles = int(self.lengths.max()) if len(self) > 0 else 0
+        scores = np.clip(self.buffer.astype(np.int64) - self.offset, 0, max_quality)
+        counts = np.bincount(self.cycles()*(max_quality + 1) + scores, minlength=ncycles*(max_quality + 1))
+        return counts.reshape((ncycles, max_quality + 1))
+
+    def _tenths(self, numerators):
+        """Return an array with numerators/lengths for each string rounded half
+        away from zero to an integer number of tenths, as round(x, 1) rounds the
+        quotients. Exact halves are rounded with round, since round sees the
+        nearest float, which may lie on either side of the half
+        """
+        lengths = np.maximum(self.lengths, 1)
+        scaled = 20*np.abs(numerators)
+        tenths = np.sign(numerators)*((scaled + lengths)//(2*lengths))
+        halves = np.flatnonzero((scaled % lengths == 0) & ((scaled//lengths) % 2 == 1))
+        for i in halves:
+            tenths[i] = int(round(10*round(float(numerators[i])/lengths[i], 1)))
+        return tenths
+
+    def _decimal(self, numerators):
+        """Return a list with numerators/lengths rounded to one decimal, and NaN
+        for empty strings
+        """
+        values = self._tenths(numerators)/10.
+        values[self.lengths == 0] = np.nan
+        return values.tolist()
+
+    def avgQ(self):
+        """Return a list with the mean quality of each string rounded as by
+        fastq_utils.avgQ
+        """
+        return self._decimal(self._sums(self.buffer) - self.lengths*self.offset)
+
+    def gtQ30(self):
+        """Return a list with the percentage of positions with quality of at least
+        30 in each string, rounded as by fastq_utils.gtQ30
+        """
+        return self._decimal(100*self._sums(self.buffer >= 30 + self.offset))
+
+    def bins(self, thresholds):
+        """Return an array with, for each string, the index of the highest threshold
+        that its rounded mean quality (as by int(round(avgQ))) reaches, or -1 if
+        below all thresholds. The thresholds must be sorted in increasing order
+        """
+        return np.searchsorted(np.asarray(thresholds), self.rounded_mean(), side='right') - 1
+
+    def rounded_mean(self):
+        """Return an array with the mean qualities rounded to integers as by int(round(avgQ))
+        """
+        tenths = self._tenths(self._sums(self.buffer) - self.lengths*self.offset)
+        return np.sign(tenths)*((np.abs(tenths) + 5)//10)
@@ -21,6 +21,41 @@ def get_slurm_jobid(jobname,user=getpass.getuser()):
         pass
     return jobids
 
+# The drmaa job states corresponding to the job states reported by squeue
+SQUEUE_STATES = {'PENDING': 'queued_active',
+                 'CONFIGURING': 'queued_active',
+                 'RUNNING': 'running',
+                 'COMPLETING': 'running',
+                 'SUSPENDED': 'user_suspended',
+                 'COMPLETED': 'done',
+                 'CANCELLED': 'failed',
+                 'FAILED': 'failed',
+                 'TIMEOUT': 'failed',
+                 'NODE_FAIL': 'failed',
+                 'PREEMPTED': 'failed'}
+
+def get_slurm_jobs(user=getpass.getuser()):
+    """Get the job ids and states of all jobs of a user with a single squeue call. Returns
+    a dictionary with lists of (jobid, state) tuples by job name, where the states are 
+    the drmaa job states that get_slurm_jobstatus returns
+    """
+    jobs = {}
+    cmd = ['/usr/bin/squeue','-h','-o','%i %T %j','-u',user]
+    try:
+        retval = str(subprocess.check_output(cmd))
+    except:
+        return jobs
+    for line in retval.split("\n"):
+        fields = line.strip().split(" ",2)
+        if len(fields) < 3:
+            continue
+        try:
+            jobid = int(fields[0])
+        except ValueError:
+            continue
+        jobs.setdefault(fields[2],[]).append((jobid,SQUEUE_STATES.get(fields[1],'undetermined')))
+    return jobs
+
 def get_slurm_jobstatus(jobid):
     """Get the status for a jobid
     """
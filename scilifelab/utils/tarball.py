@@ -0,0 +1,232 @@
+"""Write compressed tarballs in one pass, computing their checksums as
+they are written and indexing their members.
+
+The tar stream is cut in blocks that are compressed independently in
+worker threads, as pigz and pbzip2 do, and written as concatenated gzip
+members or bzip2 streams that gzip, bzip2 and tar read as usual. The
+index records the compressed and uncompressed offsets of the blocks and
+the data offset and size of the members, so that a member can be read
+by decompressing only the blocks that hold its data.
+"""
+import os
+import bz2
+import zlib
+import json
+import bisect
+import fnmatch
+import hashlib
+import tarfile
+import collections
+from multiprocessing.pool import ThreadPool
+
+import scilifelab.log
+
+LOG = scilifelab.log.minimal_logger(__name__)
+
+## Uncompressed size of the blocks of the tar stream
+BLOCK_SIZE = 32 * 1024 * 1024
+
+## Compression by tarball suffix
+COMPRESSION = {".gz":"gz", ".bz2":"bz2"}
+
+## A member of the index: name, size and offset of the data in the
+## uncompressed tar stream
+IndexMember = collections.namedtuple("IndexMember", ["name", "size", "offset_data"])
+
+def _compress_block(job):
+    compression, level, data = job
+    if compression == "gz":
+        c = zlib.compressobj(level, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+        return c.compress(data) + c.flush()
+    return bz2.compress(data, level)
+
+class BlockCompressor(object):
+    """File-like object that compresses what is written to it in
+    independent blocks, in worker threads, and writes the blocks in
+    order to fileobj while computing the checksums of the compressed
+    data.
+
+    :param fileobj: output file object
+    :param compression: gz or bz2
+    :param threads: number of compression threads
+    :param checksums: hashlib algorithms of the checksums to compute
+    :param block_size: uncompressed block size
+    :param level: compression level
+    """
+    def __init__(self, fileobj, compression="gz", threads=1, checksums=("md5",), block_size=BLOCK_SIZE, level=None):
+        self.fileobj = fileobj
+        self.compression = compression
+        self.level = level or (6 if compression == "gz" else 9)
+        self.block_size = block_size
+        self.hashes = collections.OrderedDict((x, hashlib.new(x)) for x in checksums)
+        ## (compressed offset, uncompressed offset) of each block
+        self.blocks = []
+        self._buf = []
+        self._buflen = 0
+        self._offset = 0
+        self._compressed = 0
+        self._written = 0
+        self._threads = max(threads or 1, 1)
+        self._pool = ThreadPool(self._threads) if self._threads > 1 else None
+        self._pending = collections.deque()
+
+    def tell(self):
+        """Uncompressed bytes written"""
+        return self._offset + self._buflen
+
+    def write(self, data):
+        self._buf.append(data)
+        self._buflen += len(data)
+        if self._buflen >= self.block_size:
+            data = "".join(self._buf)
+            self._buf, self._buflen = [], 0
+            for i in xrange(0, len(data) - self.block_size + 1, self.block_size):
+                self._submit(data[i:i + self.block_size])
+            rest = data[len(data) - len(data) % self.block_size:]
+            if rest:
+                self._buf, self._buflen = [rest], len(rest)
+
+    def _submit(self, data):
+        self.blocks.append((None, self._offset))
+        self._offset += len(data)
+        job = (self.compression, self.level, data)
+        if self._pool is None:
+            self._write_block(_compress_block(job))
+            return
+        self._pending.append(self._pool.apply_async(_compress_block, (job,)))
+        # Keep a bounded number of blocks in memory
+        while len(self._pending) > 2 * self._threads:
+            self._write_block(self._pending.popleft().get())
+
+    def _write_block(self, data):
+        self.blocks[self._written] = (self._compressed, self.blocks[self._written][1])
+        self._written += 1
+        self._compressed += len(data)
+        for h in self.hashes.values():
+            h.update(data)
+        self.fileobj.write(data)
+
+    def flush(self):
+        pass
+
+    def close(self):
+        """Compress the remaining data and wait for the pending blocks"""
+        if self._buflen or not self.blocks:
+            data = "".join(self._buf)
+            self._buf, self._buflen = [], 0
+            self._submit(data)
+        while self._pending:
+            self._write_block(self._pending.popleft().get())
+        if self._pool:
+            self._pool.close()
+            self._pool.join()
+
+    def hexdigests(self):
+        """Checksums of the compressed data by algorithm"""
+        return collections.OrderedDict((k, h.hexdigest()) for k, h in self.hashes.items())
+
+def _excluded(name, patterns):
+    """Check if a member name matches an exclude pattern, as tar
+    --exclude-from matches names or any of their trailing components"""
+    parts = name.split("/")
+    candidates = ["/".join(parts[i:]) for i in xrange(len(parts))]
+    return any(fnmatch.fnmatch(c, p) for p in patterns for c in candidates)
+
+def read_excludes(excludes):
+    """Read the patterns of a tar exclude file"""
+    with open(excludes) as fh:
+        return [x.rstrip("\n") for x in fh if x.strip()]
+
+def index_file(tarball):
+    return "{}.idx".format(tarball)
+
+def write_tarball(tarball, root, name, threads=1, checksums=("md5",), excludes=None, block_size=BLOCK_SIZE):
+    """Write a compressed tarball of root/name with members named as
+    tar -C root name would, and write its index. The compression is
+    given by the suffix of tarball.
+
+    :param tarball: output tarball, ending with .gz or .bz2
+    :param root: directory containing name
+    :param name: directory to archive
+    :param threads: number of compression threads
+    :param checksums: hashlib algorithms of the checksums to compute
+    :param excludes: list of exclude patterns
+    :param block_size: uncompressed block size
+
+    :returns: dictionary of checksums of the tarball by algorithm
+    """
+    compression = COMPRESSION[os.path.splitext(tarball)[1]]
+    excludes = excludes or []
+    members = []
+    tmp = "{}.{}.tmp".format(tarball, os.getpid())
+    try:
+        with open(tmp, "wb") as fh:
+            out = BlockCompressor(fh, compression, threads, checksums, block_size)
+            tar = tarfile.open(fileobj=out, mode="w", format=tarfile.GNU_FORMAT)
+            for dirpath, dirs, files in os.walk(os.path.join(root, name)):
+                dirs.sort()
+                relpath = os.path.relpath(dirpath, root)
+                dirs[:] = [d for d in dirs if not _excluded(os.path.join(relpath, d), excludes)]
+                if relpath == name and _excluded(name, excludes):
+                    dirs[:] = []
+                    continue
+                for f in [None] + sorted(files):
+                    arcname = relpath if f is None else os.path.join(relpath, f)
+                    if f is not None and _excluded(arcname, excludes):
+                        continue
+                    tarinfo = tar.gettarinfo(os.path.join(root, arcname), arcname)
+                    if tarinfo.isreg():
+                        with open(os.path.join(root, arcname), "rb") as src:
+                            tar.addfile(tarinfo, src)
+                    else:
+                        tar.addfile(tarinfo)
+                    members.append(IndexMember(arcname, tarinfo.size, tar.offset - tarfile.BLOCKSIZE * ((tarinfo.size + tarfile.BLOCKSIZE - 1) // tarfile.BLOCKSIZE)))
+            tar.close()
+            out.close()
+        os.rename(tmp, tarball)
+    except:
+        if os.path.exists(tmp):
+            os.unlink(tmp)
+        raise
+    with open(index_file(tarball), "w") as fh:
+        json.dump({"compression":compression, "blocks":out.blocks, "members":members}, fh)
+    return out.hexdigests()
+
+def read_index(tarball):
+    """Read the index of a tarball
+
+    :returns: tuple of compression, list of blocks and dictionary of IndexMember by name
+    """
+    with open(index_file(tarball)) as fh:
+        index = json.load(fh)
+    return index["compression"], index["blocks"], {x[0]:IndexMember(*x) for x in index["members"]}
+
+def _decompress_block(compression, data):
+    if compression == "gz":
+        return zlib.decompressobj(16 + zlib.MAX_WBITS).decompress(data)
+    return bz2.decompress(data)
+
+def extract_member(tarball, name):
+    """Read the data of a member of a tarball, decompressing only the
+    blocks that hold it
+
+    :param tarball: tarball written by write_tarball
+    :param name: member name
+
+    :returns: member data
+    """
+    compression, blocks, members = read_index(tarball)
+    member = members[name]
+    i = bisect.bisect_right([x[1] for x in blocks], member.offset_data) - 1
+    start = member.offset_data - blocks[i][1]
+    data = []
+    size = 0
+    with open(tarball, "rb") as fh:
+        fh.seek(blocks[i][0])
+        while size < start + member.size and i < len(blocks):
+            end = blocks[i + 1][0] if i + 1 < len(blocks) else None
+            x = _decompress_block(compression, fh.read(end - blocks[i][0]) if end is not None else fh.read())
+            data.append(x)
+            size += len(x)
+            i += 1
+    return "".join(data)[start:start + member.size]
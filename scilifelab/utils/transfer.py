@@ -0,0 +1,141 @@
+"""Copy files while computing their checksums in the same pass"""
+import os
+import time
+import shutil
+import hashlib
+import threading
+import collections
+from multiprocessing.pool import ThreadPool
+
+import scilifelab.log
+from scilifelab.utils.checksum import hash_file
+
+LOG = scilifelab.log.minimal_logger(__name__)
+
+## Buffer size for copying, a multiple of the page size
+BUFFER_SIZE = 4 * 1024 * 1024
+
+## Result of a transfer. md5 is the checksum of the source as it was
+## read, verified_md5 the checksum of the destination when re-read and
+## error the reason a transfer failed
+TransferResult = collections.namedtuple("TransferResult", ["src", "tgt", "md5", "size", "verified_md5", "error"])
+
+class BandwidthLimiter(object):
+    """Limit the combined throughput of several threads to a number of
+    bytes per second"""
+    def __init__(self, rate):
+        self.rate = float(rate)
+        self._lock = threading.Lock()
+        self._next = time.time()
+
+    def consume(self, nbytes):
+        """Wait until nbytes can be transferred within the rate"""
+        with self._lock:
+            now = time.time()
+            start = max(now, self._next)
+            self._next = start + nbytes / self.rate
+        if start > now:
+            time.sleep(start - now)
+
+def _same_file(src, tgt):
+    """Check if tgt has the size and modification time of src, as rsync
+    does before deciding to skip a file"""
+    if not os.path.exists(tgt):
+        return False
+    s, t = os.stat(src), os.stat(tgt)
+    return s.st_size == t.st_size and int(s.st_mtime) == int(t.st_mtime)
+
+def copy_and_hash(src, tgt, verify=False, limiter=None, bufsize=BUFFER_SIZE, cache=None):
+    """Copy src to tgt and compute the md5sum of the data as it is
+    copied, so that the source is read only once. The data is written
+    to a temporary file next to tgt which is renamed when complete, and
+    the modification time of src is kept. A tgt with the size and
+    modification time of src is not copied again, and its checksum is
+    taken from cache if src is unchanged since it was last computed.
+
+    :param src: source file
+    :param tgt: target file
+    :param verify: re-read tgt and compute its md5sum
+    :param limiter: BandwidthLimiter shared between transfers
+    :param bufsize: buffer size
+    :param cache: ChecksumCache for the md5sums of the source and, if verified, the target
+
+    :returns: TransferResult
+    """
+    buf = bytearray(bufsize)
+    st = os.stat(src)
+    size = st.st_size
+    if _same_file(src, tgt):
+        md5 = cache.get(src) if cache else None
+        if md5 is None:
+            LOG.debug("{} is up to date; computing md5sum of {}".format(tgt, src))
+            md5 = hash_file(src, buf, limiter)
+    else:
+        md5 = hashlib.md5()
+        view = memoryview(buf)
+        tmp = os.path.join(os.path.dirname(tgt), ".{}.{}.tmp".format(os.path.basename(tgt), os.getpid()))
+        try:
+            with open(src, "rb", 0) as fh, open(tmp, "wb", 0) as out:
+                while True:
+                    n = fh.readinto(buf)
+                    if not n:
+                        break
+                    if limiter:
+                        limiter.consume(n)
+                    md5.update(view[0:n])
+                    out.write(view[0:n])
+            shutil.copystat(src, tmp)
+            os.rename(tmp, tgt)
+        except:
+            if os.path.exists(tmp):
+                os.unlink(tmp)
+            raise
+        md5 = md5.hexdigest()
+    if cache:
+        cache.set(src, md5, st)
+    verified_md5 = None
+    if verify:
+        tst = os.stat(tgt)
+        verified_md5 = hash_file(tgt, buf, limiter)
+        if cache:
+            cache.set(tgt, verified_md5, tst)
+    return TransferResult(src, tgt, md5, size, verified_md5, None)
+
+def _transfer(job):
+    src, tgt, verify, limiter, bufsize, cache = job
+    try:
+        return copy_and_hash(src, tgt, verify, limiter, bufsize, cache)
+    except (IOError, OSError) as e:
+        LOG.warn("Failed to transfer {} to {}: {}".format(src, tgt, e))
+        return TransferResult(src, tgt, None, None, None, str(e))
+
+def transfer_files(sources, targets, verify=False, workers=1, bwlimit=None, bufsize=BUFFER_SIZE, cache=None):
+    """Copy and checksum files with copy_and_hash, several files at a
+    time. Failed transfers are reported in the error field of the
+    results rather than raised.
+
+    :param sources: source files
+    :param targets: target files
+    :param verify: re-read the targets and compute their md5sums
+    :param workers: number of files to transfer concurrently
+    :param bwlimit: limit the combined throughput to this number of bytes per second
+    :param bufsize: buffer size per transfer
+    :param cache: ChecksumCache, saved when the transfers are done
+
+    :returns: list of TransferResult, in the order of sources
+    """
+    limiter = BandwidthLimiter(bwlimit) if bwlimit else None
+    jobs = [(src, tgt, verify, limiter, bufsize, cache) for src, tgt in zip(sources, targets)]
+    workers = min(workers or 1, len(jobs))
+    try:
+        if workers <= 1:
+            return [_transfer(job) for job in jobs]
+        pool = ThreadPool(workers)
+        try:
+            return pool.map(_transfer, jobs, chunksize=1)
+        finally:
+            pool.close()
+            pool.join()
+    finally:
+        if cache:
+            cache.save()
@@ -1,26 +1,18 @@
 import argparse
 import sys
 import csv
-from scilifelab.utils.fastq_utils import BarcodeExtractor
-from scilifelab.utils.string import hamming_distance
+from scilifelab.utils.fastq_utils import count_barcodes
 from scilifelab.illumina.hiseq import HiSeqRun
 from scilifelab.illumina import map_index_name
-from collections import Counter
-from itertools import imap
+from scilifelab.illumina.barcodes import BarcodeIndex
+import time
  
-def extract_barcodes(fqfile1, lane, fqfile2=None, nindex=25, casava18=True, offset=101, bclen=6, expected=[], mismatch=True):
-    """Parse the fastq file and extract barcodes. Return a dict structure suitable for upload to StatusDB
+def extract_barcodes(fqfile1, lane, fqfile2=None, nindex=25, casava18=True, offset=101, bclen=6, expected=[], mismatch=True, processes=1):
+    """Parse the fastq file and extract barcodes. Return a dict structure suitable for upload to StatusDB.
+    With processes > 1, the barcodes are counted in parallel worker processes
     """
     
-    bcx = BarcodeExtractor(fqfile1, casava18, offset, bclen)
-    c = {}
-
-    if fqfile2 is None:
-        c = Counter(bcx)
-    else:
-        bcx2 = BarcodeExtractor(fqfile2, casava18, offset, bclen)
-        c = Counter(imap(lambda x, y: x+y, bcx, bcx2))
-
+    c = count_barcodes(fqfile1, fqfile2, casava18, offset, bclen, processes)
     c = remove_expected(c,expected,mismatch)
     counts = []
     header = ['lane', 'sequence', 'count', 'index_name']
@@ -39,37 +31,15 @@ def write_metrics(header, counts):
         csvw.writeheader()
         csvw.writerows(counts)
           
-def generate_mismatches(src):
-    """
-    Generate a list of all possible nucleotide sequences with one 
-    mismatch from the supplied sequence.
-    """
-    seqs = []
-    # Mutate each position
-    src_list = list(src)
-    for i in xrange(len(src_list)):
-        # Change to all possible nucleotides
-        for n in "ACGTN":
-            src_list[i] = n
-            seqs.append("".join(src_list))
-        # Reset the mutated nucleotide
-        src_list[i] = src[i]
-        
-    return list(set(seqs))
-
 def remove_expected(bc_counter, expected_bc, mismatch=False):
     """
     Remove the entries corresponding to the supplied list of expected barcodes, 
     optionally allowing for one mismatch 
     """
-    for bc in expected_bc:
-        if mismatch:
-            bcs = generate_mismatches(bc)
-        else:
-            bcs = [bc]
-            
-        for b in bcs:
-            del bc_counter[b]
+    index = BarcodeIndex(dict(zip(expected_bc,expected_bc)),int(mismatch))
+    for bc in bc_counter.keys():
+        if bc in index:
+            del bc_counter[bc]
             
     return bc_counter
     
@@ -96,6 +66,8 @@ def main():
     parser.add_argument('--csv-file', dest='csvfile', action='store', default=None, 
                         help="The csv samplesheet for the run. If supplied, will be used together with lane " \
                         "to exclude expected barcodes")
+    parser.add_argument('-p','--processes', dest='processes', action='store', type=int, default=1, 
+                        help="The number of processes to count barcodes with. Default is 1")
     parser.add_argument('infile1', action='store',
                         help="The input FastQ file to process. Can be gzip compressed")
     parser.add_argument('infile2', action='store', default=None, nargs='?',
@@ -108,7 +80,9 @@ def main():
     if args.csvfile is not None:
         expected = get_expected(args.csvfile,args.lane)
     
-    header, counts = extract_barcodes(args.infile1, args.lane, args.infile2, int(args.nindex), args.casava18, int(args.offset), int(args.barcode_length), expected, args.mismatch)
+    t0 = time.time()
+    header, counts = extract_barcodes(args.infile1, args.lane, args.infile2, int(args.nindex), args.casava18, int(args.offset), int(args.barcode_length), expected, args.mismatch, args.processes)
+    sys.stderr.write("Counted barcodes in {:.1f} s using {} process(es)\n".format(time.time() - t0, args.processes))
     write_metrics(header, counts)
     
 if __name__ == "__main__":
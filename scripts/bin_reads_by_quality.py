@@ -1,17 +1,21 @@
 import os
 import sys
+import itertools
+import numpy as np
 import scilifelab.utils.fastq_utils as fastq_utils
+from scilifelab.utils.quality import QualityBatch
 import argparse
 
 def main():
     
     parser = argparse.ArgumentParser(description="Filter reads from a pair of FastQ files based on the average quality."\
-                                     "If the average quality of one of the reads in the pair is below the given threshold, "\
-                                     "the pair is discarded. Output is a file named as INPUT.Q[T].[EXT], where T is the threshold "\
-                                     "and EXT is the file extension. Accepts uncompressed or gzip-compressed input files")
+                                     "If the average quality of one of the reads in the pair is below a given threshold, "\
+                                     "the pair is discarded for that threshold. Output is a file named as INPUT.Q[T].[EXT] for each "\
+                                     "threshold T, where EXT is the file extension. Accepts uncompressed or gzip-compressed input files")
 
-    parser.add_argument('-T','--threshold', action='store', default=20, 
-                        help="if any read in the pair has an average quality below this threshold, the pair is discarded. Default is 20.")
+    parser.add_argument('-T','--threshold', action='append', type=int, default=None, 
+                        help="if any read in the pair has an average quality below this threshold, the pair is discarded "\
+                        "for this threshold. Can be given several times to bin the reads on several thresholds in one pass. Default is 20.")
     parser.add_argument('-p','--phred', action='store', default=33, 
                         help="the Phred quality score offset. Default is 33 (Sanger)")
     parser.add_argument('--1.7', dest='casava17', action='store_true', default=False, 
@@ -22,7 +26,7 @@ def main():
                         help="the second sequence file of the pair")
     
     args = parser.parse_args()
-    process_fastq(args.fastq1, args.fastq2, [int(args.threshold)], int(args.phred), args.casava17)
+    process_fastq(args.fastq1, args.fastq2, args.threshold or [20], int(args.phred), args.casava17)
 
 def print_average_quals(qualities):
     
@@ -34,8 +38,9 @@ def print_average_quals(qualities):
         avg_quality.insert(0,bin)
         print ",".join([str(i) for i in avg_quality])
         
-def process_fastq(fastq_r1, fastq_r2, bins, phred_offset, casava17):
+def process_fastq(fastq_r1, fastq_r2, bins, phred_offset, casava17, batch_size=100000):
     
+    bins = sorted(set(bins))
     fh_r1 = fastq_utils.FastQParser(fastq_r1)
     fh_r2 = fastq_utils.FastQParser(fastq_r2)
     oh1 = {}
@@ -46,16 +51,22 @@ def process_fastq(fastq_r1, fastq_r2, bins, phred_offset, casava17):
         oh1[b] = fastq_utils.FastQWriter("%s.Q%d%s" % (root1,b,ext1))
         oh2[b] = fastq_utils.FastQWriter("%s.Q%d%s" % (root2,b,ext2))
     
-    for r1 in fh_r1:
-        r2 = fh_r2.next()
-        assert fastq_utils.is_read_pair(r1,r2,not casava17), "FATAL: Read identifiers differ for paired reads ({:s} and {:s})".format(r1[0],r2[0])
+    # Process the reads in batches, binning all pairs in a batch at once on the 
+    # lowest average quality of the two reads. A pair is written to the output
+    # of each threshold up to the highest one it reaches
+    for batch1 in fh_r1.batches(batch_size):
+        batch2 = [r2 for r2 in itertools.islice(fh_r2,len(batch1))]
+        assert len(batch1) == len(batch2), "FATAL: {:s} has fewer reads than {:s}".format(fastq_r2,fastq_r1)
+        for r1, r2 in zip(batch1,batch2):
+            assert fastq_utils.is_read_pair(r1,r2,not casava17), "FATAL: Read identifiers differ for paired reads ({:s} and {:s})".format(r1[0],r2[0])
 
-        bin = min(int(round(fastq_utils.avgQ(r1,phred_offset))),int(round(fastq_utils.avgQ(r2,phred_offset))))
+        bin = np.minimum(QualityBatch.from_records(batch1,phred_offset).bins(bins),
+                         QualityBatch.from_records(batch2,phred_offset).bins(bins))
         
-        for b in bins:
-            if bin >= b:
-                oh1[b].write(r1)
-                oh2[b].write(r2)
+        for level, b in enumerate(bins):
+            passed = np.flatnonzero(bin >= level)
+            oh1[b].write_batch([batch1[i] for i in passed])
+            oh2[b].write_batch([batch2[i] for i in passed])
         
     for oh in oh1.values() + oh2.values():
         oh.close()
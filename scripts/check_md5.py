@@ -0,0 +1,65 @@
+#!/usr/bin/env python
+"""Verify the md5 files of the Unaligned* folders of a flowcell
+directory and report fastq files without an md5 file, as check_md5.sh
+does. Results are written to <flowcell>.md5_check in the current
+directory, one line per file as written by md5sum -c.
+"""
+import os
+import glob
+import argparse
+
+from scilifelab.log import minimal_logger
+from scilifelab.utils.checksum import ChecksumCache, verify_md5_files
+
+LOG = minimal_logger("check_md5")
+
+def find_files(fcdir):
+    """Find the md5 files and the fastq files of the Unaligned* folders
+    in fcdir"""
+    md5files, fastq_files = [], []
+    for d in sorted(glob.glob(os.path.join(fcdir, "Unaligned*"))):
+        for root, dirs, files in os.walk(d):
+            md5files.extend([os.path.join(root, f) for f in files if f.endswith(".md5")])
+            fastq_files.extend([os.path.join(root, f) for f in files if f.endswith(".fastq.gz")])
+    return md5files, fastq_files
+
+def check_md5(fcdir, workers=1, cachedir=None):
+    """Verify the md5 files of fcdir.
+
+    :param fcdir: flowcell directory
+    :param workers: number of files to hash concurrently
+    :param cachedir: md5sum cache directory
+
+    :returns: tuple of report lines and the number of failures
+    """
+    md5files, fastq_files = find_files(fcdir)
+    checks = verify_md5_files(md5files, workers=workers, cache=ChecksumCache(cachedir) if cachedir else None)
+    lines, failed = [], 0
+    for md5file, res in checks.items():
+        for check in res:
+            ok = check.observed == check.expected
+            failed += 0 if ok else 1
+            lines.append("{}: {}".format(check.fname, "OK" if ok else "FAILED"))
+    for f in fastq_files:
+        if not os.path.exists("{}.md5".format(f)):
+            failed += 1
+            lines.append("FAIL: Missing .md5 file for {}".format(os.path.relpath(f, fcdir)))
+    return lines, failed
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("fcdir", help="flowcell directory")
+    parser.add_argument("-w", "--workers", type=int, default=1, help="number of files to hash concurrently. Default is 1")
+    parser.add_argument("--cachedir", default=None, help="directory for caching the md5sums of unchanged files between runs")
+    args = parser.parse_args()
+
+    log = "{}.md5_check".format(os.path.basename(os.path.normpath(args.fcdir)))
+    LOG.info("Writing results to {}".format(log))
+    lines, failed = check_md5(args.fcdir, args.workers, args.cachedir)
+    with open(log, "w") as fh:
+        fh.write("".join(["{}\n".format(x) for x in lines]))
+    if failed:
+        LOG.warn("{} of {} checks failed".format(failed, len(lines)))
+
+if __name__ == "__main__":
+    main()
@@ -9,6 +9,7 @@ import os
 import ConfigParser
 
 from scilifelab.log import minimal_logger
+from scilifelab.db.replication import Checkpoints, replicate, BATCH_SIZE
 from couchdb import PreconditionFailed
 
 #Set up logging
@@ -111,18 +112,31 @@ def _setup_continuous(source, destination, copy_security):
     l.info("DONE!")
 
 
-def _clone(source, destination, copy_security, with_exceptions=False):
+def _clone(source, destination, copy_security, with_exceptions=False, workers=4, checkpoint_file=None, batch_size=BATCH_SIZE):
     """Creates a complete clone of source in destination.
 
-    WARNING: This action will remove ALL content from destination.
+    Documents are copied by reading the changes of each source database
+    in batches and writing them with _bulk_docs, several databases at a
+    time. If a checkpoint file is given, the last copied sequence of
+    each database is kept in it, and databases with a checkpoint are
+    resumed from it instead of being cloned from scratch.
+
+    WARNING: This action will remove ALL content from destination
+    databases without a checkpoint.
     """
     l.info("Performing a complete clone from source to destination")
     s_couch, d_couch, s_dbs, d_dbs = _get_databases_info(source, destination)
     config = Config()
+    checkpoints = Checkpoints(checkpoint_file)
+    def key(db):
+        return "{}/{}->{}/{}".format(source.split('@')[-1], db, destination.split('@')[-1], db)
 
-    #Delete all databases in destination
+    #Delete all databases in destination that are not resumed
     l.info("Removing all databases from destination")
     for db in d_dbs:
+        if key(db) in checkpoints:
+            l.info("Resuming replication of {} from sequence {}".format(db, checkpoints.get(key(db))))
+            continue
         d_couch.delete(db)
 
     #Create all databases abailable in source to destination. Copy data and
@@ -130,14 +144,18 @@ def _clone(source, destination, copy_security, with_exceptions=False):
     l.info("Re-creating databases from source into destination")
     for db in s_dbs:
         #The users database is never deleted
-        if not db == '_users':
+        if not db == '_users' and not (key(db) in checkpoints and db in d_dbs):
             d_couch.create(db)
-        _, _, security = s_couch[db].resource.get_json('_security')
-        source_db = '/'.join([source, db])
-        dest_db = '/'.join([destination, db])
-        l.info("Copying data from {} in source to destination".format(db))
-        d_couch.replicate(source_db, dest_db)
+            #A new database is replicated from the start, also if it was dropped after a checkpoint
+            if key(db) in checkpoints:
+                l.info("Database {} was re-created in destination, replicating it from the start".format(db))
+                checkpoints.set(key(db), 0)
+    l.info("Copying data from {} databases in source to destination, {} at a time".format(len(s_dbs), workers))
+    res = replicate([(s_couch[db], d_couch[db], key(db)) for db in s_dbs], workers=workers, checkpoints=checkpoints, batch_size=batch_size)
+    for db, (seq, ndocs) in zip(s_dbs, res):
+        l.info("Copied {} documents from {} in source to destination, up to sequence {}".format(ndocs, db, seq))
         if copy_security:
+            _, _, security = s_couch[db].resource.get_json('_security')
             l.info("Copying security object to {} database in destination".format(db))
             d_couch[db].resource.put('_security', security)
         if with_exceptions:
@@ -208,6 +226,13 @@ if __name__ == "__main__":
     parser.add_argument('--with-exceptions', action='store_const', const=True, \
             help='List of files to be deleted from the DataBases after being copied. ' \
             'To be specified in your .couchrc file')
+    parser.add_argument('--workers', type=int, default=4, \
+            help='Number of databases to clone concurrently. Default is 4')
+    parser.add_argument('--checkpoint-file', type=str, default=None, \
+            help='File keeping the last copied sequence of each database. ' \
+            'Databases with a checkpoint are resumed instead of cloned from scratch')
+    parser.add_argument('--batch-size', type=int, default=BATCH_SIZE, \
+            help='Number of changes copied per request. Default is {}'.format(BATCH_SIZE))
     parser.add_argument('--set-roles', action='store_const', const=True, \
             help='List of roles to apply to  each database after copied. Only if' \
             '--no-security is present.')
@@ -232,7 +257,8 @@ if __name__ == "__main__":
     if action == "continuous":
         _setup_continuous(source, destination, copy_security)
     else:
-        _clone(source, destination, copy_security, with_exceptions=args.with_exceptions)
+        _clone(source, destination, copy_security, with_exceptions=args.with_exceptions,
+               workers=args.workers, checkpoint_file=args.checkpoint_file, batch_size=args.batch_size)
         if args.set_roles:
             if not args.no_security:
                 l.warn('--set-roles option only takes effect if applied together ' \
@@ -4,17 +4,21 @@
 import sys
 import argparse
 from scilifelab.utils.fastq_utils import FastQParser, is_read_pair
+from scilifelab.illumina.barcodes import BarcodeIndex
 
-def demultiplex_fastq(index, fastq1, fastq2):
+def demultiplex_fastq(index, fastq1, fastq2, mismatches=0):
 
-    filter = {'index': index}
+    barcodes = BarcodeIndex({index: index}, mismatches)
     
-    fp1 = FastQParser(fastq1,filter)
+    fp1 = FastQParser(fastq1)
     if fastq2 is not None:
-        fp2 = FastQParser(fastq2,filter)
+        fp2 = FastQParser(fastq2)
     for r1 in fp1:
         if fastq2 is not None:
             r2 = fp2.next()
+        if barcodes.classify(r1[0].rsplit(":",1)[1]) is None:
+            continue
+        if fastq2 is not None:
             assert is_read_pair(r1,r2), "Mismatching headers for expected read pair" 
             sys.stderr.write("{}\n".format("\n".join(r2)))
              
@@ -28,11 +32,13 @@ def main():
                         help="FastQ file to demultiplex")
     parser.add_argument('-f','--fastq2', action='store', default=None, 
                         help="Optional paired FastQ file to demultiplex")
+    parser.add_argument('-m','--mismatches', action='store', type=int, default=0, 
+                        help="Number of mismatches to allow in the index. Default is 0")
     parser.add_argument('index', action='store', 
                         help="Index sequence to demultiplex on")
     
     args = parser.parse_args()
-    demultiplex_fastq(args.index,args.fastq1,args.fastq2)
+    demultiplex_fastq(args.index,args.fastq1,args.fastq2,args.mismatches)
       
 if __name__ == "__main__":
     main()
@@ -20,15 +20,14 @@ import sys
 import time
 
 #from Bio import Seq, pairwise2
-from scilifelab.utils.fastq_utils import FastQParser, FastQWriter
+from scilifelab.utils.fastq_utils import FastQParser, MolecularTagDemultiplexer
 
-# TODO memoize sequence corrections? optimize somehow if possible
 # TODO ensure read 1,2 files are paired (SciLifeLab code)
 # TODO add directory processing
 
 
 def main(read_one, read_two, read_index, data_directory, read_index_num, output_directory,
-            index_file, max_mismatches=1, force_overwrite=False, progress_interval=1000):
+            index_file, max_mismatches=1, force_overwrite=False, progress_interval=1000, processes=1):
     check_input(read_one, read_two, read_index, data_directory, read_index_num,\
                 output_directory, index_file, max_mismatches, progress_interval)
     output_directory = create_output_dir(output_directory, force_overwrite)
@@ -38,7 +37,7 @@ def main(read_one, read_two, read_index, data_directory, read_index_num, output_
     if read_one and read_two and read_index:
         reads_processed, num_match, num_ambigmatch, num_nonmatch, num_corrected = \
                 parse_readset_byindexdict(read_one, read_two, read_index, index_dict, \
-                                      output_directory, max_mismatches, progress_interval)
+                                      output_directory, max_mismatches, progress_interval, processes)
     else:
         parse_directory() # not yet implemented
     elapsed_time = time.strftime('%H:%M:%S', time.gmtime((datetime.datetime.now() - start_time).total_seconds()))
@@ -91,91 +90,28 @@ def parse_directory():
     # possibly implement as generator, calling parse_readset_byindexdict in a for loop from the calling loop
 
 
-def parse_readset_byindexdict(read_1_fq, read_2_fq, read_index_fq, index_dict, output_directory, max_mismatches=1, progress_interval=1000):
+def parse_readset_byindexdict(read_1_fq, read_2_fq, read_index_fq, index_dict, output_directory, max_mismatches=1, progress_interval=1000, processes=1):
     """
     Parse input fastq files, searching for matches to each index.
     """
     print("Processing read set associated with \"{}\" using user-supplied indexes.".format(read_1_fq), file=sys.stderr)
     print("Maximum number of mismatches for error correction is {}.".format(max_mismatches), file=sys.stderr)
-    reads_processed, num_match, num_ambigmatch, num_nonmatch, num_corrected = 0, 0, 0, 0, 0
-    fqp_1, fqp_2, fqp_ind = map(FastQParser, (read_1_fq, read_2_fq, read_index_fq))
-    print("Counting total number of lines in fastq files...", file=sys.stderr, end="")
-    # I think du -k * 16 / 1.024 should give approximately the right number for any number of reads greater than 1000 or so
-    total_lines_in_file = int(subprocess.check_output(shlex.split("wc -l {}".format(read_1_fq))).split()[0])
-    print(" complete.", file=sys.stderr)
     if not progress_interval: progress_interval = 1000
-    if progress_interval > (total_lines_in_file / 4): progress_interval = (total_lines_in_file / 4)
-    index_fh_dict = collections.defaultdict(list)
+    demultiplexer = MolecularTagDemultiplexer(output_directory, index_dict, max_mismatches, processes=processes)
     print("Demultiplexing...", file=sys.stderr)
     time_started = datetime.datetime.now()
-    for read_1, read_2, read_ind in itertools.izip(fqp_1, fqp_2, fqp_ind):
-        read_ind_seq = read_ind[1]
-        matches_dict = collections.defaultdict(list)
-        # Sort indexes by descending length to match longer indexes first
-        for supplied_index in sorted(index_dict.keys(), key=lambda x: (-len(x))):
-            mismatches = find_dist(supplied_index, read_ind_seq, max_mismatches)
-            matches_dict[mismatches].append(supplied_index)
-            if mismatches == 0:
-                break
-        for x in range(0, max_mismatches+1):
-            if matches_dict.get(x):
-                if len(matches_dict.get(x)) == 1:
-                    # Single unamibiguous match
-                    index_seq       = matches_dict[x][0]
-                    index_len       = len(index_seq)
-                    molecular_tag   = read_ind_seq[index_len:]
-                    modify_reads( (read_1, read_2), index_seq, molecular_tag)
-                    sample_name     = index_dict[index_seq] if index_dict[index_seq] else index_seq
-                    data_write_loop(read_1, read_2, sample_name, output_directory, index_fh_dict, index_seq)
-                    num_match      += 1
-                    if not x == 0:
-                        num_corrected += 1
-                    break
-                else:
-                    # Ambiguous match
-                    sample_name     = "Ambiguous"
-                    index_seq_list  = ",".join(matches_dict.get(x))
-                    modify_reads( (read_1, read_2), index_seq_list, read_ind_seq)
-                    data_write_loop(read_1, read_2, sample_name, output_directory, index_fh_dict, sample_name)
-                    num_ambigmatch += 1
-                    break
-        else:
-            # No match
-            sample_name     = "Undetermined"
-            modify_reads( (read_1, read_2), "", read_ind_seq)
-            data_write_loop(read_1, read_2, sample_name, output_directory, index_fh_dict, sample_name)
-            num_nonmatch   += 1
-        reads_processed    += 1
-        if reads_processed % progress_interval == 0:
-            print_progress(reads_processed, (total_lines_in_file / 4), time_started=time_started)
-    return reads_processed, num_match, num_ambigmatch, num_nonmatch, num_corrected
+    reported = [0]
+    def progress(reads_processed, fraction_processed):
+        # Progress is reported per chunk of reads and the total number of reads is
+        # estimated from the offset in the (compressed) input
+        if fraction_processed and reads_processed // progress_interval > reported[0]:
+            reported[0] = reads_processed // progress_interval
+            print_progress(reads_processed, int(reads_processed / fraction_processed), time_started=time_started)
+    demultiplexer.run(read_1_fq, read_2_fq, read_index_fq, progress)
+    counts = demultiplexer.counts
+    return counts['processed'], counts['match'], counts['ambiguous'], counts['undetermined'], counts['corrected']
 
 
-def data_write_loop(read_1, read_2, sample_name, output_directory, index_fh_dict, index):
-    """
-    Writes data using FastQAppender, closing files if we open too many.
-    """
-    for read_num, read in enumerate([read_1, read_2]):
-        try:
-            index_fh_dict[index][read_num].write(read)
-        except IndexError:
-            file_path   = os.path.join(output_directory, "{sample_name}_R{read_num}.fastq".format( \
-                                                           sample_name=sample_name, read_num=read_num+1))
-            try:
-                index_fh_dict[index].append(FastQAppender(file_path))
-            except IOError as e:
-                # Too many open filehandles
-                if e.errno == 24:
-                    for fh1, fh2 in index_fh_dict.values():
-                        map(file.close, [ fh1, fh2 ] )
-                    index_fh_dict[index].append(FastQAppender(file_path))
-                    index_fh_dict[index][read_num].write(read)
-                else:
-                    raise IOError(e)
-            except ValueError:
-                # File was closed previously
-                index_fh_dict[index][read_num].reopen()
-
 # TODO make this faster
 # TODO compare to Bio.align.pairwise2 for speed
 # TODO possibly @memoize somehow
@@ -359,26 +295,6 @@ def iter_sample_fast(iterable, samplesize, total_size):
     return results
 
 
-class FastQAppender(FastQWriter):
-    """
-    A good deal like the FastQWriter but appends instead of writing.
-    Also allows file re-opening.
-    """
-    def __init__(self, file):
-        self.fname = file
-        fh = open(file,"ab")
-        if file.endswith(".gz"):
-            self._fh = gzip.GzipFile(fileobj=fh)
-        else:
-            self._fh = fh
-        self._records_written = 0
-
-    def reopen(self):
-        _records_written = self._records_written
-        self.__init__(self.fname)
-        self._records_written = _records_written
-
-
 if __name__ == "__main__":
     parser = argparse.ArgumentParser()
 
@@ -408,6 +324,8 @@ if __name__ == "__main__":
                                 help="The maximum number of mismatches allowed when performing error correction. Default is 1; set to 0 for max speed.")
     parser.add_argument("-p", "--progress-interval", type=int, default=1000,
                                 help="Update progress, estimated completion time every N reads (default 1000).")
+    parser.add_argument("-w", "--workers", type=int, dest="processes", default=1,
+                                help="The number of worker processes classifying reads (default 1).")
     arg_vars = vars(parser.parse_args())
     # It's my namespace and I'll clobber it if I want to
     locals().update(arg_vars)
@@ -419,4 +337,4 @@ if __name__ == "__main__":
         else:
             count_top_indexes(top_indexes, read_index, index_length, progress_interval)
     else:
-        main(read_one, read_two, read_index, data_directory, read_index_num, output_directory, index_file, max_mismatches, force_overwrite, progress_interval)
+        main(read_one, read_two, read_index, data_directory, read_index_num, output_directory, index_file, max_mismatches, force_overwrite, progress_interval, processes)
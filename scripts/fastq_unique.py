@@ -1,64 +1,46 @@
 """
-Reads a FastQ file from stdin and writes a file with unique records to sdout
-usage:
-    %s < in.fastq > out.unique.fastq
+Removes duplicate reads, or read pairs, from FastQ files and writes the unique
+records to <infile>-unique.fastq.gz
 
-see: http://hackmap.blogspot.com/2010/10/bloom-filter-ing-repeated-reads.html
+Duplicates are identified exactly on the read sequence (or the sequences of
+both reads in a pair). The reads are partitioned on disk by a hash of the
+sequence so that only a part of the sequences is held in memory at a time,
+within the limit given by --max-memory.
 """
-from bloomfaster import Elf
-import collections
+import argparse
+import resource
 import sys
-
-# Slight modification to read from input file instead of stdin
-from scilifelab.utils.fastq_utils import (FastQParser, FastQWriter)
-
-__doc__ %= sys.argv[0]
-if len(sys.argv) > 2:
-    print sys.argv
-    print __doc__
-    sys.exit()
-
-print >>sys.stderr, "Command: ", " ".join(sys.argv)
-infile = sys.argv[1]
-fp = FastQParser(infile)
-for _ in fp:
-    pass
-records = fp.rread()
-print >>sys.stderr, records, "records in file ", infile
-
-# say 1 out of 1000 is false positive.
-bloom = Elf(records, error_rate=1e-3)
-fp.seek(0)
-checks = []
-for _,seq,_,_ in fp:
-    if seq in bloom:
-        checks.append(seq)
-    bloom.add(seq)
-
-# now checks contains anything that could be a duplicate according to
-# the bloomfilter. for some, they were false positives.
-# for actual duplicated, just choose the first, but can also sort by quality.
-fp.seek(0)
-checks = frozenset(checks)
-print >>sys.stderr, "checking %s potential duplicates in a python set" \
-                                            % len(checks)
-outfile = "%s-unique.fastq.gz" % infile.split(".")[0]                                            
-fw = FastQWriter(outfile)
-
-putative_false_positives = collections.defaultdict(int)
-for header,seq,plus,qual in fp:
-    # it appeared only once, so just print it.
-    if not seq in checks:
-        fw.write([header,seq,plus,qual])
-        continue
-    # it appeared in the bloom-filter > 1x, so track and make sure not
-    # to print any others with same sequence.
-    putative_false_positives[seq] += 1
-    if putative_false_positives[seq] > 1:
-        continue
-    fw.write([header,seq,plus,qual])
-
-fw.close()
-false_positives = sum(1 for count in putative_false_positives.values() \
-                                                        if count == 1)
-print >>sys.stderr,  false_positives, "false-positive duplicates in the bloom filter"
+import time
+
+from scilifelab.utils.fastq_dedup import FastQDeduplicator
+
+def outfile_name(infile):
+    return "%s-unique.fastq.gz" % infile.split(".")[0]
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('fastq1', action='store',
+                        help="FastQ file to remove duplicates from")
+    parser.add_argument('fastq2', action='store', nargs='?', default=None,
+                        help="Optional paired FastQ file, read pairs are duplicates if both sequences are")
+    parser.add_argument('-m','--max-memory', action='store', type=int, default=1024,
+                        help="Memory to use for deduplication, in MB. Default is 1024")
+    parser.add_argument('-q','--best-quality', action='store_true', default=False,
+                        help="Keep the copy with the highest quality rather than the first")
+    parser.add_argument('-t','--tmpdir', action='store', default=None,
+                        help="Directory for temporary partition files")
+    args = parser.parse_args()
+
+    print >>sys.stderr, "Command: ", " ".join(sys.argv)
+    t0 = time.time()
+    infiles = [args.fastq1] if args.fastq2 is None else [args.fastq1, args.fastq2]
+    dedup = FastQDeduplicator(args.fastq1, args.fastq2, args.max_memory*1024*1024, args.best_quality, args.tmpdir)
+    outfiles = dedup.run([outfile_name(f) for f in infiles])
+
+    print >>sys.stderr, dedup.records, "records in file(s)", ", ".join(infiles)
+    print >>sys.stderr, dedup.unique, "unique records written to", ", ".join(outfiles)
+    print >>sys.stderr, "duplication rate: %.2f%%" % (100*dedup.duplication_rate())
+    print >>sys.stderr, "time: %.1f s, peak memory: %.1f MB" % (time.time() - t0, resource.getrusage(resource.RUSAGE_SELF).ru_maxrss/1024.)
+
+if __name__ == "__main__":
+    main()
@@ -1,9 +1,13 @@
 import os
+import re
+import json
 import tempfile
 import shutil
 import unittest
 from ..data import data_files
-from scilifelab.bcbio.qc import RunInfoParser
+from cStringIO import StringIO
+import numpy as np
+from scilifelab.bcbio.qc import RunInfoParser, FileCatalog, SampleRunMetricsParser, FlowcellRunMetricsParser, IlluminaXMLParser, html_table_rows
 
 filedir = os.path.abspath(os.path.realpath(os.path.dirname(__file__)))
 
@@ -28,3 +32,180 @@ class TestBcbioQC(unittest.TestCase):
         self.assertEqual(res["Instrument"], "SN0002")
         self.assertEqual(res["Date"], "120924")
 
+class TestFileCatalog(unittest.TestCase):
+    """Test the file catalogue shared by run metrics parsers"""
+    def setUp(self):
+        # Ignored directories are matched below the catalogue root, so
+        # the prefix makes the temporary directory match the pattern
+        self.rootdir = tempfile.mkdtemp(prefix="tmp_tx_log-split_")
+        self.files = ["1_120924_AC003CCCXX_nophix_3-sort-dup.align_metrics",
+                      "1_120924_AC003CCCXX_nophix_3-sort-dup.hs_metrics",
+                      "11_120924_AC003CCCXX_nophix_3-sort-dup.align_metrics",
+                      "2_120924_AC003CCCXX_nophix_3-sort-dup.align_metrics",
+                      "1_120924_AC003CCCXX_nophix.bc_metrics",
+                      "P001_101_ACGTAC_L001_R1_001_screen.txt",
+                      "1_120924_AC003CCCXX_nophix_3_1_fastq_screen.txt",
+                      "bcbb_software_versions.txt",
+                      "project-summary.csv",
+                      os.path.join("fastqc", "1_120924_AC003CCCXX_nophix_3-sort-dup_fastqc", "fastqc_data.txt"),
+                      os.path.join("tx", "1_120924_AC003CCCXX_nophix_3-sort-dup.dup_metrics"),
+                      os.path.join("Data", "reports", "Summary", "read1.xml"),
+                      os.path.join("Data", "log", "Status.xml")]
+        for f in self.files:
+            if not os.path.exists(os.path.dirname(os.path.join(self.rootdir, f))):
+                os.makedirs(os.path.dirname(os.path.join(self.rootdir, f)))
+            with open(os.path.join(self.rootdir, f), "w") as fh:
+                fh.write("")
+
+    def tearDown(self):
+        shutil.rmtree(self.rootdir)
+
+    def _walk(self):
+        """The files a full directory walk finds, ignoring directories as the parsers do"""
+        files = []
+        for root, dirs, fns in os.walk(self.rootdir):
+            if root == self.rootdir or not SampleRunMetricsParser.reignore.search(os.path.relpath(root, self.rootdir)):
+                files.extend([os.path.join(root, x) for x in fns])
+        return files
+
+    def test_select(self):
+        """Selecting catalogue files by lane, extension, name and substring"""
+        catalog = FileCatalog(self.rootdir, SampleRunMetricsParser.ignore)
+        self.assertEqual(self._walk(), catalog.files, "Catalogue files differ from directory walk")
+        self.assertEqual(len(self.files), len(catalog.all_files), "Unexpected number of files")
+        for lane in ["1", 2, "11", "3"]:
+            self.assertEqual([x for x in catalog.files if re.search("{}_[0-9]+_[0-9A-Za-z]".format(lane), x)], catalog.select(lane=lane),
+                             "Unexpected files for lane {}".format(lane))
+        self.assertEqual([os.path.join(self.rootdir, "project-summary.csv")], catalog.select(name="project-summary.csv"), "Unexpected files for name")
+        self.assertEqual([os.path.join(self.rootdir, "Data", "reports", "Summary", "read1.xml")], catalog.select(ext=".xml"), "Unexpected xml files")
+        self.assertEqual(2, len(catalog.select(ext=".xml", ignored=True)), "Unexpected xml files, including ignored")
+        self.assertEqual(3, len(catalog.select(lane=2, contains="_screen")), "Unexpected files for lane or substring")
+        self.assertEqual(catalog.files, catalog.select(lane="None"), "Lanes that are not numbers should select all files")
+
+    def test_catalogs_bounded(self):
+        """Only the most recently used catalogues are kept"""
+        dirs = [tempfile.mkdtemp(dir=self.rootdir) for i in range(0, FileCatalog.max_catalogs + 1)]
+        first = FileCatalog.get(dirs[0])
+        for d in dirs[1:-1]:
+            FileCatalog.get(d)
+        self.assertIs(first, FileCatalog.get(dirs[0]), "Catalogue should be kept")
+        FileCatalog.get(dirs[-1])
+        self.assertEqual(FileCatalog.max_catalogs, len(FileCatalog._catalogs), "Unexpected number of catalogues kept")
+        self.assertIs(first, FileCatalog.get(dirs[0]), "Recently used catalogue should be kept")
+        self.assertFalse((dirs[1], None) in FileCatalog._catalogs, "Least recently used catalogue should be dropped")
+
+    def test_parsers(self):
+        """Run metrics parsers share the catalogue and get the files a full walk finds"""
+        parser = SampleRunMetricsParser(self.rootdir)
+        self.assertIs(parser.catalog, SampleRunMetricsParser(self.rootdir).catalog, "Parsers of a directory should share the catalogue")
+        self.assertIs(parser.catalog, FlowcellRunMetricsParser(self.rootdir).catalog, "Parsers of a directory should share the catalogue")
+        for lane, pattern in [(1, "{}_[0-9]+_[0-9A-Za-z]+(_nophix)?(_3)?-.*.(align|hs|insert|dup)_metrics"),
+                              (1, "fastqc/{}_[0-9]+_[0-9A-Za-z]+(_nophix)?(_3)?-*"),
+                              (1, "{}_[0-9]+_[0-9A-Za-z]+(_nophix)?[\\._]bc[\\._]metrics")]:
+            pattern = pattern.format(lane)
+            self.assertEqual(parser.filter_files(pattern, files=self._walk()), parser.filter_files(pattern, files=parser.select_files(lane=lane)),
+                             "Selected files differ for pattern {}".format(pattern))
+
+        # Adding a file makes the parsers rescan the directory
+        fn = os.path.join(self.rootdir, "fastqc", "2_120924_AC003CCCXX_nophix.bc_metrics")
+        with open(fn, "w") as fh:
+            fh.write("")
+        new_parser = SampleRunMetricsParser(self.rootdir)
+        self.assertIsNot(parser.catalog, new_parser.catalog, "Modified directory should be rescanned")
+        self.assertTrue(fn in new_parser.files, "New file not in rescanned catalogue")
+
+def _write_chart(fn, lanes, tiles, value_fn):
+    """Write an RTA chart file with one value per lane and tile"""
+    with open(fn, "w") as fh:
+        fh.write('<?xml version="1.0"?>\n<FlowCellData Version="1">\n')
+        fh.write('<Layout NumLanes="{}" RowsPerLane="{}" ColsPerLane="1"/>\n'.format(lanes, tiles))
+        for lane in range(1, lanes + 1):
+            for tile in range(1, tiles + 1):
+                fh.write('<TL Key="{}_{}" Val="{}"/>\n'.format(lane, tile, value_fn(lane, tile)))
+        fh.write('</FlowCellData>\n')
+
+class TestIlluminaXMLParser(unittest.TestCase):
+    """Test parsing RTA xml files"""
+    def setUp(self):
+        self.rootdir = tempfile.mkdtemp(prefix="test_bcbio_rta_")
+        reports = os.path.join(self.rootdir, "Data", "reports")
+        for d in ["Summary", "ErrorRate", "NumGT30"]:
+            os.makedirs(os.path.join(reports, d))
+        os.makedirs(os.path.join(self.rootdir, "Data", "Intensities", "Summary"))
+        for read in [1, 2]:
+            with open(os.path.join(reports, "Summary", "read{}.xml".format(read)), "w") as fh:
+                fh.write('<?xml version="1.0"?>\n<Summary Read="{}"><Lane key="1" ClustersRaw="100"/><Lane key="2" ClustersRaw="200"/></Summary>\n'.format(read))
+        with open(os.path.join(reports, "NumClusters By Lane.xml"), "w") as fh:
+            fh.write('<?xml version="1.0"?>\n<Data Type="Clusters"><Lane key="1" Clusters="1000"/></Data>\n')
+        # A Summary directory outside of the reports should be skipped
+        with open(os.path.join(self.rootdir, "Data", "Intensities", "Summary", "read3.xml"), "w") as fh:
+            fh.write('<?xml version="1.0"?>\n<Summary Read="3"></Summary>\n')
+        for cycle in range(1, 4):
+            _write_chart(os.path.join(reports, "ErrorRate", "Chart_{}.xml".format(cycle)), 2, 3, lambda lane, tile: "NaN" if tile == 3 else cycle * lane * tile)
+            _write_chart(os.path.join(reports, "NumGT30", "Chart_{}.xml".format(cycle)), 2, 3, lambda lane, tile: 100 * lane + tile)
+
+    def tearDown(self):
+        shutil.rmtree(self.rootdir)
+
+    def test_parse_illumina_metrics(self):
+        """Parse summary, cluster and chart data from the run reports"""
+        metrics = FlowcellRunMetricsParser(self.rootdir).parse_illumina_metrics(fullRTA=True)
+        self.assertEqual(["read1", "read2"], sorted(metrics["Summary"].keys()), "Unexpected summary reads")
+        self.assertEqual("200", metrics["Summary"]["read2"]["2"]["ClustersRaw"], "Unexpected summary data")
+        self.assertEqual("1000", metrics["NumClusters"]["NumClusters By Lane"]["1"]["Clusters"], "Unexpected cluster data")
+        error_rate = metrics["ErrorRate"]
+        self.assertEqual(["1", "2", "3"], error_rate["charts"], "Unexpected chart indexes")
+        self.assertEqual((3, 2, 3), np.array(error_rate["values"]).shape, "Unexpected shape of chart values")
+        self.assertEqual(3 * 2 * 2, error_rate["values"][2][1][1], "Unexpected chart value for cycle 3, lane 2, tile 2")
+        self.assertIsNone(error_rate["values"][0][0][2], "NaN values should be None")
+        self.assertIs(list, type(error_rate["values"]), "Chart values should be stored as lists")
+        json.dumps(error_rate, allow_nan=False)
+        self.assertEqual("2", error_rate["NumLanes"], "Layout attributes missing")
+        self.assertIsNone(metrics["FWHM"], "Expected no FWHM charts")
+        self.assertFalse("ErrorRate" in FlowcellRunMetricsParser(self.rootdir).parse_illumina_metrics(), "Charts should only be parsed in full mode")
+
+    def test_workers(self):
+        """Parsing files with workers gives the serial result"""
+        parser = FlowcellRunMetricsParser(self.rootdir)
+        serial = parser.parse_illumina_metrics(fullRTA=True)
+        parallel = parser.parse_illumina_metrics(fullRTA=True, workers=2)
+        self.assertEqual(serial["Summary"], parallel["Summary"], "Summary data differ")
+        for kind in ["ErrorRate", "NumGT30"]:
+            self.assertEqual(serial[kind]["charts"], parallel[kind]["charts"], "Chart indexes differ")
+            self.assertEqual(serial[kind]["values"], parallel[kind]["values"], "Chart values differ")
+
+class TestDemultiplexStats(unittest.TestCase):
+    """Test parsing Demultiplex_Stats.htm files"""
+    def setUp(self):
+        self.rootdir = tempfile.mkdtemp(prefix="test_bcbio_demux_")
+        with open(os.path.join(filedir, os.pardir, "full", "data", "db", "demux_stats.htm")) as fh:
+            self.htm = fh.read()
+
+    def tearDown(self):
+        shutil.rmtree(self.rootdir)
+
+    def _write(self, unaligned, htm):
+        outdir = os.path.join(self.rootdir, unaligned, "Basecall_Stats_C003CCCXX")
+        os.makedirs(outdir)
+        with open(os.path.join(outdir, "Demultiplex_Stats.htm"), "w") as fh:
+            fh.write(htm)
+
+    def test_html_table_rows(self):
+        """Extract header and data cells of table rows"""
+        htm = ('<html><table><tr><th>A<p></p>B</th><th>&gt;= Q30</th></tr></table>'
+               '<table><tr><td><a href="x">1,000</a></td><td></td><td>a &amp; b</td></tr><tr></tr></table></html>')
+        rows = list(html_table_rows(StringIO(htm), chunk_size=7))
+        self.assertEqual([(0, [None, ">= Q30"], []), (1, [], ["1,000", None, "a & b"]), (1, [], [])], [tuple(x) for x in rows], "Unexpected table rows")
+
+    def test_parse_demultiplex_stats_htm(self):
+        """Parse and merge the barcode lane statistics and sample information of several files"""
+        self._write("Unaligned", self.htm)
+        # A second demultiplexing with a duplicate row and a new sample
+        self._write("Unaligned_2", self.htm.replace("P001_102_index6", "P001_103_index7"))
+        data = FlowcellRunMetricsParser(self.rootdir).parse_demultiplex_stats_htm(fc_name="AC003CCCXX")
+        self.assertEqual(["1-P001_101_index3-CAGATC", "1-lane1-Undetermined", "2-P001_102_index6-ACAGTG", "2-P001_103_index7-ACAGTG", "2-lane2-Undetermined"],
+                         ["{Lane}-{Sample ID}-{Index}".format(**x) for x in data["Barcode_lane_statistics"]], "Unexpected barcode lane statistics")
+        self.assertEqual("39,034,396", data["Barcode_lane_statistics"][0]["# Reads"], "Unexpected number of reads")
+        self.assertEqual("90.05", data["Barcode_lane_statistics"][0]["% of >= Q30 Bases (PF)"], "Unexpected Q30 value")
+        self.assertEqual(["P001_101_index3", "P001_102_index6", "P001_103_index7"], [x["Sample ID"] for x in data["Sample_information"]], "Unexpected sample information")
+        self.assertEqual("R1", data["Sample_information"][0]["Recipe"], "Unexpected recipe")
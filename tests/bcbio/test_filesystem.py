@@ -153,4 +153,31 @@ class TestFilesystem(unittest.TestCase):
         os.unlink(png_file)
         self.assertFalse(sq.fastq_screen_finished(self.rootdir),
                          "Fastq screen should not be considered finished with non-empty output file but without corresponding png")
-        
+
+    def test_indicator_index(self):
+        """Index the indicator files of a directory the same way as the per call functions
+        """
+        for n, times in [(1,[1000.]),(2,[3000.,2000.]),(3,[]),(14,[2500.])]:
+            with open(os.path.join(self.rootdir,"{:02d}_step.txt".format(n)),"w") as fh:
+                fh.write("".join(["{}\n".format(datetime.datetime.fromtimestamp(t).isoformat()) for t in times]))
+        with open(os.path.join(self.rootdir,"04_notes.txt"),"w") as fh:
+            fh.write("not a timestamp\n")
+        with open(os.path.join(self.rootdir,"05_blank.txt"),"w") as fh:
+            fh.write("{}\n\n{}\n".format(datetime.datetime.fromtimestamp(1500.).isoformat(),datetime.datetime.fromtimestamp(9000.).isoformat()))
+        os.mkdir(os.path.join(self.rootdir,"06_dir.txt"))
+        index = sq.IndicatorIndex(self.rootdir)
+        for steps in [[],[1],[2,14],[4],[5],[6],[7]]:
+            self.assertListEqual(sorted(sq.get_pipeline_indicator(self.rootdir,steps)),sorted(index.get_pipeline_indicator(steps)),
+                                 "Indicator files for steps {} did not match".format(steps))
+            self.assertEqual(sq.get_most_recent_indicator(sq.get_pipeline_indicator(self.rootdir,steps)),index.get_most_recent_indicator(steps),
+                             "Most recent indicator for steps {} did not match".format(steps))
+        self.assertEqual(datetime.datetime.fromtimestamp(3000.),index.get_most_recent_indicator()[0],
+                         "Timestamps after an empty line should not be counted")
+        
+        # Assert that a modified file is parsed again
+        with open(os.path.join(self.rootdir,"03_step.txt"),"w") as fh:
+            fh.write("{}\n".format(datetime.datetime.fromtimestamp(4000.).isoformat()))
+        self.assertEqual((datetime.datetime.fromtimestamp(4000.),os.path.join(self.rootdir,"03_step.txt")),
+                         sq.IndicatorIndex(self.rootdir).get_most_recent_indicator(),
+                         "A modified indicator file was not parsed again")
+
@@ -0,0 +1,78 @@
+"""Test the status query of flowcells, projects and samples in the analysis file structure
+"""
+import os
+import json
+import shutil
+import datetime
+import tempfile
+import unittest
+from mock import Mock
+
+import tests.generate_test_data as td
+import scilifelab.bcbio.status as st
+
+class TestStatus(unittest.TestCase):
+    
+    def setUp(self):
+        self.rootdir = tempfile.mkdtemp(prefix="test_bcbio_status_")
+        self.archive = os.path.join(self.rootdir,"archive")
+        self.analysis = os.path.join(self.rootdir,"analysis")
+        fcdir = os.path.join(self.archive,"120101_SN1_0001_AC0FFEEACXX")
+        os.makedirs(fcdir)
+        td._write_samplesheet([["C0FFEEACXX","1",smpl,"hg19","ACGTAC","","N","R1","NN","J__Doe_00_01"] for smpl in ["P1_101","P1_102"]],
+                              os.path.join(fcdir,"C0FFEEACXX.csv"))
+        
+        # A sample that has finished the pipeline and a sample without analysis folder
+        sample_fc = os.path.join(self.analysis,"J.Doe_00_01","P1_101","120101_AC0FFEEACXX")
+        os.makedirs(os.path.join(sample_fc,"fastq_screen"))
+        for step, t in [(1,1000.),(2,2000.),(14,3000.)]:
+            with open(os.path.join(sample_fc,"{:02d}_step.txt".format(step)),"w") as fh:
+                fh.write("{}\n".format(datetime.datetime.fromtimestamp(t).isoformat()))
+        for fname, content in [("P1_101-bcbb.log","log\n"),
+                               (os.path.join("fastq_screen","P1_101_screen.txt"),"header\nrow\n"),
+                               (os.path.join("fastq_screen","P1_101_screen.png"),"")]:
+            with open(os.path.join(sample_fc,fname),"w") as fh:
+                fh.write(content)
+        os.makedirs(os.path.join(self.analysis,"J.Doe_00_01","P1_103"))
+        self.slurm = st.slurm
+        st.slurm = Mock()
+        st.slurm.get_slurm_jobs = Mock(return_value={"P1_101": [(123,"running")]})
+        
+    def tearDown(self):
+        st.slurm = self.slurm
+        shutil.rmtree(self.rootdir)
+    
+    def test_get_status(self):
+        """Get the status of a flowcell with one squeue call
+        """
+        status = st.get_status(self.archive,self.analysis,"AC0FFEEACXX",None,workers=2)
+        self.assertEqual(1,st.slurm.get_slurm_jobs.call_count,
+                         "Expected a single listing of the slurm jobs")
+        self.assertEqual(1,len(status),
+                         "Expected the status of one flowcell")
+        proj_status = status[0]['projects'][0]
+        self.assertEqual("J.Doe_00_01",proj_status['project'],
+                         "Project name was not translated")
+        self.assertEqual(1,proj_status['no_finished_samples'],
+                         "Expected one finished sample")
+        self.assertNotIn('finished',proj_status,
+                         "The project should not be finished")
+        s1, s2 = proj_status['samples']
+        self.assertTrue(s1.get('finished',False),
+                        "The sample should be finished")
+        self.assertEqual([os.path.join(s1['sample_fc_dir'],"14_step.txt"),datetime.datetime.fromtimestamp(3000.)],s1['pipeline_progress'],
+                         "The most recent pipeline step was not found")
+        self.assertEqual([[123,"running"]],s1['slurm_job'],
+                         "The slurm jobs of the sample were not found")
+        self.assertDictEqual({'sample_id': "P1_102"},s2,
+                             "A sample without analysis folder should only have an id")
+        self.assertListEqual([],st.get_status(self.archive,self.analysis,"AC0FFEEACXX","J.Doe_00_02"),
+                             "Filtering on a missing project should not return any flowcells")
+        
+    def test_status_to_json(self):
+        """Serialize the status as JSON
+        """
+        status = json.loads(st.status_to_json(st.get_status(self.archive,self.analysis,"AC0FFEEACXX",None)))
+        sample_status = status[0]['projects'][0]['samples'][0]
+        self.assertEqual(datetime.datetime.fromtimestamp(1000.).isoformat(),sample_status['pipeline_started'][1],
+                         "Timestamps should be in ISO 8601 format")
@@ -0,0 +1,59 @@
+"""Benchmarks for performance critical code paths. Run a benchmark as
+a module from the repository root, e.g.
+
+    python -m tests.benchmarks.bench_fastq_parser
+"""
+import gzip
+import random
+import time
+
+def timed(fn, *args, **kwargs):
+    """Call fn with the supplied arguments and return a tuple with the
+    result and the elapsed wall time in seconds
+    """
+    t0 = time.time()
+    result = fn(*args, **kwargs)
+    return result, time.time() - t0
+
+def report(label, seconds, records=None, nbytes=None):
+    """Print a line with the elapsed time and throughput
+    """
+    fields = ["{:<32}".format(label), "{:>8.2f} s".format(seconds)]
+    if records is not None:
+        fields.append("{:>12.0f} records/s".format(records/max(seconds,1e-9)))
+    if nbytes is not None:
+        fields.append("{:>8.1f} MB/s".format(nbytes/max(seconds,1e-9)/1024**2))
+    print "  ".join(fields)
+
+def write_fastq(fname, nrecords, indexes=None, lane=1, read=1, sequence_length=101):
+    """Write a synthetic CASAVA 1.8+ fastq file with nrecords records. The
+    records are drawn from a small pool of random sequences so that large
+    files can be generated quickly. Returns the number of uncompressed bytes
+    written
+    """
+    if indexes is None:
+        indexes = ["ACGTAC"]
+    pool = [("".join([random.choice("ACGT") for i in xrange(sequence_length)]),
+             "".join([chr(random.randint(2,40)+33) for i in xrange(sequence_length)])) for n in xrange(1000)]
+    opener = gzip.open if fname.endswith(".gz") else open
+    nbytes = 0
+    with opener(fname, "wb") as fh:
+        chunk = []
+        for n in xrange(nrecords):
+            seq, qual = pool[n % len(pool)]
+            chunk.append("@SN1234:101:C0FFEEACXX:{}:1101:{}:{} {}:N:0:{}\n{}\n+\n{}\n".format(lane,
+                                                                                           1000 + n//10000,
+                                                                                           1000 + n%10000,
+                                                                                           read,
+                                                                                           indexes[n % len(indexes)],
+                                                                                           seq,
+                                                                                           qual))
+            if len(chunk) == 10000:
+                data = "".join(chunk)
+                nbytes += len(data)
+                fh.write(data)
+                chunk = []
+        data = "".join(chunk)
+        nbytes += len(data)
+        fh.write(data)
+    return nbytes
@@ -0,0 +1,36 @@
+"""Serial and parallel barcode counting with count_barcodes
+"""
+import argparse
+import os
+import random
+import shutil
+import tempfile
+
+from scilifelab.utils.fastq_utils import count_barcodes
+from tests.benchmarks import timed, report, write_fastq
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark barcode counting")
+    parser.add_argument('-n','--records', type=int, default=2000000, help="number of synthetic records. Default is 2000000")
+    parser.add_argument('-p','--processes', type=int, nargs='+', default=[1, 2, 4, 8], help="process counts to test")
+    args = parser.parse_args()
+
+    tmpdir = tempfile.mkdtemp(prefix="bench_barcode_count_")
+    try:
+        indexes = ["".join([random.choice("ACGTN") for i in xrange(6)]) for n in xrange(500)]
+        for suffix in [".fastq", ".fastq.gz"]:
+            fname = os.path.join(tmpdir,"bench{}".format(suffix))
+            nbytes = write_fastq(fname, args.records, indexes)
+            print "{} records, {:.1f} MB uncompressed ({})".format(args.records, nbytes/1024.**2, suffix)
+            serial = None
+            for processes in args.processes:
+                counts, secs = timed(count_barcodes, fname, processes=processes)
+                if serial is None:
+                    serial = counts
+                assert counts == serial, "Counts with {} processes differ from the serial counts".format(processes)
+                report("{} process(es)".format(processes), secs, args.records, nbytes)
+    finally:
+        shutil.rmtree(tmpdir)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,70 @@
+"""Verifying the md5 files of a flowcell with the checksum service, in
+worker threads and with the md5sum cache, compared to hashing each file
+in 8 KB reads one at a time, over synthetic fastq files
+"""
+import argparse
+import hashlib
+import os
+import shutil
+import tempfile
+
+from scilifelab.utils.checksum import ChecksumCache, verify_md5_files
+from tests.benchmarks import timed, report
+
+def serial_md5sum(infile):
+    """Hash a file in 8 KB reads"""
+    md5 = hashlib.md5()
+    with open(infile,'rb') as f:
+        for chunk in iter(lambda: f.read(128*md5.block_size), b''):
+            md5.update(chunk)
+    return md5.hexdigest()
+
+def serial_verify(md5files):
+    """Verify md5 files one line at a time"""
+    res = []
+    for md5file in md5files:
+        with open(md5file) as fh:
+            m, fname = fh.read().split()
+        res.append(serial_md5sum(os.path.join(os.path.dirname(md5file), fname)) == m)
+    return res
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark verifying md5 files")
+    parser.add_argument('-n','--files', type=int, default=16, help="number of files. Default is 16")
+    parser.add_argument('-s','--size', type=int, default=128, help="file size in MB. Default is 128")
+    parser.add_argument('-w','--workers', type=int, default=4, help="number of worker threads. Default is 4")
+    args = parser.parse_args()
+
+    rootdir = tempfile.mkdtemp(prefix="bench_checksum_")
+    try:
+        block = os.urandom(1024 * 1024)
+        md5files = []
+        for n in xrange(args.files):
+            fn = os.path.join(rootdir, "{}_120924_AC003CCCXX_P001_101_{}.fastq.gz".format(n % 8 + 1, n))
+            with open(fn, "wb") as fh:
+                for i in xrange(args.size):
+                    fh.write(block[n:] + block[:n])
+            md5files.append("{}.md5".format(fn))
+            with open(md5files[-1], "w") as fh:
+                fh.write("{}  {}\n".format(serial_md5sum(fn), os.path.basename(fn)))
+        nbytes = args.files * args.size * 1024 * 1024
+        print "{} files of {} MB".format(args.files, args.size)
+
+        expected, secs = timed(serial_verify, md5files)
+        report("serial, 8 KB reads", secs, args.files, nbytes)
+        check = lambda res: [x[0].observed == x[0].expected for x in res.values()]
+        observed, secs = timed(verify_md5_files, md5files, progress=False)
+        report("checksum service", secs, args.files, nbytes)
+        threaded, secs = timed(verify_md5_files, md5files, args.workers, progress=False)
+        report("{} workers".format(args.workers), secs, args.files, nbytes)
+        cachedir = os.path.join(rootdir, "cache")
+        _, secs = timed(verify_md5_files, md5files, args.workers, ChecksumCache(cachedir), progress=False)
+        report("{} workers, filling cache".format(args.workers), secs, args.files, nbytes)
+        cached, secs = timed(verify_md5_files, md5files, args.workers, ChecksumCache(cachedir), progress=False)
+        report("{} workers, from cache".format(args.workers), secs, args.files, nbytes)
+        assert expected == check(observed) == check(threaded) == check(cached) == [True] * args.files, "Verification differs"
+    finally:
+        shutil.rmtree(rootdir)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,64 @@
+"""Scaling of parallel gzip compression and decompression of fastq data
+with the number of threads
+"""
+import argparse
+import os
+import shutil
+import tempfile
+
+from scilifelab.utils import compress
+from tests.benchmarks import timed, report, write_fastq
+
+def copy(src, dst, threads, level, block_size):
+    """Compress src into dst and return the number of bytes written
+    """
+    n = 0
+    with open(src, "rb") as ifh:
+        ofh = compress.open_output(dst, threads, level, block_size)
+        while True:
+            data = ifh.read(1024*1024)
+            if not data:
+                break
+            ofh.write(data)
+            n += len(data)
+        ofh.close()
+    return n
+
+def read(fname, threads):
+    """Decompress fname and return the number of uncompressed bytes
+    """
+    n = 0
+    fh = compress.open_input(fname, threads)
+    while True:
+        data = fh.read(4*1024*1024)
+        if not data:
+            break
+        n += len(data)
+    fh.close()
+    return n
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark parallel gzip I/O")
+    parser.add_argument('-n','--records', type=int, default=1000000, help="number of synthetic records. Default is 1000000")
+    parser.add_argument('-t','--threads', type=int, nargs='+', default=[1, 2, 4, 8], help="thread counts to test")
+    parser.add_argument('-l','--level', type=int, default=compress.COMPRESS_LEVEL, help="compression level")
+    parser.add_argument('-b','--block-size', type=int, default=compress.BLOCK_SIZE, help="block size in bytes")
+    args = parser.parse_args()
+
+    tmpdir = tempfile.mkdtemp(prefix="bench_compress_")
+    try:
+        src = os.path.join(tmpdir, "bench.fastq")
+        nbytes = write_fastq(src, args.records)
+        print "{} records, {:.1f} MB uncompressed".format(args.records, nbytes/1024.**2)
+        for threads in args.threads:
+            dst = os.path.join(tmpdir, "bench_{}.fastq.gz".format(threads))
+            n, secs = timed(copy, src, dst, threads, args.level, args.block_size)
+            report("compress, {} threads".format(threads), secs, nbytes=n)
+            n, secs = timed(read, dst, threads)
+            assert n == nbytes, "Decompressed {} bytes, expected {}".format(n, nbytes)
+            report("decompress, {} threads".format(threads), secs, nbytes=n)
+    finally:
+        shutil.rmtree(tmpdir)
+
+if __name__ == "__main__":
+    main()
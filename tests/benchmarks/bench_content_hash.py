@@ -0,0 +1,107 @@
+"""Saving unchanged and changed project documents, compared by the stored
+content hash in bulk, compared to getting each stored document and
+comparing it field by field, over synthetic projects with many samples
+"""
+import argparse
+import copy
+import json
+import random
+import time
+
+from scilifelab.db.statusDB_utils import save_couchdb_objs, content_hash
+from tests.benchmarks import timed, report
+from tests.classes import FakeCouchDatabase
+
+class CountingCouchDatabase(FakeCouchDatabase):
+    """In-memory database counting the bytes of documents sent and received,
+    with a delay per request and per byte"""
+    latency = 0.002
+    bandwidth = 100 * 1024**2
+    def __init__(self, *args, **kwargs):
+        super(CountingCouchDatabase, self).__init__(*args, **kwargs)
+        self.nbytes = 0
+        self.writes = 0
+
+    def _transfer(self, data):
+        self.nbytes += len(data)
+        time.sleep(self.latency + len(data) / float(self.bandwidth))
+        return json.loads(data)
+
+    def get(self, docid, default=None):
+        return self._transfer(json.dumps(super(CountingCouchDatabase, self).get(docid, default)))
+
+    def view(self, name, **options):
+        rows = super(CountingCouchDatabase, self).view(name, **options)
+        self._transfer(json.dumps(rows))
+        return rows
+
+    def update(self, docs, **options):
+        self._transfer(json.dumps(docs))
+        self.writes += len(docs)
+        self._bulk = True
+        try:
+            return super(CountingCouchDatabase, self).update(docs, **options)
+        finally:
+            self._bulk = False
+
+    def save(self, doc):
+        if not getattr(self, "_bulk", False):
+            self._transfer(json.dumps(doc))
+            self.writes += 1
+        super(CountingCouchDatabase, self).save(doc)
+
+def field_compare_save(db, obj):
+    """save_couchdb_obj with a get of the stored document and a field by field comparison"""
+    dbobj = db.get(obj['_id'])
+    obj["_rev"] = dbobj.get("_rev")
+    obj["modification_time"] = dbobj["modification_time"] = "2013-01-02T00:00:00Z"
+    obj["creation_time"] = dbobj["creation_time"]
+    dbobj.pop("content_hash")
+    for key in set(obj.keys() + dbobj.keys()):
+        if key not in obj or key not in dbobj or obj[key] != dbobj[key]:
+            db.save(obj)
+            return 'uppdated'
+    return 'not uppdated'
+
+def project(i, samples):
+    return {"_id":"{:032x}".format(i), "project_name":"J.Doe_00_{:03d}".format(i), "entity_type":"project_summary",
+            "samples":dict(("P{}_{}".format(i, n), {"scilife_name":"P{}_{}".format(i, n), "status":"Sequenced", "m_reads_sequenced":n,
+                                                    "library_prep":{"A":{"prep_status":"PASSED", "reagent_labels":["ACGTAC"],
+                                                                         "library_validation":{"24-{}".format(n):{"average_size_bp":300 + n}}}}})
+                           for n in xrange(samples))}
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark saving project documents")
+    parser.add_argument('-n','--projects', type=int, default=500, help="number of projects. Default is 500")
+    parser.add_argument('-s','--samples', type=int, default=200, help="samples per project. Default is 200")
+    parser.add_argument('-c','--changed', type=float, default=0.05, help="fraction of changed projects. Default is 0.05")
+    parser.add_argument('--latency', type=float, default=0.002, help="seconds per request. Default is 0.002")
+    parser.add_argument('--bandwidth', type=float, default=100, help="MB/s transferred. Default is 100")
+    args = parser.parse_args()
+
+    CountingCouchDatabase.latency = args.latency
+    CountingCouchDatabase.bandwidth = args.bandwidth * 1024**2
+    objs = [project(i, args.samples) for i in xrange(args.projects)]
+    changed = set(random.sample(xrange(args.projects), int(args.projects * args.changed)))
+    new_objs = copy.deepcopy(objs)
+    for i in changed:
+        new_objs[i]["samples"].values()[0]["m_reads_sequenced"] = -1
+    print "{} projects of {} samples, {} changed".format(args.projects, args.samples, len(changed))
+
+    results = []
+    views = {"content/hash": lambda doc: [(doc["_id"], [doc.get("_rev"), doc["content_hash"], doc.get("creation_time")])] if doc.get("content_hash") else []}
+    for label, fn in [("get and compare fields", lambda db, objs: [field_compare_save(db, obj) for obj in objs]),
+                      ("bulk, compare content hashes", lambda db, objs: [s for i in xrange(0, len(objs), 50) for s in save_couchdb_objs(db, objs[i:i + 50])])]:
+        db = CountingCouchDatabase("projects", views)
+        for obj in objs:
+            FakeCouchDatabase.save(db, dict(obj, _rev="1-x", creation_time="2013-01-01T00:00:00Z", modification_time="2013-01-01T00:00:00Z", content_hash=content_hash(obj)))
+        db.nbytes = db.writes = db.queries = 0
+        statuses, secs = timed(fn, db, copy.deepcopy(new_objs))
+        report(label, secs, args.projects)
+        print "  {} documents written, {:.1f} MB transferred".format(db.writes, db.nbytes / 1024.0**2)
+        results.append(statuses)
+    assert results[0] == results[1], "Statuses differ"
+    assert results[0].count('uppdated') == len(changed), "Unexpected number of updated projects"
+
+if __name__ == "__main__":
+    main()
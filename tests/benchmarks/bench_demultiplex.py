@@ -0,0 +1,80 @@
+"""Demultiplexing a synthetic lane with FastQDemultiplexer compared to the
+two-pass, one-writer-per-sample implementation it replaced
+"""
+import argparse
+import os
+import random
+import shutil
+import tempfile
+
+from scilifelab.illumina.hiseq import HiSeqRun
+from scilifelab.utils.fastq_utils import FastQParser, FastQWriter, parse_header, demultiplex_fastq
+from tests.benchmarks import timed, report, write_fastq
+from tests.generate_test_data import _write_samplesheet
+
+def previous_demultiplex_fastq(outdir, samplesheet, fastq1, fastq2=None):
+    """The previous demultiplex_fastq, one pass per read and a full header parse per record
+    """
+    outfiles = {}
+    counts = {}
+    sdata = HiSeqRun.parse_samplesheet(samplesheet)
+    reads = [1]
+    if fastq2 is not None:
+        reads.append(2)
+    for sd in sdata:
+        lane = sd['Lane']
+        index = sd['Index']
+        if lane not in outfiles:
+            outfiles[lane] = {}
+            counts[lane] = {}
+        outfiles[lane][index] = []
+        counts[lane][index] = 0
+        for read in reads:
+            fname = "tmp_{}_{}_L00{}_R{}_001.fastq.gz".format(sd['SampleID'], index, lane, read)
+            outfiles[lane][index].append(FastQWriter(os.path.join(outdir,fname)))
+    fhs = [FastQParser(fastq1)]
+    if fastq2 is not None:
+        fhs.append(FastQParser(fastq2))
+    for r, fh in enumerate(fhs):
+        for record in fh:
+            header = parse_header(record[0])
+            lane = str(header['lane'])
+            index = header['index']
+            if lane in outfiles and index in outfiles[lane]:
+                outfiles[lane][index][r].write(record)
+                counts[lane][index] += 1
+    for lane in outfiles.keys():
+        for index in outfiles[lane].keys():
+            for r, fh in enumerate(outfiles[lane][index]):
+                fh.close()
+    return counts
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark demultiplexing of a synthetic lane")
+    parser.add_argument('-n','--records', type=int, default=10000000, help="number of read pairs. Default is 10000000")
+    parser.add_argument('-s','--samples', type=int, default=96, help="number of samples. Default is 96")
+    args = parser.parse_args()
+
+    tmpdir = tempfile.mkdtemp(prefix="bench_demultiplex_")
+    try:
+        indexes = sorted(set(["".join([random.choice("ACGT") for i in xrange(8)]) for n in xrange(args.samples)]))
+        # One index in ten is not in the samplesheet
+        sheet_indexes = [ix for n, ix in enumerate(indexes) if n % 10 != 9]
+        fq1, fq2 = [os.path.join(tmpdir,"lane_R{}.fastq.gz".format(r)) for r in [1,2]]
+        nbytes = write_fastq(fq1, args.records, indexes, read=1)
+        nbytes += write_fastq(fq2, args.records, indexes, read=2)
+        samplesheet = _write_samplesheet([["C0FFEEACXX", "1", "Sample_{}".format(n), "hg19", ix, "Bench", "N", "R1", "NN", "Bench"]
+                                          for n, ix in enumerate(sheet_indexes)],
+                                         os.path.join(tmpdir,"SampleSheet.csv"))
+        print "{} read pairs, {} samples, {:.1f} MB uncompressed".format(args.records, len(sheet_indexes), nbytes/1024.**2)
+        for label, fn in [("previous demultiplex_fastq", previous_demultiplex_fastq),
+                          ("demultiplex_fastq", demultiplex_fastq)]:
+            outdir = os.path.join(tmpdir,label.replace(" ","_"))
+            os.mkdir(outdir)
+            _, secs = timed(fn, outdir, samplesheet, fq1, fq2)
+            report(label, secs, args.records, nbytes)
+    finally:
+        shutil.rmtree(tmpdir)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,106 @@
+"""Parsing Demultiplex_Stats.htm files with the streaming table
+extractor compared to parsing them with BeautifulSoup, over synthetic
+stats files for several demultiplexings of a flowcell. Each parser runs
+in a separate process to measure its peak memory
+"""
+import argparse
+import multiprocessing
+import os
+import resource
+import shutil
+import tempfile
+
+from bs4 import BeautifulSoup
+
+from scilifelab.bcbio.qc import FlowcellRunMetricsParser
+from tests.benchmarks import timed, report
+
+BC_HEADER = ['Lane', 'Sample ID', 'Sample Ref', 'Index', 'Description', 'Control', 'Project', 'Yield (Mbases)', '% PF', '# Reads', '% of raw clusters per lane', '% Perfect Index Reads', '% One Mismatch Reads (Index)', '% of &gt;= Q30 Bases (PF)', 'Mean Quality Score (PF)']
+
+def write_stats(fn, samples, offset):
+    """Write a Demultiplex_Stats.htm file with a row per sample and lane"""
+    with open(fn, "w") as fh:
+        fh.write('<html>\n<body>\n<h1>Flowcell: AC003CCCXX</h1>\n<h2>Barcode lane statistics</h2>\n')
+        fh.write('<div ID="ScrollableTableHeaderDiv"><table width="100%">\n<col width="4%">\n<tr>\n')
+        fh.write("".join(["<th>{}</th>\n".format(x) for x in BC_HEADER]))
+        fh.write('</tr>\n</table></div>\n<div ID="ScrollableTableBodyDiv"><table width="100%">\n<col width="4%">\n')
+        for n in xrange(offset, offset + samples):
+            for lane in xrange(1, 9):
+                values = [lane, "P001_{}".format(n), "hg19", "ACGT{:06d}".format(n), "J__Doe_00_01", "N", "J__Doe_00_01",
+                          "3,942", "100.00", "{:,}".format(1000 * n + lane), "7.94", "92.57", "7.43", "90.05", "35.22"]
+                fh.write("<tr>\n{}</tr>\n".format("".join(["<td>{}</td>\n".format(x) for x in values])))
+        fh.write('</table></div>\n<p></p>\n<h2>Sample information</h2>\n<div ID="ScrollableTableHeaderDiv"><table width="100%">\n<tr>\n')
+        fh.write('<th>Sample<p></p>ID</th>\n<th>Recipe</th>\n<th>Operator</th>\n<th>Directory</th>\n</tr>\n</table></div>\n')
+        fh.write('<div ID="ScrollableTableBodyDiv"><table width="100%">\n')
+        for n in xrange(offset, offset + samples):
+            fh.write("<tr>\n<td>P001_{0}</td>\n<td>R1</td>\n<td>NN</td>\n<td>/srv/illumina/Unaligned/Project_J__Doe_00_01/Sample_P001_{0}</td>\n</tr>\n".format(n))
+        fh.write('</table></div>\n<p>bcl2fastq-1.8.3</p>\n</body>\n</html>\n')
+
+def soup_stats(htm_files):
+    """Parse stats files with one BeautifulSoup tree per table and
+    deduplicate rows on their joined values"""
+    metrics = {"Barcode_lane_statistics": [], "Sample_information": []}
+    for htm_file in htm_files:
+        with open(htm_file) as fh:
+            htm_doc = fh.read()
+        soup = BeautifulSoup(htm_doc, "html.parser")
+        headers = [h for h in (row.findAll("th") for row in soup.findAll("tr")) if h]
+        bc_header = [str(x.string) for x in headers[0]]
+        smp_header = [str(x.string) for x in headers[1]]
+        smp_header[0] = "Sample ID"
+        for metric, index, header in [("Barcode_lane_statistics", 1, bc_header), ("Sample_information", 3, smp_header)]:
+            soup = BeautifulSoup(htm_doc, "html.parser")
+            rows = soup.findAll("table")[index].findAll("tr")
+            metrics[metric].extend([{header[i]:str(row[i].string) for i in range(0, len(header)) if row} for row in (r.findAll("td") for r in rows)])
+    def by_lane_sample(data):
+        return "{}-{}-{}".format(data.get('Lane',''),data.get('Sample ID',''),data.get('Index',''))
+    for metric in ['Barcode_lane_statistics', 'Sample_information']:
+        dedupped = {}
+        for row in metrics[metric]:
+            dedupped.setdefault("\t".join(row.values()), row)
+        metrics[metric] = sorted(dedupped.values(), key=by_lane_sample)
+    return metrics
+
+def _run(job):
+    """Parse stats files in a child process and return the result, the
+    elapsed time and the peak memory"""
+    name, rundir, htm_files = job
+    if name == "soup":
+        res, secs = timed(soup_stats, htm_files)
+    else:
+        res, secs = timed(FlowcellRunMetricsParser(rundir).parse_demultiplex_stats_htm, "AC003CCCXX")
+    return res, secs, resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark parsing Demultiplex_Stats.htm files")
+    parser.add_argument('-s','--samples', type=int, default=1000, help="number of samples per stats file. Default is 1000")
+    parser.add_argument('-u','--unaligned', type=int, default=3, help="number of Unaligned directories. Default is 3")
+    args = parser.parse_args()
+
+    rundir = tempfile.mkdtemp(prefix="bench_demux_stats_")
+    try:
+        htm_files = []
+        for n in xrange(args.unaligned):
+            outdir = os.path.join(rundir, "Unaligned_{}".format(n), "Basecall_Stats_C003CCCXX")
+            os.makedirs(outdir)
+            htm_files.append(os.path.join(outdir, "Demultiplex_Stats.htm"))
+            # Overlapping samples give duplicate rows
+            write_stats(htm_files[-1], args.samples, n * args.samples // 2)
+        nbytes = sum(os.path.getsize(x) for x in htm_files)
+        print "{} stats files, {} samples each, {:.1f} MB".format(args.unaligned, args.samples, nbytes / 1024.0**2)
+
+        pool = multiprocessing.Pool(1, maxtasksperchild=1)
+        expected, secs, maxrss = pool.apply(_run, [("soup", rundir, htm_files)])
+        report("BeautifulSoup", secs, nbytes=nbytes)
+        print "  peak memory {:.1f} MB".format(maxrss / 1024.0)
+        observed, secs, maxrss = pool.apply(_run, [("stream", rundir, htm_files)])
+        report("streaming table extractor", secs, nbytes=nbytes)
+        print "  peak memory {:.1f} MB".format(maxrss / 1024.0)
+        pool.close()
+        pool.join()
+        assert observed == expected, "Streamed statistics differ from BeautifulSoup statistics"
+    finally:
+        shutil.rmtree(rundir)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,63 @@
+"""Throughput of FastQParser compared to the line-at-a-time parsing
+it replaced
+"""
+import argparse
+import gzip
+import os
+import shutil
+import tempfile
+
+from scilifelab.utils.fastq_utils import FastQParser
+from tests.benchmarks import timed, report, write_fastq
+
+def line_at_a_time(fname):
+    """Parse records the way FastQParser used to, one readline per line
+    """
+    fh = gzip.GzipFile(fileobj=open(fname,"rb")) if fname.endswith(".gz") else open(fname,"rb")
+    n = 0
+    try:
+        while True:
+            [fh.next().strip() for i in range(4)]
+            n += 1
+    except StopIteration:
+        pass
+    fh.close()
+    return n
+
+def block_parser(fname):
+    fqp = FastQParser(fname)
+    for record in fqp:
+        pass
+    fqp.close()
+    return fqp.rread()
+
+def block_parser_batches(fname):
+    fqp = FastQParser(fname)
+    n = 0
+    for batch in fqp.batches():
+        n += len(batch)
+    fqp.close()
+    return n
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark FastQParser throughput")
+    parser.add_argument('-n','--records', type=int, default=1000000, help="number of synthetic records. Default is 1000000")
+    args = parser.parse_args()
+    
+    tmpdir = tempfile.mkdtemp(prefix="bench_fastq_parser_")
+    try:
+        for suffix in [".fastq", ".fastq.gz"]:
+            fname = os.path.join(tmpdir,"bench{}".format(suffix))
+            nbytes = write_fastq(fname, args.records)
+            print "{} records, {:.1f} MB uncompressed ({})".format(args.records, nbytes/1024.**2, suffix)
+            for label, fn in [("line at a time", line_at_a_time),
+                              ("FastQParser", block_parser),
+                              ("FastQParser.batches", block_parser_batches)]:
+                n, secs = timed(fn, fname)
+                assert n == args.records, "{} parsed {} records, expected {}".format(label, n, args.records)
+                report(label, secs, n, nbytes)
+    finally:
+        shutil.rmtree(tmpdir)
+
+if __name__ == "__main__":
+    main()
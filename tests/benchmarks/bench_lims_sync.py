@@ -0,0 +1,51 @@
+"""Building and saving project documents with prefetched LIMS entities and
+a pool of workers, compared to fetching each entity on first use one
+project at a time, with a stub LIMS API with a delay per request
+"""
+import argparse
+import logbook
+
+from scilifelab.db.lims_sync import prefetch, limit_requests, sync_projects
+from tests.benchmarks import timed, report
+from tests.classes import FakeCouchDatabase
+from tests.statusdb.test_lims_sync import StubLims, StubProject, Artifact, Sample, Process
+
+def build(lims, proj, samples, artifacts, prefetching):
+    """Build a project document from the artifact history of its samples"""
+    samps = [Sample(lims, "{}_{}".format(proj.name, i)) for i in xrange(samples)]
+    arts = [Artifact(lims, "{}-{}".format(samp.id, i)) for samp in samps for i in xrange(artifacts)]
+    processes = [Process(lims, "{}-p".format(art.id)) for art in arts]
+    if prefetching:
+        for entities in [samps, arts, processes]:
+            prefetch(lims, entities)
+    for entity in samps + arts + processes:
+        entity.get()
+    return {"project_name":proj.name, "samples":dict((samp.id, {"artifacts":artifacts}) for samp in samps)}
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the LIMS to statusdb project sync")
+    parser.add_argument('-n','--projects', type=int, default=20, help="number of projects. Default is 20")
+    parser.add_argument('-s','--samples', type=int, default=12, help="samples per project. Default is 12")
+    parser.add_argument('-a','--artifacts', type=int, default=4, help="artifacts per sample. Default is 4")
+    parser.add_argument('-d','--delay', type=float, default=0.005, help="seconds per request. Default is 0.005")
+    parser.add_argument('-w','--workers', type=int, default=8, help="number of concurrent projects. Default is 8")
+    parser.add_argument('-r','--max-requests', type=int, default=8, help="maximum number of concurrent requests. Default is 8")
+    args = parser.parse_args()
+
+    projects = [StubProject("J.Doe_00_{:02d}".format(i)) for i in xrange(args.projects)]
+    print "{} projects of {} samples, {} s per request".format(args.projects, args.samples, args.delay)
+    results = []
+    for label, prefetching, workers in [("lazy, one project at a time", False, 1),
+                                        ("prefetched, one project at a time", True, 1),
+                                        ("prefetched, {} workers".format(args.workers), True, args.workers)]:
+        lims = limit_requests(StubLims(delay=args.delay), args.max_requests)
+        db = FakeCouchDatabase("projects", {"project/project_name": lambda doc: [(doc["project_name"], doc["_id"])]})
+        _, secs = timed(sync_projects, projects, lambda proj: build(lims, proj, args.samples, args.artifacts, prefetching), db, workers=workers,
+                         log=logbook.Logger(__name__, level=logbook.WARNING))
+        report(label, secs, args.projects)
+        print "  {} LIMS requests, {} statusdb requests".format(len(lims.requests), db.queries)
+        results.append(sorted((doc["project_name"], doc["samples"]) for doc in db.docs.values()))
+    assert results[0] == results[1] == results[2], "Project documents differ"
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,110 @@
+"""Demultiplexing synthetic HaloPlex reads by index and molecular tag with
+MolecularTagDemultiplexer, compared to the per read scan of all indexes
+that the demultiplex_mctag script did before
+"""
+import argparse
+import collections
+import gzip
+import itertools
+import os
+import random
+import shutil
+import tempfile
+
+from scilifelab.utils.fastq_utils import FastQParser, FastQWriter, MolecularTagDemultiplexer
+from tests.benchmarks import timed, report, write_fastq
+
+def find_dist(str_01, str_02, max_mismatches=None):
+    """The mismatch count of the demultiplex_mctag script"""
+    str_01, str_02 = str_01[:len(str_02)], str_02[:len(str_01)]
+    mismatches = 0
+    for a, b in itertools.izip(str_01, str_02):
+        if a != b:
+            mismatches += 1
+            if max_mismatches and mismatches > max_mismatches:
+                break
+    return mismatches
+
+def previous_demultiplex(outdir, read_1_fq, read_2_fq, read_index_fq, index_dict, max_mismatches=1):
+    """The previous parse_readset_byindexdict, sorting and scanning all indexes
+    for each read and with one writer per output file"""
+    writers = {}
+    def write(reads, name, index, tag):
+        for read in reads:
+            read[0] = read[0] + "{}:{}:".format(index, tag)
+        if name not in writers:
+            writers[name] = [FastQWriter(os.path.join(outdir, "{}_R{}.fastq".format(name, r))) for r in (1, 2)]
+        for fh, read in zip(writers[name], reads):
+            fh.write(read)
+    counts = collections.Counter()
+    for read_1, read_2, read_ind in itertools.izip(*map(FastQParser, (read_1_fq, read_2_fq, read_index_fq))):
+        read_ind_seq = read_ind[1]
+        matches_dict = collections.defaultdict(list)
+        for supplied_index in sorted(index_dict.keys(), key=lambda x: (-len(x))):
+            mismatches = find_dist(supplied_index, read_ind_seq, max_mismatches)
+            matches_dict[mismatches].append(supplied_index)
+            if mismatches == 0:
+                break
+        for x in range(0, max_mismatches+1):
+            if matches_dict.get(x):
+                if len(matches_dict.get(x)) == 1:
+                    index_seq = matches_dict[x][0]
+                    write((read_1, read_2), index_dict[index_seq] or index_seq, index_seq, read_ind_seq[len(index_seq):])
+                    counts['match'] += 1
+                    if not x == 0:
+                        counts['corrected'] += 1
+                else:
+                    write((read_1, read_2), "Ambiguous", ",".join(matches_dict.get(x)), read_ind_seq)
+                    counts['ambiguous'] += 1
+                break
+        else:
+            write((read_1, read_2), "Undetermined", "", read_ind_seq)
+            counts['undetermined'] += 1
+        counts['processed'] += 1
+    for fhs in writers.values():
+        for fh in fhs:
+            fh.close()
+    return counts
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark demultiplexing of HaloPlex reads with molecular tags")
+    parser.add_argument('-n','--records', type=int, default=200000, help="number of read pairs. Default is 200000")
+    parser.add_argument('-s','--samples', type=int, default=96, help="number of indexes. Default is 96")
+    parser.add_argument('-m','--mismatches', type=int, default=1, help="number of mismatches. Default is 1")
+    parser.add_argument('-p','--processes', type=int, default=4, help="number of worker processes. Default is 4")
+    args = parser.parse_args()
+
+    tmpdir = tempfile.mkdtemp(prefix="bench_mctag_")
+    try:
+        indexes = dict(("".join([random.choice("ACGT") for i in xrange(random.choice([8, 10]))]), "Sample_{}".format(n))
+                       for n in xrange(args.samples))
+        fq1, fq2, fqi = [os.path.join(tmpdir,"lane_{}.fastq.gz".format(r)) for r in ["R1", "R2", "I1"]]
+        nbytes = write_fastq(fq1, args.records, read=1)
+        nbytes += write_fastq(fq2, args.records, read=2)
+        choices = indexes.keys() + ["".join([random.choice("ACGT") for i in xrange(8)])]
+        with gzip.open(fqi, "wb") as fh:
+            for n in xrange(args.records):
+                seq = "".join([random.choice("ACGTN") if random.random() < 0.02 else c
+                               for c in random.choice(choices) + "".join([random.choice("ACGT") for i in xrange(10)])])
+                fh.write("@SN1234:101:C0FFEEACXX:1:1101:{}:{} 2:N:0:\n{}\n+\n{}\n".format(1000 + n//10000, 1000 + n%10000, seq, "I"*len(seq)))
+        print "{} read pairs, {} indexes, {:.1f} MB uncompressed".format(args.records, len(indexes), nbytes/1024.**2)
+        results = []
+        for label, processes in [("previous parse_readset_byindexdict", None),
+                                 ("MolecularTagDemultiplexer", 1),
+                                 ("{} processes".format(args.processes), args.processes)]:
+            outdir = os.path.join(tmpdir,label.replace(" ","_"))
+            os.mkdir(outdir)
+            if processes is None:
+                counts, secs = timed(previous_demultiplex, outdir, fq1, fq2, fqi, indexes, args.mismatches)
+            else:
+                dmx = MolecularTagDemultiplexer(outdir, indexes, args.mismatches, processes=processes)
+                _, secs = timed(dmx.run, fq1, fq2, fqi)
+                counts = dmx.counts
+            report(label, secs, args.records, nbytes)
+            results.append((dict(counts), dict((f, open(os.path.join(outdir, f)).read()) for f in os.listdir(outdir))))
+        assert results[0] == results[1] == results[2], "Demultiplexed output differs"
+    finally:
+        shutil.rmtree(tmpdir)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,67 @@
+"""Reading Picard metrics files with the typed reader, with and without
+the metrics cache, compared to converting the files cell by cell, over
+synthetic insert size metrics files
+"""
+import argparse
+import os
+import re
+import shutil
+import tempfile
+
+import pandas as pd
+
+from scilifelab.io.pandas.picard import read_metrics, _convert_input
+from tests.benchmarks import timed, report
+
+def write_insert_metrics(fn, hist_rows):
+    """Write an insert size metrics file with a histogram of hist_rows rows"""
+    with open(fn, "w") as fh:
+        fh.write("## net.sf.picard.metrics.StringHeader\n# net.sf.picard.analysis.CollectInsertSizeMetrics INPUT=sample.bam\n\n")
+        fh.write("## METRICS CLASS\tnet.sf.picard.analysis.InsertSizeMetrics\n")
+        fh.write("MEDIAN_INSERT_SIZE\tMEDIAN_ABSOLUTE_DEVIATION\tMEAN_INSERT_SIZE\tSTANDARD_DEVIATION\tREAD_PAIRS\tPAIR_ORIENTATION\tSAMPLE\n")
+        fh.write("180\t25\t185.532\t40.1\t19517198\tFR\t\n\n")
+        fh.write("## HISTOGRAM\tjava.lang.Integer\ninsert_size\tAll_Reads.fr_count\n")
+        fh.write("".join(["{}\t{}\n".format(n, (n * 7919) % 100000) for n in xrange(hist_rows)]))
+        fh.write("\n")
+
+def cellwise_metrics(f):
+    """Read a metrics file converting each cell with regular expressions"""
+    with open(f) as fh:
+        data = fh.readlines()
+    i_hist = [i for i, x in enumerate(data) if "## HISTOGRAM" in x][0]
+    tables = []
+    for lines in [data[0:i_hist], data[i_hist:]]:
+        tmp = [[_convert_input(y) for y in x.rstrip("\n").split("\t")] for x in lines if not re.match("^[ #\n]", x)]
+        tables.append(pd.DataFrame(tmp[1:], columns=tmp[0]))
+    return tuple(tables)
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark reading Picard metrics files")
+    parser.add_argument('-n','--files', type=int, default=50, help="number of metrics files. Default is 50")
+    parser.add_argument('-r','--rows', type=int, default=20000, help="number of histogram rows per file. Default is 20000")
+    args = parser.parse_args()
+
+    rootdir = tempfile.mkdtemp(prefix="bench_picard_")
+    try:
+        files = [os.path.join(rootdir, "{}_120924_AC003CCCXX_{}-sort-dup.insert_metrics".format(n % 8 + 1, n)) for n in xrange(args.files)]
+        for fn in files:
+            write_insert_metrics(fn, args.rows)
+        nbytes = sum(os.path.getsize(x) for x in files)
+        cachedir = os.path.join(rootdir, "cache")
+        print "{} files with {} histogram rows, {:.1f} MB".format(args.files, args.rows, nbytes / 1024.0**2)
+
+        expected, secs = timed(lambda: [cellwise_metrics(f) for f in files])
+        report("cell by cell", secs, args.files, nbytes)
+        observed, secs = timed(lambda: [read_metrics(f) for f in files])
+        report("typed reader", secs, args.files, nbytes)
+        _, secs = timed(lambda: [read_metrics(f, cachedir) for f in files])
+        report("typed reader, filling cache", secs, args.files, nbytes)
+        cached, secs = timed(lambda: [read_metrics(f, cachedir) for f in files])
+        report("typed reader, from cache", secs, args.files, nbytes)
+        for x, y, z in zip(expected, observed, cached):
+            assert all(a.equals(b) and a.equals(c) for a, b, c in zip(x, y, z)), "Metrics differ from cell by cell metrics"
+    finally:
+        shutil.rmtree(rootdir)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,42 @@
+"""Per-read quality statistics with QualityBatch compared to the per-record
+avgQ and gtQ30 functions
+"""
+import argparse
+import os
+import shutil
+import tempfile
+
+from scilifelab.utils.fastq_utils import FastQParser, avgQ, gtQ30
+from scilifelab.utils.quality import QualityBatch
+from tests.benchmarks import timed, report, write_fastq
+
+def per_record(records):
+    return [avgQ(r) for r in records], [gtQ30(r) for r in records]
+
+def batched(records):
+    batch = QualityBatch.from_records(records)
+    return batch.avgQ(), batch.gtQ30()
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark per-read quality statistics")
+    parser.add_argument('-n','--records', type=int, default=500000, help="number of synthetic records. Default is 500000")
+    args = parser.parse_args()
+
+    tmpdir = tempfile.mkdtemp(prefix="bench_quality_")
+    try:
+        fname = os.path.join(tmpdir,"bench.fastq")
+        write_fastq(fname, args.records)
+        records = [r for r in FastQParser(fname)]
+        print "{} records".format(args.records)
+        expected, secs = timed(per_record, records)
+        report("avgQ and gtQ30", secs, args.records)
+        observed, secs = timed(batched, records)
+        assert observed == expected, "Batch statistics differ from the per-record functions"
+        report("QualityBatch", secs, args.records)
+        _, secs = timed(lambda r: QualityBatch.from_records(r).cycle_histogram(), records)
+        report("QualityBatch.cycle_histogram", secs, args.records)
+    finally:
+        shutil.rmtree(tmpdir)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,55 @@
+"""Reporting the archive removal status of flowcells with concurrent
+ichksum commands and the state file, compared to one ichksum at a time,
+using the iRODS stubs in tests/lib/bin with a delay per ichksum call
+"""
+import argparse
+import os
+import shutil
+import tempfile
+
+from scilifelab.lib.archive import flowcell_remove_status
+from tests.benchmarks import timed, report
+
+BINDIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "lib", "bin")
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the archive removal status report")
+    parser.add_argument('-n','--flowcells', type=int, default=200, help="number of flowcells. Default is 200")
+    parser.add_argument('-d','--delay', type=float, default=0.1, help="seconds per ichksum call. Default is 0.1")
+    parser.add_argument('-w','--workers', type=int, default=16, help="number of concurrent ichksum commands. Default is 16")
+    args = parser.parse_args()
+
+    rootdir = tempfile.mkdtemp(prefix="bench_remove_status_")
+    try:
+        archive_dir, swestore_dir, irods = [os.path.join(rootdir, x) for x in ["archive", "swestore", "irods"]]
+        for d in [os.path.join(archive_dir, "compress_logs"), os.path.join(swestore_dir, "drophere2archive"), irods]:
+            os.makedirs(d)
+        flowcells = ["1209{:02d}_SN0001_{:04d}_AC{:03d}ACXX".format(n % 28 + 1, n, n) for n in xrange(args.flowcells)]
+        with open(os.path.join(archive_dir, "to_remove"), "w") as fh:
+            fh.write("".join(["./{}\n".format(fc) for fc in flowcells]))
+        for i, fc in enumerate(flowcells):
+            os.makedirs(os.path.join(archive_dir, fc))
+            with open(os.path.join(archive_dir, "compress_logs", "slurm-{}.out".format(i)), "w") as fh:
+                fh.write("Compressing {}...\n{}Exit code: 0\n".format(fc, "adding file\n" * 10000))
+            with open(os.path.join(swestore_dir, "drophere2archive", "{}.tar.bz2".format(fc)), "w") as fh:
+                fh.write(fc)
+            with open(os.path.join(irods, "{}.tar.bz2".format(fc)), "w") as fh:
+                fh.write("{:032x}".format(i))
+        os.environ["PATH"] = "{}:{}".format(BINDIR, os.environ["PATH"])
+        os.environ["ICHKSUM_DATA"] = irods
+        os.environ["ICHKSUM_DELAY"] = str(args.delay)
+        print "{} flowcells, {} s per ichksum".format(args.flowcells, args.delay)
+
+        state_file = lambda name: os.path.join(rootdir, "{}.json".format(name))
+        expected, secs = timed(flowcell_remove_status, archive_dir, swestore_dir, workers=1, state_file=state_file("serial"))
+        report("one ichksum at a time", secs, args.flowcells)
+        observed, secs = timed(flowcell_remove_status, archive_dir, swestore_dir, workers=args.workers, state_file=state_file("concurrent"))
+        report("{} concurrent ichksum".format(args.workers), secs, args.flowcells)
+        cached, secs = timed(flowcell_remove_status, archive_dir, swestore_dir, workers=args.workers, state_file=state_file("concurrent"))
+        report("unchanged, from state file", secs, args.flowcells)
+        assert expected['stdout'].getvalue() == observed['stdout'].getvalue() == cached['stdout'].getvalue(), "Reports differ"
+    finally:
+        shutil.rmtree(rootdir)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,73 @@
+"""Replicating several databases concurrently with _bulk_docs batches
+and resuming from checkpoints, compared to one database at a time,
+using in-memory databases with a delay per request
+"""
+import argparse
+import os
+import shutil
+import tempfile
+import time
+
+from scilifelab.db.replication import Checkpoints, replicate
+from tests.benchmarks import timed, report
+from tests.classes import FakeResource, RevisionTreeCouchDatabase
+
+class SlowResource(FakeResource):
+    def post_json(self, *args, **kw):
+        time.sleep(self.db.delay)
+        return super(SlowResource, self).post_json(*args, **kw)
+
+class SlowCouchDatabase(RevisionTreeCouchDatabase):
+    """In-memory database with a delay per changes, _bulk_get and _bulk_docs request"""
+    delay = 0.05
+    def __init__(self, *args, **kw):
+        super(SlowCouchDatabase, self).__init__(*args, **kw)
+        self.resource = SlowResource(self)
+
+    def changes(self, *args, **kw):
+        time.sleep(self.delay)
+        return super(SlowCouchDatabase, self).changes(*args, **kw)
+
+    def update(self, *args, **kw):
+        time.sleep(self.delay)
+        return super(SlowCouchDatabase, self).update(*args, **kw)
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark couchdb replication")
+    parser.add_argument('-n','--databases', type=int, default=8, help="number of databases. Default is 8")
+    parser.add_argument('-d','--docs', type=int, default=5000, help="documents per database. Default is 5000")
+    parser.add_argument('--delay', type=float, default=0.05, help="seconds per request. Default is 0.05")
+    parser.add_argument('-w','--workers', type=int, default=8, help="number of concurrent databases. Default is 8")
+    parser.add_argument('-b','--batch-size', type=int, default=500, help="changes per batch. Default is 500")
+    args = parser.parse_args()
+
+    SlowCouchDatabase.delay = args.delay
+    sources = []
+    for n in xrange(args.databases):
+        db = SlowCouchDatabase("db{}".format(n), {})
+        for i in xrange(args.docs):
+            db.save({"_id":"doc{}".format(i), "_rev":"1-{:032x}".format(i), "n":i})
+        sources.append(db)
+    print "{} databases of {} documents, {} s per request".format(args.databases, args.docs, args.delay)
+
+    rootdir = tempfile.mkdtemp(prefix="bench_replication_")
+    try:
+        jobs = lambda: [(db, SlowCouchDatabase(db.name, {}), db.name) for db in sources]
+        serial_jobs = jobs()
+        _, secs = timed(replicate, serial_jobs, workers=1, batch_size=args.batch_size)
+        report("one database at a time", secs, args.databases * args.docs)
+        checkpoints = Checkpoints(os.path.join(rootdir, "checkpoints.json"))
+        concurrent_jobs = jobs()
+        _, secs = timed(replicate, concurrent_jobs, workers=args.workers, checkpoints=checkpoints, batch_size=args.batch_size)
+        report("{} concurrent databases".format(args.workers), secs, args.databases * args.docs)
+        for db in sources[0:2]:
+            db.save({"_id":"doc0", "_rev":"2-{:032x}".format(0), "n":0})
+        resumed, secs = timed(replicate, concurrent_jobs, workers=args.workers, checkpoints=checkpoints, batch_size=args.batch_size)
+        report("resumed from checkpoints", secs, sum(n for _, n in resumed))
+        assert all(s.docs == t.docs for (s, t, _) in concurrent_jobs), "Replicated documents differ"
+        assert all(s.docs["doc1"] == t.docs["doc1"] for (s, t, _) in serial_jobs), "Replicated documents differ"
+    finally:
+        shutil.rmtree(rootdir)
+
+if __name__ == "__main__":
+    main()
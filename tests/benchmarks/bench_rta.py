@@ -0,0 +1,120 @@
+"""Parsing the RTA xml files of a run with targeted discovery, parsing
+in worker processes and chart values in arrays, compared to walking the
+whole run folder and parsing the charts serially to nested dictionaries,
+over a synthetic run folder with the layout of a HiSeq X run
+"""
+import argparse
+import os
+import shutil
+import tempfile
+import xml.parsers.expat
+
+import numpy as np
+
+from scilifelab.bcbio.qc import FlowcellRunMetricsParser, IlluminaXMLParser, RTA_CHARTS
+from tests.benchmarks import timed, report
+
+BASES = "ACGT"
+
+def write_run(rundir, lanes, tiles, cycles):
+    """Write a run folder with empty base call files for each lane, cycle
+    and tile, and RTA reports with one chart file per cycle"""
+    basecalls = os.path.join(rundir, "Data", "Intensities", "BaseCalls")
+    for lane in xrange(1, lanes + 1):
+        for cycle in xrange(1, cycles + 1):
+            cycledir = os.path.join(basecalls, "L{:03d}".format(lane), "C{}.1".format(cycle))
+            os.makedirs(cycledir)
+            for tile in xrange(1, tiles + 1):
+                open(os.path.join(cycledir, "s_{}_{}.bcl.gz".format(lane, tile)), "w").close()
+    for fn in [os.path.join(rundir, "Data", "Intensities", "config.xml"), os.path.join(basecalls, "config.xml")]:
+        with open(fn, "w") as fh:
+            fh.write('<?xml version="1.0"?>\n<ImageAnalysis/>\n')
+
+    reports = os.path.join(rundir, "Data", "reports")
+    for d in ["Summary"] + RTA_CHARTS:
+        os.makedirs(os.path.join(reports, d))
+    for read in [1, 2, 3]:
+        with open(os.path.join(reports, "Summary", "read{}.xml".format(read)), "w") as fh:
+            fh.write('<?xml version="1.0"?>\n<Summary Read="{}">\n'.format(read))
+            fh.write("".join(['<Lane key="{}" ClustersRaw="{}" ClustersPF="{}"/>\n'.format(lane, 1000 * lane, 900 * lane) for lane in xrange(1, lanes + 1)]))
+            fh.write('</Summary>\n')
+    with open(os.path.join(reports, "NumClusters By Lane.xml"), "w") as fh:
+        fh.write('<?xml version="1.0"?>\n<Data Type="Clusters">\n')
+        fh.write("".join(['<Lane key="{}" Clusters="{}"/>\n'.format(lane, 1000 * lane) for lane in xrange(1, lanes + 1)]))
+        fh.write('</Data>\n')
+    layout = '<?xml version="1.0"?>\n<FlowCellData Version="1">\n<Layout NumLanes="{}" RowsPerLane="{}" ColsPerLane="1"/>\n'.format(lanes, tiles)
+    tl = "".join(['<TL Key="{}_{}" Val="{{:.2f}}"/>\n'.format(lane, tile) for lane in xrange(1, lanes + 1) for tile in xrange(1, tiles + 1)])
+    for cycle in xrange(1, cycles + 1):
+        charts = [("ErrorRate", "Chart_{}.xml".format(cycle)), ("NumGT30", "Chart_{}.xml".format(cycle))]
+        charts += [(chart, "Chart_{}_{}.xml".format(cycle, base.lower())) for chart in ["FWHM", "Intensity"] for base in BASES]
+        for chart, fn in charts:
+            with open(os.path.join(reports, chart, fn), "w") as fh:
+                fh.write(layout)
+                fh.write(tl.format(*[(cycle + n) % 97 / 10.0 for n in xrange(lanes * tiles)]))
+                fh.write('</FlowCellData>\n')
+
+def walk_xml_files(rundir):
+    """Collect the xml files of a run by walking the whole run folder"""
+    fn = []
+    for root, dirs, files in os.walk(os.path.abspath(rundir)):
+        for f in files:
+            if f.endswith(".xml"):
+                fn.append(os.path.join(root, f))
+    return fn
+
+def nested_charts(files, lanes, tiles):
+    """Parse chart files to a nested dictionary per lane and tile"""
+    data = {"{}_{}".format(lane, tile):{} for lane in xrange(1, lanes + 1) for tile in xrange(1, tiles + 1)}
+    for f in files:
+        index = os.path.basename(f).rstrip(".xml").lstrip("Chart_")
+        def start_element(name, attrs):
+            if name == "TL":
+                for k in attrs.keys():
+                    if k != "Key":
+                        data[attrs["Key"]][index] = None if attrs[k] == "NaN" else float(attrs[k])
+        p = xml.parsers.expat.ParserCreate()
+        p.StartElementHandler = start_element
+        with open(f) as fh:
+            p.ParseFile(fh)
+    return data
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark parsing RTA xml files")
+    parser.add_argument('-l','--lanes', type=int, default=8, help="number of lanes. Default is 8")
+    parser.add_argument('-t','--tiles', type=int, default=96, help="number of tiles per lane. Default is 96")
+    parser.add_argument('-c','--cycles', type=int, default=302, help="number of cycles. Default is 302")
+    parser.add_argument('-w','--workers', type=int, default=4, help="number of worker processes. Default is 4")
+    args = parser.parse_args()
+
+    rundir = tempfile.mkdtemp(prefix="bench_rta_")
+    try:
+        _, secs = timed(write_run, rundir, args.lanes, args.tiles, args.cycles)
+        print "{} lanes, {} tiles, {} cycles; run folder written in {:.1f} s".format(args.lanes, args.tiles, args.cycles, secs)
+
+        files, secs = timed(lambda: sorted(walk_xml_files(rundir)))
+        report("walk run folder", secs, len(files))
+        expected, secs = timed(IlluminaXMLParser().parse, files, True)
+        report("serial parse", secs, len(files))
+        fc_parser = FlowcellRunMetricsParser(rundir)
+        observed, secs = timed(fc_parser.parse_illumina_metrics, True, args.workers)
+        report("reports with {} workers".format(args.workers), secs, len(files))
+
+        assert observed["Summary"] == expected["Summary"], "Summary data differ"
+        assert observed["NumClusters"] == expected["NumClusters"], "Cluster data differ"
+        for chart in RTA_CHARTS:
+            assert observed[chart]["charts"] == expected[chart]["charts"], "Chart indexes differ for {}".format(chart)
+            assert np.array_equal(observed[chart]["values"], expected[chart]["values"]), "Chart values differ for {}".format(chart)
+
+        chart_files = {chart:[f for f in files if os.path.basename(os.path.dirname(f)) == chart] for chart in RTA_CHARTS}
+        nested, secs = timed(lambda: {chart:nested_charts(chart_files[chart], args.lanes, args.tiles) for chart in RTA_CHARTS})
+        report("nested dictionary charts", secs, sum(len(x) for x in chart_files.values()))
+        for chart in RTA_CHARTS:
+            values = observed[chart]["values"]
+            for i, index in enumerate(observed[chart]["charts"]):
+                assert nested[chart]["{}_{}".format(args.lanes, args.tiles)][index] == values[i, -1, -1], "Nested chart values differ from arrays"
+        print "chart arrays: {:.1f} MB".format(sum(observed[chart]["values"].nbytes for chart in RTA_CHARTS) / 1024.0**2)
+    finally:
+        shutil.rmtree(rundir)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,155 @@
+"""Collecting the status of flowcells with one squeue call, an index of the
+indicator files of each sample and a pool of flowcell workers, compared to
+the previous per sample squeue calls and indicator file globbing, with a
+stub slurm with a delay per call
+"""
+import argparse
+import datetime
+import os
+import shutil
+import tempfile
+import time
+
+import scilifelab.bcbio.filesystem as bcbio
+import scilifelab.bcbio.status as st
+from scilifelab.illumina import IlluminaRun
+from scilifelab.illumina.hiseq import HiSeqRun
+from tests.benchmarks import timed, report
+from tests.generate_test_data import _write_samplesheet
+
+class StubSlurm(object):
+    """Stub of the slurm utilities with a delay per squeue call and drmaa session"""
+    def __init__(self, delay, jobs):
+        self.delay = delay
+        self.jobs = jobs
+        self.calls = 0
+
+    def get_slurm_jobid(self, jobname):
+        self.calls += 1
+        time.sleep(self.delay)
+        return [jobid for jobid, _ in self.jobs.get(jobname, [])]
+
+    def get_slurm_jobstatus(self, jobid):
+        self.calls += 1
+        time.sleep(self.delay)
+        return dict([job for jobs in self.jobs.values() for job in jobs])[jobid]
+
+    def get_slurm_jobs(self):
+        self.calls += 1
+        time.sleep(self.delay)
+        return self.jobs
+
+def previous_status(archive_dir, analysis_dir, flowcell, project, slurm):
+    """The previous status_query, listing and parsing the indicator files and
+    calling squeue and drmaa for each sample"""
+    last_step = 14
+    status = []
+    for fcdir in bcbio.get_flowcelldirs(archive_dir, flowcell):
+        fc_status = {'flowcell':os.path.basename(fcdir)}
+        samplesheet = IlluminaRun.get_samplesheet(fcdir)
+        fc_status['samplesheet'] = samplesheet
+        fc_status['projects'] = []
+        for proj in HiSeqRun.get_project_names(samplesheet):
+            proj_status = {'project':proj}
+            pdir = bcbio.get_project_analysis_dir(analysis_dir, proj)
+            if not pdir:
+                continue
+            proj_status['project_dir'] = pdir
+            proj_status['samples'] = []
+            proj_status['no_finished_samples'] = 0
+            samples = HiSeqRun.get_project_sample_ids(samplesheet, proj)
+            for smpl in samples:
+                sample_status = {'sample_id':smpl}
+                proj_status['samples'].append(sample_status)
+                sdir = bcbio.get_sample_analysis_dir(pdir, smpl)
+                if not sdir:
+                    continue
+                sample_status['sample_dir'] = sdir
+                sample_fc = [d for d in bcbio.get_flowcelldirs(sdir) if d.split("_")[-1] == fcdir.split("_")[-1]]
+                if len(sample_fc) == 0:
+                    continue
+                sample_fc = sample_fc[0]
+                sample_status['sample_fc_dir'] = sample_fc
+                fastq_screen = bcbio.get_fastq_screen_folder(sample_fc)
+                if fastq_screen:
+                    sample_status['fastq_screen'] = [fastq_screen, bcbio.fastq_screen_finished(fastq_screen)]
+                pipeline_start_indicator = bcbio.get_pipeline_indicator(sample_fc, [1])
+                if len(pipeline_start_indicator) == 0:
+                    continue
+                pipeline_start_indicator = pipeline_start_indicator[0]
+                most_recent, _ = bcbio.get_most_recent_indicator([pipeline_start_indicator])
+                sample_status['pipeline_started'] = [pipeline_start_indicator, most_recent]
+                most_recent, ifile = bcbio.get_most_recent_indicator(bcbio.get_pipeline_indicator(sample_fc))
+                sample_status['pipeline_progress'] = [ifile, most_recent]
+                sample_log = bcbio.get_sample_pipeline_log(sample_fc, smpl)
+                if not sample_log:
+                    continue
+                sample_status['pipeline_log'] = [sample_log, datetime.datetime.fromtimestamp(os.stat(sample_log).st_mtime)]
+                sample_status['slurm_job'] = [[jobid, slurm.get_slurm_jobstatus(jobid)] for jobid in slurm.get_slurm_jobid(smpl)]
+                most_recent, ifile = bcbio.get_most_recent_indicator(bcbio.get_pipeline_indicator(sample_fc, [last_step]))
+                if ifile is not None and sample_status.get('fastq_screen', [None, False])[1]:
+                    sample_status['finished'] = True
+                    proj_status['no_finished_samples'] += 1
+            if proj_status['no_finished_samples'] == len(samples):
+                proj_status['finished'] = True
+            fc_status['projects'].append(proj_status)
+        status.append(fc_status)
+    return status
+
+def make_tree(rootdir, flowcells, samples, steps):
+    """Create an archive with flowcells of one project each and the analysis
+    folders of the samples, with indicator files for each pipeline step"""
+    archive, analysis = os.path.join(rootdir, "archive"), os.path.join(rootdir, "analysis")
+    jobs = {}
+    for f in xrange(flowcells):
+        fcid = "A{:05d}ACXX".format(f)
+        fcdir = os.path.join(archive, "120101_SN1_0001_{}".format(fcid))
+        os.makedirs(fcdir)
+        proj = "J.Doe_00_{:02d}".format(f)
+        smpls = ["P{}_{}".format(f, 101 + n) for n in xrange(samples)]
+        _write_samplesheet([[fcid[1:], "1", smpl, "hg19", "ACGTAC", "", "N", "R1", "NN", proj.replace(".", "__")] for smpl in smpls],
+                           os.path.join(fcdir, "{}.csv".format(fcid)))
+        for n, smpl in enumerate(smpls):
+            sample_fc = os.path.join(analysis, proj, smpl, "120101_{}".format(fcid))
+            os.makedirs(os.path.join(sample_fc, "fastq_screen"))
+            for step in xrange(1, 1 + (steps if n % 2 == 0 else steps // 2)):
+                with open(os.path.join(sample_fc, "{:02d}_step.txt".format(step)), "w") as fh:
+                    fh.write("{}\n".format(datetime.datetime.fromtimestamp(1000. * step).isoformat()))
+            for fname, content in [("{}-bcbb.log".format(smpl), "log\n"),
+                                   (os.path.join("fastq_screen", "{}_screen.txt".format(smpl)), "header\nrow\n"),
+                                   (os.path.join("fastq_screen", "{}_screen.png".format(smpl)), "")]:
+                with open(os.path.join(sample_fc, fname), "w") as fh:
+                    fh.write(content)
+            if n % 2 == 1:
+                jobs[smpl] = [(len(jobs) + 1, "running")]
+    return archive, analysis, jobs
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the bcbio status query")
+    parser.add_argument('-n','--flowcells', type=int, default=8, help="number of flowcells. Default is 8")
+    parser.add_argument('-s','--samples', type=int, default=48, help="samples per flowcell. Default is 48")
+    parser.add_argument('--steps', type=int, default=14, help="pipeline steps of finished samples. Default is 14")
+    parser.add_argument('-d','--delay', type=float, default=0.02, help="seconds per squeue call or drmaa session. Default is 0.02")
+    parser.add_argument('-w','--workers', type=int, default=8, help="number of concurrent flowcells. Default is 8")
+    args = parser.parse_args()
+
+    rootdir = tempfile.mkdtemp(prefix="bench_status_query_")
+    try:
+        archive, analysis, jobs = make_tree(rootdir, args.flowcells, args.samples, args.steps)
+        print "{} flowcells of {} samples, {} s per slurm call".format(args.flowcells, args.samples, args.delay)
+        slurm = StubSlurm(args.delay, jobs)
+        previous, secs = timed(previous_status, archive, analysis, "ACXX", None, slurm)
+        report("previous status_query", secs, args.flowcells * args.samples)
+        print "  {} slurm calls".format(slurm.calls)
+        st.slurm = slurm = StubSlurm(args.delay, jobs)
+        status, secs = timed(st.get_status, archive, analysis, "ACXX", None, workers=args.workers)
+        report("snapshot, {} workers".format(args.workers), secs, args.flowcells * args.samples)
+        print "  {} slurm calls".format(slurm.calls)
+        _, secs = timed(st.get_status, archive, analysis, "ACXX", None, workers=args.workers)
+        report("snapshot, parsed indicators", secs, args.flowcells * args.samples)
+        assert st.status_to_json(sorted(previous)) == st.status_to_json(sorted(status)), "Status differs"
+    finally:
+        shutil.rmtree(rootdir)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,91 @@
+"""Sample run and barcode lane statistics lookups with the indexed
+connection views compared to scanning the whole views on each call, over
+a synthetic samples view
+"""
+import argparse
+import random
+
+from scilifelab.db.statusdb import SampleRunMetricsConnection, FlowcellRunMetricsConnection, _sample_view_map, _barcode_lane_stat_map
+from scilifelab.log import minimal_logger
+from tests.benchmarks import timed, report
+from tests.classes import FakeCouchDatabase
+
+def _connection(cls, db, **views):
+    """Set up a connection on db without connecting to a server"""
+    con = cls.__new__(cls)
+    con.db = db
+    con.cachedir = None
+    con.log = minimal_logger(__name__)
+    con.batch_size = 500
+    con._entries = {}
+    con._views = []
+    con._stat_index = {}
+    for attr, args in views.items():
+        setattr(con, attr, con.view(*args))
+    return con
+
+def scan_sample_ids(name_fc_view, name_proj_view, fc_id, sample_prj):
+    """get_sample_ids as a scan over the flowcell and project views"""
+    fc_sample_ids = [name_fc_view[k].id for k in name_fc_view.keys() if name_fc_view[k].value == fc_id] if fc_id else []
+    prj_sample_ids = [name_proj_view[k].id for k in name_proj_view.keys() if name_proj_view[k].value == sample_prj] if sample_prj else []
+    if len(fc_sample_ids) > 0 and len(prj_sample_ids) > 0:
+        return list(set(fc_sample_ids) & set(prj_sample_ids))
+    return list(set(fc_sample_ids) | set(prj_sample_ids))
+
+def scan_lane_statistics(stat_view, project_id, sample_id, flowcell, lane):
+    """get_barcode_lane_statistics rebuilding the lookup on each call"""
+    stats = stat_view.get(flowcell)
+    stats_d = {"{}-{}-{}".format(item.get("Project", None).replace("__", "."),
+                                 item.get("Sample ID", None),
+                                 item.get("Lane", None)):item for item in stats}
+    sample_data = stats_d.get("{}-{}-{}".format(project_id, sample_id, lane), None)
+    if not sample_data:
+        return None, None
+    return sample_data.get('Mean Quality Score (PF)', None), sample_data.get('% of >= Q30 Bases (PF)', None)
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark statusdb sample run lookups")
+    parser.add_argument('-n','--sample-runs', type=int, default=100000, help="number of synthetic sample runs. Default is 100000")
+    parser.add_argument('-q','--queries', type=int, default=20, help="number of sample id queries. Default is 20")
+    args = parser.parse_args()
+
+    # Sample runs of 96 samples per project, over flowcells of 8 lanes
+    sample_views = {"names/name_fc": _sample_view_map(lambda doc: doc["flowcell"]),
+                    "names/name_proj": _sample_view_map(lambda doc: doc["sample_prj"]),
+                    "names/name_fc_proj": _sample_view_map(lambda doc: [doc["flowcell"], doc["sample_prj"]])}
+    db = FakeCouchDatabase("samples-bench", sample_views)
+    for n in xrange(args.sample_runs):
+        project, sample = divmod(n, 96)
+        flowcell = "FC{:06d}XX".format(n // 768)
+        db.docs["id{}".format(n)] = {"_id":"id{}".format(n), "flowcell":flowcell, "sample_prj":"J.Doe_{:05d}".format(project),
+                                     "name":"{}_120924_{}_index{}A".format((n % 768) // 96 + 1, flowcell, sample)}
+    name_fc_view = {row.key:row for row in db.view("names/name_fc")}
+    name_proj_view = {row.key:row for row in db.view("names/name_proj")}
+    s_con = _connection(SampleRunMetricsConnection, db, name_fc_proj_view=("names/name_fc_proj", "row"))
+    assert len(s_con.name_fc_proj_view) == args.sample_runs, "Unexpected number of sample runs in view"
+
+    queries = [("FC{:06d}XX".format(random.randint(0, args.sample_runs // 768)), "J.Doe_{:05d}".format(random.randint(0, args.sample_runs // 96))) for n in xrange(args.queries)]
+    print "{} sample runs, {} queries by flowcell and by project".format(args.sample_runs, args.queries)
+    expected, secs = timed(lambda: [sorted(scan_sample_ids(name_fc_view, name_proj_view, fc, None) + scan_sample_ids(name_fc_view, name_proj_view, None, prj)) for fc, prj in queries])
+    report("scan get_sample_ids", secs, 2*args.queries)
+    observed, secs = timed(lambda: [sorted(s_con.get_sample_ids(fc_id=fc) + s_con.get_sample_ids(sample_prj=prj)) for fc, prj in queries])
+    assert observed == expected, "Indexed sample ids differ from scanned sample ids"
+    report("indexed get_sample_ids", secs, 2*args.queries)
+
+    # A project note over 96 samples on 8 lanes of a flowcell
+    stats = [{"Project":"J__Doe_00_01", "Sample ID":"P001_{}".format(n), "Lane":str(lane),
+              "Mean Quality Score (PF)":"36.0", "% of >= Q30 Bases (PF)":"90.0"} for n in xrange(96) for lane in xrange(1, 9)]
+    fc_db = FakeCouchDatabase("flowcells-bench", {"names/Barcode_lane_stat": _barcode_lane_stat_map})
+    fc_db.save({"_id":"fc", "name":"120924_FC000000XX", "illumina":{"Demultiplex_Stats":{"Barcode_lane_statistics":stats}}})
+    stat_view = {row.key:row.value for row in fc_db.view("names/Barcode_lane_stat")}
+    fc_con = _connection(FlowcellRunMetricsConnection, fc_db, stat_view=("names/Barcode_lane_stat", "value"))
+    lookups = [("J.Doe_00_01", "P001_{}".format(n), "120924_FC000000XX", lane) for n in xrange(96) for lane in xrange(1, 9)]
+    print "{} barcode lane statistics lookups".format(len(lookups))
+    expected, secs = timed(lambda: [scan_lane_statistics(stat_view, *x) for x in lookups])
+    report("scan lane statistics", secs, len(lookups))
+    observed, secs = timed(lambda: [fc_con.get_barcode_lane_statistics(*x) for x in lookups])
+    assert observed == expected, "Indexed lane statistics differ from scanned lane statistics"
+    report("indexed lane statistics", secs, len(lookups))
+
+if __name__ == "__main__":
+    main()
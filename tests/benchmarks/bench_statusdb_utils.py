@@ -0,0 +1,62 @@
+"""Project _id lookups with keyed and batch view queries compared to
+scanning the whole project view for each project, over a synthetic
+projects database with a cost per request and per row returned
+"""
+import argparse
+import random
+import time
+
+from scilifelab.db.statusDB_utils import find_proj_from_view, find_projs_from_view
+from tests.benchmarks import timed, report
+from tests.classes import FakeCouchDatabase
+
+class SlowCouchDatabase(FakeCouchDatabase):
+    """In-memory database with an index per view, as in CouchDB, and a
+    delay per view query and per row returned"""
+    delay = 0.01
+    row_delay = 1e-5
+    def view(self, name, keys=None, **options):
+        self.queries += 1
+        if getattr(self, "_indexed", None) != self.seq:
+            self._index = {}
+            self._indexed = self.seq
+        if name not in self._index:
+            self._index[name] = super(SlowCouchDatabase, self).view(name)
+        rows = self._index[name]
+        if keys is not None:
+            keys = set(keys)
+            rows = [r for r in rows if r.key in keys]
+        time.sleep(self.delay + self.row_delay * len(rows))
+        return rows
+
+def scan_proj_from_view(proj_db, project_name):
+    """find_proj_from_view as a scan over the whole view"""
+    for proj in proj_db.view('project/project_name'):
+        if proj.key == project_name:
+            return proj.value
+    return None
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark statusdb project lookups")
+    parser.add_argument('-n','--projects', type=int, default=20000, help="number of projects in the database. Default is 20000")
+    parser.add_argument('-l','--lookups', type=int, default=50, help="number of projects looked up. Default is 50")
+    parser.add_argument('--delay', type=float, default=0.01, help="seconds per request. Default is 0.01")
+    args = parser.parse_args()
+
+    SlowCouchDatabase.delay = args.delay
+    proj_db = SlowCouchDatabase("projects", {"project/project_name": lambda doc: [(doc["project_name"], doc["_id"])]})
+    for i in xrange(args.projects):
+        proj_db.save({"_id":"{:032x}".format(i), "project_name":"J.Doe_{:02d}_{:03d}".format(i // 1000, i % 1000)})
+    names = ["J.Doe_{:02d}_{:03d}".format(i // 1000, i % 1000) for i in random.sample(xrange(args.projects), args.lookups)]
+    print "{} projects, {} lookups, {} s per request".format(args.projects, args.lookups, args.delay)
+
+    expected, secs = timed(lambda: dict((x, scan_proj_from_view(proj_db, x)) for x in names))
+    report("view scan per project", secs, args.lookups)
+    observed, secs = timed(lambda: dict((x, find_proj_from_view(proj_db, x)) for x in names))
+    report("keyed query per project", secs, args.lookups)
+    batch, secs = timed(find_projs_from_view, proj_db, names)
+    report("one batch query", secs, args.lookups)
+    assert expected == observed == batch, "Project _ids differ"
+
+if __name__ == "__main__":
+    main()
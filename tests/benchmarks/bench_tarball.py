@@ -0,0 +1,67 @@
+"""Packaging a run folder by writing the tarball and computing its
+checksums in one pass, compared to tar with a compression program
+followed by an md5sum of the tarball, over a synthetic run folder
+"""
+import argparse
+import os
+import shutil
+import string
+import subprocess
+import tempfile
+
+from scilifelab.utils.misc import md5sum
+from scilifelab.utils.tarball import write_tarball, extract_member
+from tests.benchmarks import timed, report
+
+FLOWCELL = "120924_SN0002_0003_CC003CCCXX"
+
+def tar_and_md5sum(tarball, root, name, compress_prog):
+    """Run tar with a compression program and compute the md5sum of the tarball"""
+    subprocess.check_call(["tar", "--use-compress-program={}".format(compress_prog), "-cf", tarball, "-C", root, name])
+    return md5sum(tarball)
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark packaging run folders")
+    parser.add_argument('-n','--files', type=int, default=64, help="number of files. Default is 64")
+    parser.add_argument('-s','--size', type=int, default=8, help="file size in MB. Default is 8")
+    parser.add_argument('-t','--threads', type=int, default=4, help="number of compression threads. Default is 4")
+    args = parser.parse_args()
+
+    rootdir = tempfile.mkdtemp(prefix="bench_tarball_")
+    try:
+        # Random bases, compressing to about a third as base calls do
+        block = os.urandom(1024 * 1024).translate(string.maketrans("".join(chr(x) for x in xrange(256)), "ACGT" * 64))
+        for n in xrange(args.files):
+            fcdir = os.path.join(rootdir, FLOWCELL, "Data", "Intensities", "BaseCalls", "L00{}".format(n % 8 + 1))
+            if not os.path.exists(fcdir):
+                os.makedirs(fcdir)
+            with open(os.path.join(fcdir, "s_{}_{}.bcl".format(n % 8 + 1, 1101 + n)), "wb") as fh:
+                for i in xrange(args.size):
+                    fh.write(block[i:] + block[:i])
+        nbytes = args.files * args.size * 1024 * 1024
+        print "{} files of {} MB".format(args.files, args.size)
+
+        tarball = os.path.join(rootdir, "tar.tar.gz")
+        expected, secs = timed(tar_and_md5sum, tarball, rootdir, FLOWCELL, "gzip")
+        report("tar | gzip, md5sum", secs, args.files, nbytes)
+        print "  {:.1f} MB written and read back".format(os.path.getsize(tarball) / 1024.0**2)
+        streamed = os.path.join(rootdir, "stream.tar.gz")
+        sums, secs = timed(write_tarball, streamed, rootdir, FLOWCELL, threads=1)
+        report("streaming package", secs, args.files, nbytes)
+        print "  {:.1f} MB written".format(os.path.getsize(streamed) / 1024.0**2)
+        threaded = os.path.join(rootdir, "threads.tar.gz")
+        sums_threaded, secs = timed(write_tarball, threaded, rootdir, FLOWCELL, threads=args.threads, checksums=("md5", "sha256"))
+        report("streaming package, {} threads".format(args.threads), secs, args.files, nbytes)
+        assert sums["md5"] == md5sum(streamed) and sums_threaded["md5"] == md5sum(threaded), "md5sums differ"
+        members = lambda x: sorted(subprocess.check_output(["tar", "-tzf", x]).split())
+        assert members(tarball) == members(threaded), "Members differ"
+
+        member = os.path.join(FLOWCELL, "Data", "Intensities", "BaseCalls", "L008", "s_8_{}.bcl".format(1101 + args.files - 1))
+        data, secs = timed(extract_member, threaded, member)
+        report("extract last member from index", secs)
+        assert data == subprocess.check_output(["tar", "-xzOf", tarball, member]), "Extracted member differs"
+    finally:
+        shutil.rmtree(rootdir)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,59 @@
+"""Delivering files by copying them while computing their md5sums,
+compared to checksumming the source, copying it and checksumming the
+destination, over synthetic fastq files
+"""
+import argparse
+import os
+import shutil
+import tempfile
+
+from scilifelab.utils.misc import md5sum
+from scilifelab.utils.transfer import transfer_files
+from tests.benchmarks import timed, report
+
+def three_pass(sources, targets):
+    """Checksum the source, copy it and checksum the destination"""
+    res = []
+    for src, tgt in zip(sources, targets):
+        m = md5sum(src)
+        shutil.copy2(src, tgt)
+        res.append((m, md5sum(tgt)))
+    return res
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark delivering files with md5sums")
+    parser.add_argument('-n','--files', type=int, default=8, help="number of files. Default is 8")
+    parser.add_argument('-s','--size', type=int, default=256, help="file size in MB. Default is 256")
+    parser.add_argument('-w','--workers', type=int, default=4, help="number of concurrent transfers. Default is 4")
+    args = parser.parse_args()
+
+    rootdir = tempfile.mkdtemp(prefix="bench_transfer_")
+    try:
+        block = os.urandom(1024 * 1024)
+        sources = [os.path.join(rootdir, "{}_120924_AC003CCCXX_P001_101_{}.fastq.gz".format(n % 8 + 1, n)) for n in xrange(args.files)]
+        for fn in sources:
+            with open(fn, "wb") as fh:
+                for i in xrange(args.size):
+                    fh.write(block)
+        nbytes = args.files * args.size * 1024 * 1024
+        print "{} files of {} MB".format(args.files, args.size)
+        for d in ["three_pass", "single", "paranoid", "workers"]:
+            os.makedirs(os.path.join(rootdir, d))
+        targets = lambda d: [os.path.join(rootdir, d, os.path.basename(x)) for x in sources]
+
+        expected, secs = timed(three_pass, sources, targets("three_pass"))
+        report("md5sum, copy, md5sum", secs, args.files, nbytes)
+        single, secs = timed(transfer_files, sources, targets("single"))
+        report("copy and hash", secs, args.files, nbytes)
+        paranoid, secs = timed(transfer_files, sources, targets("paranoid"), verify=True)
+        report("copy and hash, paranoid", secs, args.files, nbytes)
+        concurrent, secs = timed(transfer_files, sources, targets("workers"), workers=args.workers)
+        report("copy and hash, {} workers".format(args.workers), secs, args.files, nbytes)
+
+        assert [x[0] for x in expected] == [x.md5 for x in single] == [x.md5 for x in concurrent], "md5sums differ"
+        assert [x[1] for x in expected] == [x.verified_md5 for x in paranoid], "Verified md5sums differ"
+    finally:
+        shutil.rmtree(rootdir)
+
+if __name__ == "__main__":
+    main()
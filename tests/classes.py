@@ -38,3 +38,195 @@ def has_couchdb_installation():
         time.sleep(1)
         pass
     return has_couchdb
+
+class FakeCouchDatabase(object):
+    """In-memory stand-in for a couchdb.Database, with python map
+    functions for views. Counts the queries and the view rows returned.
+
+    :param name: database name
+    :param views: dictionary of view names and map functions returning (key, value) pairs
+    """
+    def __init__(self, name, views):
+        self.name = name
+        self.views = views
+        self.docs = {}
+        self.deleted = {}
+        self.seq = 0
+        self.log = []
+        self.queries = 0
+        self.rows_returned = 0
+
+    def save(self, doc):
+        doc = dict(doc)
+        self.docs[doc["_id"]] = doc
+        self.seq += 1
+        self.log.append((self.seq, doc["_id"]))
+
+    def delete(self, docid):
+        self.deleted[docid] = self.docs.pop(docid).get("_rev")
+        self.seq += 1
+        self.log.append((self.seq, docid))
+
+    def update(self, docs, new_edits=True):
+        if not new_edits:
+            raise NotImplementedError("Use RevisionTreeCouchDatabase to write documents without new edits")
+        self.queries += 1
+        results = []
+        for doc in docs:
+            current = self.docs.get(doc["_id"], None)
+            if current is not None and current.get("_rev") != doc.get("_rev"):
+                results.append((False, doc["_id"], couchdb.ResourceConflict()))
+                continue
+            rev = "{}-x".format(int(current.get("_rev", "0").split("-")[0]) + 1 if current else 1)
+            self.save(dict(doc, _rev=rev))
+            results.append((True, doc["_id"], rev))
+        return results
+
+    def get(self, docid, default=None):
+        self.queries += 1
+        return self.docs.get(docid, default)
+
+    def info(self):
+        return {"db_name":self.name, "update_seq":self.seq}
+
+    def view(self, name, keys=None, startkey=None, endkey=None, include_docs=False, **options):
+        self.queries += 1
+        if name == "_all_docs":
+            rows = [couchdb.client.Row(id=k, key=k, doc=dict(self.docs[k])) if k in self.docs else couchdb.client.Row(key=k, error="not_found") for k in keys]
+            self.rows_returned += len(rows)
+            return rows
+        if name not in self.views:
+            raise couchdb.ResourceNotFound()
+        rows = sorted([couchdb.client.Row(id=docid, key=k, value=v) for docid, doc in self.docs.items() for k, v in self.views[name](doc)], key=lambda r: r.key)
+        if keys is not None:
+            rows = [r for r in rows if r.key in keys]
+        if startkey is not None:
+            rows = [r for r in rows if r.key >= startkey]
+        if endkey is not None:
+            rows = [r for r in rows if r.key <= endkey]
+        self.rows_returned += len(rows)
+        return rows
+
+    def changes(self, since=0, include_docs=False, limit=None, **options):
+        self.queries += 1
+        latest = {}
+        for seq, docid in self.log:
+            if seq > since:
+                latest[docid] = seq
+        results = []
+        for docid, seq in sorted(latest.items(), key=lambda x: x[1])[0:limit]:
+            change = {"id":docid, "seq":seq, "changes":[{"rev":self.docs[docid].get("_rev") if docid in self.docs else self.deleted.get(docid)}]}
+            if docid not in self.docs:
+                change["deleted"] = True
+                if include_docs:
+                    change["doc"] = {"_id":docid, "_rev":self.deleted.get(docid), "_deleted":True}
+            elif include_docs:
+                change["doc"] = dict(self.docs[docid])
+            results.append(change)
+        return {"results":results, "last_seq":results[-1]["seq"] if results else since}
+
+def _rev_key(rev):
+    pos, revid = rev.split("-", 1)
+    return int(pos), revid
+
+class FakeResource(object):
+    """Stand-in for the resource of a fake database, serving _bulk_get"""
+    def __init__(self, db):
+        self.db = db
+
+    def post_json(self, path=None, body=None, headers=None, **params):
+        if path != "_bulk_get":
+            raise couchdb.ResourceNotFound()
+        self.db.queries += 1
+        revs = params.get("revs") == "true"
+        results = []
+        for ref in body["docs"]:
+            doc = self.db._get_rev(ref["id"], ref["rev"], revs)
+            results.append({"id":ref["id"], "docs":[{"ok":doc} if doc is not None else {"error":{"id":ref["id"], "error":"not_found"}}]})
+        return 200, {}, {"results":results}
+
+class RevisionTreeCouchDatabase(FakeCouchDatabase):
+    """In-memory database that keeps the revision tree of each document,
+    as the leaf revisions with their history, like CouchDB. Documents
+    written without new edits extend a leaf if their revision history
+    includes it and add a conflicting leaf otherwise. docs holds the
+    winning revision of each document that is not deleted.
+    """
+    def __init__(self, name, views):
+        super(RevisionTreeCouchDatabase, self).__init__(name, views)
+        self.resource = FakeResource(self)
+        # Lists of (revision path, newest first, and body) by document id
+        self.leaves = {}
+
+    def _winner(self, docid):
+        return max(self.leaves[docid], key=lambda leaf: (not leaf[1].get("_deleted", False), _rev_key(leaf[0][0])))
+
+    def _store(self, docid, path, body):
+        leaves = self.leaves.setdefault(docid, [])
+        for i, (leaf_path, _) in enumerate(leaves):
+            if leaf_path[0] in path:
+                leaves[i] = (path, body)
+                break
+            if path[0] in leaf_path:
+                return
+        else:
+            leaves.append((path, body))
+        winner_path, winner = self._winner(docid)
+        if winner.get("_deleted"):
+            self.docs.pop(docid, None)
+            self.deleted[docid] = winner_path[0]
+        else:
+            self.docs[docid] = dict(winner, _id=docid, _rev=winner_path[0])
+            self.deleted.pop(docid, None)
+        self.seq += 1
+        self.log.append((self.seq, docid))
+
+    def _edit(self, docid, rev, body):
+        """Add a revision as a child of the winning revision"""
+        parent = self._winner(docid)[0] if docid in self.leaves else []
+        if rev is None:
+            rev = "{}-{:032x}".format(_rev_key(parent[0])[0] + 1 if parent else 1, self.seq + 1)
+        self._store(docid, [rev] + parent, body)
+
+    def save(self, doc):
+        body = dict((k, v) for k, v in doc.items() if k not in ("_id", "_rev"))
+        self._edit(doc["_id"], doc.get("_rev"), body)
+
+    def delete(self, docid):
+        self._edit(docid, None, {"_deleted":True})
+
+    def conflicts(self, docid):
+        """Return the conflicting revisions of a document"""
+        winner = self._winner(docid)[0][0]
+        return sorted([path[0] for path, body in self.leaves.get(docid, []) if not body.get("_deleted") and path[0] != winner])
+
+    def _get_rev(self, docid, rev, revs=False):
+        for path, body in self.leaves.get(docid, []):
+            if path[0] == rev:
+                doc = dict(body, _id=docid, _rev=rev)
+                if revs:
+                    doc["_revisions"] = {"start":_rev_key(rev)[0], "ids":[r.split("-", 1)[1] for r in path]}
+                return doc
+        return None
+
+    def get(self, docid, default=None, rev=None, revs=None, **options):
+        self.queries += 1
+        if rev is None:
+            return self.docs.get(docid, default)
+        doc = self._get_rev(docid, rev, revs == "true")
+        return default if doc is None else doc
+
+    def update(self, docs, new_edits=True):
+        if new_edits:
+            return super(RevisionTreeCouchDatabase, self).update(docs, new_edits)
+        self.queries += 1
+        for doc in docs:
+            if "_revisions" in doc:
+                start, ids = doc["_revisions"]["start"], doc["_revisions"]["ids"]
+                path = ["{}-{}".format(start - i, revid) for i, revid in enumerate(ids)]
+            else:
+                path = [doc["_rev"]]
+            body = dict((k, v) for k, v in doc.items() if k not in ("_id", "_rev", "_revisions"))
+            self._store(doc["_id"], path, body)
+        return []
+
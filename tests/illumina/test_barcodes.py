@@ -0,0 +1,123 @@
+"""Test suite for the barcodes module
+"""
+
+import unittest
+import random
+import tests.generate_test_data as td
+from scilifelab.illumina.barcodes import BarcodeIndex, PrefixIndex, neighbourhood, index_definitions_lookup
+from scilifelab.illumina.index_definitions import BASIC_LOOKUP
+from scilifelab.utils.string import hamming_distance
+
+class TestBarcodeIndex(unittest.TestCase):
+    
+    def setUp(self):
+        self.barcodes = {'index1': 'ATCACG',
+                         'index2': 'CGATGT',
+                         'index3': 'TTAGGC',
+                         'dual1': 'ATTACTCG-TATAGCCT'}
+    
+    def test_neighbourhood(self):
+        """Generate all sequences within a number of mismatches
+        """
+        for mismatches in range(3):
+            seqs = list(neighbourhood("ACGTAC",mismatches))
+            self.assertEqual(len(seqs),len(set([s for d, s in seqs])),
+                             "Neighbourhood contains duplicate sequences")
+            self.assertTrue(all([hamming_distance("ACGTAC",s) == d for d, s in seqs]),
+                            "Neighbourhood distances are not correct")
+        self.assertEqual(1+6*4+15*4*4,len(seqs),
+                         "Neighbourhood with two mismatches does not have the expected size")
+
+    def test_classify(self):
+        """Classify barcodes with and without mismatches
+        """
+        exact = BarcodeIndex(self.barcodes,0)
+        onemm = BarcodeIndex(self.barcodes,1)
+        for name, bc in self.barcodes.items():
+            expected = bc.replace("-","")
+            self.assertEqual(expected,exact.classify(bc),
+                             "Exact barcode was not classified correctly")
+            self.assertEqual([name],onemm.get_names(bc),
+                             "Exact barcode did not return the expected name")
+            mutated = "N{}".format(expected[1:])
+            self.assertIsNone(exact.classify(mutated),
+                              "Barcode with a mismatch should not be classified with exact matching")
+            self.assertEqual(expected,onemm.classify(mutated),
+                             "Barcode with a mismatch was not classified correctly")
+        self.assertEqual("ATTACTCGTATAGCCT",onemm.classify("ATTACTCG+TATAGCCT"),
+                         "Dual index with separator was not classified correctly")
+        self.assertIsNone(onemm.classify("GGGGGG"),
+                          "Unknown barcode should not be classified")
+        self.assertListEqual([None,"ATCACG","CGATGT"],onemm.classify_many(["GGGGGG","ATCACC","CGATGT"]),
+                             "Batch classification did not return the expected barcodes")
+        self.assertEqual(2,onemm.count(["ATCACC","ATCACG","GGGGGG"])["ATCACG"],
+                         "Batch counting did not return the expected counts")
+
+    def test_collisions(self):
+        """Detect sequences that are equally close to two barcodes
+        """
+        bci = BarcodeIndex({'a': 'AAAA', 'b': 'AATT'},1)
+        self.assertDictEqual({'AAAT': ['AAAA','AATT'], 'AATA': ['AAAA','AATT']},bci.collisions,
+                             "Collisions between barcodes were not detected")
+        self.assertIsNone(bci.classify("AAAT"),
+                          "Ambiguous barcode should not be classified")
+        self.assertEqual(2,len(bci.matches("AAAT")),
+                         "All matching barcodes were not returned")
+        self.assertEqual("AAAA",BarcodeIndex({'a': 'AAAA', 'b': 'AATT'},2).classify("AAAC"),
+                         "The closest barcode was not returned")
+
+    def test_index_definitions(self):
+        """Compare lookups in the index definitions to a full scan
+        """
+        bci = index_definitions_lookup(1)
+        for n in xrange(25):
+            query = td.generate_barcode(random.choice([6,8]))
+            expected = [name for name, seq in BASIC_LOOKUP.items() if len(seq) == len(query) and hamming_distance(seq,query) <= 1]
+            self.assertListEqual(sorted(expected),sorted(bci.matches(query)),
+                                 "Index lookup did not match a full scan")
+
+def scan_prefixes(indexes, seq, mismatches):
+    """Match the start of seq to each index, longest first, the way the
+    demultiplex_mctag script did before PrefixIndex
+    """
+    hits = {}
+    for index in sorted(indexes, key=lambda x: -len(x)):
+        d = hamming_distance(index[0:len(seq)], seq[0:len(index)])
+        hits.setdefault(d, []).append(index)
+        if d == 0:
+            break
+    for d in range(mismatches+1):
+        if d in hits:
+            return tuple(hits[d]), d
+    return (), None
+
+class TestPrefixIndex(unittest.TestCase):
+
+    def test_classify(self):
+        """Match indexes of different length followed by a molecular tag
+        """
+        pxi = PrefixIndex(["ACGTAC", "ACGTACGG", "TTTTGG"], 1)
+        self.assertEqual((("ACGTACGG",), 0), pxi.classify("ACGTACGGCCAA"),
+                         "The longest exact match was not returned")
+        self.assertEqual((("ACGTAC",), 0), pxi.classify("ACGTACTTCCAA"),
+                         "An exact match should take precedence over a longer index with a mismatch")
+        self.assertEqual((("TTTTGG",), 1), pxi.classify("TTTTGCAAAA"),
+                         "Index with a mismatch was not corrected")
+        self.assertEqual((("ACGTACGG", "ACGTAC"), 1), pxi.classify("ACGTAAGGCC"),
+                         "Equally close indexes should be ambiguous, longest first")
+        self.assertEqual(((), None), pxi.classify("GGGGGGGGGG"),
+                         "Unknown index should not be matched")
+        self.assertEqual((("TTTTGG",), 1), pxi.classify("TTT.GG"),
+                         "Index with characters outside of the alphabet was not corrected")
+
+    def test_scan(self):
+        """Compare lookups to a full scan of the indexes
+        """
+        indexes = list(set([td.generate_barcode(random.choice([6, 8])) for n in xrange(20)]))
+        for mismatches in range(3):
+            pxi = PrefixIndex(indexes, mismatches)
+            for n in xrange(200):
+                seq = random.choice(indexes) + td.generate_barcode(4)
+                seq = "".join([random.choice("ACGTN") if random.random() < 0.1 else c for c in seq])[0:random.choice([5, 14])]
+                self.assertEqual(scan_prefixes(indexes, seq, mismatches), pxi.classify(seq),
+                                 "Lookup of {} did not match a full scan".format(seq))
@@ -0,0 +1,98 @@
+"""Tests for reading Picard metrics files"""
+import os
+import glob
+import shutil
+import tempfile
+import unittest
+import numpy as np
+from scilifelab.io.pandas.picard import read_metrics, read_picard
+from scilifelab.bcbio.qc import ExtendedPicardMetricsParser
+
+HEADER = """## net.sf.picard.metrics.StringHeader
+# net.sf.picard.analysis.{} INPUT=sample.bam OUTPUT=sample.{}
+## net.sf.picard.metrics.StringHeader
+# Started on: Mon Sep 24 10:00:00 CEST 2012
+
+"""
+
+HS_METRICS = HEADER.format("directed.CalculateHsMetrics", "hs_metrics") + """## METRICS CLASS\tnet.sf.picard.analysis.directed.HsMetrics
+BAIT_SET\tGENOME_SIZE\tPF_UQ_BASES_ALIGNED\tON_TARGET_BASES\tMEAN_TARGET_COVERAGE\tZERO_CVG_TARGETS_PCT\tPCT_TARGET_BASES_10X\tSAMPLE
+agilent_v4\t3101804739\t1500000\t750000\t54.2\t0,0125\t0.91\t
+
+"""
+
+INSERT_METRICS = HEADER.format("CollectInsertSizeMetrics", "insert_metrics") + """## METRICS CLASS\tnet.sf.picard.analysis.InsertSizeMetrics
+MEDIAN_INSERT_SIZE\tMEAN_INSERT_SIZE\tPAIR_ORIENTATION
+180\t185.5\tFR
+
+## HISTOGRAM\tjava.lang.Integer
+insert_size\tAll_Reads.fr_count
+100\t10
+101\t12
+102\t9
+
+"""
+
+class TestPicardMetrics(unittest.TestCase):
+    """Test the typed and cached Picard metrics reader"""
+    def setUp(self):
+        self.rootdir = tempfile.mkdtemp(prefix="test_picard_")
+        self.cachedir = os.path.join(self.rootdir, "cache")
+        self.hs_metrics = os.path.join(self.rootdir, "1_120924_AC003CCCXX_1-sort.hs_metrics")
+        self.insert_metrics = os.path.join(self.rootdir, "1_120924_AC003CCCXX_1-sort-dup.insert_metrics")
+        for fn, data in [(self.hs_metrics, HS_METRICS), (self.insert_metrics, INSERT_METRICS)]:
+            with open(fn, "w") as fh:
+                fh.write(data)
+
+    def tearDown(self):
+        shutil.rmtree(self.rootdir)
+
+    def test_read_metrics(self):
+        """Read metrics and histograms with typed columns"""
+        metrics, hist = read_metrics(self.hs_metrics)
+        self.assertIsNone(hist, "Expected no histogram")
+        self.assertEqual(["BAIT_SET", "GENOME_SIZE", "PF_UQ_BASES_ALIGNED", "ON_TARGET_BASES", "MEAN_TARGET_COVERAGE", "ZERO_CVG_TARGETS_PCT", "PCT_TARGET_BASES_10X", "SAMPLE"],
+                         list(metrics.columns), "Unexpected columns")
+        self.assertEqual(3101804739, metrics.GENOME_SIZE.values[0], "Unexpected genome size")
+        self.assertEqual(np.int64, metrics.ON_TARGET_BASES.dtype, "Counts should be integers")
+        self.assertEqual(0.0125, metrics.ZERO_CVG_TARGETS_PCT.values[0], "Decimal commas should be read as points")
+        self.assertEqual("", metrics.SAMPLE.values[0], "Empty values should be strings")
+        metrics, hist = read_metrics(self.insert_metrics)
+        self.assertEqual([185.5], list(metrics.MEAN_INSERT_SIZE), "Unexpected mean insert size")
+        self.assertEqual("FR", metrics.PAIR_ORIENTATION.values[0], "Unexpected pair orientation")
+        self.assertEqual([100, 101, 102], list(hist.insert_size), "Unexpected histogram")
+
+    def test_cache(self):
+        """Parsed files are cached by path, inode, modification time and size"""
+        expected = read_metrics(self.insert_metrics)
+        observed = read_metrics(self.insert_metrics, self.cachedir)
+        self.assertEqual(1, len(glob.glob(os.path.join(self.cachedir, "*.npz"))), "Expected one cache file")
+        cached = read_metrics(self.insert_metrics, self.cachedir)
+        for x, y, z in zip(expected, observed, cached):
+            self.assertTrue(x.equals(y) and x.equals(z), "Cached metrics differ from metrics")
+        data, cached_data = read_picard(self.insert_metrics), read_picard(self.insert_metrics, self.cachedir)
+        self.assertEqual((data.header, data.metrics_class), (cached_data.header, cached_data.metrics_class), "Unexpected header of cached file")
+        self.assertTrue(np.array_equal(data.histogram[1], cached_data.histogram[1]), "Unexpected histogram of cached file")
+        # A modified file is parsed again
+        with open(self.insert_metrics, "w") as fh:
+            fh.write(INSERT_METRICS.replace("185.5", "190.25"))
+        os.utime(self.insert_metrics, (1400000000.123, 1400000000.123))
+        metrics, hist = read_metrics(self.insert_metrics, self.cachedir)
+        self.assertEqual([190.25], list(metrics.MEAN_INSERT_SIZE), "Modified file not parsed")
+        self.assertEqual(2, len(glob.glob(os.path.join(self.cachedir, "*.npz"))), "Expected a cache file for the modified file")
+        # Modification times are compared at full precision
+        with open(self.insert_metrics, "w") as fh:
+            fh.write(INSERT_METRICS.replace("185.5", "190.75"))
+        os.utime(self.insert_metrics, (1400000000.124, 1400000000.124))
+        metrics, hist = read_metrics(self.insert_metrics, self.cachedir)
+        self.assertEqual([190.75], list(metrics.MEAN_INSERT_SIZE), "Modified file of the same size not parsed")
+
+    def test_extract_metrics(self):
+        """Extract string metrics for qc documents"""
+        parser = ExtendedPicardMetricsParser(self.cachedir)
+        metrics = parser.extract_metrics([self.hs_metrics, self.insert_metrics])
+        self.assertEqual("# net.sf.picard.analysis.CollectInsertSizeMetrics INPUT=sample.bam OUTPUT=sample.insert_metrics", metrics["INS_command"], "Unexpected command")
+        self.assertEqual("185.5", metrics["INS_metrics"]["MEAN_INSERT_SIZE"], "Unexpected insert size")
+        self.assertEqual({"insert_size":["100", "101", "102"], "All_Reads.fr_count":["10", "12", "9"]}, metrics["INS_hist"], "Unexpected histogram")
+        self.assertEqual("0,0125", metrics["HS_metrics"]["ZERO_CVG_TARGETS_PCT"], "Unexpected hs metrics")
+        self.assertEqual(metrics, ExtendedPicardMetricsParser(self.cachedir).extract_metrics([self.hs_metrics, self.insert_metrics]), "Cached metrics differ")
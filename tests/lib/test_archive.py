@@ -0,0 +1,79 @@
+"""Tests for the archive library, with stubs for the iRODS commands in bin"""
+import os
+import shutil
+import tempfile
+import unittest
+
+from scilifelab.lib.archive import flowcell_remove_status, parse_compress_log, irods_checksum
+
+filedir = os.path.abspath(os.path.dirname(os.path.realpath(__file__)))
+FLOWCELLS = ["120829_SN0001_0001_AA001AAAXX", "120829_SN0001_0002_BB001BBBXX", "120924_SN0002_0003_CC003CCCXX"]
+
+class TestFlowcellRemoveStatus(unittest.TestCase):
+    def setUp(self):
+        self.rootdir = tempfile.mkdtemp(prefix="test_archive_")
+        self.archive_dir = os.path.join(self.rootdir, "archive")
+        self.swestore_dir = os.path.join(self.rootdir, "swestore")
+        self.irods = os.path.join(self.rootdir, "irods")
+        self.ichksum_log = os.path.join(self.rootdir, "ichksum.log")
+        for d in [os.path.join(self.archive_dir, "compress_logs"), os.path.join(self.swestore_dir, "drophere2archive"), self.irods]:
+            os.makedirs(d)
+        with open(os.path.join(self.archive_dir, "to_remove"), "w") as fh:
+            fh.write("".join(["./{}\n".format(fc) for fc in FLOWCELLS]))
+        for i, fc in enumerate(FLOWCELLS):
+            os.makedirs(os.path.join(self.archive_dir, fc))
+            with open(os.path.join(self.archive_dir, "compress_logs", "slurm-{}.out".format(i)), "w") as fh:
+                fh.write("Compressing {}...\nExit code: 1\nretrying\nExit code: {}\n".format(fc, i))
+            if i < 2:
+                with open(os.path.join(self.swestore_dir, "drophere2archive", "{}.tar.bz2".format(fc)), "w") as fh:
+                    fh.write("x" * 1000)
+                with open(os.path.join(self.irods, "{}.tar.bz2".format(fc)), "w") as fh:
+                    fh.write("checksum{}".format(i))
+        self.environ = dict(os.environ)
+        os.environ["PATH"] = "{}:{}".format(os.path.join(filedir, "bin"), os.environ["PATH"])
+        os.environ["ICHKSUM_DATA"] = self.irods
+        os.environ["ICHKSUM_LOG"] = self.ichksum_log
+
+    def tearDown(self):
+        os.environ.clear()
+        os.environ.update(self.environ)
+        shutil.rmtree(self.rootdir)
+
+    def _checked(self):
+        if not os.path.exists(self.ichksum_log):
+            return []
+        with open(self.ichksum_log) as fh:
+            checked = sorted(fh.read().split())
+        os.unlink(self.ichksum_log)
+        return checked
+
+    def test_parse_compress_log(self):
+        """Get the compressed flowcell and last exit code of a compress log"""
+        self.assertEqual((FLOWCELLS[2], "2"), parse_compress_log(os.path.join(self.archive_dir, "compress_logs", "slurm-2.out")), "Unexpected exit code")
+        self.assertIsNone(parse_compress_log(os.path.join(self.archive_dir, "to_remove")), "Expected no match")
+
+    def test_irods_checksum(self):
+        """Get the checksum line of ichksum, or None if the command fails"""
+        tarball = "{}.tar.bz2".format(FLOWCELLS[0])
+        self.assertEqual(tarball, irods_checksum(tarball).split()[0], "Unexpected checksum line")
+        self.assertIsNone(irods_checksum("{}.tar.bz2".format(FLOWCELLS[2])), "Failed ichksum should have no checksum")
+        os.environ["PATH"] = self.rootdir
+        self.assertIsNone(irods_checksum(tarball), "Missing ichksum should have no checksum")
+
+    def test_remove_status(self):
+        """Check flowcells concurrently and only re-check changed tarballs"""
+        out = flowcell_remove_status(self.archive_dir, self.swestore_dir, workers=2)['stdout'].getvalue()
+        lines = {x.split()[0]:x.split() for x in out.split("\n") if x.startswith("12")}
+        self.assertEqual(["0", "0.00", "{}.tar.bz2".format(FLOWCELLS[0]), "checksum0"], lines[FLOWCELLS[0]][1:], "Unexpected status")
+        self.assertEqual(["2", "0.00", "1"], lines[FLOWCELLS[2]][1:], "Missing tarball should have no checksum")
+        self.assertEqual(["{}.tar.bz2".format(fc) for fc in FLOWCELLS], self._checked(), "Expected all flowcells to be checked")
+        self.assertEqual(out, flowcell_remove_status(self.archive_dir, self.swestore_dir)['stdout'].getvalue(), "Cached status differs")
+        self.assertEqual(["{}.tar.bz2".format(FLOWCELLS[2])], self._checked(), "Only failed checks should be repeated")
+        # A changed tarball is checked again
+        with open(os.path.join(self.swestore_dir, "drophere2archive", "{}.tar.bz2".format(FLOWCELLS[1])), "a") as fh:
+            fh.write("x")
+        with open(os.path.join(self.irods, "{}.tar.bz2".format(FLOWCELLS[1])), "w") as fh:
+            fh.write("checksum3")
+        out = flowcell_remove_status(self.archive_dir, self.swestore_dir)['stdout'].getvalue()
+        self.assertIn("checksum3", out, "Changed tarball not checked")
+        self.assertEqual(["{}.tar.bz2".format(fc) for fc in FLOWCELLS[1:]], self._checked(), "Unexpected checks")
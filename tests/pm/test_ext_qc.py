@@ -0,0 +1,45 @@
+"""Tests for collecting sample qc data in the qc extension"""
+import os
+import shutil
+import tempfile
+import unittest
+import argparse
+import scilifelab.log
+from scilifelab.pm.ext.ext_qc import RunMetricsController, _batches
+
+class TestSampleQc(unittest.TestCase):
+    """Test collecting sample run qc data serially and with workers"""
+    def setUp(self):
+        self.rootdir = tempfile.mkdtemp(prefix="test_ext_qc_")
+        self.jobs = []
+        for n in range(1, 7):
+            sampledir = os.path.join(self.rootdir, "P001_10{}".format(n))
+            os.makedirs(sampledir)
+            sample_kw = dict(flowcell="AC003CCCXX", date="120924", lane=str(n % 2 + 1), barcode_name="P001_10{}".format(n),
+                             sample_prj="J.Doe_00_01", barcode_id=n, sequence="ACGTA{}".format("ACGTAC"[n-1]))
+            self.jobs.append((sampledir, sample_kw, dict(run_setup=None), None))
+
+    def tearDown(self):
+        shutil.rmtree(self.rootdir)
+
+    def _controller(self, workers):
+        ctrl = RunMetricsController.__new__(RunMetricsController)
+        ctrl.pargs = argparse.Namespace(workers=workers)
+        ctrl.app = argparse.Namespace(log=scilifelab.log.minimal_logger(__name__))
+        return ctrl
+
+    def _strip(self, obj):
+        return {k:v for k, v in obj.items() if k not in ["_id", "creation_time", "modification_time"]}
+
+    def test_workers(self):
+        """Collecting sample qc data with workers gives the serial result"""
+        serial = [self._strip(x) for x in self._controller(1)._sample_qc(self.jobs)]
+        parallel = [self._strip(x) for x in self._controller(3)._sample_qc(self.jobs)]
+        self.assertEqual(["P001_10{}".format(n) for n in range(1, 7)], [x["barcode_name"] for x in parallel],
+                         "Sample run documents not in samplesheet order")
+        self.assertEqual(serial, parallel, "Documents collected with workers differ from serial documents")
+
+    def test_batches(self):
+        """Group objects in batches"""
+        self.assertEqual([[0, 1, 2], [3, 4, 5], [6]], list(_batches(iter(range(7)), 3)), "Unexpected batches")
+        self.assertEqual([], list(_batches([], 3)), "Expected no batches")
@@ -0,0 +1,123 @@
+"""Tests for the LIMS to statusdb synchronization, with a stub LIMS API"""
+import threading
+import time
+import unittest
+import couchdb
+from scilifelab.db.lims_sync import prefetch, limit_requests, sync_projects
+
+from ..classes import FakeCouchDatabase
+
+class StubLims(object):
+    """Stub of a genologics Lims instance, recording the requests and
+    the maximum number of concurrent requests"""
+    def __init__(self, delay=0):
+        self.delay = delay
+        self.requests = []
+        self.running = 0
+        self.max_running = 0
+        self._lock = threading.Lock()
+
+    def _request(self, method, uri):
+        with self._lock:
+            self.requests.append((method, uri))
+            self.running += 1
+            self.max_running = max(self.max_running, self.running)
+        time.sleep(self.delay)
+        with self._lock:
+            self.running -= 1
+        return "<{}/>".format(uri)
+
+    def get(self, uri):
+        return self._request("GET", uri)
+
+    def post(self, uri, data):
+        return self._request("POST", uri)
+
+    def get_batch(self, instances):
+        root = self.post("{}/batch/retrieve".format(instances[0]._URI), None)
+        for instance in instances:
+            instance.root = root
+        return instances
+
+class StubEntity(object):
+    def __init__(self, lims, id):
+        self.lims = lims
+        self.id = id
+        self.uri = "{}/{}".format(self._URI, id)
+        self.root = None
+
+    def get(self):
+        if self.root is None:
+            self.root = self.lims.get(self.uri)
+
+class Artifact(StubEntity):
+    _URI = "artifacts"
+
+class Sample(StubEntity):
+    _URI = "samples"
+
+class Process(StubEntity):
+    _URI = "processes"
+
+class StubProject(object):
+    def __init__(self, name):
+        self.name = name
+
+class TestPrefetch(unittest.TestCase):
+    """Test prefetching of LIMS entities"""
+    def test_prefetch(self):
+        """Fetch artifacts and samples in batches and processes one by one"""
+        lims = StubLims()
+        arts = [Artifact(lims, "2-{}".format(i)) for i in range(5)]
+        arts[0].root = "<fetched/>"
+        entities = arts + [arts[1], None] + [Sample(lims, "P1_10{}".format(i)) for i in range(3)] + [Process(lims, "24-{}".format(i)) for i in range(2)]
+        self.assertEqual(10, len(prefetch(lims, entities, batch_size=3)), "Expected unique entities")
+        self.assertEqual([("GET", "processes/24-0"), ("GET", "processes/24-1"), ("POST", "artifacts/batch/retrieve"),
+                          ("POST", "artifacts/batch/retrieve"), ("POST", "samples/batch/retrieve")], sorted(lims.requests), "Unexpected requests")
+        lims.requests = []
+        prefetch(lims, entities)
+        self.assertEqual([], lims.requests, "Fetched entities should not be fetched again")
+
+    def test_limit_requests(self):
+        """Cap the number of concurrent requests"""
+        lims = limit_requests(StubLims(delay=0.01), 2)
+        prefetch(lims, [Process(lims, "24-{}".format(i)) for i in range(10)], workers=8)
+        self.assertEqual(10, len(lims.requests), "Expected one request per process")
+        self.assertEqual(2, lims.max_running, "Expected at most 2 concurrent requests")
+
+class TestSyncProjects(unittest.TestCase):
+    """Test building and saving projects"""
+    def setUp(self):
+        self.db = FakeCouchDatabase("projects", {"project/project_name": lambda doc: [(doc["project_name"], doc["_id"])]})
+        self.db.save({"_id":"p0", "_rev":"1-x", "project_name":"J.Doe_00_00", "samples":{}, "creation_time":"2013-01-01T00:00:00Z"})
+        self.db.save({"_id":"p1", "_rev":"1-x", "project_name":"J.Doe_00_01", "samples":{}, "creation_time":"2013-01-01T00:00:00Z"})
+
+    def _build(self, proj):
+        if proj.name == "J.Doe_00_03":
+            raise KeyError("application")
+        return {"project_name":proj.name, "samples":{"P1_101":{}} if proj.name == "J.Doe_00_01" else {}}
+
+    def test_sync_projects(self):
+        """Build projects concurrently and save them in bulk"""
+        projects = [StubProject("J.Doe_00_{:02d}".format(i)) for i in range(5)]
+        statuses = sync_projects(projects, self._build, self.db, workers=3, batch_size=2)
+        self.assertEqual({"J.Doe_00_00":"not uppdated", "J.Doe_00_01":"uppdated", "J.Doe_00_02":"created",
+                          "J.Doe_00_03":"failed", "J.Doe_00_04":"created"}, statuses, "Unexpected statuses")
+        self.assertEqual({"P1_101":{}}, self.db.docs["p1"]["samples"], "Project not updated")
+        self.assertEqual("2-x", self.db.docs["p1"]["_rev"], "Unexpected revision")
+        self.assertEqual("2013-01-01T00:00:00Z", self.db.docs["p1"]["creation_time"], "Creation time not kept")
+        self.assertEqual(4, len(self.db.docs), "Expected new projects to be created")
+        # One view query for the project _ids, and for each batch one request for
+        # the missing content hash view, one to get the documents and one to save
+        self.assertEqual(7, self.db.queries, "Unexpected number of requests")
+
+    def test_save_failures(self):
+        """Mark the projects of a batch that cannot be saved as failed"""
+        def update(docs, new_edits=True):
+            if "J.Doe_00_02" in [doc["project_name"] for doc in docs]:
+                raise couchdb.ServerError("timeout")
+            return FakeCouchDatabase.update(self.db, docs, new_edits)
+        self.db.update = update
+        projects = [StubProject("J.Doe_00_{:02d}".format(i)) for i in [1, 2, 4]]
+        statuses = sync_projects(projects, self._build, self.db, workers=1, batch_size=2)
+        self.assertEqual({"J.Doe_00_01":"failed", "J.Doe_00_02":"failed", "J.Doe_00_04":"created"}, statuses, "Unexpected statuses")
@@ -0,0 +1,69 @@
+"""Tests for client side couchdb replication"""
+import json
+import os
+import shutil
+import tempfile
+import unittest
+from scilifelab.db.replication import Checkpoints, replicate, replicate_db
+
+from ..classes import RevisionTreeCouchDatabase
+
+def _db(name, ndocs):
+    db = RevisionTreeCouchDatabase(name, {})
+    for i in range(ndocs):
+        db.save({"_id":"{}_{}".format(name, i), "_rev":"{}-abc".format(i % 3 + 1), "n":i})
+    return db
+
+class TestReplication(unittest.TestCase):
+    """Test replication of changes with _bulk_docs"""
+    def setUp(self):
+        self.rootdir = tempfile.mkdtemp(prefix="test_replication_")
+        self.checkpoint_file = os.path.join(self.rootdir, "checkpoints.json")
+
+    def tearDown(self):
+        shutil.rmtree(self.rootdir)
+
+    def test_replicate(self):
+        """Replicate several databases concurrently, keeping ids and revisions"""
+        sources = [_db("samples", 25), _db("flowcells", 7)]
+        sources[0].delete("samples_3")
+        targets = [RevisionTreeCouchDatabase(db.name, {}) for db in sources]
+        targets[0].save({"_id":"samples_3", "_rev":"1-abc", "n":3})
+        res = replicate([(s, t, s.name) for s, t in zip(sources, targets)], workers=2, checkpoints=Checkpoints(self.checkpoint_file), batch_size=10)
+        self.assertEqual([(26, 25), (7, 7)], res, "Unexpected sequences and number of documents")
+        for s, t in zip(sources, targets):
+            self.assertEqual(s.docs, t.docs, "Documents differ")
+        self.assertNotIn("samples_3", targets[0].docs, "Deletion not replicated")
+        self.assertEqual([], targets[0].conflicts("samples_3"), "Deletion should extend the existing revision")
+        self.assertEqual(3, targets[0].queries, "Expected one _bulk_docs request per batch")
+        self.assertEqual(7, sources[0].queries, "Expected one changes and one _bulk_get request per batch and a last changes request")
+        with open(self.checkpoint_file) as fh:
+            self.assertEqual({"samples":26, "flowcells":7}, json.load(fh), "Unexpected checkpoints")
+
+    def test_resume(self):
+        """Resume a replication from its checkpoint"""
+        source, target = _db("samples", 10), RevisionTreeCouchDatabase("samples", {})
+        replicate_db(source, target, Checkpoints(self.checkpoint_file), batch_size=4)
+        source.save({"_id":"samples_0", "_rev":"2-def", "n":0})
+        source.save({"_id":"samples_10", "_rev":"1-abc", "n":10})
+        target.queries = 0
+        seq, ndocs = replicate_db(source, target, Checkpoints(self.checkpoint_file), batch_size=4)
+        self.assertEqual((12, 2), (seq, ndocs), "Only new changes should be replicated")
+        self.assertEqual(1, target.queries, "Expected one _bulk_docs request")
+        self.assertEqual(source.docs, target.docs, "Documents differ")
+
+    def test_resume_edits(self):
+        """Replicate updates and deletions of replicated documents without conflicts"""
+        source, target = _db("samples", 4), RevisionTreeCouchDatabase("samples", {})
+        checkpoints = Checkpoints()
+        replicate_db(source, target, checkpoints)
+        source.save(dict(source.docs["samples_0"], n=10))
+        source.delete("samples_1")
+        replicate_db(source, target, checkpoints)
+        self.assertEqual(source.docs, target.docs, "Documents differ")
+        self.assertNotIn("samples_1", target.docs, "Deleted document came back")
+        self.assertEqual([[], []], [target.conflicts(docid) for docid in ["samples_0", "samples_1"]], "Replicated edits should not conflict")
+        # Without the revision history, an update becomes a conflicting leaf
+        target.update([{"_id":"samples_2", "_rev":"4-def", "n":2}], new_edits=False)
+        self.assertEqual(["3-abc"], target.conflicts("samples_2"), "Expected a conflict without revision history")
+
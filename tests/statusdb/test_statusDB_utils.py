@@ -0,0 +1,103 @@
+"""Tests for the statusdb view lookups"""
+import unittest
+import couchdb
+from scilifelab.db.statusDB_utils import find_proj_from_view, find_projs_from_view, find_proj_from_samp, find_projs_from_samps, \
+    find_samp_from_view, find_samps_from_view, find_flowcell_from_view, find_flowcells_from_view, \
+    find_sample_run_id_from_view, find_sample_run_ids_from_view, content_hash, save_couchdb_obj, save_couchdb_objs
+
+from ..classes import FakeCouchDatabase
+
+PROJECT_VIEWS = {"project/project_name": lambda doc: [(doc["project_name"], doc["_id"])],
+                 "samples/sample_project_name": lambda doc: [(s, doc["project_name"]) for s in doc.get("samples", {})]}
+SAMPLE_VIEWS = {"names/id_to_proj": lambda doc: [(doc["_id"], [doc["sample_prj"], doc["name"], doc["flowcell"]])],
+                "names/id_to_name": lambda doc: [(doc["_id"], doc["name"])]}
+FLOWCELL_VIEWS = {"names/id_to_name": lambda doc: [(doc["_id"], doc["name"])]}
+HASH_VIEWS = {"content/hash": lambda doc: [(doc["_id"], [doc.get("_rev"), doc["content_hash"], doc.get("creation_time")])] if doc.get("content_hash") else []}
+
+class TestViewLookups(unittest.TestCase):
+    """Test keyed and batch lookups in the statusdb views"""
+    def setUp(self):
+        self.proj_db = FakeCouchDatabase("projects", PROJECT_VIEWS)
+        self.samp_db = FakeCouchDatabase("samples", SAMPLE_VIEWS)
+        self.fc_db = FakeCouchDatabase("flowcells", FLOWCELL_VIEWS)
+        for i in range(10):
+            self.proj_db.save({"_id":"p{}".format(i), "project_name":"J.Doe_00_{:02d}".format(i), "samples":{"P{}_101".format(i):{}}})
+            self.samp_db.save({"_id":"s{}".format(i), "name":"1_120924_AC003CCCXX_P{}_101".format(i), "sample_prj":"J.Doe_00_{:02d}".format(i % 2), "flowcell":"AC003CCCXX"})
+            self.fc_db.save({"_id":"f{}".format(i), "name":"120924_{}C003CCCXX".format("AB"[i % 2] + str(i))})
+
+    def test_projects(self):
+        """Look up projects by name and sample with keyed view queries"""
+        self.assertEqual("p3", find_proj_from_view(self.proj_db, "J.Doe_00_03"), "Unexpected project _id")
+        self.assertIsNone(find_proj_from_view(self.proj_db, "J.Doe_00_10"), "Expected no project")
+        self.proj_db.rows_returned = 0
+        self.assertEqual({"J.Doe_00_01":"p1", "J.Doe_00_02":"p2"}, find_projs_from_view(self.proj_db, ["J.Doe_00_01", "J.Doe_00_02", "J.Doe_00_10"]), "Unexpected project _ids")
+        self.assertEqual(2, self.proj_db.rows_returned, "Expected only the requested rows")
+        self.assertEqual("J.Doe_00_04", find_proj_from_samp(self.proj_db, "P4_101"), "Unexpected project")
+        self.assertEqual({"P4_101":"J.Doe_00_04"}, find_projs_from_samps(self.proj_db, ["P4_101", "P11_101"]), "Unexpected projects")
+
+    def test_samples_and_flowcells(self):
+        """Look up samples, sample runs and flowcells with one view scan per batch"""
+        samps = find_samp_from_view(self.samp_db, "J.Doe_00_01")
+        self.assertEqual(["s1", "s3", "s5", "s7", "s9"], sorted(samps.keys()), "Unexpected samples")
+        self.assertEqual(["1_120924_AC003CCCXX_P1_101", "AC003CCCXX"], samps["s1"], "Unexpected sample values")
+        self.samp_db.queries = 0
+        self.samp_db.save({"_id":"s10", "name":"1_120924_AC003CCCXX_P0_102", "sample_prj":"j.doe_00_00", "flowcell":"AC003CCCXX"})
+        samps = find_samps_from_view(self.samp_db, ["J.Doe_00_00", "J.Doe_00_01", "J.Doe_00_10"])
+        self.assertEqual(1, self.samp_db.queries, "Expected one view query")
+        self.assertEqual([6, 5, 0], [len(samps[x]) for x in ["J.Doe_00_00", "J.Doe_00_01", "J.Doe_00_10"]], "Unexpected number of samples")
+        self.assertEqual("s2", find_sample_run_id_from_view(self.samp_db, "1_120924_AC003CCCXX_P2_101"), "Unexpected sample run _id")
+        self.assertEqual({"1_120924_AC003CCCXX_P2_101":"s2"}, find_sample_run_ids_from_view(self.samp_db, ["1_120924_AC003CCCXX_P2_101", "x"]), "Unexpected sample run _ids")
+        self.assertEqual("f3", find_flowcell_from_view(self.fc_db, "B3C003CCCXX"), "Unexpected flowcell _id")
+        self.assertIsNone(find_flowcell_from_view(self.fc_db, "B4C003CCCXX"), "Expected no flowcell")
+        self.assertEqual({"A0C003CCCXX":"f0", "B1C003CCCXX":"f1"}, find_flowcells_from_view(self.fc_db, ["A0C003CCCXX", "B1C003CCCXX"]), "Unexpected flowcell _ids")
+
+class TestSaveObjects(unittest.TestCase):
+    """Test saving objects compared by content hash"""
+    def setUp(self):
+        self.db = FakeCouchDatabase("projects", HASH_VIEWS)
+        self.project = {"_id":"p1", "project_name":"J.Doe_00_01", "entity_type":"project_summary",
+                        "samples":{"P1_101":{"status":"doc_not_found", "m_reads_sequenced":"doc_not_found"}, "P1_102":{}}}
+
+    def test_content_hash(self):
+        """Leave the volatile fields out of the content hash"""
+        self.assertEqual(content_hash({"a":[1, {"b":u"x", "c":2}]}), content_hash({"a":[1, {"c":2, "b":"x"}], "_rev":"1-x", "modification_time":"2013-01-01"}), "Expected equal hashes")
+        self.assertNotEqual(content_hash({"a":[1, 2]}), content_hash({"a":[2, 1]}), "Expected different hashes")
+        self.assertNotEqual(content_hash({"a":{}}), content_hash({"a":[]}), "Expected different hashes for objects and lists")
+        self.assertNotEqual(content_hash({"a":{"k":1}}), content_hash({"a":[["k", 1]]}), "Expected different hashes for objects and lists of pairs")
+
+    def test_save(self):
+        """Decide whether to save an object from the stored content hash"""
+        obj = {"_id":"f1", "name":"120924_AC003CCCXX", "lanes":{"1":{"reads":100}}}
+        self.assertEqual("created", save_couchdb_obj(self.db, dict(obj)), "Expected a new object")
+        self.db.queries = 0
+        self.assertEqual("not uppdated", save_couchdb_obj(self.db, dict(obj)), "Expected an unchanged object")
+        self.assertEqual(1, self.db.queries, "Expected only the content hash view to be queried")
+        creation_time = self.db.docs["f1"]["creation_time"]
+        obj["lanes"]["1"]["reads"] = 200
+        self.assertEqual("uppdated", save_couchdb_obj(self.db, dict(obj)), "Expected an updated object")
+        self.assertEqual(200, self.db.docs["f1"]["lanes"]["1"]["reads"], "Object not saved")
+        self.assertEqual(creation_time, self.db.docs["f1"]["creation_time"], "Creation time not kept")
+        self.assertEqual(content_hash(obj), self.db.docs["f1"]["content_hash"], "Content hash not saved")
+
+    def test_save_failures(self):
+        """Save objects again one at a time only after bulk save conflicts"""
+        class FailingDatabase(FakeCouchDatabase):
+            def update(self, docs, new_edits=True):
+                self.queries += 1
+                return [(False, doc["_id"], couchdb.ResourceConflict() if doc["_id"] == "p1" else couchdb.ServerError()) for doc in docs]
+        db = FailingDatabase("projects", HASH_VIEWS)
+        self.assertEqual(["created", "failed"], save_couchdb_objs(db, [self.project, {"_id":"p2", "project_name":"J.Doe_00_02"}]), "Unexpected statuses")
+        self.assertEqual(["p1"], db.docs.keys(), "Expected only the conflicting object to be saved again")
+
+    def test_save_20158_status(self):
+        """Compare projects with missing sample statuses to the whole stored project"""
+        stored = dict(self.project, creation_time="2013-01-01T00:00:00Z", samples={"P1_101":{"status":"Sequenced", "m_reads_sequenced":10}, "P1_102":{}})
+        stored["content_hash"] = content_hash(stored)
+        self.db.save(stored)
+        self.assertEqual(["not uppdated", "created"], save_couchdb_objs(self.db, [self.project, {"_id":"p2", "project_name":"J.Doe_00_02"}]), "Unexpected statuses")
+        self.assertEqual({"status":"Sequenced", "m_reads_sequenced":10}, self.project["samples"]["P1_101"], "Expected the stored status")
+        self.assertEqual(stored["content_hash"], self.project["content_hash"], "Expected the stored content hash")
+        # Without the content hash view, all objects are compared to the whole stored object
+        db = FakeCouchDatabase("projects", {})
+        db.save(dict(stored, _rev="1-x"))
+        self.assertEqual(["not uppdated"], save_couchdb_objs(db, [dict(stored, samples={"P1_101":{"status":"doc_not_found", "m_reads_sequenced":"doc_not_found"}, "P1_102":{}})]), "Unexpected statuses")
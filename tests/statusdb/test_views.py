@@ -0,0 +1,189 @@
+"""Tests for lazy and cached couchdb views"""
+import os
+import shutil
+import tempfile
+import unittest
+from scilifelab.db import CouchView
+from scilifelab.db.statusdb import SampleRunMetricsConnection, FlowcellRunMetricsConnection, SampleRunMetricsDocument, _sample_view_map, _barcode_lane_stat_map, _id_to_name_map
+from scilifelab.log import minimal_logger
+
+from ..classes import FakeCouchDatabase
+
+SAMPLE_VIEWS = {"names/name": _sample_view_map(lambda doc: None),
+                "names/name_fc_proj": _sample_view_map(lambda doc: [doc.get("flowcell", None), doc.get("sample_prj", None)]),
+                "names/fc_name": lambda doc: [(v, k) for k, v in _sample_view_map(lambda doc: doc.get("flowcell", None))(doc)],
+                "names/proj_name": lambda doc: [(v, k) for k, v in _sample_view_map(lambda doc: doc.get("sample_prj", None))(doc)],
+                "names/id_to_name": _id_to_name_map("name")}
+
+def _sample_run(lane, flowcell, project, sequence):
+    return SampleRunMetricsDocument(lane=str(lane), date="120924", flowcell=flowcell,
+                                    sample_prj=project, sequence=sequence, barcode_name="P001_10{}".format(lane))
+
+class TestCouchView(unittest.TestCase):
+    """Test lookups in lazy and cached views"""
+    def setUp(self):
+        self.cachedir = tempfile.mkdtemp(prefix="test_couchview_")
+        self.db = FakeCouchDatabase("samples-test", SAMPLE_VIEWS)
+        self.docs = [_sample_run(lane, fc, prj, "ACGT") for lane in range(1, 9) for fc, prj in [("AC003CCCXX", "J.Doe_00_01"), ("BB002BBBXX", "J.Doe_00_02")]]
+        for doc in self.docs:
+            self.db.save(doc)
+
+    def tearDown(self):
+        shutil.rmtree(self.cachedir)
+
+    def test_lazy_lookups(self):
+        """Keyed lookups only fetch the rows asked for"""
+        view = CouchView(self.db, "names/name", "id")
+        self.assertEqual(0, self.db.queries, "Creating a view should not query the database")
+        self.assertEqual(self.docs[0]["_id"], view.get(self.docs[0]["name"]), "Unexpected id for sample run")
+        self.assertIsNone(view.get("no_such_sample"), "Missing key should give default")
+        self.assertFalse("no_such_sample" in view, "Missing key should not be in view")
+        self.assertEqual(2, self.db.queries, "Lookups should be memoized")
+        self.assertEqual(1, self.db.rows_returned, "Keyed lookups should only return the rows asked for")
+        found = view.get_many([d["name"] for d in self.docs[0:4]])
+        self.assertEqual(4, len(found), "Unexpected number of sample runs from get_many")
+        self.assertEqual(3, self.db.queries, "get_many should use one query")
+        self.assertEqual([d["name"] for d in self.docs if d["lane"] == "2"],
+                         [k for k, _ in view.range("2_", "2_~")], "Unexpected keys in key range")
+        self.assertEqual(len(self.docs), len(view), "Unexpected number of rows in loaded view")
+
+    def test_cached_view(self):
+        """Cached views are updated from the changes feed"""
+        view = CouchView(self.db, "names/name_fc_proj", "value", SAMPLE_VIEWS["names/name_fc_proj"], self.cachedir)
+        self.assertEqual(len(self.docs), len(view), "Unexpected number of rows in view")
+        self.assertTrue(os.path.exists(os.path.join(self.cachedir, "samples-test_names_name_fc_proj.json")), "No cache file written")
+
+        # Modify, add and remove documents
+        self.docs[0]["sample_prj"] = "J.Doe_00_03"
+        self.db.save(self.docs[0])
+        new = _sample_run(1, "CC001AAAXX", "J.Doe_00_03", "TTTT")
+        self.db.save(new)
+        self.db.delete(self.docs[1]["_id"])
+        self.db.rows_returned = 0
+
+        view = CouchView(self.db, "names/name_fc_proj", "value", SAMPLE_VIEWS["names/name_fc_proj"], self.cachedir)
+        self.assertEqual(len(self.docs), len(view), "Unexpected number of rows in updated view")
+        self.assertEqual(0, self.db.rows_returned, "Cached view should not be reloaded")
+        self.assertEqual(["AC003CCCXX", "J.Doe_00_03"], view[self.docs[0]["name"]], "Modified document not updated")
+        self.assertEqual(["CC001AAAXX", "J.Doe_00_03"], view[new["name"]], "Added document missing")
+        self.assertFalse(self.docs[1]["name"] in view, "Deleted document still in view")
+        expected = sorted([(k, v) for k, v in CouchView(self.db, "names/name_fc_proj", "value").iteritems()])
+        self.assertEqual(expected, sorted(view.items()), "Cached view differs from view")
+
+class TestSampleRunMetricsViews(unittest.TestCase):
+    """Test sample run lookups with lazy views"""
+    def setUp(self):
+        self.db = FakeCouchDatabase("samples-test", dict(SAMPLE_VIEWS))
+        self.docs = [_sample_run(lane, fc, prj, "ACGT") for lane in range(1, 5) for fc, prj in [("AC003CCCXX", "J.Doe_00_01"), ("BB002BBBXX", "J.Doe_00_02")]]
+        for doc in self.docs:
+            self.db.save(doc)
+        # Set up a connection without connecting to a server
+        self.s_con = SampleRunMetricsConnection.__new__(SampleRunMetricsConnection)
+        self.s_con.db = self.db
+        self.s_con.cachedir = None
+        self.s_con.batch_size = 3
+        self.s_con._entries = {}
+        self.s_con._views = []
+        self.s_con.log = minimal_logger(__name__)
+        self.s_con.name_view = self.s_con.view("names/name", "id", SAMPLE_VIEWS["names/name"])
+        self.s_con.id_name_view = self.s_con.view("names/id_to_name", "row", SAMPLE_VIEWS["names/id_to_name"])
+        self.s_con.name_fc_proj_view = self.s_con.view("names/name_fc_proj", "row", SAMPLE_VIEWS["names/name_fc_proj"])
+
+    def test_get_samples(self):
+        """Get samples by flowcell and project"""
+        expected = sorted([d["name"] for d in self.docs if d["flowcell"] == "AC003CCCXX"])
+        self.assertEqual(expected, sorted([s["name"] for s in self.s_con.get_samples(fc_id="AC003CCCXX")]), "Unexpected samples for flowcell")
+        self.assertEqual(expected, sorted([s["name"] for s in self.s_con.get_samples(fc_id="AC003CCCXX", sample_prj="J.Doe_00_01")]), "Unexpected samples for flowcell and project")
+        self.assertEqual([], self.s_con.get_samples(fc_id="AC003CCCXX", sample_prj="J.Doe_00_02"), "Expected no samples for flowcell and other project")
+        # Without a cache, the sample runs are looked up with keyed queries
+        self.assertIsNone(self.s_con.name_fc_proj_view._rows, "The name_fc_proj view should not be loaded")
+        self.db.rows_returned = 0
+        self.assertEqual(4, len(self.s_con.get_sample_ids(fc_id="AC003CCCXX", sample_prj="J.Doe_00_01")), "Unexpected sample runs for flowcell and project")
+        self.assertEqual(8, self.db.rows_returned, "Keyed queries should only return the sample runs of the flowcell and project")
+
+    def test_get_entries(self):
+        """Get several entries in batches and reuse them in get_entry"""
+        names = [d["name"] for d in self.docs[0:5]] + ["no_such_sample"]
+        entries = self.s_con.get_entries(names)
+        self.assertEqual(sorted(names[0:5]), sorted(entries.keys()), "Unexpected entries")
+        self.assertEqual(self.docs[0]["flowcell"], entries[names[0]]["flowcell"], "Unexpected entry contents")
+        # One view query for the ids and two batches of documents
+        self.assertEqual(3, self.db.queries, "Unexpected number of queries")
+        self.assertEqual(self.docs[1]["_id"], self.s_con.get_entry(names[1], "_id"), "Unexpected entry from get_entry")
+        self.assertEqual(3, self.db.queries, "get_entry should reuse fetched entries")
+
+    def test_save_many(self):
+        """Save new, modified and unmodified documents in bulk"""
+        unchanged = SampleRunMetricsDocument(**self.db.docs[self.docs[0]["_id"]])
+        modified = SampleRunMetricsDocument(**self.db.docs[self.docs[1]["_id"]])
+        modified["project_id"] = "P002"
+        new = _sample_run(5, "AC003CCCXX", "J.Doe_00_01", "ACGT")
+        # Objects created anew for existing names get the database id
+        recreated = _sample_run(2, self.docs[2]["flowcell"], self.docs[2]["sample_prj"], "ACGT")
+        recreated["bc_count"] = 1000
+        self.db.queries = 0
+        saved = self.s_con.save_many([unchanged, modified, new, recreated])
+        self.assertEqual([modified["name"], new["name"], recreated["name"]], [x["name"] for x in saved], "Unexpected objects saved")
+        self.assertEqual(6, self.db.queries, "Unexpected number of queries for two batches")
+        self.assertEqual("P002", self.db.docs[self.docs[1]["_id"]]["project_id"], "Modified document not saved")
+        self.assertTrue(new["_id"] in self.db.docs, "New document not saved")
+        self.assertEqual(self.docs[2]["_id"], recreated["_id"], "Recreated object should get database id")
+        self.assertEqual(1000, self.db.docs[self.docs[2]["_id"]]["bc_count"], "Recreated object not merged")
+        self.assertEqual(len(self.docs) + 1, len(self.db.docs), "Unexpected number of documents")
+        self.assertEqual(new["_id"], self.s_con.name_view.get(new["name"]), "New document not found by name")
+
+    def test_save_many_numbered_names(self):
+        """Find existing documents with names that the names/name view leaves out"""
+        numbered = _sample_run(1, "AC003CCCXX", "J.Doe_00_01", "ACGT")
+        numbered["name"] = "{}_2".format(numbered["name"])
+        self.db.save(numbered)
+        recreated = SampleRunMetricsDocument(**dict(self.db.docs[numbered["_id"]], _id="new_id"))
+        recreated["name"] = numbered["name"]
+        recreated["bc_count"] = 1000
+        self.assertEqual([recreated["name"]], [x["name"] for x in self.s_con.save_many([recreated])], "Recreated object not saved")
+        self.assertEqual(numbered["_id"], recreated["_id"], "Recreated object should get database id")
+        self.assertFalse("new_id" in self.db.docs, "Duplicate document saved")
+        # A new document is found by name in later calls
+        new = _sample_run(5, "AC003CCCXX", "J.Doe_00_01", "ACGT")
+        new["name"] = "{}_2".format(new["name"])
+        self.s_con.save_many([new])
+        again = SampleRunMetricsDocument(**dict(self.db.docs[new["_id"]], _id="other_id"))
+        again["name"] = new["name"]
+        again["bc_count"] = 1000
+        self.s_con.save_many([again])
+        self.assertEqual(new["_id"], again["_id"], "New document not found by name")
+        self.assertEqual(len(self.docs) + 2, len(self.db.docs), "Unexpected number of documents")
+
+    def test_indexes_updated(self):
+        """Flowcell and project indexes are kept up to date when saving"""
+        # The names/name_fc_proj view is indexed when the keyed views are missing
+        del self.db.views["names/fc_name"], self.db.views["names/proj_name"]
+        ids = self.s_con.get_sample_ids(fc_id="AC003CCCXX")
+        self.assertEqual(4, len(ids), "Unexpected number of sample runs for flowcell")
+        new = _sample_run(5, "AC003CCCXX", "J.Doe_00_01", "ACGT")
+        moved = SampleRunMetricsDocument(**self.db.docs[ids[0]])
+        moved["sample_prj"] = "J.Doe_00_03"
+        self.s_con.save_many([new, moved])
+        self.assertEqual(sorted(ids + [new["_id"]]), sorted(self.s_con.get_sample_ids(fc_id="AC003CCCXX")), "New sample run not indexed")
+        self.assertEqual([moved["_id"]], self.s_con.get_sample_ids(sample_prj="J.Doe_00_03"), "Modified sample run not indexed")
+        self.assertEqual(4, len(self.s_con.get_sample_ids(fc_id="AC003CCCXX", sample_prj="J.Doe_00_01")), "Unexpected sample runs for flowcell and project")
+
+class TestFlowcellRunMetricsViews(unittest.TestCase):
+    """Test flowcell lookups with lazy views"""
+    def test_get_barcode_lane_statistics(self):
+        """Get barcode lane statistics for project, sample and lane"""
+        db = FakeCouchDatabase("flowcells-test", {"names/Barcode_lane_stat": _barcode_lane_stat_map})
+        stats = [{"Project":"J__Doe_00_01", "Sample ID":"P001_10{}".format(n), "Lane":str(lane),
+                  "Mean Quality Score (PF)":"3{}.{}".format(n, lane), "% of >= Q30 Bases (PF)":"9{}".format(lane)} for n in range(1, 5) for lane in range(1, 9)]
+        db.save({"_id":"fc1", "name":"120924_AC003CCCXX", "illumina":{"Demultiplex_Stats":{"Barcode_lane_statistics":stats}}})
+        fc_con = FlowcellRunMetricsConnection.__new__(FlowcellRunMetricsConnection)
+        fc_con.db = db
+        fc_con.cachedir = None
+        fc_con._views = []
+        fc_con._stat_index = {}
+        fc_con.stat_view = fc_con.view("names/Barcode_lane_stat", "value", _barcode_lane_stat_map)
+        self.assertEqual(("32.5", "95"), fc_con.get_barcode_lane_statistics("J.Doe_00_01", "P001_102", "120924_AC003CCCXX", 5), "Unexpected statistics")
+        self.assertEqual(("34.1", "91"), fc_con.get_barcode_lane_statistics("J.Doe_00_01", "P001_104", "120924_AC003CCCXX", "1"), "Unexpected statistics")
+        self.assertEqual((None, None), fc_con.get_barcode_lane_statistics("J.Doe_00_01", "P001_105", "120924_AC003CCCXX", 1), "Expected no statistics for missing sample")
+        self.assertEqual((None, None), fc_con.get_barcode_lane_statistics("J.Doe_00_01", "P001_101", "120924_BB002BBBXX", 1), "Expected no statistics for missing flowcell")
+        self.assertEqual(2, db.queries, "Unexpected number of queries")
@@ -0,0 +1,80 @@
+import os
+import json
+import shutil
+import hashlib
+import tempfile
+import unittest
+
+from scilifelab.utils.misc import md5sum
+from scilifelab.utils.checksum import ChecksumCache, md5sums, verify_md5_files, hash_file
+
+class TestChecksum(unittest.TestCase):
+    def setUp(self):
+        self.rootdir = tempfile.mkdtemp(prefix="test_checksum_")
+        self.cachedir = os.path.join(self.rootdir, "cache")
+        self.files = []
+        for n, size in enumerate([0, 1000, 5 * 1024 * 1024 + 3]):
+            fn = os.path.join(self.rootdir, "{}_120924_AC003CCCXX_P001_101_{}.fastq.gz".format(n + 1, n))
+            with open(fn, "wb") as fh:
+                fh.write(os.urandom(size))
+            self.files.append(fn)
+
+    def tearDown(self):
+        shutil.rmtree(self.rootdir)
+
+    def test_hash_file(self):
+        """Hash files in large reads"""
+        for fn in self.files:
+            with open(fn, "rb") as fh:
+                self.assertEqual(hashlib.md5(fh.read()).hexdigest(), hash_file(fn), "Unexpected md5sum")
+            self.assertEqual(hash_file(fn), md5sum(fn), "misc.md5sum should hash with hash_file")
+
+    def test_md5sums(self):
+        """Hash files in worker threads, using the cache for unchanged files"""
+        expected = {fn:md5sum(fn) for fn in self.files}
+        self.assertEqual(expected, md5sums(self.files, workers=2, cache=ChecksumCache(self.cachedir)), "Unexpected md5sums")
+        self.assertTrue(os.path.exists(os.path.join(self.cachedir, "md5sums.json")), "Cache not saved")
+        # Cached md5sums are used for unchanged files, read from a new cache
+        cache = ChecksumCache(self.cachedir)
+        self.assertEqual(expected[self.files[2]], cache.get(self.files[2]), "md5sum not cached")
+        cache.set(self.files[1], "cached")
+        self.assertEqual("cached", md5sums(self.files, cache=cache)[self.files[1]], "Cached md5sum not used")
+        # A modified file is hashed again
+        with open(self.files[1], "ab") as fh:
+            fh.write("x")
+        os.utime(self.files[1], (0, 0))
+        self.assertEqual(md5sum(self.files[1]), md5sums(self.files, cache=cache)[self.files[1]], "Modified file not hashed")
+        # Modification times are compared at full precision
+        os.utime(self.files[1], (1400000000.123, 1400000000.123))
+        cache.set(self.files[1], "cached")
+        os.utime(self.files[1], (1400000000.124, 1400000000.124))
+        self.assertIsNone(cache.get(self.files[1]), "Modified file found in cache")
+        self.assertIsNone(md5sums([os.path.join(self.rootdir, "missing")], progress=False).values()[0], "Missing file should have no md5sum")
+
+    def test_cache_pruned(self):
+        """Drop cached md5sums of removed and modified files on save"""
+        md5sums(self.files, cache=ChecksumCache(self.cachedir), progress=False)
+        os.unlink(self.files[0])
+        with open(self.files[1], "ab") as fh:
+            fh.write("x")
+        os.utime(self.files[1], (0, 0))
+        cache = ChecksumCache(self.cachedir)
+        cache.set(self.files[2], "cached")
+        cache.save()
+        with open(os.path.join(self.cachedir, "md5sums.json")) as fh:
+            saved = json.load(fh)
+        self.assertEqual([self.files[2]], saved.keys(), "Stale entries not dropped from the cache")
+        self.assertEqual("cached", ChecksumCache(self.cachedir).get(self.files[2]), "Current entry not kept in the cache")
+
+    def test_verify_md5_files(self):
+        """Verify md5 files in one pool"""
+        md5files = []
+        for fn in self.files:
+            md5files.append("{}.md5".format(fn))
+            with open(md5files[-1], "w") as fh:
+                fh.write("{}  {}\nmalformed\n".format(md5sum(fn) if fn != self.files[0] else "0" * 32, os.path.basename(fn)))
+        res = verify_md5_files(md5files, workers=2)
+        self.assertEqual(md5files, res.keys(), "Results should be in the order of the md5 files")
+        self.assertEqual([1, 1, 1], [len(x) for x in res.values()], "Malformed lines should be skipped")
+        self.assertEqual([False, True, True], [x[0].observed == x[0].expected for x in res.values()], "Unexpected verification")
+        self.assertEqual(os.path.basename(self.files[2]), res[md5files[2]][0].fname, "Unexpected file name")
@@ -0,0 +1,104 @@
+"""Test suite for the compress module
+"""
+
+import tempfile
+import os
+import shutil
+import gzip
+import random
+import subprocess
+import unittest
+import scilifelab.utils.compress as compress
+import scilifelab.utils.fastq_utils as fu
+import tests.generate_test_data as td
+
+class TestCompress(unittest.TestCase):
+    """Test parallel reading and writing of gzip files
+    """
+
+    def setUp(self):
+        self.rootdir = tempfile.mkdtemp(prefix="test_compress_")
+        self.data = "".join([random.choice("ACGT\n") for i in xrange(100000)])
+
+    def tearDown(self):
+        shutil.rmtree(self.rootdir)
+
+    def _write(self, fname, chunk=1000, **kwargs):
+        fh = compress.open_output(fname, **kwargs)
+        for i in xrange(0, len(self.data), chunk):
+            fh.write(self.data[i:i+chunk])
+        fh.close()
+
+    def test_parallel_roundtrip(self):
+        """Write and read back a block compressed gzip file
+        """
+        fname = os.path.join(self.rootdir, "parallel.gz")
+        self._write(fname, threads=4, block_size=7000)
+        self.assertTrue(compress.is_blocked_gzip(fname),
+                        "Parallel writer did not produce a block compressed file")
+
+        # The output is valid gzip for the gzip module and the gzip tool
+        with gzip.open(fname) as fh:
+            self.assertEqual(self.data, fh.read(),
+                             "Data decompressed by the gzip module did not match the written data")
+        if compress.find_executable("gzip"):
+            self.assertEqual(0, subprocess.call(["gzip", "-t", fname]),
+                             "gzip -t failed on the block compressed file")
+
+        # Read it back in parallel, in pieces of different sizes
+        for size in [-1, 1, 999, 7000, 100000]:
+            fh = compress.open_input(fname, threads=3)
+            self.assertIsInstance(fh, compress.ParallelGzipReader)
+            chunks = []
+            while True:
+                chunk = fh.read(size)
+                if not chunk:
+                    break
+                chunks.append(chunk)
+            fh.close()
+            self.assertEqual(self.data, "".join(chunks),
+                             "Data read in parallel in pieces of {} bytes did not match the written data".format(size))
+
+    def test_empty_output(self):
+        """Write valid gzip files without any data
+        """
+        for threads in [1, 4]:
+            fname = os.path.join(self.rootdir, "empty_{}.fastq.gz".format(threads))
+            fu.FastQWriter(fname, threads=threads).close()
+            with gzip.open(fname) as fh:
+                self.assertEqual("", fh.read(),
+                                 "Expected no data in gzip file written with {} threads".format(threads))
+            if compress.find_executable("gzip"):
+                self.assertEqual(0, subprocess.call(["gzip", "-t", fname]),
+                                 "gzip -t failed on the empty file written with {} threads".format(threads))
+            fqp = fu.FastQParser(fname, threads=threads)
+            self.assertListEqual([], [r for r in fqp],
+                                 "Expected no records in empty file written with {} threads".format(threads))
+
+    def test_fallback_reader(self):
+        """Read a regular gzip file with more than one thread
+        """
+        fname = os.path.join(self.rootdir, "single.gz")
+        self._write(fname)
+        self.assertFalse(compress.is_blocked_gzip(fname),
+                         "Single threaded writer should produce a regular gzip file")
+        fh = compress.open_input(fname, threads=4)
+        self.assertEqual(self.data, fh.read(),
+                         "Data read from a regular gzip file did not match the written data")
+        fh.close()
+
+    def test_fastq_threads(self):
+        """Write and parse fastq records with multiple threads
+        """
+        fname = os.path.join(self.rootdir, "reads.fastq.gz")
+        records = [td.generate_fastq_record() for n in xrange(500)]
+        fqw = fu.FastQWriter(fname, threads=4, block_size=10000)
+        for record in records:
+            fqw.write(record)
+        fqw.close()
+        fqp = fu.FastQParser(fname, threads=4)
+        self.assertListEqual(records, [r for r in fqp],
+                             "Records parsed with multiple threads did not match the written records")
+        fqp.seek(0)
+        self.assertEqual(len(records), len([r for r in fqp]),
+                         "Parsing did not restart from the beginning after seek")
@@ -0,0 +1,118 @@
+"""Test suite for the fastq_dedup module
+"""
+
+import tempfile
+import os
+import shutil
+import random
+import unittest
+import scilifelab.utils.fastq_dedup as fd
+import scilifelab.utils.fastq_utils as fu
+import tests.generate_test_data as td
+
+class TestFastQDeduplicator(unittest.TestCase):
+    """Test the exact removal of duplicate reads
+    """
+
+    def setUp(self):
+        self.rootdir = tempfile.mkdtemp(prefix="test_FastQDeduplicator_")
+
+        # Create read pairs where some sequences, and some pairs, occur several times
+        seqs = [td.generate_nucleotide_sequence(sequence_length=30) for n in xrange(50)]
+        self.pairs = []
+        for n in xrange(500):
+            pair = td.generate_fastq_record(pair=True, sequence_length=30)
+            pair[1] = random.choice(seqs)
+            pair[5] = random.choice(seqs[0:5])
+            self.pairs.append(pair)
+        self.fastq = [os.path.join(self.rootdir,"test_{}.fastq.gz".format(r)) for r in [1,2]]
+        fqw = [fu.FastQWriter(f) for f in self.fastq]
+        for pair in self.pairs:
+            fqw[0].write(pair[0:4])
+            fqw[1].write(pair[4:8])
+        for w in fqw:
+            w.close()
+
+    def tearDown(self):
+        shutil.rmtree(self.rootdir)
+
+    def _outfiles(self, n):
+        return [os.path.join(self.rootdir,"out_{}.fastq.gz".format(r)) for r in range(1,n+1)]
+
+    def test_single_end(self):
+        """Keep the first copy of each sequence, in input order
+        """
+        expected, seen = [], set()
+        for pair in self.pairs:
+            if pair[1] not in seen:
+                seen.add(pair[1])
+                expected.append(pair[0:4])
+
+        # Use a small memory budget to force the partitions to be split further
+        dedup = fd.FastQDeduplicator(self.fastq[0], max_memory=10000, tmpdir=self.rootdir)
+        outfile = dedup.run(self._outfiles(1))[0]
+        observed = [r for r in fu.FastQParser(outfile)]
+        self.assertListEqual(expected,observed,
+                             "Unexpected records after removing duplicates")
+        self.assertEqual(len(self.pairs),dedup.records,
+                         "Unexpected number of records parsed")
+        self.assertEqual(len(expected),dedup.unique,
+                         "Unexpected number of unique records")
+        self.assertAlmostEqual(1. - float(len(expected))/len(self.pairs),dedup.duplication_rate(),
+                               msg="Unexpected duplication rate")
+        self.assertListEqual(["out_1.fastq.gz","test_1.fastq.gz","test_2.fastq.gz"],sorted(os.listdir(self.rootdir)),
+                             "Temporary partition files were not removed")
+
+    def test_paired_best_quality(self):
+        """Keep the read pair with the highest quality for each pair of sequences
+        """
+        best = {}
+        for n, pair in enumerate(self.pairs):
+            key = (pair[1],pair[5])
+            score = sum([ord(c) for c in pair[3] + pair[7]])
+            if key not in best or score > best[key][1]:
+                best[key] = (n, score)
+        expected = [self.pairs[n] for n in sorted([v[0] for v in best.values()])]
+
+        dedup = fd.FastQDeduplicator(self.fastq[0], self.fastq[1], best_quality=True)
+        outfiles = dedup.run(self._outfiles(2))
+        observed = [r1 + r2 for r1, r2 in zip(fu.FastQParser(outfiles[0]),fu.FastQParser(outfiles[1]))]
+        self.assertListEqual(expected,observed,
+                             "Unexpected read pairs after removing duplicates")
+        self.assertEqual(len(expected),dedup.unique,
+                         "Unexpected number of unique read pairs")
+
+    def test_unpaired(self):
+        """Raise an error if the paired files have different numbers of records
+        """
+        fastq2 = os.path.join(self.rootdir,"truncated_2.fastq")
+        fqw = fu.FastQWriter(fastq2)
+        for pair in self.pairs[0:-1]:
+            fqw.write(pair[4:8])
+        fqw.close()
+        dedup = fd.FastQDeduplicator(self.fastq[0], fastq2, tmpdir=self.rootdir)
+        with self.assertRaises(ValueError):
+            dedup.run(self._outfiles(2))
+        self.assertListEqual(["test_1.fastq.gz","test_2.fastq.gz","truncated_2.fastq"],sorted(os.listdir(self.rootdir)),
+                             "Temporary partition files were not removed")
+
+    def test_repeated_read(self):
+        """Do not split again a partition that splitting does not shrink
+        """
+        fastq = os.path.join(self.rootdir,"repeated.fastq")
+        fqw = fu.FastQWriter(fastq)
+        for n in xrange(300):
+            fqw.write(self.pairs[0][0:4])
+        fqw.close()
+
+        written = []
+        class Deduplicator(fd.FastQDeduplicator):
+            def _write_partitions(self, entries, workdir, nparts, level):
+                written.append(level)
+                return fd.FastQDeduplicator._write_partitions(self, entries, workdir, nparts, level)
+        dedup = Deduplicator(fastq, max_memory=10000, tmpdir=self.rootdir)
+        outfile = dedup.run(self._outfiles(1))[0]
+        self.assertListEqual([self.pairs[0][0:4]],[r for r in fu.FastQParser(outfile)],
+                             "Unexpected records after removing duplicates")
+        self.assertListEqual([0,1],written,
+                             "Partition of a single read should be split once")
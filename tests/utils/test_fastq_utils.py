@@ -10,6 +10,7 @@ import copy
 import scilifelab.utils.fastq_utils as fu
 import tests.generate_test_data as td
 import scilifelab.illumina.hiseq as hi
+from tests.illumina.test_barcodes import scan_prefixes
 from collections import Counter
 
 class TestFastQParser(unittest.TestCase):
@@ -70,7 +71,36 @@ class TestFastQParser(unittest.TestCase):
             pass
         self.assertEqual(expected,fqr.rread(),
                          "The returned number of filtered reads based on lanes did not match expected number")
-        
+
+    def test_block_boundaries(self):
+        """Parse records split across block boundaries
+        """
+        expected = [r for r in fu.FastQParser(self.example_fq)]
+        for bufsize in [1, 7, 64, 1000]:
+            fqr = fu.FastQParser(self.example_fq,bufsize=bufsize)
+            self.assertListEqual(expected,[r for r in fqr],
+                                 "Parsing with block size {} did not return the expected records".format(bufsize))
+            self.assertEqual(len(expected),fqr.rread(),
+                             "The number of parsed records did not match expected number")
+
+        # A file lacking the final newline should give the same records
+        fd, fqfile = tempfile.mkstemp(suffix=".fastq", dir=self.rootdir)
+        os.close(fd)
+        with open(fqfile,"w") as fh:
+            fh.write("\n".join(["\n".join(r) for r in expected]))
+        self.assertListEqual(expected,[r for r in fu.FastQParser(fqfile,bufsize=100)],
+                             "Parsing a file without a trailing newline did not return the expected records")
+
+    def test_batches(self):
+        """Iterate over batches of records
+        """
+        expected = [r for r in fu.FastQParser(self.example_fq)]
+        batches = [b for b in fu.FastQParser(self.example_fq).batches(100)]
+        self.assertTrue(all([len(b) <= 100 for b in batches]),
+                        "Batches larger than the requested size were returned")
+        self.assertListEqual(expected,[r for b in batches for r in b],
+                             "The batched records did not match the expected records")
+
 class TestFastQWriter(unittest.TestCase):
     """Test the FastQWriter functionality
     """
@@ -189,7 +219,111 @@ class TestFastQUtils(unittest.TestCase):
                              "The number of demultiplexed reads in file does not match expected")
             self.assertListEqual(sorted(headers),sorted(self.indexes[index]),
                                  "The parsed headers from demultiplexed fastq file do not match the expected")
-            
+
+    def test_demultiplex_fastq_limited_handles(self):
+        """Demultiplex a test fastq file with a cap on the number of open files
+        """
+
+        # Keep a single output file open and flush often so that files are reopened for appending
+        dmx = fu.FastQDemultiplexer(self.rootdir,self.samplesheet,max_open=1,buffer_records=7)
+        outfiles = dmx.run(self.fastq_1,self.fastq_2)["1"]
+        for index in outfiles.keys():
+            self.assertEqual(len(self.indexes[index]),dmx.counts["1"][index],
+                             "The reported number of demultiplexed read pairs does not match expected")
+            recs = [[r for r in fu.FastQParser(f)] for f in outfiles[index]]
+            self.assertListEqual(sorted(self.indexes[index]),sorted([r[0] for r in recs[0]]),
+                                 "The parsed headers from demultiplexed fastq file do not match the expected")
+            self.assertListEqual([r[0].split()[0] for r in recs[0]],[r[0].split()[0] for r in recs[1]],
+                                 "Header strings from paired fastq files don't match")
+
+    def test_demultiplex_fastq_unpaired(self):
+        """Raise an error if the paired files have different numbers of records
+        """
+        records = [r for r in fu.FastQParser(self.fastq_2)]
+        fastq_2 = os.path.join(self.rootdir,"truncated_R2.fastq.gz")
+        fqw = fu.FastQWriter(fastq_2)
+        for r in records[0:-1]:
+            fqw.write(r)
+        fqw.close()
+        with self.assertRaises(ValueError):
+            fu.demultiplex_fastq(self.rootdir,self.samplesheet,self.fastq_1,fastq_2)
+        self.assertListEqual([],[f for f in os.listdir(self.rootdir) if f.startswith("tmp_")],
+                             "Temporary files were not removed")
+
+class TestMolecularTagDemultiplexer(unittest.TestCase):
+    
+    def setUp(self):
+        self.rootdir = tempfile.mkdtemp(prefix="test_fastq_utils_")
+        self.indexes = {"ACGTAC": "Sample_1", "TTGGCCAA": "Sample_2", "GATCGA": None}
+        fnames = [os.path.join(self.rootdir,f) for f in ["lane_R1.fastq.gz","lane_R2.fastq","lane_I1.fastq.gz"]]
+        fhs = [fu.FastQWriter(f) for f in fnames]
+        self.tags = []
+        for n in range(3000):
+            seq = "{}{}".format(random.choice(self.indexes.keys() + ["CCCCCC"]),td.generate_barcode(10))
+            seq = "".join([random.choice("ACGTN") if random.random() < 0.05 else c for c in seq])
+            self.tags.append(seq)
+            for fh, s in zip(fhs,[td.generate_barcode(30),td.generate_barcode(30),seq]):
+                fh.write(["@READ:{}".format(n),s,"+","I"*len(s)])
+        for fh in fhs:
+            fh.close()
+        self.fastq_1, self.fastq_2, self.fastq_index = fnames
+        
+    def tearDown(self):
+        shutil.rmtree(self.rootdir)
+    
+    def _expected(self):
+        """Expected output names and header tags from a full scan of the indexes
+        """
+        expected = {}
+        for n, seq in enumerate(self.tags):
+            matches, _ = scan_prefixes(self.indexes.keys(),seq,1)
+            if len(matches) == 1:
+                name, tag = self.indexes[matches[0]] or matches[0], "{}:{}:".format(matches[0],seq[len(matches[0]):])
+            else:
+                name, tag = "Ambiguous" if matches else "Undetermined", "{}:{}:".format(",".join(matches),seq)
+            expected.setdefault(name,[]).append("@READ:{}{}".format(n,tag))
+        return expected
+    
+    def test_demultiplex(self):
+        """Demultiplex reads by the index at the start of the index read
+        """
+        fractions = []
+        dmx = fu.MolecularTagDemultiplexer(self.rootdir,self.indexes,1,max_open=2,buffer_records=100,chunk_records=500)
+        outfiles = dmx.run(self.fastq_1,self.fastq_2,self.fastq_index,lambda n, f: fractions.append(f))
+        expected = self._expected()
+        self.assertListEqual(sorted(expected.keys()),sorted(outfiles.keys()),
+                             "The expected output files were not written")
+        for name, headers in expected.items():
+            recs = [[r for r in fu.FastQParser(f)] for f in outfiles[name]]
+            self.assertListEqual(headers,[r[0] for r in recs[0]],
+                                 "The headers of read 1 did not have the expected tags")
+            self.assertListEqual(headers,[r[0] for r in recs[1]],
+                                 "The headers of read 2 did not have the expected tags")
+            self.assertEqual(len(headers),dmx.samples[name],
+                             "The reported number of read pairs did not match")
+        self.assertEqual(3000,dmx.counts['processed'],
+                         "All read pairs were not processed")
+        self.assertEqual(3000,sum([dmx.counts[k] for k in ['match','ambiguous','undetermined']]),
+                         "The outcomes did not add up to the processed read pairs")
+        self.assertEqual(6,len(fractions),
+                         "Progress was not reported for each chunk")
+        self.assertListEqual(sorted(fractions),fractions,
+                             "The fraction processed should be increasing")
+        self.assertAlmostEqual(1.0,fractions[-1],2,
+                               "The fraction processed should end at the size of the input")
+    
+    def test_demultiplex_processes(self):
+        """Demultiplex in worker processes, with the output in input order
+        """
+        outdirs = [os.path.join(self.rootdir,str(p)) for p in [1,2]]
+        outputs = []
+        for processes, outdir in zip([1,2],outdirs):
+            os.mkdir(outdir)
+            dmx = fu.MolecularTagDemultiplexer(outdir,self.indexes,1,processes=processes,chunk_records=300)
+            outfiles = dmx.run(self.fastq_1,self.fastq_2,self.fastq_index)
+            outputs.append(dict([(name,[open(f).read() for f in fnames]) for name, fnames in outfiles.items()]))
+        self.assertDictEqual(outputs[0],outputs[1],
+                             "Output from worker processes did not match the output from a single process")
 
 class TestBarcodeExtractor(unittest.TestCase):
     """Test class for the functionality
@@ -260,3 +394,55 @@ class TestBarcodeExtractor(unittest.TestCase):
                               "Extracted and expected barcode counts don't match")
          
         
+
+class TestCountBarcodes(unittest.TestCase):
+    """Test parallel barcode counting
+    """
+    
+    def setUp(self):
+        self.rootdir = tempfile.mkdtemp(prefix="test_count_barcodes_")
+        barcodes = [td.generate_barcode() for i in xrange(20)] + ["ACGTNA"]
+        self.fastq = {}
+        for ext in [".fastq", ".fastq.gz"]:
+            self.fastq[ext] = []
+            for read in [1,2]:
+                fname = os.path.join(self.rootdir,"reads_R{}{}".format(read,ext))
+                random.seed(read)
+                fqw = fu.FastQWriter(fname)
+                for i in xrange(2000):
+                    rec = td.generate_fastq_record(index=random.choice(barcodes), sequence_length=random.randint(95,110))
+                    fqw.write(rec)
+                fqw.close()
+                self.fastq[ext].append(fname)
+        
+    def tearDown(self):
+        shutil.rmtree(self.rootdir)
+    
+    def test_encode_barcode(self):
+        """Encode and decode barcodes as integers
+        """
+        for bc in ["", "A", "ACGTACGT", "TTTTTTTTTTTTTTTTTTTTTTTT", "ACGTN", "AC\n", "A0"]:
+            self.assertEqual(bc,fu.decode_barcode(fu.encode_barcode(bc)),
+                             "Decoded barcode does not match the encoded barcode")
+        self.assertIsInstance(fu.encode_barcode("ACGT"),int)
+        self.assertEqual("ACGTN",fu.encode_barcode("ACGTN"),
+                         "Barcode with N should not be encoded")
+    
+    def test_count_barcodes(self):
+        """Count barcodes with several processes and compare to the serial counts
+        """
+        # Use small shards to exercise the splitting and the merging of counts
+        sizes = fu.COUNT_RANGE_SIZE, fu.COUNT_MIN_RANGE_SIZE, fu.COUNT_CHUNK_RECORDS
+        fu.COUNT_RANGE_SIZE, fu.COUNT_MIN_RANGE_SIZE, fu.COUNT_CHUNK_RECORDS = 16*1024, 1, 77
+        try:
+            self.assertGreater(os.path.getsize(self.fastq[".fastq"][0]),4*fu.COUNT_RANGE_SIZE,
+                               "Test file should be split into several byte ranges")
+            for files in self.fastq.values():
+                for args in [(files[0], None), (files[0], files[1])]:
+                    for casava18 in [True, False]:
+                        serial = fu.count_barcodes(*args, casava18=casava18, offset=100, length=6)
+                        parallel = fu.count_barcodes(*args, casava18=casava18, offset=100, length=6, processes=3)
+                        self.assertDictEqual(dict(serial),dict(parallel),
+                                             "Parallel barcode counts do not match the serial counts")
+        finally:
+            fu.COUNT_RANGE_SIZE, fu.COUNT_MIN_RANGE_SIZE, fu.COUNT_CHUNK_RECORDS = sizes
@@ -0,0 +1,61 @@
+"""Test suite for the quality module
+"""
+
+import random
+import unittest
+import numpy as np
+import scilifelab.utils.fastq_utils as fu
+import tests.generate_test_data as td
+from scilifelab.utils.quality import QualityBatch
+
+class TestQualityBatch(unittest.TestCase):
+    
+    def setUp(self):
+        self.records = [td.generate_fastq_record(sequence_length=random.randint(1,150)) for i in xrange(500)]
+        self.batch = QualityBatch.from_records(self.records)
+    
+    def test_per_read_statistics(self):
+        """Compare the batch statistics to the per-record functions
+        """
+        self.assertListEqual([fu.avgQ(r) for r in self.records],self.batch.avgQ(),
+                             "Batch average qualities do not match avgQ")
+        self.assertListEqual([fu.gtQ30(r) for r in self.records],self.batch.gtQ30(),
+                             "Batch fractions above Q30 do not match gtQ30")
+        self.assertListEqual([int(round(fu.avgQ(r))) for r in self.records],self.batch.rounded_mean().tolist(),
+                             "Batch rounded average qualities do not match avgQ")
+    
+    def test_rounding(self):
+        """Round means and percentages halfway between tenths as the per-record functions
+        """
+        records = [["@r","A","+",chr(33 + 31)*3 + chr(33 + 30)*17],
+                   ["@r","A","+",chr(33 + 31)*6 + chr(33 + 30)*34],
+                   ["@r","A","+",chr(33 + 31)*3 + chr(33 + 30)*37],
+                   ["@r","A","+",chr(33 + 30) + chr(33 + 20)*79],
+                   ["@r","A","+",chr(33 + 2)*3 + chr(33 + 3)*3]]
+        batch = QualityBatch.from_records(records)
+        self.assertListEqual([fu.avgQ(r) for r in records],batch.avgQ(),
+                             "Batch average qualities do not match avgQ")
+        self.assertListEqual([fu.gtQ30(r) for r in records],batch.gtQ30(),
+                             "Batch fractions above Q30 do not match gtQ30")
+        self.assertListEqual([int(round(fu.avgQ(r))) for r in records],batch.rounded_mean().tolist(),
+                             "Batch rounded average qualities do not match avgQ")
+
+    def test_cycle_histogram(self):
+        """Count quality scores per cycle
+        """
+        hist = self.batch.cycle_histogram(max_quality=40)
+        self.assertEqual(max([len(r[3]) for r in self.records]),hist.shape[0],
+                         "The histogram does not have one row per cycle")
+        self.assertEqual(sum([len(r[3]) for r in self.records]),hist.sum(),
+                         "The histogram does not count all quality scores")
+        expected = sum([1 for r in self.records if len(r[3]) > 2 and ord(r[3][2]) - 33 == 17])
+        self.assertEqual(expected,hist[2,17],
+                         "The histogram count for a cycle and quality does not match expected")
+    
+    def test_bins(self):
+        """Bin reads on average quality
+        """
+        thresholds = [10,20,30]
+        expected = [len([t for t in thresholds if int(round(fu.avgQ(r))) >= t]) - 1 for r in self.records]
+        self.assertListEqual(expected,self.batch.bins(thresholds).tolist(),
+                             "Quality bins do not match expected")
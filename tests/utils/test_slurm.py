@@ -15,15 +15,37 @@ class TestSlurm(unittest.TestCase):
         """
         
         # Mock the system calls
-        subprocess.check_output = Mock(return_value='')
-        # Assert that getting non-existing jobs return an empty job list
-        self.assertListEqual([],sq.get_slurm_jobid("jobname"),
-                             "Querying for jobid of non-existing job should return an empty list")
-        # Assert that a returned job id is parsed correctly
-        for jobids in [[123456789],[123456789,987654321]]:
-            subprocess.check_output = Mock(return_value="\n".join([str(jid) for jid in jobids]))
-            self.assertListEqual(jobids,sq.get_slurm_jobid("jobname"),
-                                 "Querying for jobid of existing job did not return the correct value")
+        check_output = subprocess.check_output
+        try:
+            subprocess.check_output = Mock(return_value='')
+            # Assert that getting non-existing jobs return an empty job list
+            self.assertListEqual([],sq.get_slurm_jobid("jobname"),
+                                 "Querying for jobid of non-existing job should return an empty list")
+            # Assert that a returned job id is parsed correctly
+            for jobids in [[123456789],[123456789,987654321]]:
+                subprocess.check_output = Mock(return_value="\n".join([str(jid) for jid in jobids]))
+                self.assertListEqual(jobids,sq.get_slurm_jobid("jobname"),
+                                     "Querying for jobid of existing job did not return the correct value")
+        finally:
+            subprocess.check_output = check_output
+        
+    def test_get_slurm_jobs(self):
+        """List the jobs of a user by job name with a single squeue call
+        """
+        check_output = subprocess.check_output
+        try:
+            subprocess.check_output = Mock(return_value="123 RUNNING P1_101\n124 PENDING P1_101\n125 COMPLETING a job name\n126_1 RUNNING P1_102\n127 BOOT_FAIL P1_103\n")
+            self.assertDictEqual({"P1_101": [(123,"running"),(124,"queued_active")],
+                                  "a job name": [(125,"running")],
+                                  "P1_103": [(127,"undetermined")]},sq.get_slurm_jobs("user"),
+                                 "The jobs were not listed by job name with their drmaa states")
+            self.assertEqual(1,subprocess.check_output.call_count,
+                             "Expected a single squeue call")
+            subprocess.check_output = Mock(side_effect=OSError("No such file or directory"))
+            self.assertDictEqual({},sq.get_slurm_jobs("user"),
+                                 "A failing squeue call should return no jobs")
+        finally:
+            subprocess.check_output = check_output
         
         
 
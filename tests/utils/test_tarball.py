@@ -0,0 +1,57 @@
+import os
+import shutil
+import subprocess
+import tempfile
+import unittest
+
+from scilifelab.utils.misc import md5sum
+from scilifelab.utils.tarball import write_tarball, extract_member, read_index, read_excludes
+
+FLOWCELL = "120924_SN0002_0003_CC003CCCXX"
+
+class TestTarball(unittest.TestCase):
+    def setUp(self):
+        self.rootdir = tempfile.mkdtemp(prefix="test_tarball_")
+        fcdir = os.path.join(self.rootdir, FLOWCELL)
+        self.files = {os.path.join(FLOWCELL, "RunInfo.xml"): "<RunInfo/>\n",
+                      os.path.join(FLOWCELL, "Data", "Intensities", "BaseCalls", "L001", "s_1_1101.bcl"): os.urandom(200000),
+                      os.path.join(FLOWCELL, "Data", "Intensities", "BaseCalls", "L001", "s_1_1102.bcl"): "",
+                      os.path.join(FLOWCELL, "Thumbnail_Images", "L001", "s_1_1101_a.jpg"): "jpg"}
+        for fn, data in self.files.items():
+            if not os.path.exists(os.path.dirname(os.path.join(self.rootdir, fn))):
+                os.makedirs(os.path.dirname(os.path.join(self.rootdir, fn)))
+            with open(os.path.join(self.rootdir, fn), "wb") as fh:
+                fh.write(data)
+        self.excludes = os.path.join(self.rootdir, "excludes")
+        with open(self.excludes, "w") as fh:
+            fh.write("Thumbnail_Images\n*.jpg\n")
+
+    def tearDown(self):
+        shutil.rmtree(self.rootdir)
+
+    def _test_tarball(self, suffix, threads):
+        tarball = os.path.join(self.rootdir, "{}.tar{}".format(FLOWCELL, suffix))
+        sums = write_tarball(tarball, self.rootdir, FLOWCELL, threads=threads, checksums=("md5", "sha256"),
+                             excludes=read_excludes(self.excludes), block_size=16384)
+        self.assertEqual(md5sum(tarball), sums["md5"], "md5sum of written tarball differs")
+        self.assertEqual(["md5", "sha256"], sums.keys(), "Unexpected checksums")
+        # tar and bzip2 read concatenated bzip2 streams, the bz2 module of python 2 does not
+        names = subprocess.check_output(["tar", "-tf", tarball]).rstrip("/\n").replace("/\n", "\n").split("\n")
+        for fn, data in self.files.items():
+            if "Thumbnail_Images" in fn:
+                self.assertNotIn(fn, names, "Excluded file in tarball")
+                continue
+            self.assertEqual(data, subprocess.check_output(["tar", "-xOf", tarball, fn]), "Unexpected member data")
+            self.assertEqual(data, extract_member(tarball, fn), "Unexpected member data from index")
+        self.assertIn(FLOWCELL, names, "Flowcell directory not in tarball")
+        compression, blocks, members = read_index(tarball)
+        self.assertTrue(len(blocks) > 10, "Expected several blocks")
+        self.assertEqual(set(names), set(members.keys()), "Index members differ from tarball members")
+
+    def test_write_gz(self):
+        """Write a gzip compressed tarball in blocks with several threads"""
+        self._test_tarball(".gz", 3)
+
+    def test_write_bz2(self):
+        """Write a bzip2 compressed tarball in blocks"""
+        self._test_tarball(".bz2", 1)
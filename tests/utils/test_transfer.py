@@ -0,0 +1,66 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+from scilifelab.utils.misc import md5sum
+from scilifelab.utils.transfer import copy_and_hash, transfer_files, BandwidthLimiter
+
+class TestTransfer(unittest.TestCase):
+    def setUp(self):
+        self.rootdir = tempfile.mkdtemp(prefix="test_transfer_")
+        self.sources = []
+        for n, size in enumerate([0, 1000, 3 * 1024 + 17]):
+            fn = os.path.join(self.rootdir, "{}_120924_AC003CCCXX_P001_101_{}.fastq.gz".format(n + 1, n))
+            with open(fn, "wb") as fh:
+                fh.write(os.urandom(size))
+            self.sources.append(fn)
+        self.targets = [os.path.join(self.rootdir, "INBOX", os.path.basename(x)) for x in self.sources]
+        os.makedirs(os.path.join(self.rootdir, "INBOX"))
+
+    def tearDown(self):
+        shutil.rmtree(self.rootdir)
+
+    def test_copy_and_hash(self):
+        """Copy a file and compute its md5sum in the same pass"""
+        res = copy_and_hash(self.sources[2], self.targets[2], bufsize=1024)
+        self.assertEqual(md5sum(self.sources[2]), res.md5, "Unexpected md5sum")
+        self.assertEqual(md5sum(self.sources[2]), md5sum(self.targets[2]), "Copy differs from source")
+        self.assertEqual(os.path.getsize(self.sources[2]), res.size, "Unexpected size")
+        self.assertEqual(int(os.stat(self.sources[2]).st_mtime), int(os.stat(self.targets[2]).st_mtime), "Modification time not kept")
+        self.assertIsNone(res.verified_md5, "Target should only be re-read when verifying")
+        self.assertEqual([os.path.basename(self.targets[2])], os.listdir(os.path.dirname(self.targets[2])), "Temporary file left behind")
+
+    def test_copy_and_hash_verify(self):
+        """Verify a copy by re-reading it"""
+        res = copy_and_hash(self.sources[1], self.targets[1], verify=True)
+        self.assertEqual(res.md5, res.verified_md5, "Verified md5sum differs")
+        # An up to date target is not copied again
+        with open(self.targets[1], "r+b") as fh:
+            fh.write("x")
+        shutil.copystat(self.sources[1], self.targets[1])
+        res = copy_and_hash(self.sources[1], self.targets[1], verify=True)
+        self.assertEqual(md5sum(self.sources[1]), res.md5, "Unexpected source md5sum")
+        self.assertNotEqual(res.md5, res.verified_md5, "A corrupted target should fail verification")
+
+    def test_transfer_files(self):
+        """Transfer several files concurrently"""
+        sources = self.sources + [os.path.join(self.rootdir, "missing.fastq.gz")]
+        targets = self.targets + [os.path.join(self.rootdir, "INBOX", "missing.fastq.gz")]
+        res = transfer_files(sources, targets, verify=True, workers=2, bwlimit=1024 ** 3)
+        self.assertEqual(sources, [x.src for x in res], "Results should be in the order of the sources")
+        for x in res[0:3]:
+            self.assertIsNone(x.error, "Unexpected error")
+            self.assertEqual(md5sum(x.src), x.md5, "Unexpected md5sum")
+            self.assertEqual(x.md5, x.verified_md5, "Verified md5sum differs")
+        self.assertIsNotNone(res[3].error, "Missing source should give an error")
+        self.assertFalse(os.path.exists(targets[3]), "Missing source should not be copied")
+
+    def test_bandwidth_limiter(self):
+        """Limit the throughput to a number of bytes per second"""
+        limiter = BandwidthLimiter(1000)
+        limiter.consume(0)
+        t0 = limiter._next
+        limiter.consume(100)
+        limiter.consume(100)
+        self.assertAlmostEqual(0.2, limiter._next - t0, places=1, msg="Unexpected schedule")